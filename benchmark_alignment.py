@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# ############################################################################################
+# PURPOSE:
+#
+# Regression check and benchmark for fl.align_to_index, the get_indexer alignment of ARM
+# radiation, mast heading metadata etc onto the station times. A month of 1 s station times and
+# ARM times with gaps, duplicates and times the station doesn't have are aligned with the old
+# compare_indexes get_loc loop from create_level2_product_tower.py and with align_to_index. The
+# other directions are checked against reindex(method=..., tolerance=...).
+#
+# USAGE:
+#
+#   python3 benchmark_alignment.py [--days 30]
+#
+# ############################################################################################
+import argparse, time
+
+import numpy  as np
+import pandas as pd
+
+from datetime import datetime
+
+import functions_library as fl
+
+# the original, kept here to check against, without the progress prints
+def compare_indexes(inds_sparse, inds_lush):
+    inds_not_present = []
+    map_between = ([],[])
+    for sparse_i in range(len(inds_sparse)):
+        sparse_date = inds_sparse[sparse_i]
+        try:
+            lush_i = inds_lush.get_loc(sparse_date)
+            map_between[0].append(lush_i)
+            map_between[1].append(sparse_i)
+        except Exception:
+            inds_not_present.append(sparse_date)
+    return inds_not_present, map_between
+
+def same(a, b):
+    a = np.asarray(a, dtype=np.float64); b = np.asarray(b, dtype=np.float64)
+    return a.shape == b.shape and np.all((a == b) | (np.isnan(a) & np.isnan(b)))
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--days', metavar='int', type=int, default=30, help='days of 1 s data')
+    args = parser.parse_args()
+
+    rng       = np.random.default_rng(42)
+    slow_inds = pd.date_range(datetime(2020, 1, 1), periods=args.days*86400, freq='s')
+    slow_inds = slow_inds.delete(np.flatnonzero(rng.random(slow_inds.size) < 0.02)) # the station has gaps too
+    arm_inds  = pd.date_range(datetime(2019, 12, 31, 23), periods=args.days*86400, freq='s')
+    arm_inds  = arm_inds[rng.random(arm_inds.size) > 0.05]
+    arm_data  = pd.DataFrame({'down_long_hemisp': rng.normal(200, 20, arm_inds.size),
+                              'down_short_hemisp': rng.normal(100, 50, arm_inds.size)}, index=arm_inds)
+
+    n_bad = 0
+    t0 = time.perf_counter()
+    not_present, index_map = compare_indexes(arm_inds, slow_inds)
+    old = {}
+    for rv in arm_data.columns:
+        val_arr = np.full(len(slow_inds), np.nan)
+        val_arr[np.array(index_map[0])] = arm_data[rv].values[np.array(index_map[1])]
+        old[rv] = val_arr
+    t_old = time.perf_counter()-t0
+
+    t0 = time.perf_counter()
+    new, align_info = fl.align_to_index(arm_data, slow_inds, direction='exact')
+    t_new = time.perf_counter()-t0
+
+    ok = all(same(old[rv], new[rv]) for rv in arm_data.columns) and len(not_present) == len(align_info['unmatched_source'])
+    if not ok: n_bad += 1
+    print(f"... {arm_inds.size} ARM times onto {slow_inds.size} station times: get_loc loop {t_old:.2f} s, align_to_index {t_new:.3f} s, identical: {ok}")
+
+    shifted = arm_data.set_index(arm_data.index+pd.to_timedelta(rng.integers(-400, 400, arm_inds.size), unit='ms'))
+    shifted = shifted.sort_index()
+    for direction, method in (('nearest', 'nearest'), ('backward', 'pad'), ('forward', 'backfill')):
+        new, align_info = fl.align_to_index(shifted, slow_inds, direction=direction, tolerance='500ms')
+        ref = shifted.reindex(slow_inds, method=method, tolerance=pd.Timedelta('500ms'))
+        ok  = all(same(ref[c], new[c]) for c in shifted.columns) and \
+              align_info['unmatched_target'] == int(ref.iloc[:, 0].isna().sum())
+        if not ok: n_bad += 1
+        print(f"... {direction:8s} within 500 ms matches reindex: {ok}, {align_info['unmatched_target']} station times unmatched")
+
+    # a time both have, the station starts an hour after the ARM data
+    dupe_time = arm_inds.intersection(slow_inds)[600]
+    dupe_i    = arm_inds.get_loc(dupe_time)
+    dupes = pd.concat([arm_data.iloc[0:dupe_i+400], arm_data.iloc[dupe_i-100:dupe_i+400]*2])
+    new, align_info = fl.align_to_index(dupes, slow_inds[0:3000], direction='exact')
+    ok = same(new.loc[dupe_time], arm_data.loc[dupe_time]*2)
+    if not ok: n_bad += 1
+    print(f"... duplicated ARM times keep the last one: {ok}")
+
+    if n_bad != 0: raise Exception("align_to_index doesn't match the old alignment")
+
+if __name__ == '__main__':
+    main()
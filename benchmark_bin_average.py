@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# ############################################################################################
+# PURPOSE:
+#
+# Regression check and benchmark for fl.bin_average/fl.bin_stats/fl.bin_vector_average, the
+# bincount/reduceat resampling. A synthetic day of 10 Hz winds and 1 s logger data (with gaps,
+# angles that wrap through north, qc flags and a string column) is averaged into 1 and 10 min
+# bins both ways: resample().apply(take_average)/average_mosaic_flags as the level2 codes did,
+# and the kernel. Means have to agree to rounding (the sums are in a different order), the qc
+# flags and which bins are nan have to be identical.
+#
+# USAGE:
+#
+#   python3 benchmark_bin_average.py [--columns 40]
+#
+# ############################################################################################
+import argparse, time
+
+import numpy  as np
+import pandas as pd
+
+from datetime import datetime, timedelta
+
+import functions_library as fl
+
+# the original, kept here to check against
+def average_mosaic_flags_loop(qc_series, fstr):
+    def take_qc_average(data_series):
+        tot_good             = (data_series == 0).sum()
+        tot_caution_and_good = tot_good + (data_series == 1).sum()
+        tot_engineering      = (data_series == 3).sum()
+        if tot_good/len(data_series) >= 0.5:             return 0
+        if tot_caution_and_good/len(data_series) >= 0.5: return 1
+        if tot_engineering/len(data_series) >= 0.5:      return 3
+        if data_series.isna().sum() == len(data_series): return np.nan
+        return 2
+    return qc_series.resample(fstr, label='left').apply(take_qc_average)
+
+def close(a, b):
+    a = np.asarray(a, dtype=np.float64); b = np.asarray(b, dtype=np.float64)
+    if a.shape != b.shape or not np.array_equal(np.isnan(a), np.isnan(b)): return False
+    ok = ~np.isnan(a)
+    return np.allclose(a[ok], b[ok], rtol=1e-10, atol=1e-9)
+
+def make_logger_day(day, ncols, rng):
+    index = pd.date_range(day, day+timedelta(1), freq='1s')[0:-1]
+    df    = pd.DataFrame({f'var_{i}': rng.normal(i, 1, index.size) for i in range(0, ncols)}, index=index)
+    df['tower_heading']   = np.mod(rng.normal(0, 20, index.size), 360) # wraps through north
+    df['mast_heading_qc'] = rng.choice([0, 1, 2, 3, np.nan], index.size, p=[0.4, 0.2, 0.1, 0.2, 0.1])
+    df['var_0_qc']        = rng.choice([0, 0, 0, 1, 3], index.size).astype(np.float64)
+    df['station_name']    = 'tower'
+    gaps = rng.random(index.size) < 0.3
+    df.loc[gaps, 'var_1'] = np.nan                                   # bins either side of 50 % missing
+    df.iloc[3600:7200, 2] = np.nan                                   # an hour with nothing
+    df.loc[df.index[36000:39600], 'var_0_qc'] = np.nan
+    return df.drop(df.index[50000:50300])                            # and rows that aren't there at all
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--columns', metavar='int', type=int, default=40, help='columns in the logger day')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(42)
+    day = datetime(2020, 1, 1)
+    df  = make_logger_day(day, args.columns, rng)
+    qc_cols    = ['mast_heading_qc', 'var_0_qc']
+    angle_cols = ['tower_heading']
+
+    n_bad = 0
+    for fstr in ['1T', '10T']:
+        t0 = time.perf_counter()
+        old = {}
+        for var_name in df.columns:
+            if   var_name in qc_cols:    old[var_name] = average_mosaic_flags_loop(df[var_name], fstr)
+            elif var_name in angle_cols: old[var_name] = df[var_name].resample(fstr, label='left').apply(fl.take_average, is_angle=True)
+            else:
+                try: old[var_name] = df[var_name].resample(fstr, label='left').apply(fl.take_average)
+                except Exception: old[var_name] = pd.Series(np.nan, index=old['var_0'].index) # strings, as the level2 codes do
+        t_old = time.perf_counter()-t0
+
+        t0  = time.perf_counter()
+        new = fl.bin_average(df, fstr, angle_cols=angle_cols, qc_cols=qc_cols)
+        t_new = time.perf_counter()-t0
+
+        bad_cols = [c for c in df.columns if not (new.index.equals(old[c].index) and close(new[c], old[c]))]
+        n_bad   += len(bad_cols)
+        print(f"... {fstr:>3} bins, {df.shape[1]} columns: apply(take_average) {t_old:.2f} s, bin_average {t_new:.3f} s, differ: {bad_cols}")
+
+        qc_ok = all(np.array_equal(fl.average_mosaic_flags(df[c], fstr).values, old[c].values, equal_nan=True) for c in qc_cols)
+        if not qc_ok: n_bad += 1
+        print(f"... average_mosaic_flags identical: {qc_ok}")
+
+    fast_index = pd.date_range(day, day+timedelta(1), freq='100ms')[0:-1]
+    fast = pd.DataFrame({'u': rng.normal(3, 2, fast_index.size), 'v': rng.normal(-2, 2, fast_index.size),
+                         'T': rng.normal(-20, 0.1, fast_index.size)}, index=fast_index)
+    fast.loc[rng.random(fast_index.size) < 0.05, 'u'] = np.nan
+
+    t0 = time.perf_counter()
+    stats = fl.bin_stats(fast, '1T')
+    t_new = time.perf_counter()-t0
+    t0 = time.perf_counter()
+    resampled = fast.resample('1T', label='left')
+    old_stats = {'mean': resampled.mean(), 'std': resampled.std(), 'min': resampled.min(),
+                 'max': resampled.max(), 'count': resampled.count()}
+    t_old = time.perf_counter()-t0
+    stats_ok = all(close(stats[s][c], old_stats[s][c]) for s in old_stats for c in fast.columns)
+    if not stats_ok: n_bad += 1
+    print(f"... bin_stats {t_new:.3f} s, resample mean/std/min/max/count {t_old:.3f} s, agree: {stats_ok}")
+
+    vec   = fl.bin_vector_average(fast['u'], fast['v'], '10T')
+    u_min = fast['u'].resample('10T', label='left').apply(fl.take_average)
+    v_min = fast['v'].resample('10T', label='left').apply(fl.take_average)
+    vec_ok = close(vec['wspd'], np.sqrt(u_min**2+v_min**2)) and \
+             close(vec['wdir'], np.mod((np.arctan2(-u_min,-v_min)*180/np.pi),360))
+    if not vec_ok: n_bad += 1
+    print(f"... bin_vector_average agrees: {vec_ok}")
+
+    if n_bad != 0: raise Exception("the bin kernels don't match resample/take_average")
+
+if __name__ == '__main__':
+    main()
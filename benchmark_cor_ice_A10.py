@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# ############################################################################################
+# PURPOSE:
+#
+# Regression check and benchmark for fl.cor_ice_A10_array against the scalar fl.cor_ice_A10
+# it replaces in the level2 per-record loops. Synthetic 10 minute records (a year of them by
+# default) in unstable, near neutral and stable regimes, and very stable ones (warm air over
+# cold ice in light winds, zeta past 150) that get 3 iterations instead of 7, with some missing
+# inputs thrown in. Every output is compared, regime by regime, nearly all the very stable
+# records have to take the 3 iteration branch, and the scalar loop is timed on a subset and
+# extrapolated.
+#
+# USAGE:
+#
+#   python3 benchmark_cor_ice_A10.py [-n records_per_regime] [--scalar_records 5000]
+#
+# ############################################################################################
+import argparse, time
+
+import numpy  as np
+
+import functions_library as fl
+
+out_names = ['hsb','hlb','tau','zo','zot','zoq','L','usr','tsr','qsr','dter','dqer','hl_webb',
+             'Cd','Ch','Ce','Cdn_10','Chn_10','Cen_10','rr','rt','rq']
+
+# inputs like the tower 10 m level, air temperature is the surface temperature minus dT, so
+# a negative dT (air warmer than the surface) is stable
+def make_regime(rng, n, dT_range, u_range):
+    ts = rng.uniform(-35, -2, n)
+    t  = ts-rng.uniform(*dT_range, n)
+    u  = rng.uniform(*u_range, n)
+    Q  = rng.uniform(0.2, 0.9, n)*1e-3*np.exp(0.07*t) # roughly near ice saturation
+    zi = np.full(n, 600.)
+    P  = rng.uniform(990, 1035, n)
+    zu = np.full(n, 10.54)-rng.uniform(0, 0.3, n)
+    zt = zu-1.2
+    zq = zu-1.4
+    return [u, ts, t, Q, zi, P, zu, zt, zq]
+
+def scalar_loop(bulk_input, nrec):
+    out = np.full((len(out_names), nrec), np.nan)
+    for ii in range(0, nrec):
+        tmp = [x[ii] for x in bulk_input]
+        if not any(np.isnan(tmp)): out[:,ii] = fl.cor_ice_A10(tmp)
+    return out
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--nrecords', metavar='int', type=int, default=52560//3, help='records per regime, a year of 10 min records total')
+    parser.add_argument('--scalar_records', metavar='int', type=int, default=5000, help='records per regime to run the scalar version on')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(42)
+    regimes = {'unstable'    : make_regime(rng, args.nrecords, (0.5, 6.0),    (1.0, 12.0)),
+               'neutral'     : make_regime(rng, args.nrecords, (-0.05, 0.05), (3.0, 15.0)),
+               'stable'      : make_regime(rng, args.nrecords, (-6.0, -0.5),  (2.0, 12.0)),
+               'very stable' : make_regime(rng, args.nrecords, (-12.0, -6.0), (0.05, 0.4))}
+    for name, bulk_input in regimes.items(): # missing data
+        bulk_input[rng.integers(0, 9)][rng.choice(args.nrecords, 20, replace=False)] = np.nan
+
+    worst = 0
+    for name, bulk_input in regimes.items():
+        t0 = time.perf_counter()
+        array_out = fl.cor_ice_A10_array(bulk_input)
+        t_arr = time.perf_counter()-t0
+        n_iter = array_out[-1]
+
+        ns = min(args.scalar_records, args.nrecords)
+        t0 = time.perf_counter()
+        scalar_out = scalar_loop(bulk_input, ns)
+        t_sca = time.perf_counter()-t0
+
+        print(f"... {name:>11}: array {t_arr*1000:8.1f} ms for {args.nrecords}, scalar ~{t_sca*args.nrecords/ns:8.1f} s, "+
+              f"iterations {np.bincount(n_iter, minlength=8)[[0,3,7]]} (0/3/7)")
+        if name == 'very stable' and np.sum(n_iter == 3) < 0.9*np.sum(n_iter > 0):
+            raise Exception(f"only {np.sum(n_iter == 3)} very stable records took the 3 iteration branch")
+
+        for i_var, var in enumerate(out_names):
+            a = array_out[i_var][0:ns]
+            s = scalar_out[i_var]
+            if np.any(np.isnan(a) != np.isnan(s)):
+                raise Exception(f"{name}: {var} is missing in one version and not the other")
+            scale = np.nanmax(np.abs(s)) if np.any(np.abs(s) > 0) else 1.0
+            diff  = np.nanmax(np.abs(a-s))/scale if np.any(~np.isnan(s)) else 0.0
+            worst = max(worst, diff)
+            if diff > 1e-9: print(f"     {var:>8}: max relative difference {diff:.3e}")
+
+    print(f"... worst relative difference of any output: {worst:.3e}")
+    if worst > 1e-9: raise Exception("the array version doesn't agree with cor_ice_A10")
+
+if __name__ == '__main__':
+    main()
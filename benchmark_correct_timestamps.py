@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# ############################################################################################
+# PURPOSE:
+#
+# Regression check and benchmark for the asfs fast data timestamp correction. Builds a synthetic
+# 20 Hz station-day (17280 scans of 5 s, ~1.7M rows) with a few short scans, a repeated scan time
+# and clock jumps forwards and backwards thrown in, and compares fl.spread_scan_timestamps against
+# the original row by row correct_timestamps loop from create_level1_product_asfs.py.
+#
+# The original loop is far too slow to run on a whole day, so it is timed on the first
+# --legacy_rows rows and extrapolated, and run on those and on --window_scans scans either side of
+# each of the problems. Every row of those (but the last scan, which the loop can't see the end of)
+# has to match the vectorized times for the whole day.
+#
+# USAGE:
+#
+#   python3 benchmark_correct_timestamps.py [--legacy_rows 100000] [--window_scans 50]
+#
+# ############################################################################################
+import argparse, time
+
+import numpy  as np
+import pandas as pd
+
+from datetime import datetime, timedelta
+
+import functions_library as fl
+
+# the original, kept here to check against
+def correct_timestamps_loop(df):
+
+    df.index = range(0, len(df))
+
+    times     = df["TIMESTAMP"].copy()
+    new_times = times.copy()
+    dupes     = times[times.duplicated()==False]
+    ind_iter  = iter(dupes.index)
+
+    tot_len = len(df)
+    curr_i  = next(ind_iter)
+
+    break_me = False
+    while True:
+        try: next_i = next(ind_iter)
+        except:
+            break_me = True
+            next_i = tot_len-1
+
+        dist = next_i-curr_i
+        if dist == 0: break
+        tstep = 5/dist
+        tdelt = timedelta(0,tstep)
+
+        for ii in range(curr_i, next_i):
+            new_times.at[ii] = times.loc[ii]+(ii-curr_i)*tdelt
+
+        if break_me:
+            break
+        curr_i  = next_i
+
+    new_times = new_times - pd.to_timedelta(5,unit='s')
+    df['TIMESTAMP'] = new_times
+    df.index = new_times
+    return df
+
+# one day of scans with the usual problems in it, and the scans they're in
+def make_fast_day(date, rng):
+    nscan      = 17280
+    scan_sizes = np.full(nscan, 100)
+    scan_sizes[rng.choice(nscan, 50, replace=False)] = rng.integers(10, 99, 50) # dropouts, short scans
+    scan_ends  = date + pd.to_timedelta(5*np.arange(1, nscan+1), unit='s')
+    scan_ends  = scan_ends.values.copy()
+    scan_ends[9000:] += np.timedelta64(2, 's')   # clock jump
+    scan_ends[12001] = scan_ends[12000]          # logger repeats a scan time
+    scan_ends[15000:] -= np.timedelta64(10, 's') # clock jumps back two scans
+    day = pd.DataFrame({'TIMESTAMP': np.repeat(scan_ends, scan_sizes),
+                        'metek_x':   rng.standard_normal(scan_sizes.sum())})
+    return day, np.append(0, np.cumsum(scan_sizes)), {'clock jump': 9000, 'repeated scan': 12001, 'clock jump back': 15000}
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--legacy_rows',  metavar='int', type=int, default=100000, help='rows to run the old loop on')
+    parser.add_argument('--window_scans', metavar='int', type=int, default=50,     help='scans either side of each problem to run the old loop on')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(42)
+    day, scan_rows, defects = make_fast_day(datetime(2020, 1, 1), rng)
+    print(f"... synthetic fast day with {len(day)} rows")
+
+    t0 = time.perf_counter()
+    new_times, scan_info = fl.spread_scan_timestamps(day['TIMESTAMP'].values, scan_len=5)
+    t_vec = time.perf_counter()-t0
+    print(f"... vectorized, whole day: {t_vec:.3f} s, {scan_info}")
+
+    sub = day.iloc[0:args.legacy_rows].copy()
+    t0 = time.perf_counter()
+    old = correct_timestamps_loop(sub.copy())
+    t_old = time.perf_counter()-t0
+
+    new_sub, _ = fl.spread_scan_timestamps(sub['TIMESTAMP'].values, scan_len=5)
+    n_diff = np.sum(old['TIMESTAMP'].values != new_sub)
+    print(f"... original loop, {len(sub)} rows: {t_old:.2f} s (~{t_old*len(day)/len(sub):.0f} s for the day)")
+    print(f"... rows that differ from the original: {n_diff}")
+
+    n_bad = int(n_diff != 0)
+    windows = {'start of the day': (0, args.legacy_rows)}
+    for name, scan in defects.items():
+        windows[name] = (scan_rows[scan-args.window_scans], scan_rows[scan+args.window_scans])
+    for name, (row_0, row_1) in windows.items():
+        old = correct_timestamps_loop(day.iloc[row_0:row_1].copy())['TIMESTAMP'].values
+        last_scan = np.flatnonzero(~day['TIMESTAMP'].iloc[row_0:row_1].duplicated().values)[-1]
+        n_diff = np.sum(old[0:last_scan] != new_times[row_0:row_0+last_scan])
+        if n_diff != 0: n_bad += 1
+        print(f"... {name:17s} rows {row_0}-{row_0+last_scan}, rows that differ from the whole day: {n_diff}")
+
+    if n_bad != 0: raise Exception("vectorized timestamps don't match the original loop")
+
+if __name__ == '__main__':
+    main()
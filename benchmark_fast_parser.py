@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# ############################################################################################
+# PURPOSE:
+#
+# Regression check and benchmark for parse_fast_file in create_level1_product_tower.py, the
+# bytes/translate reader for the hourly metek 'msc' files. Writes a synthetic hour of 20 Hz data
+# with NUL chars at the beginning of some lines, a few truncated lines and a blank one, and reads
+# it with parse_fast_file and with a plain line-by-line reader (strip the NULs, split, keep lines
+# with the right number of fields) like the old slow fallback. The values and the number of
+# dropped lines have to be identical. A clean file through read_csv is timed for comparison.
+#
+# USAGE:
+#
+#   python3 benchmark_fast_parser.py [--hz 20] [--nul-lines 500]
+#
+# ############################################################################################
+import argparse, shutil, tempfile, time
+
+import numpy  as np
+import pandas as pd
+
+from create_level1_product_tower import parse_fast_file
+
+ncols = 10 # timestamp, heatstatus, x, y, z, T, hspd, ts, incx, incy
+
+def read_lines(path, ncols):
+    with open(path, 'rb') as fin:
+        next(fin)
+        rows = []; n_dropped = 0
+        for line in fin:
+            fields = line.replace(b'\x00', b'').split()
+            if len(fields) == 0: continue
+            if len(fields) != ncols: n_dropped += 1; continue
+            rows.append([float(f) for f in fields])
+    return pd.DataFrame(rows), n_dropped
+
+def make_hour(path, hz, n_nul, rng, clean=False):
+    nrows = 3600*hz
+    stamp = np.arange(0, nrows)*(1000000//hz) # mmssuuu, with ms ticks
+    stamp = (stamp//60000000)*100000+(stamp//1000)%60000
+    data  = np.column_stack([stamp, np.zeros(nrows), rng.normal(0, 2, (nrows, ncols-2)).round(2)])
+    lines = [' '.join(f'{v:.10g}' for v in row) for row in data]
+    n_bad = 0
+    if not clean:
+        for i in rng.choice(nrows, 25, replace=False):    lines[i] = lines[i][0:len(lines[i])//3]; n_bad += 1
+        for i in rng.choice(nrows, n_nul, replace=False): lines[i] = '\x00'*int(rng.integers(1, 40))+lines[i]
+        lines.insert(nrows//2, '')
+    with open(path, 'w') as fout: fout.write('header line\n'+'\n'.join(lines)+'\n')
+    return n_bad
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--hz',        metavar='int', type=int, default=20,  help='sample rate')
+    parser.add_argument('--nul-lines', metavar='int', type=int, default=500, help='lines starting with NULs')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='fast_parser_')
+    rng      = np.random.default_rng(42)
+    nul_file = f'{work_dir}/msc29912_raw.txt'
+    n_trunc  = make_hour(nul_file, args.hz, args.nul_lines, rng)
+    clean_file = f'{work_dir}/msc29913_raw.txt'
+    make_hour(clean_file, args.hz, 0, rng, clean=True)
+
+    t0 = time.perf_counter(); new, n_new = parse_fast_file(nul_file, ncols); t_new = time.perf_counter()-t0
+    t0 = time.perf_counter(); old, n_old = read_lines(nul_file, ncols);      t_old = time.perf_counter()-t0
+    t0 = time.perf_counter()
+    pd.read_csv(clean_file, parse_dates=False, sep='\s+', na_values=['nan','NaN'], header=None, skiprows=[0], engine='c')
+    t_csv = time.perf_counter()-t0
+
+    same = new.shape == old.shape and np.array_equal(new.values, old.values.astype(np.float64), equal_nan=True)
+    print(f"... {old.shape[0]} rows, {args.nul_lines} with NULs, {n_trunc} truncated")
+    print(f"... line by line {t_old:.2f} s, parse_fast_file {t_new:.3f} s, read_csv on a clean file {t_csv:.3f} s")
+    print(f"... dropped lines {n_new} (line by line {n_old}), values identical: {same}")
+
+    shutil.rmtree(work_dir)
+    if not same or n_new != n_old or n_new != n_trunc: raise Exception("parse_fast_file doesn't match the line reader")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# ############################################################################################
+# PURPOSE:
+#
+# Regression check and benchmark for get_data_functions.flux_day_ring, the sequential reader the
+# asfs level2 code uses for the fast data. Writes a few days of synthetic level1 fast netcdfs
+# (with a missing day in the middle), then reads each day plus the hour either side through the
+# ring and the way it was done before, get_flux_data on yesterday/today/tomorrow for every day.
+# Every file has to be read exactly once by the ring and the windows have to be identical.
+#
+# USAGE:
+#
+#   python3 benchmark_flux_day_ring.py [-d days] [--hz 20] [-w workdir]
+#
+# ############################################################################################
+import argparse, os, shutil, tempfile, time
+
+import numpy  as np
+import pandas as pd
+import xarray as xr
+
+from collections import Counter
+from datetime    import datetime, timedelta
+
+from get_data_functions import get_flux_data, get_flux_file, flux_day_ring
+
+station   = 'asfs30'
+first_day = datetime(2019, 11, 15)
+
+def make_fast_files(data_dir, days, hz, rng):
+    for iday in range(0, days):
+        today = first_day+timedelta(iday)
+        if iday == days//2: continue # a missing day
+        index = pd.date_range(today, today+timedelta(1), freq=f'{1000//hz}ms', name='time')[0:-1]
+        frame = pd.DataFrame({v: rng.normal(0, 1, index.size).astype(np.float32)
+                              for v in ['metek_x', 'metek_y', 'metek_z', 'metek_T', 'licor_co2', 'licor_h2o']},
+                             index=index)
+        ds = xr.Dataset.from_dataframe(frame)
+        ds.attrs['version'] = 'synthetic'
+        day_file = get_flux_file(station, today, 1, data_dir, 'fast')
+        os.makedirs(os.path.dirname(day_file), exist_ok=True)
+        ds.to_netcdf(day_file, engine='netcdf4')
+
+def same(a, b):
+    if a.shape != b.shape or not a.index.equals(b.index) or list(a.columns) != list(b.columns): return False
+    for col in a.columns:
+        x = a[col].values; y = b[col].values
+        if x.dtype.kind == 'f' and not np.all((x == y) | (np.isnan(x) & np.isnan(y))): return False
+        if x.dtype.kind != 'f' and not np.all(x == y): return False
+    return True
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-d', '--days',    metavar='int', type=int, default=5,  help='days of synthetic data')
+    parser.add_argument('--hz',            metavar='int', type=int, default=20, help='sample rate')
+    parser.add_argument('-w', '--workdir', metavar='str', default=None,         help='where to write the files')
+    args = parser.parse_args()
+
+    work_dir = args.workdir if args.workdir else tempfile.mkdtemp(prefix='day_ring_')
+    data_dir = f'{work_dir}/data/'
+    make_fast_files(data_dir, args.days, args.hz, np.random.default_rng(42))
+    day_series = pd.date_range(first_day, first_day+timedelta(args.days-1))
+
+    t0 = time.perf_counter()
+    ring = flux_day_ring(station, 1, data_dir, 'fast')
+    ring_windows = [ring.window(today-timedelta(hours=1), today+timedelta(days=1, hours=1)) for today in day_series]
+    t_ring = time.perf_counter()-t0
+
+    t0 = time.perf_counter()
+    old_windows = []
+    for today in day_series:
+        tomorrow = today+timedelta(1)
+        fd, fd_version = get_flux_data(station, today-timedelta(1), today+timedelta(1), 1, data_dir, 'fast',
+                                       time_range=(today-timedelta(hours=1), tomorrow+timedelta(hours=1)))
+        old_windows.append(fd[today-timedelta(hours=1):tomorrow+timedelta(hours=1)])
+    t_old = time.perf_counter()-t0
+
+    n_opened = Counter(ring.opened)
+    n_files  = len(os.listdir(os.path.dirname(get_flux_file(station, first_day, 1, data_dir, 'fast'))))
+    n_bad    = sum(not same(r, o) for r, o in zip(ring_windows, old_windows))
+
+    print(f"... {args.days} days at {args.hz} Hz, {n_files} files")
+    print(f"... through the ring:   {t_ring:6.2f} s, {len(ring.opened)} files read, most reads of one file {max(n_opened.values())}")
+    print(f"... yesterday to tomorrow each day: {t_old:6.2f} s")
+    print(f"... windows that differ: {n_bad}")
+
+    if not args.workdir: shutil.rmtree(work_dir)
+
+    if len(n_opened) != n_files or max(n_opened.values()) != 1: raise Exception("the ring didn't read every file exactly once")
+    if n_bad != 0: raise Exception("the ring's windows don't match get_flux_data")
+
+if __name__ == '__main__':
+    main()
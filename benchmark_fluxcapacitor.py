@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# ############################################################################################
+# PURPOSE:
+#
+# Regression check and benchmark for fl.grachev_fluxcapacitor_batched, the flux calculations for
+# all windows of a day at once. Synthetic 10 Hz sonic/licor red noise (with spikes, a sonic gap
+# that rejects a few windows, a licor gap and a last window that's a bit short) is cut into 10
+# min flux windows the way level2 does it, with pressure/temperature/humidity for each window,
+# and run through the batched code and window by window through the original
+# grachev_fluxcapacitor. The scalars and spectra have to agree to --rtol of the largest value in
+# each column, with nans in the same places.
+#
+# USAGE:
+#
+#   python3 benchmark_fluxcapacitor.py [--hours 6] [--rtol 1e-8]
+#
+# ############################################################################################
+import argparse, time, warnings
+
+import numpy  as np
+import pandas as pd
+
+from datetime import datetime, timedelta
+
+import functions_library as fl
+
+warnings.filterwarnings(action='ignore', category=FutureWarning)
+warnings.filterwarnings(action='ignore', category=RuntimeWarning) # the original divides by zero on the windows without licor
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--hours', metavar='int',   type=int,   default=6,    help='hours of 10 Hz data')
+    parser.add_argument('--rtol',  metavar='float', type=float, default=1e-8, help='largest difference, relative to the largest value in the column')
+    args = parser.parse_args()
+
+    rng   = np.random.default_rng(42)
+    day   = datetime(2020, 1, 1)
+    index = pd.date_range(day-timedelta(hours=1), day+timedelta(hours=args.hours+1), freq='100ms')
+    n     = index.size
+    red   = lambda scale: np.cumsum(rng.standard_normal(n))*0.002*scale+rng.standard_normal(n)*scale
+    metek = pd.DataFrame({'u': 3+red(1), 'v': -2+red(1), 'w': red(0.3), 'T': -20+red(0.2)}, index=index)
+    licor = pd.DataFrame({'licor_h2o': 0.8+red(0.01), 'licor_co2': 700+red(1)}, index=index)
+    for col in metek.columns:
+        metek[col].values[rng.random(n) < 0.0005] += 20*rng.choice([-1, 1])    # spikes
+    metek.iloc[n//3:n//3+3*6000] = np.nan                                    # half an hour of sonic gone
+    licor.iloc[2*n//3:2*n//3+3*6000] = np.nan                                # and of licor
+
+    integration_window = 10
+    flux_times = pd.date_range(day, day+timedelta(hours=args.hours), freq=f'{integration_window}min')
+    po2_len    = np.ceil(2**round(np.log2(integration_window*60*10))/10/60)
+    t_win      = pd.Timedelta((po2_len-integration_window)/2, 'minutes')
+    win_starts = flux_times[0:-1]-t_win
+    win_ends   = flux_times[1:]+t_win
+    nwin       = len(win_starts)
+    metek = metek[:win_ends[-1]-timedelta(seconds=10)]                       # the last window is a bit short
+    licor = licor[:win_ends[-1]-timedelta(seconds=10)]
+    pr   = rng.uniform(990, 1030, nwin)
+    temp = rng.uniform(-30, -5, nwin)
+    mr   = rng.uniform(0.0002, 0.001, nwin)
+
+    t0 = time.perf_counter()
+    old = []
+    for iw in range(0, nwin):
+        old.append(fl.grachev_fluxcapacitor(3.3, metek.loc[win_starts[iw]:win_ends[iw]].copy(),
+                                            licor.loc[win_starts[iw]:win_ends[iw]].copy(), 'g/m3', 'mg/m3',
+                                            pr[iw], temp[iw], mr[iw]))
+    old   = pd.concat(old)
+    t_old = time.perf_counter()-t0
+
+    t0 = time.perf_counter()
+    new   = fl.grachev_fluxcapacitor_batched(3.3, metek, licor, 'g/m3', 'mg/m3', pr, temp, mr, win_starts, win_ends)
+    t_new = time.perf_counter()-t0
+
+    # the original gives a rejected window a single nan instead of its spectra
+    n_bad = 0; worst = (0, None)
+    has_spec = np.array([np.size(s) > 1 for s in old['fs']])
+    for name in fl.turb_scalar_names+fl.turb_spectra_names:
+        a = old[name].to_numpy(dtype=np.float64) if name in fl.turb_scalar_names else np.full(new[name].shape, np.nan)
+        b = new[name].copy()
+        if name in fl.turb_spectra_names:
+            a[has_spec] = np.stack([np.asarray(s, dtype=np.float64) for s in old[name][has_spec]])
+            if name == 'fs': b[~has_spec] = np.nan # the batched version always has the frequencies
+        if a.shape != b.shape or not np.array_equal(np.isnan(a), np.isnan(b)):
+            n_bad += 1; print(f"!!! {name}: nans in different places"); continue
+        ok = ~np.isnan(a)
+        if not np.any(ok): continue
+        scale = np.max(np.abs(a[ok]))
+        rel   = np.max(np.abs(a[ok]-b[ok]))/scale if scale > 0 else np.max(np.abs(a[ok]-b[ok]))
+        if rel > args.rtol: n_bad += 1; print(f"!!! {name}: differs by {rel:.2e} of its largest value")
+        if rel > worst[0]: worst = (rel, name)
+
+    n_valid = int(np.sum(~np.isnan(new['Hs'])))
+    print(f"... {nwin} windows ({n_valid} with fluxes): window by window {t_old:.2f} s, batched {t_new:.3f} s")
+    print(f"... largest difference {worst[0]:.2e} of the column's largest value ({worst[1]})")
+
+    if n_bad != 0: raise Exception("the batched fluxes don't match grachev_fluxcapacitor")
+
+if __name__ == '__main__':
+    main()
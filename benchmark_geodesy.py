@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# ############################################################################################
+# PURPOSE:
+#
+# Regression check and benchmark for the wgs84 geodesy in functions_library (geod_inverse, the
+# numpy vincenty_inverse fallback) and get_data_functions.ship_track. vincenty_inverse is checked
+# against the textbook Flinders Peak -> Buninyong line and, if pyproj is installed, against
+# Geod.inv on a year of 1 min station/ship positions around the MOSAiC drift. The ship track
+# interpolation is checked against interpolate('time') over the 10 s fixes and the 1 min times
+# together, and timed against the reindex().interpolate() the tower code used.
+#
+# USAGE:
+#
+#   python3 benchmark_geodesy.py [--minutes 525600]
+#
+# ############################################################################################
+import argparse, time
+
+import numpy  as np
+import pandas as pd
+
+from datetime import datetime
+
+import functions_library as fl
+from get_data_functions import ship_track
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--minutes', metavar='int', type=int, default=525600, help='1 min positions to use')
+    args = parser.parse_args()
+
+    n_bad = 0
+
+    # Vincenty (1975) / Geoscience Australia's example, the azimuth is 306 52 05.37 in -180 to 180
+    az, dist = fl.vincenty_inverse(-(37+57/60+3.72030/3600), 144+25/60+29.52440/3600,
+                                   -(37+39/60+10.15610/3600), 143+55/60+35.38390/3600)
+    ok = abs(dist-54972.271) < 1e-3 and abs(az-(306+52/60+5.37/3600-360)) < 1e-5
+    if not ok: n_bad += 1
+    print(f"... Flinders Peak -> Buninyong {float(dist):.3f} m, {float(az):.6f} deg, matches: {ok}")
+
+    rng   = np.random.default_rng(42)
+    index = pd.date_range(datetime(2019, 10, 5), periods=args.minutes, freq='T')
+    drift = np.cumsum(rng.normal(0, 0.0005, (index.size, 2)), axis=0)
+    ship  = pd.DataFrame({'lat': 85+drift[:, 0], 'lon': np.mod(120+drift[:, 1]*20+180, 360)-180}, index=index)
+    lat   = ship['lat'].values+rng.normal(0, 0.005, index.size)  # a station a few hundred m to km away
+    lon   = ship['lon'].values+rng.normal(0, 0.05, index.size)
+    lat[rng.random(index.size) < 0.01] = np.nan
+
+    t0 = time.perf_counter()
+    az_v, dist_v = fl.vincenty_inverse(lat, lon, ship['lat'].values, ship['lon'].values)
+    t_vin = time.perf_counter()-t0
+    print(f"... vincenty_inverse on {index.size} pairs: {t_vin:.2f} s")
+
+    try:
+        from pyproj import Geod
+        t0 = time.perf_counter()
+        az_p, az21, dist_p = Geod(ellps='WGS84').inv(lon, lat, ship['lon'].values, ship['lat'].values)
+        t_pyproj = time.perf_counter()-t0
+        good = ~np.isnan(lat)
+        ok   = np.array_equal(np.isnan(dist_v), ~good) and np.max(np.abs(dist_v[good]-dist_p[good])) < 1e-4 and \
+               np.max(np.abs(np.mod(az_v[good]-az_p[good]+180, 360)-180)) < 1e-6
+        if not ok: n_bad += 1
+        print(f"... Geod.inv {t_pyproj:.2f} s, vincenty agrees to 0.1 mm/1e-6 deg: {ok}")
+    except ImportError:
+        print("... no pyproj, vincenty_inverse only checked against the textbook line")
+
+    # the ship track every 10 s with a gap, interpolated to the 1 min index both ways
+    fine     = pd.date_range(index[0], index[-1], freq='10s')
+    fine_df  = pd.DataFrame({'lat': np.interp(fine.asi8, index.asi8, ship['lat'].values),
+                             'lon': np.interp(fine.asi8, index.asi8, ship['lon'].values)}, index=fine)
+    fine_df  = fine_df.drop(fine_df.index[5000:9000])
+    target   = index[1:-1]
+
+    # what the tower code did, timed. it only interpolates between the 1 min neighbours, so
+    # the reference is the fixes and the targets together, interpolated in time
+    t0 = time.perf_counter()
+    fine_df.reindex(target).interpolate()
+    t_old = time.perf_counter()-t0
+    old = fine_df.reindex(fine_df.index.union(target)).interpolate(method='time').reindex(target)
+    t0 = time.perf_counter()
+    track = ship_track(fine_df)
+    new_lat, new_lon = track.position(target)
+    t_new = time.perf_counter()-t0
+
+    ok = np.allclose(old['lat'].values, new_lat, atol=1e-9) and \
+         np.allclose(np.mod(old['lon'].values-new_lon+180, 360)-180, 0, atol=1e-9)
+    if not ok: n_bad += 1
+    print(f"... ship track to {target.size} times: reindex/interpolate {t_old:.2f} s, ship_track {t_new:.2f} s, agree: {ok}")
+
+    t0 = time.perf_counter()
+    dist, bearing = track.distance_bearing(target, lat[1:-1], lon[1:-1])
+    print(f"... distance and bearing to the ship for {target.size} times in one call: {time.perf_counter()-t0:.2f} s")
+
+    if n_bad != 0: raise Exception("the geodesy doesn't match")
+
+if __name__ == '__main__':
+    main()
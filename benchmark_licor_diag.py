@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# ############################################################################################
+# PURPOSE:
+#
+# Regression check and benchmark for fl.decode_licor_diag/fl.unpack_licor_diag, the licor
+# diagnostic decoding with masks and shifts. Every one of the 2^16 codes (plus nans, fractions
+# and negative values) goes through the original bin() string decoder from functions_library.py
+# and the new one, pll/detector/chopper have to be identical. The other fields of unpack are
+# checked against plain integer arithmetic. Then a day of 20 Hz diagnostics is timed.
+#
+# USAGE:
+#
+#   python3 benchmark_licor_diag.py [--rows 1728000]
+#
+# ############################################################################################
+import argparse, time
+
+import numpy  as np
+import pandas as pd
+
+import functions_library as fl
+
+# the original, kept here to check against. np.int is gone from numpy now, it's int here
+def decode_licor_diag_strings(raw_diag):
+
+    bin_v = np.vectorize(bin)
+
+    licor_diag     = np.int16(raw_diag)
+    pll            = licor_diag*np.nan
+    detector_temp  = licor_diag*np.nan
+    chopper_temp   = licor_diag*np.nan
+    non_nan_inds  = ~np.isnan(raw_diag)
+    if non_nan_inds.any():
+
+        licor_diag_bin = bin_v(licor_diag[non_nan_inds])
+
+        chopper_temp[non_nan_inds]  = [int(x[2]) if len(x)==10 and x[2]!='b' else np.nan for x in licor_diag_bin]
+        detector_temp[non_nan_inds] = [int(x[3]) if len(x)==10 and x[2]!='b' else np.nan for x in licor_diag_bin]
+        pll[non_nan_inds]           = [int(x[4]) if len(x)==10 and x[2]!='b' else np.nan for x in licor_diag_bin]
+
+    return pll, detector_temp, chopper_temp
+
+def same(a, b):
+    a = np.asarray(a, dtype=np.float64); b = np.asarray(b, dtype=np.float64)
+    return a.size == b.size and np.all((a == b) | (np.isnan(a) & np.isnan(b)))
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', metavar='int', type=int, default=1728000, help='rows in the timed day')
+    args = parser.parse_args()
+
+    codes = np.arange(0, 2**16, dtype=np.float64)
+    extra = np.array([np.nan, np.nan, -0.5, -1, -300, 0.5, 127.9, 128.2, 200.5, 255.9, 256.0])
+    raw   = pd.Series(np.concatenate([codes, extra]))
+
+    n_bad = 0
+    old = decode_licor_diag_strings(raw.values.copy())
+    new = fl.decode_licor_diag(raw)
+    for name, o, n in zip(['pll', 'detector_temp', 'chopper_temp'], old, new):
+        ok = same(o, n)
+        if not ok: n_bad += 1
+        print(f"... {name:13s} identical to the string decoder over {raw.size} values: {ok}")
+
+    diag  = fl.unpack_licor_diag(codes)
+    icode = codes.astype(np.int64)
+    for field, expected in (('chopper',  (icode >> 7) & 1), ('detector', (icode >> 6) & 1),
+                            ('pll',      (icode >> 5) & 1), ('sync',     (icode >> 4) & 1),
+                            ('agc',      icode & 15)):
+        byte = icode < 256
+        ok   = np.array_equal(diag[field].mask, ~byte) and np.array_equal(diag[field].data[byte], expected[byte])
+        if not ok: n_bad += 1
+        print(f"... unpacked {field:8s} ok: {ok}")
+
+    rng = np.random.default_rng(42)
+    day = pd.Series(rng.choice([255, 247, 223, 191, 127, 240], args.rows).astype(np.float64))
+    day[rng.random(args.rows) < 0.01] = np.nan
+
+    t0 = time.perf_counter(); decode_licor_diag_strings(day.values.copy()); t_old = time.perf_counter()-t0
+    t0 = time.perf_counter(); fl.decode_licor_diag(day);                    t_new = time.perf_counter()-t0
+    print(f"... {args.rows} rows: strings {t_old:.2f} s, masks and shifts {t_new:.4f} s")
+
+    if n_bad != 0: raise Exception("the licor diagnostic decoder doesn't match")
+
+if __name__ == '__main__':
+    main()
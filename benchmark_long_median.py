@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# ############################################################################################
+# PURPOSE:
+#
+# Regression check and benchmark for fl.long_rolling_median, the decimated 6 hr/1 day running
+# medians of the tower/mast heading and ice altitude in create_level2_product_tower.py. Synthetic
+# 1 s series that drift over hours (a 12 hr tidal swing in the heading, slow settling of the ice
+# altitude) with gps noise (normal, and skewed for the altitude), spikes and pad-filled gaps are
+# filtered with the exact pandas rolling median and the decimated one. The largest deviation is
+# printed as a fraction of the spread of the samples in the window (from the interquartile
+# range, so the spikes don't count), and has to stay
+# under --max-dev at decimate=10. With decimate=1 the result has to be identical to pandas, and
+# min_periods has to give the same nans as pandas.
+#
+# USAGE:
+#
+#   python3 benchmark_long_median.py [--days 20] [--max-dev 0.15]
+#
+# ############################################################################################
+import argparse, time
+
+import numpy  as np
+import pandas as pd
+
+from datetime import datetime
+
+import functions_library as fl
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--days',    metavar='int',   type=int,   default=20,   help='days of 1 s data')
+    parser.add_argument('--max-dev', metavar='float', type=float, default=0.15, help='largest deviation at decimate=10, in units of the spread')
+    args = parser.parse_args()
+
+    rng   = np.random.default_rng(42)
+    index = pd.date_range(datetime(2019, 11, 1), periods=args.days*86400, freq='s')
+    hours = np.arange(index.size)/3600
+    unitv = pd.Series(np.cos(np.radians(30+2*np.sin(2*np.pi*hours/12.42)+rng.normal(0, 0.5, index.size))), index=index)
+    alt   = pd.Series(1.985-0.0005*hours+rng.normal(0, 0.05, index.size), index=index)
+    skew  = pd.Series(1.985-0.0005*hours+rng.exponential(0.05, index.size), index=index)
+    for s in (unitv, alt, skew):
+        s[rng.random(index.size) < 0.001] *= 5                       # spikes
+        s.iloc[index.size//3:index.size//3+7200] = np.nan            # two hours without gps
+
+    n_bad = 0
+    for name, series, window in (('heading unit vector', unitv, 21600), ('ice alt', alt, 21600),
+                                 ('ice alt skewed', skew, 21600), ('ice alt 1 day', alt, 86400)):
+        filled = series.ffill()
+        t0 = time.perf_counter(); exact = filled.rolling(window, center=True, min_periods=1).median(); t_exact = time.perf_counter()-t0
+        rolling = filled.rolling(window, center=True, min_periods=1)
+        spread  = ((rolling.quantile(0.75)-rolling.quantile(0.25))/1.349).values # robust, the spikes don't count
+
+        same, dev = fl.long_rolling_median(filled, window, decimate=1, check=True)
+        ok = np.array_equal(same.values, exact.values, equal_nan=True)
+        if not ok: n_bad += 1
+
+        for decimate in (10, 30, 60):
+            t0 = time.perf_counter(); fast, dev = fl.long_rolling_median(filled, window, decimate); t_fast = time.perf_counter()-t0
+            dev = float(np.nanmax(np.abs(fast.values-exact.values)/spread))
+            if decimate == 10 and dev > args.max_dev: n_bad += 1
+            print(f"... {name:20s} {window:5d} s window, every {decimate:2d} s: exact {t_exact:.2f} s, decimated {t_fast:.3f} s, max deviation {dev:.3f} of the spread")
+        print(f"... {name:20s} decimate=1 identical to pandas: {ok}")
+
+    # a long gap that isn't filled, min_periods decides where there's no median
+    min_periods = 18000 # the 2 hr gap leaves less than that in the windows around it
+    exact = alt.rolling(21600, center=True, min_periods=min_periods).median()
+    fast, dev = fl.long_rolling_median(alt, 21600, 10, min_periods=min_periods)
+    differ = np.count_nonzero(np.isnan(exact.values) != np.isnan(fast.values))
+    if differ > 20: n_bad += 1
+    print(f"... min_periods={min_periods} on the unfilled gap, samples where only one of them is nan: {differ}")
+
+    if n_bad != 0: raise Exception("the decimated long medians are too far from the exact ones")
+
+if __name__ == '__main__':
+    main()
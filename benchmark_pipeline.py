@@ -0,0 +1,490 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# ############################################################################################
+# PURPOSE:
+#
+# Benchmark for the processing pipeline as a whole, stage by stage, on synthetic station-days
+# so it can be run anywhere and compared between commits. Writes the raw files the level1 codes
+# read (asfs 20 Hz fast and 1 min slow card files, tower hourly metek msc*_raw.txt files and the
+# 1 Hz CR1000X/mast logger files) and level1/level2 netcdfs for get_flux_data, then times:
+#
+#   asfs_get_fast_data, asfs_get_slow_data, tower_get_fast_data, tower_get_slow_data (cold and
+#   with the parse cache), correct_timestamps, despike, grachev_fluxcapacitor, cor_ice_A10,
+#   qc_flagging, write_level2_netcdf, get_flux_data (level1, level2 and a lazy variable/time subset)
+#
+# Each stage runs in its own process so the peak memory (VmHWM, reset after the stage's inputs
+# are built) belongs to that stage alone, wall time is the best of --repeats runs. The results
+# go to a json file, and --compare reads two of them and reports the stages that got slower or
+# bigger by more than --threshold, exiting 1 if there were any.
+#
+# USAGE:
+#
+#   python3 benchmark_pipeline.py [-o results.json] [-d days] [-r repeats] [-s stage,stage...]
+#                                 [-w workdir] [--keep]
+#   python3 benchmark_pipeline.py --compare old.json new.json [--threshold 0.1]
+#   python3 benchmark_pipeline.py --list
+#
+# ############################################################################################
+import argparse, time, os, sys, json, shutil, tempfile, socket, platform, resource, subprocess, gc
+
+from multiprocessing import Process as P
+from multiprocessing import Queue   as Q
+
+import numpy  as np
+import pandas as pd
+
+from datetime import datetime, timedelta
+
+import functions_library as fl
+
+nan        = np.NaN
+first_day  = datetime(2019, 11, 15) # a plain day in the middle of leg 1, none of the special cases
+asfs_name  = 'asfs30'
+rng_seed   = 42
+
+# ############################################################################################
+# memory, from /proc so that the high water mark can be reset after a stage's inputs are built
+def reset_peak_rss():
+    try:
+        with open('/proc/self/clear_refs', 'w') as f: f.write('5')
+        return True
+    except OSError: return False
+
+def read_rss_mb(field='VmHWM'):
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(field+':'): return int(line.split()[1])/1024
+    except OSError: pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024 # kB on linux
+
+# ############################################################################################
+# synthetic raw files, laid out like the archive under workdir/data/
+
+# asfs fast card files, 20 Hz in 5 s scans of 100 rows that all carry the scan end time, six
+# hours to a file, with the half day either side of the days that get_fast_data reads too
+def make_asfs_fast_files(data_dir, days, rng):
+    card_dir = f'{data_dir}{asfs_name}/0_level_raw/site_visits/visit_01/SDcard/'
+    os.makedirs(card_dir, exist_ok=True)
+    nrows = 0
+    file_starts = pd.date_range(first_day-timedelta(hours=12), first_day+timedelta(days, hours=12), freq='6H')[0:-1]
+    for fstart in file_starts:
+        scan_ends = fstart+pd.to_timedelta(5*np.arange(1, 6*720+1), unit='s')
+        n = scan_ends.size*100
+        frame = pd.DataFrame({'TIMESTAMP':   np.repeat(scan_ends.strftime('%Y-%m-%d %H:%M:%S'), 100),
+                              'metek_x':     np.round(rng.normal(3, 1, n), 2),
+                              'metek_y':     np.round(rng.normal(-2, 1, n), 2),
+                              'metek_z':     np.round(rng.normal(0, 0.3, n), 2),
+                              'metek_T':     np.round(rng.normal(-20, 0.2, n), 2),
+                              'metek_heatstatus':    np.zeros(n, dtype=int),
+                              'metek_senspathstate': np.zeros(n, dtype=int),
+                              'licor_co2':   np.round(rng.normal(17, 0.05, n), 3),
+                              'licor_h2o':   np.round(rng.normal(40, 1, n), 3),
+                              'licor_pr':    np.round(rng.normal(101, 0.01, n), 3),
+                              'licor_diag':  np.full(n, 250),
+                              'licor_co2_str': np.round(rng.normal(90, 1, n), 1)})
+        frame.to_csv(f'{card_dir}{asfs_name}_fast_{fstart.strftime("%Y%m%d_%H%M")}.dat',
+                     header=False, index=False, quoting=2) # quote the timestamp like the logger
+        nrows += n
+    return nrows
+
+# asfs slow card files, one a day of 1 min records with the 89 column (version 0) layout
+def make_asfs_slow_files(data_dir, days, rng):
+    card_dir = f'{data_dir}{asfs_name}/0_level_raw/site_visits/visit_01/SDcard/'
+    os.makedirs(card_dir, exist_ok=True)
+    for iday in range(-1, days+1):
+        day   = first_day+timedelta(iday)
+        times = pd.date_range(day+timedelta(minutes=1), day+timedelta(1), freq='T')
+        frame = pd.DataFrame(np.round(rng.normal(0, 10, (times.size, 88)), 3))
+        frame.insert(0, 'TIMESTAMP', times.strftime('%Y-%m-%d %H:%M:%S'))
+        frame.to_csv(f'{card_dir}{asfs_name}_slow_{day.strftime("%Y%m%d")}.dat', header=False, index=False, quoting=2)
+    return times.size*(days+2)
+
+# tower metek files, one an hour, a header line then whitespace separated records with the time
+# as MMSSmmm in the first column
+def make_tower_fast_files(data_dir, days, rng):
+    metek_dir = f'{data_dir}tower/0_level_raw/Metek02m/'
+    os.makedirs(metek_dir, exist_ok=True)
+    n     = 72000
+    msecs = np.arange(0, n)*50
+    mmssuuu = (msecs//60000)*100000+(msecs%60000)
+    for iday in range(0, days):
+        for hour in pd.date_range(first_day+timedelta(iday), periods=24, freq='H'):
+            frame = pd.DataFrame({'mmssuuu': mmssuuu, 'heatstatus': np.zeros(n, dtype=int),
+                                  'x': np.round(rng.normal(3, 1, n), 2), 'y': np.round(rng.normal(-2, 1, n), 2),
+                                  'z': np.round(rng.normal(0, 0.3, n), 2), 'T': np.round(rng.normal(-20, 0.2, n), 2),
+                                  'hspd': np.round(rng.normal(3.6, 1, n), 2), 'ts': np.round(rng.normal(253, 0.2, n), 2),
+                                  'incx': np.full(n, 0.1), 'incy': np.full(n, -0.2)})
+            name = f'msc{hour.year%1000:03d}{hour.dayofyear:03d}{hour.hour:02d}_raw.txt'
+            with open(metek_dir+name, 'w') as f:
+                f.write('Metek uSonic-3 Cage MP, 20 Hz\n')
+                frame.to_csv(f, sep=' ', header=False, index=False)
+    return n*24*days
+
+# tower CR1000X logger (TOA5, 4 header lines) and CR1000 mast files at 1 Hz, one a day, plus a
+# few extra days either side to fill the fuzzy window get_slow_data looks in
+def make_tower_slow_files(data_dir, days, rng):
+    from tower_data_definitions import define_level1_slow as tower_level1_slow
+
+    logger_dir = f'{data_dir}tower/0_level_raw/CR1000X/daily_files/'
+    mast_dir   = f'{data_dir}tower/0_level_raw/CR1000_mast/daily_files/'
+    os.makedirs(logger_dir, exist_ok=True); os.makedirs(mast_dir, exist_ok=True)
+
+    slow_atts, slow_vars = tower_level1_slow()
+    mast_cols = 16
+    for iday in range(-3, days+3):
+        day   = first_day+timedelta(iday)
+        times = pd.date_range(day+timedelta(seconds=1), day+timedelta(1), freq='S').strftime('%Y-%m-%d %H:%M:%S')
+        for out_dir, name, ncol, col_names in ((logger_dir, 'CR1000X_tower', len(slow_vars)-1, slow_vars),
+                                               (mast_dir,   'CR1000_Noodleville', mast_cols, None)):
+            frame = pd.DataFrame(np.round(rng.normal(0, 10, (times.size, ncol)), 3))
+            frame.insert(0, 'TIMESTAMP', times)
+            if col_names is None: col_names = ['TIMESTAMP']+[f'mast_col_{i}' for i in range(0, ncol)]
+            with open(f'{out_dir}{name}_{day.strftime("%m%d%Y")}_0000.dat', 'w') as f:
+                f.write('"TOA5","synthetic","CR1000X","1","CR1000X.Std.03","CPU:tower.CR1X","1","Slow"\n')
+                f.write(','.join([f'"{c}"' for c in col_names])+'\n')
+                f.write(','.join(['"TS"']+['""']*ncol)+'\n')
+                f.write(','.join(['""']+['"Smp"']*ncol)+'\n')
+                frame.to_csv(f, header=False, index=False, quoting=2)
+    return times.size*(days+6)
+
+# a 1 min level2 dataframe with every variable the asfs level2 file has, qc flags all good
+def make_level2_frame(day, rng):
+    import asfs_data_definitions as asfs_defs
+    l2_atts, l2_cols = asfs_defs.define_level2_variables()
+    qc_atts, qc_cols = asfs_defs.define_qc_variables()
+    index = pd.date_range(day, day+timedelta(1), freq='T')[0:-1]
+    data  = {v: rng.normal(0, 10, index.size) for v in l2_cols}
+    data.update({v: np.zeros(index.size, dtype=np.int64) for v in qc_cols})
+    return pd.DataFrame(data, index=index)
+
+# level1 slow and level2 met netcdfs for get_flux_data, the level2 ones via write_level2_netcdf
+def make_netcdf_files(data_dir, days, rng):
+    from netCDF4 import Dataset
+    import create_level2_product_asfs as asfs2
+
+    l1_dir = f'{data_dir}{asfs_name}/1_level_ingest_{asfs_name}/'
+    l2_dir = f'{data_dir}{asfs_name}/2_level_product_{asfs_name}/'
+    os.makedirs(l1_dir, exist_ok=True); os.makedirs(l2_dir, exist_ok=True)
+    set_script_globals(asfs2, data_dir)
+
+    for iday in range(0, days):
+        day = first_day+timedelta(iday)
+        asfs2.write_level2_netcdf(make_level2_frame(day, rng), asfs_name, day, '1min', l2_dir)
+
+        with Dataset(f'{l1_dir}mos{asfs_name}slow.level1.{day.strftime("%Y%m%d.%H%M%S")}.nc', 'w') as nc:
+            nc.createDimension('time', None)
+            t = nc.createVariable('time', 'd', 'time')
+            t.setncattr('units', f'seconds since {day}')
+            t[:] = np.arange(0, 1440)*60.
+            for ivar in range(0, 88):
+                var = nc.createVariable(f'slow_var_{ivar}', 'f4', 'time')
+                var[:] = rng.normal(0, 10, 1440)
+
+# writes everything once, a marker file says what's there so --workdir can be reused
+def make_synthetic_data(work_dir, days):
+    data_dir = f'{work_dir}/data/'
+    marker   = f'{work_dir}/synthetic_data.json'
+    if os.path.exists(marker):
+        with open(marker) as f: made = json.load(f)
+        if made['days'] == days and made['first_day'] == str(first_day): return made
+
+    rng  = np.random.default_rng(rng_seed)
+    made = {'days': days, 'first_day': str(first_day)}
+    for name, make_func in (('asfs_fast_rows',  make_asfs_fast_files),  ('asfs_slow_rows',  make_asfs_slow_files),
+                            ('tower_fast_rows', make_tower_fast_files), ('tower_slow_rows', make_tower_slow_files),
+                            ('netcdf_files',    make_netcdf_files)):
+        t0 = time.perf_counter()
+        made[name] = make_func(data_dir, days, rng)
+        print(f"... made synthetic {name.replace('_', ' ')} in {time.perf_counter()-t0:.1f} s")
+
+    with open(marker, 'w') as f: json.dump(made, f)
+    return made
+
+# ############################################################################################
+# the stages. each setup builds its inputs and returns the thing to time and some size info
+
+# the processing scripts keep their settings in module globals that main() fills in
+def set_script_globals(module, data_dir, nthreads=1):
+    module.data_dir       = data_dir
+    module.level1_dir     = f'{os.path.dirname(data_dir.rstrip("/"))}/level1/'
+    module.slow_cache_dir = f'{os.path.dirname(data_dir.rstrip("/"))}/slow_cache/'
+    module.verboseprint   = lambda *a, **k: None
+    module.printline      = lambda *a, **k: None
+    module.verbose        = False
+    module.nthreads       = nthreads
+    module.trial          = False
+    module.n_trial_files  = 0
+    module.nan            = np.NaN
+    module.def_fill_int   = -9999
+    module.def_fill_flt   = -9999.0
+    module.epoch_time     = datetime(1970,1,1,0,0,0)
+    module.lvlname        = 'level2.4'
+    os.makedirs(f'{module.level1_dir}{asfs_name}', exist_ok=True)
+    os.makedirs(module.slow_cache_dir, exist_ok=True)
+
+def setup_asfs_get_fast_data(data_dir, args):
+    import create_level1_product_asfs as asfs1
+    set_script_globals(asfs1, data_dir, args.nthreads)
+    catalogue_file = asfs1.get_catalogue_file(asfs_name, None)
+    qq = Q(); asfs1.get_fast_file_list(asfs_name, catalogue_file, qq); qq.get() # catalogue is up to date
+    return lambda: asfs1.get_fast_data(first_day, catalogue_file, asfs_name), {'rows_per_day': 1728000}
+
+def setup_asfs_get_slow_data(data_dir, args):
+    import create_level1_product_asfs as asfs1
+    set_script_globals(asfs1, data_dir, args.nthreads)
+    end_time = first_day+timedelta(args.days)
+    return lambda: asfs1.get_slow_data(asfs_name, first_day, end_time, None), {'days': args.days}
+
+def setup_tower_get_fast_data(data_dir, args):
+    import create_level1_product_tower as tower1
+    set_script_globals(tower1, data_dir, args.nthreads)
+    return lambda: tower1.get_fast_data('tower/0_level_raw/Metek02m/', first_day), {'rows_per_day': 1728000}
+
+def setup_tower_get_slow_data(data_dir, args):
+    import create_level1_product_tower as tower1
+    set_script_globals(tower1, data_dir, args.nthreads)
+    shutil.rmtree(tower1.slow_cache_dir); os.makedirs(tower1.slow_cache_dir)
+    return lambda: tower1.get_slow_data(first_day), {'rows_per_day': 86400, 'cache': 'cold'}
+
+def setup_tower_get_slow_data_cached(data_dir, args):
+    import create_level1_product_tower as tower1
+    set_script_globals(tower1, data_dir, args.nthreads)
+    tower1.get_slow_data(first_day) # fills the cache if it isn't already
+    return lambda: tower1.get_slow_data(first_day+timedelta(args.days-1)), {'rows_per_day': 86400, 'cache': 'warm'}
+
+def setup_correct_timestamps(data_dir, args):
+    rng        = np.random.default_rng(rng_seed)
+    scan_sizes = np.full(17280, 100)
+    scan_sizes[rng.choice(17280, 50, replace=False)] = rng.integers(10, 99, 50) # short scans
+    scan_ends  = (first_day+pd.to_timedelta(5*np.arange(1, 17281), unit='s')).values
+    times      = np.repeat(scan_ends, scan_sizes)
+    return lambda: fl.spread_scan_timestamps(times, scan_len=5), {'rows': times.size}
+
+# 1 Hz day, short windows like the ship distance/bearing and a long one like the tower heading
+def setup_despike(data_dir, args):
+    rng    = np.random.default_rng(rng_seed)
+    index  = pd.date_range(first_day, periods=86400, freq='S')
+    series = [pd.Series(np.cumsum(rng.normal(0, 0.01, index.size))+(rng.random(index.size) < 0.001)*5, index=index)
+              for i in range(0, 4)]
+    def despike_day():
+        for s in series:
+            fl.despike(s.copy(), 2, 15, 'yes')
+            fl.despike(s.copy(), 0.02, 3600, 'no')
+    return despike_day, {'rows': index.size, 'series': len(series), 'filterlen': [15, 3600]}
+
+# a day of 10 Hz sonic/licor cut into 10 min flux windows the way level2 does it
+def setup_grachev_fluxcapacitor(data_dir, args):
+    rng    = np.random.default_rng(rng_seed)
+    index  = pd.date_range(first_day-timedelta(hours=1), first_day+timedelta(1, hours=1), freq='100ms')
+    n      = index.size
+    red    = lambda scale: np.cumsum(rng.standard_normal(n))*0.002*scale+rng.standard_normal(n)*scale
+    metek  = pd.DataFrame({'u': 3+red(1), 'v': -2+red(1), 'w': red(0.3), 'T': -20+red(0.2)}, index=index)
+    licor  = pd.DataFrame({'licor_h2o': 0.8+red(0.01), 'licor_co2': 700+red(1)}, index=index)
+
+    integration_window = 10
+    flux_times = pd.date_range(first_day, first_day+timedelta(1), freq=f'{integration_window}T')
+    po2_len    = np.ceil(2**round(np.log2(integration_window*60*10))/10/60)
+    t_win      = pd.Timedelta((po2_len-integration_window)/2, 'minutes')
+    win_starts = flux_times[0:-1]-t_win
+    win_ends   = flux_times[1:]+t_win
+    return (lambda: fl.grachev_fluxcapacitor_batched(3.3, metek, licor, 'g/m3', 'mg/m3', 1013., -20., 0.0008,
+                                                     win_starts, win_ends), {'windows': len(win_starts)})
+
+def setup_cor_ice_A10(data_dir, args):
+    rng = np.random.default_rng(rng_seed)
+    n   = 1440
+    ts  = rng.uniform(-35, -2, n)
+    t   = ts-rng.uniform(-2, 4, n)
+    bulk_input = [rng.uniform(1, 12, n), ts, t, rng.uniform(0.2, 0.9, n)*1e-3*np.exp(0.07*t), np.full(n, 600.),
+                  rng.uniform(990, 1035, n), np.full(n, 10.54), np.full(n, 9.34), np.full(n, 9.14)]
+    return lambda: fl.cor_ice_A10_array(bulk_input), {'records': n}
+
+def setup_qc_flagging(data_dir, args):
+    import qc_level2
+    from tower_data_definitions import define_qc_variables as tower_qc_variables
+    rng          = np.random.default_rng(rng_seed)
+    qc_var_names = tower_qc_variables()[1]
+    index        = pd.date_range(first_day, first_day+timedelta(args.days), freq='T')[0:-1]
+    data         = {v[0:-3]: rng.standard_normal(index.size) for v in qc_var_names if v.endswith('_qc')}
+    for var in ['vaisala_T_2m', 'vaisala_T_6m', 'vaisala_T_10m', 'mast_T']: data[var] = rng.standard_normal(index.size)
+    df = pd.DataFrame(data, index=index)
+    return (lambda: qc_level2.qc_flagging(df.copy(), "./qc_tables/qc_table_tower.csv", qc_var_names, 'tower'),
+            {'rows': index.size, 'qc_vars': len(qc_var_names)})
+
+def setup_write_level2_netcdf(data_dir, args):
+    import create_level2_product_asfs as asfs2
+    set_script_globals(asfs2, data_dir)
+    out_dir = f'{os.path.dirname(data_dir.rstrip("/"))}/scratch/'
+    os.makedirs(out_dir, exist_ok=True)
+    l2_data = make_level2_frame(first_day, np.random.default_rng(rng_seed))
+    return (lambda: asfs2.write_level2_netcdf(l2_data.copy(), asfs_name, first_day, '1min', out_dir),
+            {'rows': len(l2_data), 'vars': l2_data.columns.size})
+
+def setup_get_flux_data_level1(data_dir, args):
+    from get_data_functions import get_flux_data
+    end_day = first_day+timedelta(args.days-1)
+    return (lambda: get_flux_data(asfs_name, first_day, end_day, 1, data_dir=data_dir, data_type='slow',
+                                  nthreads=args.nthreads), {'days': args.days})
+
+def setup_get_flux_data_level2(data_dir, args):
+    from get_data_functions import get_flux_data
+    end_day = first_day+timedelta(args.days-1)
+    return (lambda: get_flux_data(asfs_name, first_day, end_day, 2, data_dir=data_dir, data_type='met',
+                                  nthreads=args.nthreads), {'days': args.days})
+
+# the lazy path, two variables for the middle of the first day
+def setup_get_flux_data_subset(data_dir, args):
+    from get_data_functions import get_flux_data
+    end_day    = first_day+timedelta(args.days-1)
+    time_range = (first_day+timedelta(hours=6), first_day+timedelta(hours=18))
+    return (lambda: get_flux_data(asfs_name, first_day, end_day, 1, data_dir=data_dir, data_type='slow',
+                                  variables=['slow_var_0', 'slow_var_1'], time_range=time_range),
+            {'days': args.days, 'variables': 2})
+
+stage_setups = {'asfs_get_fast_data':         setup_asfs_get_fast_data,
+                'asfs_get_slow_data':         setup_asfs_get_slow_data,
+                'tower_get_fast_data':        setup_tower_get_fast_data,
+                'tower_get_slow_data':        setup_tower_get_slow_data,
+                'tower_get_slow_data_cached': setup_tower_get_slow_data_cached,
+                'correct_timestamps':         setup_correct_timestamps,
+                'despike':                    setup_despike,
+                'grachev_fluxcapacitor':      setup_grachev_fluxcapacitor,
+                'cor_ice_A10':                setup_cor_ice_A10,
+                'qc_flagging':                setup_qc_flagging,
+                'write_level2_netcdf':        setup_write_level2_netcdf,
+                'get_flux_data_level1':       setup_get_flux_data_level1,
+                'get_flux_data_level2':       setup_get_flux_data_level2,
+                'get_flux_data_subset':       setup_get_flux_data_subset,}
+
+# one run of one stage, in its own process, result dict on qq
+def run_stage(stage_name, data_dir, args, qq):
+    try:
+        stage_func, size_info = stage_setups[stage_name](data_dir, args)
+        gc.collect()
+        rss_before = read_rss_mb('VmRSS')
+        was_reset  = reset_peak_rss()
+
+        t0 = time.perf_counter()
+        stage_func()
+        wall = time.perf_counter()-t0
+
+        peak = read_rss_mb('VmHWM') if was_reset else resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024
+        qq.put({'wall_s': wall, 'peak_rss_mb': peak,
+                'rss_before_mb': rss_before, 'peak_reset': was_reset,
+                'child_peak_rss_mb': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss/1024,
+                'size': size_info})
+    except Exception as e:
+        qq.put({'error': f'{type(e).__name__}: {e}'})
+
+def time_stage(stage_name, data_dir, args):
+    runs = []
+    for r in range(0, args.repeats):
+        qq = Q()
+        pp = P(target=run_stage, args=(stage_name, data_dir, args, qq))
+        pp.start()
+        result = qq.get()
+        pp.join()
+        if 'error' in result: return result
+        runs.append(result)
+
+    best = min(runs, key=lambda r: r['wall_s'])
+    return {'wall_s':            best['wall_s'],
+            'wall_all_s':        [r['wall_s'] for r in runs],
+            'peak_rss_mb':       max([r['peak_rss_mb'] for r in runs]),
+            'stage_rss_mb':      max([r['peak_rss_mb']-r['rss_before_mb'] for r in runs]),
+            'child_peak_rss_mb': max([r['child_peak_rss_mb'] for r in runs]),
+            'peak_reset':        best['peak_reset'],
+            'size':              best['size']}
+
+def run_info(args):
+    try:    commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True).stdout.strip()
+    except OSError: commit = '?'
+    versions = {'python': platform.python_version(), 'numpy': np.__version__, 'pandas': pd.__version__}
+    for lib in ['scipy', 'xarray', 'netCDF4']:
+        try: versions[lib] = __import__(lib).__version__
+        except ImportError: versions[lib] = None
+    return {'time': datetime.now().isoformat(timespec='seconds'), 'host': socket.gethostname(),
+            'cpus': os.cpu_count(), 'commit': commit, 'versions': versions,
+            'days': args.days, 'repeats': args.repeats, 'nthreads': args.nthreads}
+
+# ############################################################################################
+# compare two result files, stage by stage. returns the number of regressions
+def compare_results(old_file, new_file, threshold):
+    with open(old_file) as f: old = json.load(f)
+    with open(new_file) as f: new = json.load(f)
+
+    print(f"... {old['meta']['commit'][0:10]} ({old['meta']['time']}) -> {new['meta']['commit'][0:10]} ({new['meta']['time']})")
+    print(f"    {'stage':<28} {'old s':>9} {'new s':>9} {'ratio':>6}   {'old MB':>8} {'new MB':>8} {'ratio':>6}")
+
+    n_regressed = 0
+    for stage_name in new['stages']:
+        new_stage = new['stages'][stage_name]
+        old_stage = old['stages'].get(stage_name)
+        if old_stage is None or 'error' in old_stage or 'error' in new_stage:
+            print(f"    {stage_name:<28} not comparable: {old_stage and old_stage.get('error', '')} {new_stage.get('error', '')}")
+            continue
+
+        t_ratio   = new_stage['wall_s']/old_stage['wall_s']
+        m_ratio   = new_stage['peak_rss_mb']/old_stage['peak_rss_mb']
+        regressed = t_ratio > 1+threshold or m_ratio > 1+threshold
+        if regressed: n_regressed += 1
+        print(f"    {stage_name:<28} {old_stage['wall_s']:9.3f} {new_stage['wall_s']:9.3f} {t_ratio:6.2f}   "+
+              f"{old_stage['peak_rss_mb']:8.1f} {new_stage['peak_rss_mb']:8.1f} {m_ratio:6.2f}"+
+              ("   !!! regression" if regressed else ""))
+
+    if n_regressed > 0: print(f"!!! {n_regressed} stages regressed by more than {threshold*100:.0f}%")
+    else:               print(f"... no regressions over {threshold*100:.0f}%")
+    return n_regressed
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-o', '--output',   metavar='str', default='benchmark_pipeline.json', help='json file the results go to')
+    parser.add_argument('-d', '--days',     metavar='int', type=int, default=1, help='synthetic station-days to make')
+    parser.add_argument('-r', '--repeats',  metavar='int', type=int, default=3, help='best of this many runs per stage')
+    parser.add_argument('-p', '--nthreads', metavar='int', type=int, default=1, help='nthreads for the stages that have it')
+    parser.add_argument('-s', '--stages',   metavar='str', default=None, help='comma separated stages to run, default all')
+    parser.add_argument('-w', '--workdir',  metavar='str', default=None, help='where the synthetic data goes, reused if it matches')
+    parser.add_argument('--keep',    action='store_true', help="don't delete the synthetic data afterwards")
+    parser.add_argument('--list',    action='store_true', help='list the stages and exit')
+    parser.add_argument('--compare', metavar='str', nargs=2, default=None, help='old.json new.json, report regressions')
+    parser.add_argument('--threshold', metavar='float', type=float, default=0.1, help='fractional slowdown/growth that counts as a regression')
+    args = parser.parse_args()
+
+    if args.list:
+        for stage_name in stage_setups: print(stage_name)
+        return
+    if args.compare:
+        sys.exit(1 if compare_results(*args.compare, args.threshold) > 0 else 0)
+
+    stage_names = list(stage_setups.keys())
+    if args.stages:
+        stage_names = args.stages.split(',')
+        unknown = [s for s in stage_names if s not in stage_setups]
+        if unknown: raise Exception(f"unknown stages {unknown}, see --list")
+
+    work_dir = args.workdir if args.workdir else tempfile.mkdtemp(prefix='mosaic_bench_')
+    os.makedirs(work_dir, exist_ok=True)
+    data_dir = f'{work_dir}/data/'
+
+    try:
+        print(f"... synthetic data for {args.days} station-days in {work_dir}")
+        made    = make_synthetic_data(work_dir, args.days)
+        results = {'meta': run_info(args), 'synthetic_data': made, 'stages': {}}
+
+        for stage_name in stage_names:
+            result = time_stage(stage_name, data_dir, args)
+            results['stages'][stage_name] = result
+            if 'error' in result: print(f"!!! {stage_name:<28} failed: {result['error']}")
+            else: print(f"... {stage_name:<28} {result['wall_s']:9.3f} s, peak {result['peak_rss_mb']:8.1f} MB "+
+                        f"({result['stage_rss_mb']:+.1f} MB in the stage)")
+
+        with open(args.output, 'w') as f: json.dump(results, f, indent=2)
+        print(f"... results written to {args.output}")
+
+    finally:
+        if not args.keep and not args.workdir: shutil.rmtree(work_dir, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
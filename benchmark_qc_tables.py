@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# ############################################################################################
+# PURPOSE:
+#
+# Regression check and benchmark for the compiled manual QC tables in qc_level2.py. Runs the
+# original row by row qc_flagging (copied below) and the compiled version on the four shipped
+# tables, with a synthetic 10 minute dataframe covering all of MOSAiC, and checks that every qc
+# variable comes out identical. The original needs more than 5 GB for 1 minute data.
+#
+# USAGE:
+#
+#   python3 benchmark_qc_tables.py [--freq 10min]
+#
+# ############################################################################################
+import argparse, time
+
+import numpy  as np
+import pandas as pd
+
+import qc_level2
+
+from tower_data_definitions import define_qc_variables as tower_qc_variables
+from asfs_data_definitions  import define_qc_variables as asfs_qc_variables
+
+nan = np.NaN
+
+# the original, kept here to check against. same setup as qc_flagging, then the table loops
+def qc_flagging_original(data_frame, table_file, qc_var_names, station_name):
+
+    flag_df = qc_level2.get_qc_table(table_file)
+
+    qcdf = pd.DataFrame(index=data_frame.index, columns=qc_var_names, dtype=np.int64)
+    qcdf = qcdf.fillna(0)
+    data_frame = pd.concat([data_frame, qcdf], axis=1)
+
+    if station_name == 'tower':
+        for h in ['2m', '6m', '10m', 'mast']:
+            var = f'turbulence_{h}_qc'
+            data_frame[var] = np.nan
+            if h!='mast': data_frame.loc[~data_frame[f'vaisala_T_{h}'].isnull(), var] = 0
+            else: data_frame.loc[~data_frame[f'{h}_T'].isnull(), var] = 0 
+        data_frame['bulk_qc'] = np.nan
+        data_frame.loc[~data_frame['vaisala_T_10m'].isnull(), 'bulk_qc'] = 0
+    else:
+        data_frame['turbulence_qc'] = np.nan
+        data_frame['bulk_qc']       = np.nan
+        data_frame.loc[~data_frame['temp'].isnull(), 'turbulence_qc'] = 0
+        data_frame.loc[~data_frame['temp'].isnull(), 'bulk_qc']       = 0
+
+    lookup_table = qc_level2.get_qc_lookup_table(qc_var_names, station_name)
+
+    for irow, row in flag_df.iterrows():
+        height_strs = ['2m', '6m', '10m', 'mast'] 
+        if any(h in row['var_name'] for h in height_strs):
+            hstr = '_'+row['var_name'].split('_')[-1]
+            special_key = row['var_name'].rstrip('_'+hstr)
+        else:
+            hstr = ''
+            special_key = row['var_name']
+
+        if any(special_key in c for c in lookup_table.keys()):
+            for v in lookup_table[special_key]: 
+                special_var = v+hstr+'_qc'
+                data_frame.loc[row['start_date']:row['end_date'], special_var] = row['qc_val']
+        else:
+            var_to_qc = row['var_name']+'_qc' 
+            data_frame.loc[row['start_date']:row['end_date'], var_to_qc] = row['qc_val']
+
+    for parent_var, child_var_list in lookup_table.items():
+        if 'ALL_' not in parent_var:
+            try:
+                data_frame[parent_var+'_qc'] 
+                height_strs = ['',]
+            except KeyError:
+                data_frame[parent_var+'_2m_qc'] 
+                height_strs = ['_2m', '_6m', '_10m', '_mast'] 
+            for h in height_strs:
+                caut_inds = (data_frame[parent_var+h+'_qc']==1)  
+                bad_inds  = (data_frame[parent_var+h+'_qc']==2)  
+                eng_inds  = (data_frame[parent_var+h+'_qc']==3)
+                for child_var in child_var_list:
+                    no_overwrite = (data_frame[child_var+h+'_qc']!=2)&(data_frame[child_var+h+'_qc']!=3)
+                    data_frame.loc[(caut_inds)&(no_overwrite), child_var+h+'_qc'] = 1
+                    no_overwrite = (data_frame[child_var+h+'_qc']!=2)
+                    data_frame.loc[(eng_inds)&(no_overwrite), child_var+h+'_qc']  = 3
+                    data_frame.loc[bad_inds, child_var+h+'_qc']  = 2
+        else:
+            for irow, row in flag_df.iterrows():
+                if parent_var == row['var_name']: 
+                    for child_var in child_var_list:
+                        try: 
+                            child_qc_var = child_var+'_qc'
+                            no_overwrite = (data_frame[child_qc_var]!=2)&(data_frame[child_qc_var]!=3)
+                            if row['qc_val'] == 2: no_overwrite = (data_frame[child_qc_var]!=2)
+                            time_range = (data_frame.index>row['start_date'])&(data_frame.index<row['end_date'])
+                            data_frame.loc[(time_range) & (no_overwrite), child_qc_var] = row['qc_val']
+                        except:
+                            for h in ['_2m', '_6m', '_10m', '_mast']:
+                                child_qc_var = child_var+h+'_qc'
+                                no_overwrite = (data_frame[child_qc_var]!=2)&(data_frame[child_qc_var]!=3)
+                                if row['qc_val'] == 2: no_overwrite = (data_frame[child_qc_var]!=2)
+                                time_range = (data_frame.index>row['start_date'])&(data_frame.index<row['end_date'])
+                                data_frame.loc[(time_range) & (no_overwrite), child_qc_var] = row['qc_val']
+    return data_frame
+
+# some data for every qc variable, and the temperatures the turbulence flags key off of
+def make_data(qc_var_names, station_name, freq, rng):
+    index = pd.date_range('20191015', '20200920', freq=freq)
+    data  = {v[0:-3]: rng.standard_normal(index.size) for v in qc_var_names if v.endswith('_qc')}
+    if station_name == 'tower': extra = ['vaisala_T_2m', 'vaisala_T_6m', 'vaisala_T_10m', 'mast_T']
+    else:                       extra = ['temp']
+    for var in extra:
+        data[var] = rng.standard_normal(index.size)
+        data[var][rng.random(index.size) < 0.05] = nan # gaps
+    return pd.DataFrame(data, index=index)
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--freq', metavar='str', default='10min', help='time step of the synthetic data')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(42)
+    for station_name in ['tower', 'asfs30', 'asfs40', 'asfs50']:
+        table_file = f"./qc_tables/qc_table_{station_name}.csv"
+        if station_name == 'tower': qc_var_names = tower_qc_variables()[1]
+        else:                       qc_var_names = asfs_qc_variables()[1]
+
+        df = make_data(qc_var_names, station_name, args.freq, rng)
+
+        t0 = time.perf_counter()
+        old = qc_flagging_original(df.copy(), table_file, qc_var_names, station_name)
+        t_old = time.perf_counter()-t0
+
+        t0 = time.perf_counter()
+        new = qc_level2.qc_flagging(df.copy(), table_file, qc_var_names, station_name)
+        t_new = time.perf_counter()-t0
+
+        t0 = time.perf_counter()
+        qc_level2.qc_flagging(df.copy(), table_file, qc_var_names, station_name) # compiled table is cached now
+        t_cached = time.perf_counter()-t0
+
+        qc_cols = [c for c in old.columns if c.endswith('_qc')]
+        n_diff  = 0
+        for col in qc_cols:
+            a = old[col].to_numpy(dtype=np.float64)
+            b = new[col].to_numpy(dtype=np.float64)
+            n_col = np.sum(~((a == b) | (np.isnan(a) & np.isnan(b))))
+            if n_col > 0: print(f"     {col}: {n_col} flags differ")
+            n_diff += n_col
+        if set(qc_cols) != set([c for c in new.columns if c.endswith('_qc')]):
+            print(f"     the qc columns differ: {set(qc_cols) ^ set([c for c in new.columns if c.endswith('_qc')])}")
+            n_diff += 1
+
+        print(f"... {station_name:>6}: {len(qc_cols)} qc vars x {len(df)} times, original {t_old:7.2f} s, "+
+              f"compiled {t_new:6.2f} s ({t_cached:5.2f} s cached), {n_diff} flags differ")
+        if n_diff != 0: raise Exception(f"compiled qc table doesn't match the original for {station_name}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# ############################################################################################
+# PURPOSE:
+#
+# Regression check and benchmark for fl.running_median/fl.despike_stream, the double heap running
+# median that carries its state from one piece of a series to the next. A synthetic 1 Hz series
+# (heading-like, with gaps and spikes) is fed in day sized pieces, and in pieces of random sizes
+# (empty ones, ones shorter than the window and longer), with the tower level2 windows (21600
+# and 86400), the 20 Hz despike window (1200) and an even one, and compared with the centred
+# pandas rolling median / fl.despike on the whole series. They have to be identical, joins
+# between the pieces included, and so does a series shorter than half a window.
+#
+# USAGE:
+#
+#   python3 benchmark_running_median.py [-d days] [--chunk 86400]
+#
+# ############################################################################################
+import argparse, time
+
+import numpy  as np
+import pandas as pd
+
+import functions_library as fl
+
+def same(a, b):
+    a = np.asarray(a, dtype=np.float64); b = np.asarray(b, dtype=np.float64)
+    return a.size == b.size and np.all((a == b) | (np.isnan(a) & np.isnan(b)))
+
+# the series through rm in pieces that start at starts, values and medians put back together
+def in_pieces(rm, series, starts):
+    bounds = list(starts)+[series.size]
+    out    = [rm.update(series[bounds[i]:bounds[i+1]]) for i in range(0, len(bounds)-1)]+[rm.flush()]
+    return np.concatenate([o[0] for o in out]), np.concatenate([o[1] for o in out])
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-d', '--days',  metavar='int', type=int, default=4,     help='days of 1 Hz data')
+    parser.add_argument('--chunk',       metavar='int', type=int, default=86400, help='samples per piece')
+    args = parser.parse_args()
+
+    rng    = np.random.default_rng(42)
+    n      = args.days*86400
+    series = pd.Series(np.cumsum(rng.normal(0, 0.01, n))+(rng.random(n) < 0.001)*5)
+    series[rng.random(n) < 0.02] = np.nan                   # scattered dropouts
+    series[n//3:n//3+5000]        = np.nan                   # and a long gap
+    series[n//2:n//2+2000]        = 1.5                      # and a stuck sensor, lots of equal values
+    values = series.values
+    random_starts = np.unique(np.concatenate([[0, 1, 1], rng.integers(0, n, 40)])) # 1, 1: an empty piece
+    print(f"... {n} samples in pieces of {args.chunk}, and in {random_starts.size} random pieces")
+
+    n_bad = 0
+    for window, min_periods in ((21600, 1), (86400, 1), (1200, 600), (1000, 1)):
+        t0 = time.perf_counter()
+        whole = series.rolling(window, center=True, min_periods=min_periods).median().values
+        t_whole = time.perf_counter()-t0
+
+        t0 = time.perf_counter()
+        out_values, medians = in_pieces(fl.running_median(window, min_periods), values, range(0, n, args.chunk))
+        t_stream = time.perf_counter()-t0
+        ok = same(medians, whole) and same(out_values, values)
+
+        out_values, medians = in_pieces(fl.running_median(window, min_periods), values, random_starts)
+        ok = ok and same(medians, whole) and same(out_values, values)
+
+        short  = values[n//2-window//5:n//2+window//5] # shorter than half the window, half stuck
+        medians = in_pieces(fl.running_median(window, min_periods), short, [0, short.size//3])[1]
+        ok = ok and same(medians, pd.Series(short).rolling(window, center=True, min_periods=min_periods).median().values)
+
+        if not ok: n_bad += 1
+        print(f"... window {window:6d}: pandas on the whole series {t_whole:6.2f} s, double heap in pieces {t_stream:6.2f} s, identical: {ok}")
+
+    for medfill in ['yes', 'no', 'ret']:
+        ds  = fl.despike_stream(2, 1200, medfill)
+        out = np.concatenate([ds.update(values[i:i+args.chunk]) for i in range(0, n, args.chunk)]+[ds.flush()])
+        ok  = same(out, fl.despike(series.copy(), 2, 1200, medfill).values)
+        if not ok: n_bad += 1
+        print(f"... despike medfill={medfill:>3}: identical: {ok}")
+
+    if n_bad != 0: raise Exception("the chunked running median doesn't match pandas")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# ############################################################################################
+# PURPOSE:
+#
+# Micro-benchmark for the spectral plan used by grachev_fluxcapacitor. Times the old call
+# pattern (6 welch + 13 csd calls that each rebuild the window/detrend/fft) against the cached
+# plan that transforms each series once, for a single 10 minute window and for a full day of
+# them. Synthetic red-noise data, no files needed.
+#
+# USAGE:
+#
+#   python3 benchmark_spectral_plan.py [-n number_of_windows] [-r repeats]
+#
+# ############################################################################################
+import argparse, time
+
+import numpy  as np
+
+from scipy import signal
+
+import functions_library as fl
+
+def old_call_pattern(us, vs, ws, Ts, qs, cs, wdirs, nf):
+    F,su = signal.welch(us,10,signal.windows.hamming(nf),detrend='linear')
+    F,sv = signal.welch(vs,10,signal.windows.hamming(nf),detrend='linear')
+    F,sw = signal.welch(ws,10,signal.windows.hamming(nf),detrend='linear')
+    F,sT = signal.welch(Ts,10,signal.windows.hamming(nf),detrend='linear')
+    F,sq = signal.welch(qs,10,signal.windows.hamming(nf),detrend='linear')
+    F,sc = signal.welch(cs,10,signal.windows.hamming(nf),detrend='linear')
+    F,swu = signal.csd(ws,us,10,signal.windows.hamming(nf),detrend='linear')
+    F,swv = signal.csd(ws,vs,10,signal.windows.hamming(nf),detrend='linear')
+    F,swT = signal.csd(ws,Ts,10,signal.windows.hamming(nf),detrend='linear')
+    F,swq = signal.csd(ws,qs,10,signal.windows.hamming(nf),detrend='linear')
+    F,swc = signal.csd(ws,cs,10,signal.windows.hamming(nf),detrend='linear')
+    F,suT = signal.csd(us,Ts,10,signal.windows.hamming(nf),detrend='linear')
+    F,svT = signal.csd(vs,Ts,10,signal.windows.hamming(nf),detrend='linear')
+    F,suv = signal.csd(us,vs,10,signal.windows.hamming(nf),detrend='linear')
+    F,suq = signal.csd(us,qs,10,signal.windows.hamming(nf),detrend='linear')
+    F,svq = signal.csd(vs,qs,10,signal.windows.hamming(nf),detrend='linear')
+    F,suc = signal.csd(us,cs,10,signal.windows.hamming(nf),detrend='linear')
+    F,svc = signal.csd(vs,cs,10,signal.windows.hamming(nf),detrend='linear')
+    F,swdir = signal.welch(wdirs,10,signal.windows.hamming(nf),detrend='linear')
+    return [su, sv, sw, sT, sq, sc, swu, swv, swT, swq, swc, suT, svT, suv, suq, svq, suc, svc, swdir]
+
+def plan_call_pattern(us, vs, ws, Ts, qs, cs, wdirs, nf):
+    plan = fl.get_spectral_plan(10, nf)
+    Xu, Xv, Xw, XT, Xq, Xc, Xwdir = plan.segment_fft(np.stack([us, vs, ws, Ts, qs, cs, wdirs]))
+    return [plan.spectrum(Xu), plan.spectrum(Xv), plan.spectrum(Xw), plan.spectrum(XT), plan.spectrum(Xq),
+            plan.spectrum(Xc), plan.cross_spectrum(Xw,Xu), plan.cross_spectrum(Xw,Xv), plan.cross_spectrum(Xw,XT),
+            plan.cross_spectrum(Xw,Xq), plan.cross_spectrum(Xw,Xc), plan.cross_spectrum(Xu,XT),
+            plan.cross_spectrum(Xv,XT), plan.cross_spectrum(Xu,Xv), plan.cross_spectrum(Xu,Xq),
+            plan.cross_spectrum(Xv,Xq), plan.cross_spectrum(Xu,Xc), plan.cross_spectrum(Xv,Xc),
+            plan.spectrum(Xwdir)]
+
+# red noise, roughly what a sonic looks like
+def make_window(rng, nf):
+    return [np.cumsum(rng.standard_normal(nf))*0.01 + rng.standard_normal(nf) for i in range(0,7)]
+
+def time_it(func, windows, nf, repeats):
+    best = np.inf
+    for r in range(0,repeats):
+        t0 = time.perf_counter()
+        for win in windows: func(*win, nf)
+        best = min(best, time.perf_counter()-t0)
+    return best
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--nwindows', metavar='int', type=int, default=144, help='windows in a "day", 144 x 10 min')
+    parser.add_argument('-r', '--repeats',  metavar='int', type=int, default=3,   help='best of this many repeats')
+    args = parser.parse_args()
+
+    nf      = 2**13
+    rng     = np.random.default_rng(42)
+    windows = [make_window(rng, nf) for i in range(0,args.nwindows)]
+
+    # check they agree before timing anything
+    old_out  = old_call_pattern(*windows[0], nf)
+    plan_out = plan_call_pattern(*windows[0], nf)
+    max_diff = max([np.max(np.abs(o-p))/np.max(np.abs(o)) for o, p in zip(old_out, plan_out)])
+    print(f"... max relative difference between welch/csd and the plan: {max_diff:.3e}")
+
+    fl.get_spectral_plan(10, nf) # the plan is built once per process, don't count it
+
+    for label, wins in (('one window', windows[0:1]), (f'{len(windows)} windows', windows)):
+        t_old  = time_it(old_call_pattern,  wins, nf, args.repeats)
+        t_plan = time_it(plan_call_pattern, wins, nf, args.repeats)
+        print(f"... {label:>14}: welch/csd {t_old*1000:9.1f} ms, plan {t_plan*1000:9.1f} ms, speedup {t_old/t_plan:5.1f}x")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# ############################################################################################
+# PURPOSE:
+#
+# Regression check and benchmark for fl.build_timestamps/fl.parse_logger_timestamps, the integer
+# timestamp construction the tower and asfs level1 readers use. A day of 20 Hz tower 'mmssuuu'
+# stamps (24 hourly files) is converted the way get_fast_data did, zfill'd strings with the
+# file's date through pd.to_datetime, and with build_timestamps. A day of 20 Hz asfs logger
+# strings is read with read_csv(parse_dates=...) and with read_csv plus parse_logger_timestamps,
+# which costs about the same but doesn't give up on the column over one bad string. The times
+# have to be identical, and out of range components/garbage strings have to come back NaT.
+#
+# USAGE:
+#
+#   python3 benchmark_timestamps.py [--hz 20]
+#
+# ############################################################################################
+import argparse, os, shutil, tempfile, time
+
+import numpy  as np
+import pandas as pd
+
+from datetime import datetime, timedelta
+
+import functions_library as fl
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--hz', metavar='int', type=int, default=20, help='sample rate')
+    args = parser.parse_args()
+
+    n_bad = 0
+    day   = datetime(2020, 2, 29)
+    rng   = np.random.default_rng(42)
+
+    # the tower, hour by hour as the files come
+    usec    = np.arange(0, 3600*args.hz)*(1000000//args.hz)
+    mmssuuu = ((usec//60000000)*100000+(usec//1000)%60000).astype(np.float64)
+    t_old = 0; t_new = 0; same = True
+    for hour in range(0, 24):
+        file_date = day+timedelta(hours=hour)
+        t0 = time.perf_counter()
+        noaadate = np.char.zfill(mmssuuu.astype(int).astype(str), 7)
+        date_now = ' {}-{}-{}-{}'.format(file_date.year, file_date.month, file_date.day, file_date.hour)
+        old      = pd.to_datetime(np.array([nd+date_now for nd in noaadate]), format='%M%S%f %Y-%m-%d-%H')
+        t_old   += time.perf_counter()-t0
+
+        t0 = time.perf_counter()
+        d  = file_date
+        new, bad = fl.build_timestamps(d.year, d.month, d.day, d.hour, mmssuuu//100000,
+                                       (mmssuuu//1000)%100, (mmssuuu%1000)*1000)
+        t_new   += time.perf_counter()-t0
+        same     = same and not bad.any() and np.array_equal(old.values, new)
+    if not same: n_bad += 1
+    print(f"... tower day, {24*mmssuuu.size} stamps: strings/to_datetime {t_old:.2f} s, build_timestamps {t_new:.3f} s, identical: {same}")
+
+    # the asfs, a day of logger strings with fractional seconds every so often, read from a csv the way
+    # the asfs reader did, parse_dates in read_csv, and the way it does now
+    times   = pd.date_range(day, day+timedelta(1), freq=f'{1000//args.hz}ms')[0:-1]
+    strings = np.array(times.strftime('%Y-%m-%d %H:%M:%S'), dtype=object)
+    frac    = rng.random(times.size) < 0.01
+    strings[frac] = times[frac].strftime('%Y-%m-%d %H:%M:%S.%f')
+    expected = times.values.astype('datetime64[s]').astype('datetime64[ns]')
+    expected[frac] = times.values[frac]
+    csv_file = f'{tempfile.mkdtemp(prefix="timestamps_")}/asfs_day.csv'
+    pd.DataFrame({'TIMESTAMP': strings, 'metek_x': rng.normal(0, 1, times.size)}).to_csv(csv_file, header=False, index=False)
+
+    t0 = time.perf_counter()
+    old = pd.read_csv(csv_file, parse_dates=[0], sep=',', engine='c', names=['TIMESTAMP', 'metek_x'])
+    t_old = time.perf_counter()-t0
+    t0 = time.perf_counter()
+    new = pd.read_csv(csv_file, sep=',', engine='c', names=['TIMESTAMP', 'metek_x'])
+    new_times, bad = fl.parse_logger_timestamps(new['TIMESTAMP'].values)
+    t_new = time.perf_counter()-t0
+    shutil.rmtree(os.path.dirname(csv_file))
+
+    # pandas 2 takes the format from the first string, so with fractions here and there parse_dates
+    # gives up and leaves the column as strings
+    same     = not bad.any() and np.array_equal(new_times, expected)
+    old_same = np.issubdtype(old['TIMESTAMP'].dtype, np.datetime64) and np.array_equal(old['TIMESTAMP'].values, expected)
+    if not same: n_bad += 1
+    print(f"... asfs day, {times.size} strings: read_csv parse_dates {t_old:.2f} s, read_csv+parse_logger_timestamps {t_new:.2f} s")
+    print(f"... parse_logger_timestamps right: {same}, parse_dates right: {old_same} ({old['TIMESTAMP'].dtype})")
+
+    # what's wrong has to be flagged, not raise, where read_csv would leave the whole column as strings
+    junk   = ['2020-13-01 00:00:00', '2019-02-29 00:00:00', '2020-01-01 24:00:00', '2020-01-01 00:60:00',
+              '2020-01-01 00:00:60', 'TIMESTAMP', '"TS"', '', np.nan, '2020-01-01 00:00:00.12 4']
+    good   = ['2020-02-29 23:59:59', '2020-01-01T00:00:00.5', '2020-01-01 00:00:00.123456']
+    good_t = np.array(['2020-02-29T23:59:59', '2020-01-01T00:00:00.5', '2020-01-01T00:00:00.123456'], dtype='datetime64[ns]')
+    new, bad = fl.parse_logger_timestamps(np.array(junk+good, dtype=object))
+    ok = np.array_equal(bad, [True]*len(junk)+[False]*len(good)) and np.all(np.isnat(new[bad])) and \
+         np.array_equal(new[~bad], good_t)
+    comps, comp_bad = fl.build_timestamps([2020, 2020, 2020, 2020], [2, 2, 4, 4], [29, 30, 30, 31], 0, 0, [0, 0, np.nan, 0])
+    ok = ok and np.array_equal(comp_bad, [False, True, True, True])
+    if not ok: n_bad += 1
+    print(f"... bad components and strings flagged as NaT: {ok}")
+
+    if n_bad != 0: raise Exception("the integer timestamps don't match pd.to_datetime")
+
+if __name__ == '__main__':
+    main()
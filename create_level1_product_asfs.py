@@ -67,7 +67,7 @@ from asfs_data_definitions import define_level1_slow, define_level1_fast
 
 import functions_library as fl
 
-import os, inspect, argparse, time, subprocess
+import os, inspect, argparse, time, glob
  
 import numpy  as np
 import pandas as pd
@@ -80,6 +80,7 @@ global nthreads
 if '.psd.' in socket.gethostname():
     nthreads = 15  # the twins have 64 cores, it won't hurt if we use <20
 else: nthreads = 4 # laptops don't tend to have 64 cores
+max_tasks_per_worker = 10 # worker processes are replaced after this many days, caps memory growth
 
 from multiprocessing import Process as P
 from multiprocessing import Queue   as Q
@@ -135,7 +136,8 @@ def main(): # the main data crunching program
     parser.add_argument('-v', '--verbose', action ='count', help='print verbose log messages')
     parser.add_argument('-a', '--station', metavar='str',help='asfs#0, if omitted all will be procesed')
     parser.add_argument('-p', '--path', metavar='str', help='base path to data up to, including /data/, include trailing slash')  # pass the base path to make it more mobile
-    parser.add_argument('-pd', '--pickledir', metavar='str',help='want to store a pickle of the data for debugging?')
+    parser.add_argument('-pd', '--pickledir', metavar='str',help='directory to cache the data in (feather/zarr), for speed on reruns')
+    parser.add_argument('-f', '--force', action ='store_true', help='reprocess every day, even the ones the run manifest says are up to date')
 
     # add verboseprint function for extra info using verbose flag, ignore these 5 lines if you want
     args         = parser.parse_args()
@@ -196,6 +198,55 @@ def main(): # the main data crunching program
     # ##########################################################################################
     # read *all* of the slow data... why have so much RAM if you don't use it?
 
+    printline()
+    print("\nGetting list of fast files for each station and sorting them by date... \n")
+    printline()
+
+    # there's too much fast data, we need to read in and write out each
+    # day individually if coded like slow below, station "fast" datasets take
+    # 32Gb of RAM (I only have 40Gb) and that's only for legs 1 and 2
+    # #########################################################################
+    fast_atts, fast_cols = define_level1_fast()
+    fast_catalogue       = {} # the raw file catalogue (sqlite file) for each station, see fl.raw_file_catalogue
+    fast_file_q = {}
+    for curr_station in flux_stations: # update station catalogues in parallel
+        fast_file_q[curr_station] = Q()
+        P(target=get_fast_file_list, \
+               args=(curr_station, get_catalogue_file(curr_station, pickle_dir), fast_file_q[curr_station])).start()
+
+    for curr_station in flux_stations: # wait for threads and get return values
+        fast_catalogue[curr_station] = fast_file_q[curr_station].get()
+
+    day_series = pd.date_range(start_time+timedelta(1), end_time-timedelta(1)) # data was requested for these days
+    day_delta  = pd.to_timedelta(86399999999,unit='us') # we want to go up to but not including 00:00
+
+    # a station day is made from the fast files get_fast_data() reads for it and the slow files with data
+    # in the day, the run manifest (see fl.run_manifest) knows which days were already written from those
+    # files as they are now, with this code_version. only the others are (re)done, unless --force
+    printline()
+    print("Checking the run manifests for days that are already up to date...")
+    manifest = {}; day_jobs = {}; stale_days = {}
+    for curr_station in flux_stations:
+        catalogue = fl.raw_file_catalogue(fast_catalogue[curr_station])
+        catalogue.update('slow', catalogue.card_files(data_dir+curr_station+'/0_level_raw/site_visits/', 'slow'))
+        day_jobs[curr_station] = {}
+        for today in day_series:
+            ldb, udb  = get_fast_window(today, curr_station)
+            day_files = catalogue.overlapping('fast', ldb, udb, ncols=[7,11,12], header_lines=0)+\
+                        catalogue.overlapping('slow', today, today+day_delta)
+            day_jobs[curr_station][fl.dstr(today)] = fl.run_manifest.fingerprint(day_files, code_version, params={'trial': trial})
+        catalogue.close()
+
+        print(f"\n{curr_station}:")
+        manifest[curr_station]   = fl.run_manifest(f'{get_level1_out_dir(curr_station)}/run_manifest_level1.sqlite')
+        stale_days[curr_station] = manifest[curr_station].plan(day_jobs[curr_station], force=args.force, verbose=verbose)
+    printline()
+
+    if all(len(stale_days[curr_station]) == 0 for curr_station in flux_stations):
+        print("\nEvery day you asked for is up to date, nothing to do!! (use -f/--force to redo them anyway)")
+        print(version_msg)
+        return
+
     print("Getting data from raw DAQ files from stations: {}!!".format(flux_stations))
     print("   ... and doing it in threads, hold onto your britches")
     printline()
@@ -248,36 +299,10 @@ def main(): # the main data crunching program
                 print("\nStation {} was alive for the entire time range you requested!! Not bad... \n"
                       .format(curr_station, threshold))
 
-    printline()
-    print("\nGetting list of fast files for each station and sorting them by date... \n")
-    printline()
-
-    # there's too much fast data, we need to read in and write out each
-    # day individually if coded like slow above, station "fast" datasets take
-    # 32Gb of RAM (I only have 40Gb) and that's only for legs 1 and 2
-    # #########################################################################
-    fast_atts, fast_cols = define_level1_fast()
-    fast_file_list       = {} # a list of fast data files for each station and the
-    first_timestamp_list = {} # corresponding first file timestamp, sorted in time
-    last_timestamp_list = {} # corresponding first file timestamp, sorted in time
-    fast_file_q = {}
-    for curr_station in flux_stations: # get station file lists in parallel
-        fast_file_q[curr_station] = Q()
-        P(target=get_fast_file_list, \
-               args=(curr_station, pickle_dir, fast_file_q[curr_station])).start()
-
-    for curr_station in flux_stations: # wait for threads and get return values
-        first_timestamp_list[curr_station] = fast_file_q[curr_station].get()
-        last_timestamp_list[curr_station] = fast_file_q[curr_station].get()
-        fast_file_list[curr_station]       = fast_file_q[curr_station].get()
-
     # we have to actually import the fast data on a daily basis for each station, so this
     # is all done in a loop for each day, and then level1 QC/writing for both slow/fast
     # data is done in that loop.... very annoying but seems the best solution
     # ##############################################################################################
-    day_series = pd.date_range(start_time+timedelta(1), end_time-timedelta(1)) # data was requested for these days
-    day_delta  = pd.to_timedelta(86399999999,unit='us') # we want to go up to but not including 00:00
-
     printline()
     print("\n Got all slow data and have a list of fast files, now processing each day...\n")
 
@@ -287,11 +312,10 @@ def main(): # the main data crunching program
 
     # defined here, called below in loops, this is the code for processing one days data, 
     # done this way so the code can be threaded
-    def process_station_day(curr_station, slow_data_today, day_q):
+    def process_station_day(curr_station, today, slow_data_today, day_q):
 
         # run the threads for retreiving data
-        fast_data_today = get_fast_data(today, fast_file_list[curr_station],
-                                        first_timestamp_list[curr_station], last_timestamp_list[curr_station], curr_station)
+        fast_data_today = get_fast_data(today, fast_catalogue[curr_station], curr_station)
 
         # ########################################################################
         # level 1 cleaning and QC starts here. this is *only* minimal fixes fit for
@@ -382,26 +406,26 @@ def main(): # the main data crunching program
     # make more sense... something something technical debt
     nthreads_station = int(np.floor(nthreads/3)) # num of days we can throw into child procs before waiting
 
-    q_dict = {}  # setup queue storage
-    for curr_station in flux_stations: q_dict[curr_station] = []
-
-    # call processing by day then station (allows threading for processing a single days data)
+    # every station day is its own task, handed to the next free worker (see fl.task_pool)
+    day_pool = fl.task_pool(nthreads, max_tasks=max_tasks_per_worker)
     for curr_station in flux_stations:
-        printline(endline=f"\n\n  Processing all requested days of data for {curr_station}\n"); printline()
-        day_ind = -1*nthreads
-        while day_ind < len(day_series): # loop over the days in the processing range and crunch away
-            day_ind += nthreads
-            q_list = []
-            for day_i in range(day_ind, day_ind+nthreads): # with nthreads parallel processing
-                if day_i >= len(day_series): continue
-                today    = day_series[day_i]
-                tomorrow = today+day_delta
-                sd_today = slow_data[curr_station][today:tomorrow]
-                q_today = Q()
-                P(target=process_station_day, args=(curr_station, sd_today, q_today)).start()
-                q_list.append((q_today, today))
-                
-            for qq, day in q_list: qq.get()
+        for today in day_series: # loop over the days in the processing range and crunch away
+            if fl.dstr(today) not in stale_days[curr_station]: continue
+            tomorrow = today+day_delta
+            sd_today = slow_data[curr_station][today:tomorrow]
+            day_pool.submit((curr_station, today), process_station_day, curr_station, today, sd_today)
+
+    printline(endline=f"\n\n  Processing all requested days of data for {flux_stations}\n"); printline()
+    for (curr_station, day), status, day_results, runtime in day_pool.results():
+        verboseprint(f"... {curr_station} {day} took {runtime:.1f} s")
+        if status != 'ok': 
+            print(f"!!! {curr_station} {day} {status} after {runtime:.1f} s:\n{day_results}")
+            manifest[curr_station].drop(fl.dstr(day))
+        else:
+            day_files = glob.glob(f"{get_level1_out_dir(curr_station)}/mos{curr_station}*.level1.{day.strftime('%Y%m%d.%H%M%S')}.nc")
+            manifest[curr_station].record(fl.dstr(day), day_jobs[curr_station][fl.dstr(day)], day_files)
+
+    for curr_station in flux_stations: manifest[curr_station].close()
 
 
     printline()
@@ -418,8 +442,11 @@ def get_slow_data(station, start_time, end_time, pickle_dir):
 
     # look through station subdirectories and only take data file if it's an "SDcard" folder... 
     # returns file path list for all files in all sd card data dirs for this station, i.e. a list of every data file
-    card_file_list = get_card_file_list('slow', searchdir) 
-    print('... found {} slow files in directory {}'.format(len(card_file_list), searchdir))
+    catalogue      = fl.raw_file_catalogue(get_catalogue_file(station, pickle_dir))
+    catalogue.update('slow', get_card_file_list('slow', searchdir, catalogue))
+    card_file_list = catalogue.overlapping('slow', start_time, end_time)
+    catalogue.close()
+    print('... found {} slow files in directory {} for this time range'.format(len(card_file_list), searchdir))
     frame_list = [] # list of frames from files... to be concatted after loop
     data_atts, data_cols  = define_level1_slow()
 
@@ -447,170 +474,131 @@ def get_slow_data(station, start_time, end_time, pickle_dir):
         else: cver = 0
 
         cols  = get_level1_col_headers(num_cols, cver)
-        frame = pd.read_csv(dfile, parse_dates=[0], sep=',', na_values=na_vals,\
+        frame = pd.read_csv(dfile, sep=',', na_values=na_vals,\
                             index_col=0, engine='c', names=cols)
+
+        # the timestamps are put together from the digits in the strings (fl.parse_logger_timestamps)
+        times, bad_times = fl.parse_logger_timestamps(frame.index.values)
+        frame.index = pd.DatetimeIndex(times, name=frame.index.name)
+        if bad_times.any(): 
+            fl.warn('{} unreadable timestamps dropped from {}'.format(np.count_nonzero(bad_times), dfile))
+            frame = frame[~bad_times]
         file_q.put(frame)
 
-    pickled_filename = f'{station}_raw_slow_df.pkl' # code_version is tacked on to this when run
-    was_pickled = False
-    if pickle_dir:
-        for root, dirs, files in os.walk(pickle_dir): # pretty stupid way to find the file
-            for filename in files:
-                if pickled_filename in filename:
-                    filename = pickle_dir+filename
-                    data_frame = pd.read_pickle(filename)
-                    name_words = filename.rpartition('_')[-1].rpartition('.')
-                    code_version = f"{name_words[0]}.{name_words[1]}"
-                    print(f" ... found and loaded pickle {filename} \n\n"); was_pickled = True
-                    break
+    cache = None
+    if pickle_dir and not trial: # trial runs only read some of the files
+        cache_name = f'{station}_raw_slow_df_{start_time:%Y%m%d%H%M}_{end_time:%Y%m%d%H%M}'
+        cache      = fl.frame_cache(pickle_dir)
+        cache_key  = cache.make_key(cache_name, card_file_list, code_version)
 
-        if not was_pickled: print("... didn't find a pickle, we'll write one !!!\n\n")
+        data_frame, cached_version = cache.get(cache_key)
+        if data_frame is not None:
+            print(f" ... found {cache_name} in the cache \n\n")
+            cache.close()
+            return data_frame
+        print(f"... {cache_name} isn't cached, we'll cache it !!!\n\n")
         
     # divide the files into pools and call thread_read() on the list of files in parallel
-    if not was_pickled: 
-        
-        q_list = []
-        for file_i, data_file in enumerate(card_file_list):
-
-            if (file_i % 250 == 0) and file_i != 0:  
-                verboseprint("... at {} of {} for {} slow data".format(file_i, len(card_file_list),station))
-
-            file_q = Q()
-            q_list.append(file_q)
-            P(target=read_slow_csv, args=(data_file, file_q)).start()
-
-            if (file_i+1) % nthreads == 0 or data_file == card_file_list[-1]:
-                for fq in q_list:
-                    new_frame = fq.get()
-                    frame_list.append(new_frame)
-                q_list = []
-                if trial and n_trial_files<file_i: break
-
-        print(f"... got all files read, got all threads back for {station}. now we concat")
-        data_frame = pd.concat(frame_list) # is concat computationally efficient?    
-        data_frame = data_frame.sort_index() # sort chronologically    
-        data_frame.drop_duplicates(inplace=True) # get rid of duplicates
-        data_frame = data_frame[start_time:end_time] # done gathering data, now narrow down to requested window
-
-        # some sanity checks
-        n_dupes = ~data_frame.duplicated().size
-        if data_frame.empty: # 'fatal' is a print function defined at the bottom of this script that exits
-            print("No {} data for requested time range {} ---> {} ?\n".format(searchdir,start_time,end_time))
-            print("... Im sorry... no data will be created for {}".format(station))
-            return data_frame
-
-        if n_dupes > 0 : fl.fatal("... there were {} duplicates for {} in this time range!!\n you got duped, dying".format(n_dupes, searchdir))
-
-        # now, reindex for every second in range and fill with nans so that the we commplete record
-        mins_range = pd.date_range(start_time, end_time, freq='T') # all the minutes today, for obs
-        try:
-            data_frame = data_frame.reindex(labels=mins_range, copy=False)
-        except Exception as ee:
-            printline()
-            print("There was an exception reindexing for {}".format(searchdir))
-            print(' ---> {}'.format(ee))
-            printline()
-            print(data_frame.index[data_frame.index.duplicated()])
-            print("...dropping these duplicate indexes... ")
-            printline()
-            data_frame = data_frame.drop(data_frame.index[data_frame.index.duplicated()], axis=0)
-            print(" There are now {} duplicates in DF".format(len(data_frame[data_frame.index.duplicated()])))
-            print(" There are now {} duplicates in timeseries".format(len(mins_range[mins_range.duplicated()])))
-            data_frame = data_frame.reindex(labels=mins_range, copy=False)
-
-        # why doesn't the dataframe constructor use the name from cols for the index name??? silly
-        data_frame.index.name = data_cols[0]
-
-        # now we subtract 1 min from the index so that the times mark the beginning rather than the end of the 1 min avg time, more conventional-like
-        data_frame.index = data_frame.index-pd.Timedelta(1,unit='min')  
-
-        if pickle_dir:
-            print("\n\n!!! You requested to pickle the dataframe for speed !!!")
-            print(f"... right now we're writing it to this directory {pickled_filename}")
-            print("... copy this manually to a ramdisk somewhere for bonus speed points")
-            print("... must be symlinked here to be seen by this routine")
-            print("...\n... this takes a minute, patience\n\n")
-            data_frame.to_pickle(f"{pickle_dir}/{pickled_filename}.pkl")
+    file_pool = fl.task_pool(nthreads, max_tasks=max_tasks_per_worker*100) # files are small, days are big
+    for file_i, data_file in enumerate(card_file_list):
+        if trial and n_trial_files<file_i: break
+        file_pool.submit(data_file, read_slow_csv, data_file)
+
+    for file_i, (data_file, status, new_frames, runtime) in enumerate(file_pool.results()):
+        if (file_i % 250 == 0) and file_i != 0:  
+            verboseprint("... at {} of {} for {} slow data".format(file_i, len(card_file_list),station))
+        if status != 'ok':
+            print("!!! problem reading {}, {} !!!\n{}".format(data_file, status, new_frames))
+            continue
+        frame_list.append(new_frames[0])
+
+    print(f"... got all files read, got all threads back for {station}. now we concat")
+    data_frame = pd.concat(frame_list) # is concat computationally efficient?    
+    data_frame = data_frame.sort_index() # sort chronologically    
+    data_frame.drop_duplicates(inplace=True) # get rid of duplicates
+    data_frame = data_frame[start_time:end_time] # done gathering data, now narrow down to requested window
+
+    # some sanity checks
+    n_dupes = ~data_frame.duplicated().size
+    if data_frame.empty: # 'fatal' is a print function defined at the bottom of this script that exits
+        print("No {} data for requested time range {} ---> {} ?\n".format(searchdir,start_time,end_time))
+        print("... Im sorry... no data will be created for {}".format(station))
+        if cache is not None: cache.close()
+        return data_frame
+
+    if n_dupes > 0 : fl.fatal("... there were {} duplicates for {} in this time range!!\n you got duped, dying".format(n_dupes, searchdir))
+
+    # now, reindex for every second in range and fill with nans so that the we commplete record
+    mins_range = pd.date_range(start_time, end_time, freq='T') # all the minutes today, for obs
+    try:
+        data_frame = data_frame.reindex(labels=mins_range, copy=False)
+    except Exception as ee:
+        printline()
+        print("There was an exception reindexing for {}".format(searchdir))
+        print(' ---> {}'.format(ee))
+        printline()
+        print(data_frame.index[data_frame.index.duplicated()])
+        print("...dropping these duplicate indexes... ")
+        printline()
+        data_frame = data_frame.drop(data_frame.index[data_frame.index.duplicated()], axis=0)
+        print(" There are now {} duplicates in DF".format(len(data_frame[data_frame.index.duplicated()])))
+        print(" There are now {} duplicates in timeseries".format(len(mins_range[mins_range.duplicated()])))
+        data_frame = data_frame.reindex(labels=mins_range, copy=False)
+
+    # why doesn't the dataframe constructor use the name from cols for the index name??? silly
+    data_frame.index.name = data_cols[0]
+
+    # now we subtract 1 min from the index so that the times mark the beginning rather than the end of the 1 min avg time, more conventional-like
+    data_frame.index = data_frame.index-pd.Timedelta(1,unit='min')  
+
+    if cache is not None:
+        print("... caching it, this takes a minute, patience")
+        cache.put(cache_key, cache_name, data_frame, code_version)
+        cache.close()
 
     # sort data by time index and return data_frame to queue
     return data_frame
     
 
-# finds all files for station, returning a list of the timestamps from
-# the first lines of each file and a sorted list of filenames
-def get_fast_file_list(station, pickle_dir, qq):
+# where the raw file catalogue for a station lives, next to the cache if we have one
+def get_catalogue_file(station, pickle_dir):
+    if pickle_dir: return f'{pickle_dir}/raw_files_{station}.sqlite'
+    else:          return f'{level1_dir}{station}/raw_files_{station}.sqlite'
 
-    import pickle
-    ffl_pkl = f'{pickle_dir}/ffl_objs{station}.pkl'
-    if pickle_dir and os.path.exists(ffl_pkl):
-        with open(ffl_pkl, 'rb') as pickme:
-            sorted_first_timestamps, sorted_last_timestamps, sorted_file_list = pickle.load(pickme)
+# finds all fast files for station and brings the catalogue of their first/last timestamps up
+# to date, only the files that are new or changed since the last run are opened. returns the
+# catalogue file on qq, get_fast_data() asks it for the files it needs for each day
+def get_fast_file_list(station, catalogue_file, qq):
 
-    else:
-        # look through station subdirectories and only take data file if it's an "SDcard" folder... 
-        # returns list of every data file path in sdcard subdirs
-        searchdir          = data_dir+station+'/0_level_raw/site_visits/'
-        entire_file_list   = get_card_file_list('fast', searchdir) 
-        first_ts_series    = []  # keep the timestamp from first line to concat in the correct order
-        last_ts_series    = []  # keep the timestamp from first line to concat in the correct order
-        unsorted_file_list = []
-        print('... found {} fast files in directory {}'.format(len(entire_file_list), searchdir))
-
-        for file_n, data_file in enumerate(entire_file_list):
-            if file_n % 1000 == 0 and file_n != 0:  
-                verboseprint("... currently on file {} of {} for fast files in {} "
-                             .format(file_n, len(entire_file_list), searchdir))
-
-            # count the columns in the first line, if less than expected, bail
-
-            try: 
-                f = open(data_file)
-                firstline=f.readline().rsplit(',')
-                f.close()
-                #... stupid, but fast
-                lastline = subprocess.check_output(['tail', '-1', data_file]).decode("utf-8")[0:-1].rsplit(',')
-            except Exception as e:
-                print("!!! problem with data file {}!!!".format(data_file))
-                print("!!! {} !!!".format(e))
-                continue
-            f.close()
+    searchdir  = data_dir+station+'/0_level_raw/site_visits/'
+    catalogue  = fl.raw_file_catalogue(catalogue_file)
+    fast_files = get_card_file_list('fast', searchdir, catalogue) 
+    print('... found {} fast files in directory {}'.format(len(fast_files), searchdir))
 
-            num_cols  = len(firstline)
-            if (num_cols not in [7,11,12]):
-                print("!!! The number of columns should be 7 or 11, something's up !!!")
-                print("!!! not using {} with cols {}".format(data_file,num_cols))
-                continue
+    n_scanned, n_gone = catalogue.update('fast', fast_files, verbose=verbose)
+    print('... scanned {} new/changed fast files for {}, {} are gone'.format(n_scanned, station, n_gone))
+    catalogue.close()
 
-            # keep first timestamp for sorting
-            try: 
-                first_timestamp = np.datetime64(datetime.strptime(firstline[0].strip('"'), '%Y-%m-%d %H:%M:%S'))
-                last_timestamp = np.datetime64(datetime.strptime(lastline[0].strip('"'), '%Y-%m-%d %H:%M:%S'))
-            except Exception as e:
-                print("!!! something was wrong with the timestamp format in {} !!!".format(data_file))
-                print("!!! {} !!!".format(firstline))
-                print("!!! {} !!!".format(e))
-                continue
+    qq.put(catalogue_file)
 
-            first_ts_series.append(first_timestamp)
-            last_ts_series.append(last_timestamp)
-            unsorted_file_list.append(data_file)
+# the time range of fast data get_fast_data() reads for date, so it has data either side of the day to
+# interpolate timestamps over. on the days the radio data was used it goes back 8 days to de-dupe
+def get_fast_window(date, curr_station):
 
-        # use numpy to sort files by first timestamp
-        ftss = np.array(first_ts_series)
-        ltss = np.array(last_ts_series)
-        ufl  = np.array(unsorted_file_list)
+    day_delta      = pd.to_timedelta(86399999999,unit='us') # we want to go up to but not including 00:00
+    half_day_delta = pd.to_timedelta(43200000000 ,unit='us') # we want to eliminate interpolation boundary conds
 
-        sorted_first_timestamps = ftss[np.argsort(ftss)]
-        sorted_last_timestamps = ltss[np.argsort(ftss)]
-        sorted_file_list  = ufl[np.argsort(ftss)]
+    # we search for data outside of today because we need to interpolate timestamps...
+    # ... a quarter day is too much but... too much might be good enough
+    ldb = date-half_day_delta           # lower_date_bound for data to pull in for today
+    udb = date+day_delta+half_day_delta # upper_date_bound for data to pull in for today
+
+    # used radio data on these days :|
+    if ((curr_station=='asfs50' and (datetime(2020, 4, 10) <= date <= datetime(2020, 5, 7))) 
+        or (curr_station=='asfs30' and (datetime(2020, 5, 5) <= date <= datetime(2020, 6, 1)))):
+        ldb = date-pd.to_timedelta(8, unit='d')
 
-        if pickle_dir: 
-            with open(ffl_pkl, 'wb') as pickme:
-                list = pickle.dump((sorted_first_timestamps, sorted_last_timestamps, sorted_file_list), pickme)
-            
-    qq.put(sorted_first_timestamps.tolist())
-    qq.put(sorted_last_timestamps.tolist())
-    qq.put(sorted_file_list.tolist())
+    return ldb, udb
 
 # gets data for the 20hz metek sonics, complicated because of nuances grabbing fast data
 # via logger this function pulls files into dataframe, sorted based on time of first
@@ -620,7 +608,7 @@ def get_fast_file_list(station, pickle_dir, qq):
 # ########################################################################################
 # sorry Chris, I hope this function isn't too incomprehensible/ugly. and if it is, then I
 # hope it just_works(tm) and you don't have to touch it.
-def get_fast_data(date, fast_file_list, first_timestamp_list, last_timestamp_list, curr_station): 
+def get_fast_data(date, catalogue_file, curr_station): 
 
     # get data cols/attributes from definitions file
     data_atts, data_cols = define_level1_fast()
@@ -631,45 +619,37 @@ def get_fast_data(date, fast_file_list, first_timestamp_list, last_timestamp_lis
 
     na_vals = ['nan','NaN','NAN','NA','\"INF\"','\"-INF\"','\"NAN\"','\"NA','\"NAN','inf','-inf''\"inf\"','\"-inf\"','']
 
-    if len(fast_file_list) != len(first_timestamp_list): # sanity check
-        fl.fatal("something went wrong with fast file stuff... weird")
-
-    # we search for data outside of today because we need to interpolate timestamps...
-    # ... a quarter day is too much but... too much might be good enough
-    ldb = date-half_day_delta           # lower_date_bound for data to pull in for today
-    udb = date+day_delta+half_day_delta # upper_date_bound for data to pull in for today
+    ldb, udb = get_fast_window(date, curr_station)
+    if ldb < date-half_day_delta: print("... de-duping the strange fast data from the spring")
 
-    # used radio data on these days :|
-    if ((curr_station=='asfs50' and (datetime(2020, 4, 10) <= date <= datetime(2020, 5, 7))) 
-        or (curr_station=='asfs30' and (datetime(2020, 5, 5) <= date <= datetime(2020, 6, 1)))):
+    # only files with the number of columns we know how to read, 7 or 11
+    catalogue    = fl.raw_file_catalogue(catalogue_file)
+    files_to_use = catalogue.overlapping('fast', ldb, udb, ncols=[7,11,12], header_lines=0)
+    catalogue.close()
 
-        print("... de-duping the strange fast data from the spring")
-        ldb = date-pd.to_timedelta(8, unit='d')
-        udb = date+day_delta+half_day_delta # upper_date_bound for data to pull in for today
-
-    inds_to_use = []
-    for i, ftstamp in enumerate(first_timestamp_list):
-        ltstamp = last_timestamp_list[i]
-        if (ftstamp<udb and ltstamp>ldb):
-            inds_to_use.append(i)
-
-    if len(inds_to_use) == 0 :
+    if len(files_to_use) == 0 :
         verboseprint("!!! NO FAST DATA FROM {} FOR DAY {} !!!".format(curr_station, date))
         return pd.DataFrame(columns=data_cols)
 
     frame_list = [] # all the frames created from files from today
     files_used = []
-    for file_i in inds_to_use:
+    for data_file in files_to_use:
         cols      = data_cols.copy()
-        data_file = fast_file_list[file_i]
         # count the columns in the first line, if less than expected, bail
         with open(data_file) as f: 
             firstline = f.readline().rsplit(',')
             num_cols  = len(firstline)
 
         try:  # ingest each csv into own data frame and keep in list
-            frame = pd.read_csv(data_file, parse_dates=[0], sep=',', na_values=na_vals,\
+            frame = pd.read_csv(data_file, sep=',', na_values=na_vals,\
                                 engine='c', names=cols)
+
+            # 20 Hz of timestamp strings, put together from their digits rather than parsed
+            times, bad_times = fl.parse_logger_timestamps(frame['TIMESTAMP'].values)
+            frame['TIMESTAMP'] = times
+            if bad_times.any(): 
+                fl.warn('{} unreadable timestamps dropped from {}'.format(np.count_nonzero(bad_times), data_file))
+                frame = frame[~bad_times]
             frame_list.append(frame)
             files_used.append(data_file)
 
@@ -742,50 +722,20 @@ def get_fast_data(date, fast_file_list, first_timestamp_list, last_timestamp_lis
     full_frame    = deduped_frame
 
     # this fixes the fast timestamping in 5 second blocks issues...
-    # ... it's way slower than the old interpolation, but much more correct
+    # ... the samples of each scan are spread evenly across it, see fl.spread_scan_timestamps
     def correct_timestamps(df):
 
-        verboseprint("... correcting fast data timestamps, extremely slow")
+        verboseprint("... correcting fast data timestamps")
 
         df.index = range(0, len(df)) # have to give it a simple index to count points with
 
-        # use 'duplicated' to mark the start of the next scan cycle
-        times     = df["TIMESTAMP"].copy()
-        new_times = times.copy()
-        dupes     = times[times.duplicated()==False]
-        ind_iter  = iter(dupes.index)
-
-        tot_len = len(df)
-
-        try: curr_i = next(ind_iter)
-        except: 
-            not_do = "true-true" # this condition should never be hit
-
-        # loop over each block of equal timestamps and interpolate only between blocks
-        break_me = False
-        while True:
-            try: next_i = next(ind_iter)
-            except:
-                break_me = True
-                next_i = tot_len-1
+        new_times, scan_info = fl.spread_scan_timestamps(df["TIMESTAMP"].values, scan_len=5)
+        if scan_info['short_scans'] > 0 or scan_info['long_scans'] > 0 or scan_info['repeated_times'] > 0 or scan_info['clock_jumps'] > 0:
+            verboseprint(f"... {scan_info['n_scans']} scans, {scan_info['short_scans']} short, {scan_info['long_scans']} long, "+
+                         f"{scan_info['repeated_times']} repeated timestamps, {scan_info['clock_jumps']} clock jumps")
 
-            dist = next_i-curr_i
-            if dist == 0: break #weird
-            tstep = 5/dist
-            tdelt = timedelta(0,tstep)
-
-            for ii in range(curr_i, next_i):
-                new_times.at[ii] = times.loc[ii]+(ii-curr_i)*tdelt
-
-            if break_me:
-                break
-            curr_i  = next_i
-
-        # well. not quite done. now we subtract 5 sec (length of the scan) from the index so that
-        # the times mark the beginning rather than the end
-        offset_delta  = pd.to_timedelta(5,unit='s') 
-
-        new_times = new_times - offset_delta
+        # the times now mark the beginning rather than the end of the scan 
+        new_times = pd.DatetimeIndex(new_times)
         df['TIMESTAMP'] = new_times
         df.index = new_times
 
@@ -808,26 +758,21 @@ def get_fast_data(date, fast_file_list, first_timestamp_list, last_timestamp_lis
 
     return return_frame
 
-# function that searches sitevisit dirs looking for SDcard directory and returns data file paths in a list
-def get_card_file_list(filestr, searchdir): # filestr is the name in the data file you want to get slow/fast/etc
-    card_file_list = []
-    card_dir_list = [''] 
-    for subdir, dirs, files in os.walk(searchdir):
-        for curr_dir in dirs:
-            if "sdcard" in curr_dir.lower():
-                card_dir = subdir+'/'+curr_dir
-                if card_dir_list[-1] != card_dir: card_dir_list.append(card_dir)
-                card_files_in_dir = []
-                for f in os.listdir(card_dir):
-                    if filestr in f.lower() and f.endswith('.dat') and not f.startswith('._'):
-                        card_files_in_dir.append(card_dir+'/'+f)
-                card_file_list.extend(card_files_in_dir) # lets not make a list of lists
+# function that searches sitevisit dirs looking for SDcard directory and returns data file paths in a list,
+# the directory listings are kept in the catalogue so only directories that changed are listed again
+def get_card_file_list(filestr, searchdir, catalogue): # filestr is the name in the data file you want to get slow/fast/etc
+    card_file_list = catalogue.card_files(searchdir, filestr)
+    card_dir_list  = sorted(set([os.path.dirname(f) for f in card_file_list]))
     verboseprint(f"\n\n... you asked for it, here's your list of {filestr} card files...\n\n")
     printline()
     [print(d) for d in card_dir_list]
     printline()
     return card_file_list
 
+# where the level1 files for a station are written
+def get_level1_out_dir(curr_station):
+    return level1_dir+curr_station+"/1_level_mgallagh_test_"+curr_station
+
 # do the stuff to write out the level1 files, after finishing this it could probably just be one
 # function that is called separately for fast and slow... : \ maybe refactor someday.... mhm
 def write_level1_netcdfs(slow_data, slow_atts, fast_data, fast_atts, curr_station, date):
@@ -877,7 +822,7 @@ def write_level1_netcdfs(slow_data, slow_atts, fast_data, fast_atts, curr_statio
 
     print("... writing level1 for {} on {}, ~{}% of slow data is present".format(curr_station, date, 100-avg_missing_slow))
 
-    out_dir       = level1_dir+curr_station+"/1_level_mgallagh_test_"+curr_station
+    out_dir       = get_level1_out_dir(curr_station)
     file_str_fast = '/mos{}fast.level1.{}.nc'.format(curr_station, date.strftime('%Y%m%d.%H%M%S'))
     file_str_slow = '/mos{}slow.level1.{}.nc'.format(curr_station, date.strftime('%Y%m%d.%H%M%S'))
 
@@ -954,8 +899,8 @@ def write_level1_netcdfs(slow_data, slow_atts, fast_data, fast_atts, curr_statio
     slow_delta_ints = np.floor((slow_dti - tm).total_seconds())      # seconds
     fast_delta_ints = np.floor((fast_dti - tm).total_seconds()*1000) # ms 
 
-    t_slow_ind = pd.Int64Index(slow_delta_ints)
-    t_fast_ind = pd.Int64Index(fast_delta_ints)
+    t_slow_ind = pd.Index(slow_delta_ints, dtype='int64')
+    t_fast_ind = pd.Index(fast_delta_ints, dtype='int64')
 
     # set the time dimension and variable attributes to what's defined above
     t_slow = netcdf_lev1_slow.createVariable('time', 'd','time') # seconds since
@@ -968,8 +913,8 @@ def write_level1_netcdfs(slow_data, slow_atts, fast_data, fast_atts, curr_statio
     bt_slow_delta_ints = np.floor((bt_slow_dti - bot).total_seconds())      # seconds
     bt_fast_delta_ints = np.floor((bt_fast_dti - bot).total_seconds()*1000) # ms 
 
-    bt_slow_ind = pd.Int64Index(bt_slow_delta_ints)
-    bt_fast_ind = pd.Int64Index(bt_fast_delta_ints)
+    bt_slow_ind = pd.Index(bt_slow_delta_ints, dtype='int64')
+    bt_fast_ind = pd.Index(bt_fast_delta_ints, dtype='int64')
 
     # set the time dimension and variable attributes to what's defined above
     bt_slow = netcdf_lev1_slow.createVariable('time_offset', 'd','time') # seconds since
@@ -52,10 +52,9 @@ from tower_data_definitions import define_level1_slow, define_level1_fast
 
 import functions_library as fl # functions written by the flux team for processing data
 
-import os, inspect, argparse, time
+import os, io, inspect, argparse, time, hashlib, glob
 
-from multiprocessing import Process as P
-from multiprocessing import Queue   as Q
+from concurrent.futures import ThreadPoolExecutor
 
 import socket 
 
@@ -63,10 +62,10 @@ global nthreads
 if '.psd.' in socket.gethostname():
     nthreads = 20  # the twins have 64 cores, it won't hurt if we use <20
 else: nthreads = 8 # laptops don't tend to have 64 cores, set to 1 to debug
+max_tasks_per_worker = 10 # worker processes are replaced after this many days, caps memory growth
+n_io_threads         = 4  # threads reading the hourly fast files inside each day's process, not tied to nthreads
 
 # need to debug something? kills multithreading to step through function calls
-# from multiprocessing.dummy import Process as P
-# from multiprocessing.dummy import Queue   as Q
 # nthreads = 1
 
 import numpy  as np
@@ -102,6 +101,7 @@ def main(): # the main data crunching program
 
     global data_dir      # make available to the functions at bottom
     global level1_dir
+    global slow_cache_dir
     global printline     # prints a line out of dashes, pretty boring
     global verboseprint  # defines a function that prints only if -v is used when running
 
@@ -117,6 +117,12 @@ def main(): # the main data crunching program
     # pass the base path to make it more mobile
     parser.add_argument('-p', '--path', metavar='str', help='base path to data up to, including /data/, include trailing slash')
 
+    # where the parsed slow logger files are kept, see read_cached_slow_file()
+    parser.add_argument('-cd', '--cachedir', metavar='str', help='directory for the parsed slow file cache, default is tower/slow_cache/')
+
+    # days are only redone if the run manifest says they're out of date, see fl.run_manifest
+    parser.add_argument('-f', '--force', action ='store_true', help='reprocess every day, even the ones that are up to date')
+
     args         = parser.parse_args()
     v_print      = print if args.verbose else lambda *a, **k: None
     verboseprint = v_print
@@ -128,6 +134,10 @@ def main(): # the main data crunching program
         data_dir = '/Projects/MOSAiC/'
 
     level1_dir = data_dir+'tower/1_level_ingest' #./processed_data/tower/level1/'  # where does level1 data go
+
+    if args.cachedir: slow_cache_dir = args.cachedir
+    else:             slow_cache_dir = data_dir+'tower/slow_cache/'
+    os.makedirs(slow_cache_dir, exist_ok=True)
     
     # QC params:
     apogee_switch_date = datetime(2019,11,12,10,21,29) # Nov. 12th, 10:21::29
@@ -181,6 +191,25 @@ def main(): # the main data crunching program
     day_series = pd.date_range(start_time, end_time)    # we're going to loop over these days
     day_delta  = pd.to_timedelta(86399999999,unit='us') # we want to go up to but not including 00:00
 
+    # a day is made from the logger files in its fuzzy window and its hourly fast files, the run manifest
+    # knows which days were already written from those files as they are now, with this code_version.
+    # only the others are (re)done, unless --force
+    manifest   = fl.run_manifest(f'{level1_dir}/run_manifest_level1.sqlite')
+    day_params = {'process_fast_data': process_fast_data, 'calc_stats': calc_stats}
+    day_jobs   = {}
+    for today in day_series:
+        logger_files, mast_gps_files = get_slow_file_lists(today)
+        fast_files = [data_dir+subdir+data_file
+                      for subdir in [metek_bottom_dir, metek_middle_dir, metek_top_dir, metek_mast_dir, licor_dir]
+                      for data_file, file_hour in get_fast_file_list(subdir, today)]
+        day_jobs[fl.dstr(today)] = manifest.fingerprint(logger_files+mast_gps_files+fast_files, code_version, params=day_params)
+
+    printline()
+    print("Checking the run manifest for days that are already up to date:")
+    stale_days = manifest.plan(day_jobs, force=args.force, verbose=args.verbose)
+    day_series = pd.DatetimeIndex([today for today in day_series if fl.dstr(today) in stale_days])
+    printline()
+
     def process_tower_day(today, day_q): 
 
         tomorrow      = today+day_delta
@@ -225,11 +254,13 @@ def main(): # the main data crunching program
                                               targ_T,\
                                               body_T)
 
-        metek_bottom = get_fast_data(metek_bottom_dir, today)
-        metek_middle = get_fast_data(metek_middle_dir, today)
-        metek_top    = get_fast_data(metek_top_dir,    today)
-        metek_mast   = get_fast_data(metek_mast_dir,   today)
-        licor_bottom = get_fast_data(licor_dir,        today)
+        # the 5 x 24 hourly fast files are all started at once on n_io_threads threads, then put together
+        # instrument by instrument in the order they're listed here
+        fast_dirs = [metek_bottom_dir, metek_middle_dir, metek_top_dir, metek_mast_dir, licor_dir]
+        with ThreadPoolExecutor(max_workers=n_io_threads) as io_pool:
+            fast_reads = [submit_fast_reads(fast_dir, today, io_pool) for fast_dir in fast_dirs]
+            metek_bottom, metek_middle, metek_top, metek_mast, licor_bottom = \
+                [get_fast_data(fast_dir, today, reads) for fast_dir, reads in zip(fast_dirs, fast_reads)]
 
         # now clean and QC the fast data subtleties, here we decode the licor diagnostics so it doesn't have to been done every level2 run
         print("... decoding the Licor diagnostics. it's fast like the Dranitsyn. Gimme a minute...")
@@ -325,20 +356,19 @@ def main(): # the main data crunching program
         day_q.put(True)
         return 
 
-    q_list = []  # setup queue storage
-    day_list = [] # for debugging
-    for i_day, today in enumerate(day_series): # loop over the days in the processing range and get a list of files
-
-        q_today = Q()
-        q_list.append(q_today)
-        day_list.append(today)
-        P(target=process_tower_day, args=(today, q_today,)).start()
+    # each day is its own task, handed to the next free worker (see fl.task_pool)
+    day_pool = fl.task_pool(nthreads, max_tasks=max_tasks_per_worker)
+    for today in day_series: day_pool.submit(today, process_tower_day, today)
 
-        if (i_day+1) % nthreads == 0 or today == day_series[-1]:
-            for iq, qq in enumerate(q_list):
-                qq.get()
-            q_list = []
-        #import gc; gc.collect() 
+    for today, status, day_results, runtime in day_pool.results():
+        verboseprint(f"... {today} took {runtime:.1f} s")
+        if status != 'ok': 
+            print(f"!!! {today} {status} after {runtime:.1f} s:\n{day_results}")
+            manifest.drop(fl.dstr(today))
+        else:
+            day_files = glob.glob(f"{level1_dir}/mosflxtower*.level1.{today.strftime('%Y%m%d.%H%M%S')}.nc")
+            manifest.record(fl.dstr(today), day_jobs[fl.dstr(today)], day_files)
+    manifest.close()
 
     print('---------------------------------------------------------------------------------------------')
     print('All done! Netcdf output files can be found in: {}'.format(level1_dir))
@@ -348,14 +378,52 @@ def main(): # the main data crunching program
 def get_slow_data(date):
 
     tower_subdir = 'tower/0_level_raw/CR1000X/daily_files/'
-    mast_subdir  = 'tower/0_level_raw/CR1000_mast/daily_files/'
     slow_data  = pd.DataFrame()
-    fuzzy_window = timedelta(20) # we look for files 2 days before and after because we didn't save even days...(?!)
-    # fuzzy_window>=5 required for days of MOSAiC where logger info is spread out across 'daily-ish' files -- "shutdown days"
 
     slow_atts, slow_vars = define_level1_slow()
     print('... getting slow logger data from: %s' % data_dir+tower_subdir)
-    
+
+    logger_file_list, mast_gps_file_list = get_slow_file_lists(date)
+
+    # the files are parsed once and cached (see read_cached_slow_file), so we only pull out the rows
+    # for today. the logger stamps the end of the second, hence the extra second
+    day_start = date
+    day_end   = date+timedelta(1, 1)
+
+    logger_df_list = [] # logger dataframes to be concatted all at once
+    for path in logger_file_list:
+        frame = read_cached_slow_file(path, parse_logger_file, day_start, day_end)
+        if frame is not None: logger_df_list.append(frame)
+
+    try:
+        logger_df = pd.concat(logger_df_list, verify_integrity=False) # is concat computationally efficient?
+    except: 
+        print("!!! no logger data in 20 day window around day... is this reasonable?")
+        logger_df = pd.DataFrame()
+
+    mast_gps_df_list = [] # mast gps dataframes to be concatted all at once
+    for path in mast_gps_file_list:
+        frame = read_cached_slow_file(path, parse_mast_gps_file, day_start, day_end)
+        if frame is not None: mast_gps_df_list.append(frame)
+
+    if len(mast_gps_df_list)>0:
+        mast_gps_df = pd.concat(mast_gps_df_list, verify_integrity=False) # is concat computationally efficient? 
+        slow_data = mast_gps_df.combine_first(logger_df) # there's mast_T etc etc in both files, must overwrite
+    else:
+        slow_data = logger_df
+
+    slow_data.index = slow_data.index-pd.Timedelta(1,unit='sec') 
+    return slow_data.sort_index() # sort logger data (when copied, you lose the file create ordering...)
+
+# the logger and mast gps files (full paths) that might have data for date, from the dates in their
+# names. used by get_slow_data() and for the run manifest, a day's inputs are these files
+def get_slow_file_lists(date):
+
+    tower_subdir = 'tower/0_level_raw/CR1000X/daily_files/'
+    mast_subdir  = 'tower/0_level_raw/CR1000_mast/daily_files/'
+    fuzzy_window = timedelta(20) # we look for files 2 days before and after because we didn't save even days...(?!)
+    # fuzzy_window>=5 required for days of MOSAiC where logger info is spread out across 'daily-ish' files -- "shutdown days"
+
     logger_file_list   = [] # list of filenames to concat into dataframes
     mast_gps_file_list = [] # list of filenames to concat into mast dataframes
 
@@ -387,80 +455,139 @@ def get_slow_data(date):
                 fl.warn('There is a logger file I cant use, this makes no sense... {}'.format(data_file))
                 use_file = False
 
-    logger_df_list = [] # logger dataframes to be concatted all at once
-    for logger_file in logger_file_list:
-        path  = data_dir+tower_subdir+'/'+logger_file
-        with open(path) as f:
-            firstline = f.readlines()[1].rsplit(',')
-            num_cols = len(firstline)
-            na_vals = ['nan','NaN','NAN','NA','\"INF\"','\"-INF\"','\"NAN\"','\"NA','\"NAN','inf','-inf''\"inf\"','\"-inf\"']
-            frame = pd.read_csv(path,parse_dates=[0],sep=',',na_values=na_vals,\
-                                index_col=0,header=[1],skiprows=[2,3],engine='c',\
-                                converters={'gps_alt':convert_sci, 'gps_hdop':convert_sci})#,\
-                                #dtype=dtype_dict)
-            logger_df_list.append(frame)
-
-    try:
-        logger_df = pd.concat(logger_df_list, verify_integrity=False) # is concat computationally efficient?
-    except: 
-        print(f"!!! no logger data in {fuzzy_window} day window around day... is this reasonable?")
-        logger_df = pd.DataFrame()
-
-    mast_gps_df_list = [] # mast gps dataframes to be concatted all at once
-    for mast_gps_file in mast_gps_file_list:
-        path  = data_dir+mast_subdir+'/'+mast_gps_file
-        with open(path) as f:
-
-            cols = ["TIMESTAMP","mast_RECORD","mast_gps_lat_deg_Avg","mast_gps_lat_min_Avg","mast_gps_lon_deg_Avg",\
-                    "mast_gps_lon_min_Avg","mast_gps_hdg_Avg","mast_gps_alt_Avg","mast_gps_qc","mast_gps_hdop_Avg",\
-                    "mast_gps_nsat_Avg","mast_PTemp","mast_batt_volt","mast_call_time_mainscan","mast_T","mast_RH","mast_P"]
-
-            firstline = f.readlines()[1].rsplit(',')
-            num_cols = len(firstline)
-            na_vals = ['nan','NaN','NAN','NA','\"INF\"','\"-INF\"','\"NAN\"','\"NA','\"NAN','inf','-inf''\"inf\"','\"-inf\"']
-            frame = pd.read_csv(path,names=cols,parse_dates=[0],sep=',',na_values=na_vals,\
-                                index_col=0,skiprows=[0,1,2,3],engine='c',\
-                                converters={'gps_alt':convert_sci, 'gps_hdop':convert_sci})#,\
-                                #dtype=dtype_dict)
-                                    
-            mast_gps_df_list.append(frame)
-
-    if len(mast_gps_df_list)>0:
-        mast_gps_df = pd.concat(mast_gps_df_list, verify_integrity=False) # is concat computationally efficient? 
-        # need to shift some times because of a drfted clock -ccox notes.txt 20200422         
-        # mast_gps_df.loc[datetime(2020,4,13,12,27,49):datetime(2020,4,22,14,51,16)].index=mast_gps_df.loc[datetime(2020,4,13,12,27,49):datetime(2020,4,22,14,51,16)].index.shift(freq='+248s') # this should work, but .loc and .shift or .reindex do not play nicely together
-        # however, I cannot find a graceful solution after more hours than I'd like to recall so F$#k it        
-       # aa = mast_gps_df[:datetime(2020,4,13,12,27,48)]
-       # bb = mast_gps_df[datetime(2020,4,13,12,27,49):datetime(2020,4,22,14,51,16)]
-       # cc = mast_gps_df[datetime(2020,4,22,14,51,17):]
-       # bb.index=bb.index.shift(freq='+248s') 
-       # mast_gps_df = pd.concat([aa,bb,cc])
-       # mast_gps_df.drop_duplicates(inplace=True)
-        aa = mast_gps_df[(mast_gps_df.index <= datetime(2020,4,13,12,27,49))]  
-        bb = mast_gps_df[(mast_gps_df.index > datetime(2020,4,13,12,27,49)) & (mast_gps_df.index <= datetime(2020,4,22,14,51,16))] 
-        cc = mast_gps_df[(mast_gps_df.index > datetime(2020,4,22,14,51,16))]  
-        bb.index=bb.index.shift(freq='+248s') 
-        mast_gps_df = pd.concat([aa,bb,cc])
-  
-        slow_data = logger_df.combine_first(mast_gps_df) # there's mast_T etc etc in both files, must overwrite
-        slow_data = mast_gps_df.combine_first(logger_df) # there's mast_T etc etc in both files, must overwrite
-        #slow_data = pd.concat([logger_df, mast_gps_df], axis=1) # is concat computationally efficient?  
-    else:
-        slow_data = logger_df
-
-    slow_data.index = slow_data.index-pd.Timedelta(1,unit='sec') 
-    return slow_data.sort_index() # sort logger data (when copied, you lose the file create ordering...)
-
-
-# gets data that is in the metek format, either 'raw' or 'stats' can but put in as a data_str
-def get_fast_data(subdir, date):
+    logger_file_list   = [data_dir+tower_subdir+'/'+f for f in logger_file_list]
+    mast_gps_file_list = [data_dir+mast_subdir+'/'+f for f in mast_gps_file_list]
+    return logger_file_list, mast_gps_file_list
+
+
+# the logger timestamp strings in the index of a frame read from path to datetime64 (fl.parse_logger_timestamps),
+# rows with timestamps that can't be read are dropped
+def logger_time_index(frame, path):
+    times, bad_times = fl.parse_logger_timestamps(frame.index.values)
+    frame.index = pd.DatetimeIndex(times, name=frame.index.name)
+    if bad_times.any():
+        fl.warn('{} unreadable timestamps dropped from {}'.format(np.count_nonzero(bad_times), path))
+        frame = frame[~bad_times]
+    return frame
+
+# reads a CR1000X logger file
+def parse_logger_file(path):
+    na_vals = ['nan','NaN','NAN','NA','\"INF\"','\"-INF\"','\"NAN\"','\"NA','\"NAN','inf','-inf''\"inf\"','\"-inf\"']
+    frame = pd.read_csv(path,sep=',',na_values=na_vals,\
+                        index_col=0,header=[1],skiprows=[2,3],engine='c',\
+                        converters={'gps_alt':convert_sci, 'gps_hdop':convert_sci})#,\
+                        #dtype=dtype_dict)
+    return logger_time_index(frame, path)
+
+# reads a CR1000 mast file, with the drifting clock fixed
+def parse_mast_gps_file(path):
+    cols = ["TIMESTAMP","mast_RECORD","mast_gps_lat_deg_Avg","mast_gps_lat_min_Avg","mast_gps_lon_deg_Avg",\
+            "mast_gps_lon_min_Avg","mast_gps_hdg_Avg","mast_gps_alt_Avg","mast_gps_qc","mast_gps_hdop_Avg",\
+            "mast_gps_nsat_Avg","mast_PTemp","mast_batt_volt","mast_call_time_mainscan","mast_T","mast_RH","mast_P"]
+
+    na_vals = ['nan','NaN','NAN','NA','\"INF\"','\"-INF\"','\"NAN\"','\"NA','\"NAN','inf','-inf''\"inf\"','\"-inf\"']
+    frame = pd.read_csv(path,names=cols,sep=',',na_values=na_vals,\
+                        index_col=0,skiprows=[0,1,2,3],engine='c',\
+                        converters={'gps_alt':convert_sci, 'gps_hdop':convert_sci})#,\
+                        #dtype=dtype_dict)
+    frame = logger_time_index(frame, path)
+
+    # need to shift some times because of a drfted clock -ccox notes.txt 20200422         
+    # mast_gps_df.loc[datetime(2020,4,13,12,27,49):datetime(2020,4,22,14,51,16)].index=mast_gps_df.loc[datetime(2020,4,13,12,27,49):datetime(2020,4,22,14,51,16)].index.shift(freq='+248s') # this should work, but .loc and .shift or .reindex do not play nicely together
+    # however, I cannot find a graceful solution after more hours than I'd like to recall so F$#k it        
+    # the shift only depends on the timestamp so it's done file by file, before the files are catted
+    aa = frame[(frame.index <= datetime(2020,4,13,12,27,49))]  
+    bb = frame[(frame.index > datetime(2020,4,13,12,27,49)) & (frame.index <= datetime(2020,4,22,14,51,16))] 
+    cc = frame[(frame.index > datetime(2020,4,22,14,51,16))]  
+    bb.index=bb.index.shift(freq='+248s') 
+    return pd.concat([aa,bb,cc])
+
+# reads an hourly metek/licor 'msc' file, the first line is a header and every other line should have
+# ncols whitespace separated numbers. the whole file is read as bytes and NUL chars (rarely sprinkled at
+# the beginning of lines, shutdowns?) are deleted in one translate. lines that then don't have ncols
+# fields are found by counting field starts per line with numpy and cut out, and what's left goes to
+# one read_csv. returns the frame (columns 0..ncols-1) and the number of non-empty lines dropped
+whitespace_bytes = np.frombuffer(b' \t\r\n', dtype=np.uint8)
+def parse_fast_file(path, ncols):
+
+    with open(path, 'rb') as fin: raw = fin.read()
+    raw  = raw.translate(None, b'\x00')
+    body = raw.partition(b'\n')[2] # skip the header
+    if not body.endswith(b'\n'): body = body+b'\n'
+
+    buf      = np.frombuffer(body, dtype=np.uint8)
+    newline  = buf == ord('\n')
+    is_space = np.isin(buf, whitespace_bytes)
+    line_num = np.cumsum(newline)-newline # the newline belongs to the line it ends
+    starts   = ~is_space & np.concatenate(([True], is_space[0:-1]))
+    n_fields = np.bincount(line_num[starts], minlength=np.count_nonzero(newline))
+
+    good_lines = n_fields == ncols
+    n_dropped  = np.count_nonzero(~good_lines & (n_fields > 0))
+    if n_dropped > 0: body = buf[good_lines[line_num]].tobytes()
+
+    if not good_lines.any(): return pd.DataFrame(columns=range(0, ncols), dtype=np.float64), n_dropped
+
+    frame = pd.read_csv(io.BytesIO(body), parse_dates=False, sep='\s+', na_values=['nan','NaN'],
+                        header=None, engine='c')
+    if any(frame.dtypes == object): # garbage that still had the right number of fields
+        frame = frame.apply(pd.to_numeric, errors='coerce')
+    return frame, n_dropped
+
+# each slow file falls in the fuzzy window of ~40 days, so rather than parsing it for every one of
+# them it's parsed once with parse_func and written to slow_cache_dir as an npz of typed columns,
+# keyed by path, size and mtime (and the cache version, bump it if the parse functions change).
+# returns the rows in [start, end] or None if there aren't any
+slow_cache_version = 2
+def read_cached_slow_file(path, parse_func, start, end):
+
+    file_stat  = os.stat(path)
+    cache_stem = '{}/{}_{}'.format(slow_cache_dir, os.path.basename(path), hashlib.md5(path.encode()).hexdigest()[0:10])
+    cache_file = f'{cache_stem}_v{slow_cache_version}_{file_stat.st_size}_{file_stat.st_mtime_ns}.npz'
+
+    start = np.datetime64(start, 'ns')
+    end   = np.datetime64(end,   'ns')
+
+    if not os.path.exists(cache_file): 
+        frame = parse_func(path)
+        if not np.issubdtype(frame.index.dtype, np.datetime64): # unparseable timestamps, don't cache it 
+            fl.warn('The timestamps in {} could not be parsed, not caching it'.format(path))
+            return frame
+
+        for old_file in glob.glob(f'{cache_stem}_*.npz'): # the file changed or the cache version did
+            if old_file != cache_file: os.remove(old_file)
+
+        index  = frame.index.values
+        span   = np.array([index.min(), index.max()]) if index.size > 0 else np.array([], dtype=index.dtype)
+        arrays = {f'col_{i}': frame[col].values for i, col in enumerate(frame.columns)}
+
+        tmp_file = f'{cache_file}.{os.getpid()}.tmp' # other days might be writing the same file
+        with open(tmp_file, 'wb') as f:
+            np.savez(f, index=index, span=span, columns=np.array(frame.columns, dtype=str),
+                     index_name=np.array(frame.index.name or ''), **arrays)
+        os.replace(tmp_file, cache_file)
+
+        in_range = (index >= start) & (index <= end)
+        if not np.any(in_range): return None
+        return frame[in_range]
+
+    # npz members are only read when asked for, so files outside the range cost almost nothing
+    with np.load(cache_file, allow_pickle=True) as cached:
+        span = cached['span']
+        if span.size == 0 or span[1] < start or span[0] > end: return None
+
+        index    = cached['index']
+        in_range = (index >= start) & (index <= end)
+        if not np.any(in_range): return None
+
+        index_name = str(cached['index_name'])
+        frame = pd.DataFrame({col: cached[f'col_{i}'][in_range] for i, col in enumerate(cached['columns'])},
+                             index=pd.DatetimeIndex(index[in_range], name=index_name if index_name else None))
+    return frame
+
+# the column names for the fast files of the instrument in subdir
+def get_fast_cols(subdir):
     fast_atts, fast_vars = define_level1_fast() 
-    
-    metek_data = pd.DataFrame()
-    day_delta  = pd.to_timedelta(86399999999,unit='us') # we look for files from date+(1day-1microsecond)
-
-    print('... getting fast data from: %s' % data_dir+subdir)
-    nfiles = 0
 
     # define column names according to instrument 
     inst_strs = ['licor','2m','6m','10m','30m']
@@ -468,64 +595,62 @@ def get_fast_data(subdir, date):
     if curr_inst == '30m': curr_inst='mast' #directory labeled 30m, data vars labeled mast...
     cols = [s for s in fast_vars if curr_inst in s.lower()]
     if curr_inst == 'licor': cols = cols[0:7] # there's 7 columns in the original data but we're decoding the diags and adding vars
+    return cols
+
+# reads one hourly fast file from the hour file_date and puts the timestamps on it, returns the frame
+# and the number of malformed lines that were dropped. runs on the io threads (see submit_fast_reads)
+def read_fast_file(path, file_date, cols):
+
+    # read in data finally, then assign colunm names and convert timestamps after. rarely, some files
+    # have "NUL chars" sprinkled at the beginning of lines, parse_fast_file takes care of those in bulk
+    frame, n_dropped = parse_fast_file(path, len(cols))
+
+    mmssuuu  = frame[0].values # convert timestamp into useable datetime array and then set index to timestamps
+
+    # mmssuuu is minutes, seconds and milliseconds into the hour of the file, the timestamps are
+    # put together from those and the file's date with integer arithmetic (fl.build_timestamps)
+    frame.columns = cols # rename columns appropriately
+    d = file_date
+    timestamps, bad_times = fl.build_timestamps(d.year, d.month, d.day, d.hour, mmssuuu//100000,
+                                                (mmssuuu//1000)%100, (mmssuuu%1000)*1000)
+    frame = frame.set_index(pd.DatetimeIndex(timestamps, name='TIMESTAMP'))
+    frame = frame[~bad_times] # drop bad timestamps
+    return frame, n_dropped
+
+# starts reading the hourly files of subdir for date on io_pool, a thread pool. the pandas c parser and
+# numpy let go of the gil so the threads really do read in parallel. returns (file name, future) in
+# hour order, get_fast_data() puts them together
+def submit_fast_reads(subdir, date, io_pool):
+    cols  = get_fast_cols(subdir)
+    reads = []
+    for data_file, metek_file_date in sorted(get_fast_file_list(subdir, date), key=lambda f: f[1]): # the hourly files for today
+        verboseprint('... using the file {} from the day: {}'.format(data_file, metek_file_date))
+        reads.append((data_file, io_pool.submit(read_fast_file, data_dir+subdir+data_file, metek_file_date, cols)))
+    return reads
+
+# gets data that is in the metek format, either 'raw' or 'stats' can but put in as a data_str. reads are
+# the files from submit_fast_reads(), if they weren't started already they're read here on n_io_threads
+def get_fast_data(subdir, date, reads=None):
+
+    if reads is None:
+        with ThreadPoolExecutor(max_workers=n_io_threads) as io_pool:
+            return get_fast_data(subdir, date, submit_fast_reads(subdir, date, io_pool))
+
+    cols       = get_fast_cols(subdir)
+    metek_data = pd.DataFrame()
+    day_delta  = pd.to_timedelta(86399999999,unit='us') # we look for files from date+(1day-1microsecond)
 
-    frame_list = []
-    first_file = True
-    for data_file in os.listdir(data_dir+subdir):
-        if data_file.startswith('msc') and data_file.endswith('_raw.txt'):
-            file_words  = data_file.split(sep='_')
-            date_string = file_words[0].strip('msc') # YYYJJJHH
-
-            metek_file_date = datetime.strptime('2'+date_string,'%Y%j%H')
-
-            if metek_file_date >= (date) and metek_file_date < (date+day_delta):
-                nfiles += 1
-                #if first_file:
-                verboseprint('... using the file {} from the day: {}'.format(data_file, metek_file_date))
-                    #first_file = False
-                path        = data_dir+subdir+data_file
-                header_list = None
-
-                # read in data finally, then assign colunm names and convert timestamps after
-                frame = pd.read_csv(path, parse_dates=False, sep='\s+', na_values=['nan','NaN'],
-                                     header=header_list, skiprows=[0], engine='c',)
-
-                mmssuuu  = frame[0].values # convert timestamp into useable datetime array and then set index to timestamps
-
-                # rarely, some files have a random amount of "NUL chars" sprinkled at the beginning of lines, must be shutdown periods?
-                # it's rare enough that we don't want to run the conversion on *all* files (v. slow), so we just re-read the bad files
-                # literally only saves one data point of fast data, worth it? we could just drop that line but it took a while to track down and fix
-                # this is written this way because pandas *and* numpy process the nul char in the pipeline before doing conversions and it borks everything
-                # and I couldn't find a reasonable workaround. kind of stupid to essentially re-write a slower version of read_csv
-                if np.any(np.isnan(mmssuuu)): 
-                    bad_inds = np.argwhere(np.isnan(mmssuuu))
-                    fl.warn("SOMETHING WRONG WITH TIMESTAMPS (NUL CHAR?) IN FILE {}\n\n SOMEWHERE NEAR LINES {}.. this is gonna be slow".format(data_file, bad_inds))
-                    with open(path, 'r') as fin:
-                        next(fin)
-                        weird_string_lines = fin.read().split("\n")
-                    for i, line in enumerate(weird_string_lines):
-                        weird_data_line = np.fromstring(line, sep=' ')
-                        if i == 0:
-                            weird_data = weird_data_line.transpose()
-                        if len(weird_data_line) > 0 : weird_data = np.vstack([weird_data, weird_data_line])
-                    frame = pd.DataFrame(weird_data)
-                    frame[0] = pd.to_numeric(frame[0])
-                    mmssuuu  = frame[0].values
-                    bad_inds = np.argwhere(np.isnan(mmssuuu))
-
-                frame.columns = cols # rename columns appropriately
-                noaadate = np.char.zfill(mmssuuu.astype(int).astype(str), 7)
-                date_now = ' {}-{}-{}-{}'.format(metek_file_date.year, metek_file_date.month,
-                                                    metek_file_date.day,  metek_file_date.hour)
-                time_now = np.array([nd+date_now for nd in noaadate])
-                timestamps = pd.to_datetime(time_now, format='%M%S%f %Y-%m-%d-%H').rename('TIMESTAMP')
-                frame = frame.set_index(timestamps)
-                frame = frame[mmssuuu>=0] # drop bad timestamps
-                frame_list.append(frame)
-
+    print('... getting fast data from: %s' % data_dir+subdir)
+    nfiles = len(reads)
 
-        else: # found a file that is not an 'msc' file...warn user??
-            x = 'do nothing' # placeholder, guess we won't warn the user, sorry user!
+    frame_list    = []
+    dropped_lines = {}
+    for data_file, read in reads: # in hour order, whichever thread finished first
+        frame, n_dropped = read.result()
+        if n_dropped > 0:
+            fl.warn("{} MALFORMED LINES DROPPED FROM FILE {}".format(n_dropped, data_file))
+            dropped_lines[data_file] = n_dropped
+        frame_list.append(frame)
 
     if nfiles == 0: 
         fl.warn('NO FAST DATA FOR {} on {} ... MAKE SENSE??\n\n'.format(subdir,date)\
@@ -542,12 +667,37 @@ def get_fast_data(subdir, date):
     elif nfiles != 24:
         fl.warn('{} of 24 {} files available for today {}'.format(nfiles,subdir,date))
 
+    if len(dropped_lines) > 0:
+        print('... {} malformed lines dropped from {} of the {} {} files'.format(sum(dropped_lines.values()),
+                                                                                len(dropped_lines), nfiles, subdir))
+
     # put the date from all files into one data frame before giving it back
     metek_data = pd.concat(frame_list) # is concat computationally efficient?
 
     metek_data = metek_data.sort_index()
     return metek_data
 
+# the hourly metek/licor 'msc' files in data_dir+subdir for date, as (file name, hour of the file),
+# from the julian day and hour in their names. used by get_fast_data() and for the run manifest
+def get_fast_file_list(subdir, date):
+
+    day_delta  = pd.to_timedelta(86399999999,unit='us') # we look for files from date+(1day-1microsecond)
+    file_list  = []
+    for data_file in os.listdir(data_dir+subdir):
+        if data_file.startswith('msc') and data_file.endswith('_raw.txt'):
+            file_words  = data_file.split(sep='_')
+            date_string = file_words[0].strip('msc') # YYYJJJHH
+
+            metek_file_date = datetime.strptime('2'+date_string,'%Y%j%H')
+
+            if metek_file_date >= (date) and metek_file_date < (date+day_delta):
+                file_list.append((data_file, metek_file_date))
+
+        else: # found a file that is not an 'msc' file...warn user??
+            x = 'do nothing' # placeholder, guess we won't warn the user, sorry user!
+
+    return file_list
+
 def write_level1_fast(metek_bottom, metek_middle, metek_top, metek_mast, licor_bottom, date):
 
     # these keys are the names of the groups in the netcdf files and the
@@ -635,8 +785,8 @@ def write_level1_fast(metek_bottom, metek_middle, metek_top, metek_mast, licor_b
         bt_fast_delta_ints = np.floor((bt_fast_dti - bot).total_seconds()*1000)      # milliseconds
         fast_delta_ints    = np.floor((fast_dti - tm).total_seconds()*1000)      # milliseconds
 
-        bt_fast_ind = pd.Int64Index(bt_fast_delta_ints)
-        t_fast_ind  = pd.Int64Index(fast_delta_ints)
+        bt_fast_ind = pd.Index(bt_fast_delta_ints, dtype='int64')
+        t_fast_ind  = pd.Index(fast_delta_ints, dtype='int64')
 
         t_fast[:]   = t_fast_ind.values
         bt_fast[:]  = bt_fast_ind.values
@@ -782,8 +932,8 @@ def write_level1_slow(slow_data, date):
     bt_slow_delta_ints = np.floor((bt_slow_dti - bot).total_seconds())      # seconds
     slow_delta_ints    = np.floor((slow_dti - tm).total_seconds())      # seconds
 
-    bt_slow_ind        = pd.Int64Index(bt_slow_delta_ints)
-    t_slow_ind         = pd.Int64Index(slow_delta_ints)
+    bt_slow_ind        = pd.Index(bt_slow_delta_ints, dtype='int64')
+    t_slow_ind         = pd.Index(slow_delta_ints, dtype='int64')
 
     t_slow[:]  = t_slow_ind.values
     bt_slow[:] = bt_slow_ind.values
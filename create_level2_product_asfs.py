@@ -59,8 +59,8 @@ code_version = code_version()
 from asfs_data_definitions import define_global_atts, define_level2_variables, define_turb_variables, define_qc_variables
 from asfs_data_definitions import define_level1_slow, define_level1_fast, define_10hz_variables
 
-from qc_level2 import qc_asfs_winds, qc_stations, qc_asfs_turb_data
-from get_data_functions import get_flux_data, get_arm_radiation_data
+from qc_level2 import qc_asfs_winds, qc_stations, qc_asfs_turb_data, qc_table_digest
+from get_data_functions import get_flux_data, get_flux_file, get_arm_radiation_data, flux_day_ring, get_ship_track
 
 import functions_library as fl # includes a bunch of helper functions that we wrote
 
@@ -75,7 +75,7 @@ from pvlib import spa
     #    solar radiation applications. Solar Energy, vol. 81, no. 6, p. 838,
     #    2007.
 
-import os, inspect, argparse, time, sys, socket
+import os, inspect, argparse, time, sys, socket, glob
 
 global nthreads 
 hostname = socket.gethostname()
@@ -88,16 +88,12 @@ if '.psd.' in hostname:
         nthreads = 90  # the new compute is hefty.... real hefty
 
 else: nthreads = 8     # laptops don't tend to have 12  cores... yet
-
-from multiprocessing import Process as P
-from multiprocessing import Queue   as Q
+max_tasks_per_worker = 10 # worker processes are replaced after this many days, caps memory growth
 
 # need to debug something? this makes useful pickle files in ./tests/ ... uncomment below if you want to kill threading
 we_want_to_debug = True
 if we_want_to_debug:
 
-    # from multiprocessing.dummy import Process as P
-    # from multiprocessing.dummy import Queue   as Q
     # nthreads = 1
     try: from debug_functions import drop_me as dm
     except: you_dont_care=True
@@ -162,7 +158,8 @@ def main(): # the main data crunching program
     parser.add_argument('-v', '--verbose', action ='count', help='print verbose log messages')
     parser.add_argument('-p', '--path', metavar='str', help='base path of data location, up to andincluding /data/, include trailing slash') 
     parser.add_argument('-a', '--station', metavar='str',help='asfs#0, if omitted all will be procesed')
-    parser.add_argument('-pd', '--pickledir', metavar='str',help='want to store a pickle of the data for debugging?')
+    parser.add_argument('-pd', '--pickledir', metavar='str',help='directory to cache the data in (feather/zarr), for speed on reruns')
+    parser.add_argument('-f', '--force', action ='store_true', help='reprocess every day, even the ones the run manifest says are up to date')
     # add verboseprint function for extra info using verbose flag, ignore these 5 lines if you want
     
     args         = parser.parse_args()
@@ -208,6 +205,33 @@ def main(): # the main data crunching program
     print('The last day we will process data is:              %s\n\n' % str(end_time-timedelta(1)))
     printline()
 
+    # a station day is made from the level1 files for yesterday, today and tomorrow (the hour either side
+    # and the gps smoothing) and the qc table rows for today. the run manifest (see fl.run_manifest) knows
+    # which days were already written from those as they are now, with this code_version and these
+    # parameters, only the others are (re)done unless --force. the partner data (ARM, ship track) isn't
+    # tracked, use --force when it changes
+    day_params = {'integ_time_turb_flux': integ_time_turb_flux, 'calc_fluxes': calc_fluxes, 'lvlname': lvlname}
+    manifest = {}; day_jobs = {}; stale_days = {}
+    print("Checking the run manifests for days that are already up to date...")
+    for curr_station in flux_stations:
+        day_jobs[curr_station] = {}
+        for today in pd.date_range(start_time+timedelta(1), end_time-timedelta(1)):
+            day_files = [get_flux_file(curr_station, today+timedelta(d), 1, data_dir, data_type)
+                         for d in [-1, 0, 1] for data_type in ['slow', 'fast']]
+            qc_hash   = qc_table_digest(f"./qc_tables/qc_table_{curr_station}.csv", today, today+timedelta(1))
+            day_jobs[curr_station][fl.dstr(today)] = fl.run_manifest.fingerprint(day_files, code_version, qc_hash, day_params)
+
+        print(f"\n{curr_station}:")
+        manifest[curr_station]   = fl.run_manifest(f'{get_level2_out_dir(curr_station)}/run_manifest_level2.sqlite')
+        stale_days[curr_station] = manifest[curr_station].plan(day_jobs[curr_station], force=args.force, verbose=verbose)
+    printline()
+
+    flux_stations = [curr_station for curr_station in flux_stations if len(stale_days[curr_station]) > 0]
+    if len(flux_stations) == 0:
+        print("\nEvery day you asked for is up to date, nothing to do!! (use -f/--force to redo them anyway)")
+        print(version_msg)
+        return
+
     # thresholds! limits that can warn you about bad data!
     # these aren't used yet but should be used to warn about spurious data
     lat_thresh        = (70   ,90)       # limits area where station
@@ -256,16 +280,9 @@ def main(): # the main data crunching program
     station_initial_start_time['asfs40'] = datetime(2019,10,5,5,15,0)
     station_initial_start_time['asfs50'] = datetime(2019,10,10,10,49,0) 
     
-    # Load the ship track and reindex to slow_data, calculate distance [m] and bearing [deg from tower rel to true north, as wind direction]
-    ship_df = pd.read_csv(leica_dir+'Leica_Sep20_2019_Oct01_2020_clean.dat',sep='\s+',parse_dates={'date': [0,1]}).set_index('date')          
-    ship_df.columns = ['u1','lon_ew','latd','latm','lond','lonm','u2','u3','u4','u5','u6','u7']
-    ship_df['lat']=ship_df['latd']+ship_df['latm']/60
-
-    # 9 is a missing value in the original file. when combined from above line 9+9/60=9.15 is the new missing data
-    ship_df['lat'].mask(ship_df['lat'] == 9+9/60, inplace=True) 
-    ship_df['lon']=ship_df['lond']+ship_df['lonm']/60
-    ship_df['lon'].mask(ship_df['lon'] == 9+9/60, inplace=True) 
-    ship_df['lon'] = ship_df['lon']*ship_df['lon_ew'] # deg west will be negative now
+    # Load the ship track, distance [m] and bearing [deg from tower rel to true north, as wind direction] are
+    # calculated from it in process_gps
+    ship_track = get_ship_track(leica_dir)
 
     # ###################################################################################################
     # various calibration params
@@ -569,7 +586,7 @@ def main(): # the main data crunching program
     for curr_station in flux_stations:
     
         in_dir = data_dir+'/'+curr_station+'/1_level_ingest_'+curr_station+'/'      # where does level 1 data live?
-        df_station, code_version = get_flux_data(curr_station, start_time, end_time, 1,
+        df_station, level1_version = get_flux_data(curr_station, start_time, end_time, 1,
                                                  data_dir, 'slow', verbose, nthreads, False, pickle_dir)
         slow_data[curr_station] = df_station
 
@@ -634,7 +651,7 @@ def main(): # the main data crunching program
     ########################################  # # Process the GPS # #  #############################################
     # I'm going to do all the gps qc up front mostly because I need to smooth the heading before we split individual days  
     print('\n---------------------------------------------------------------------------------------------\n')            
-    def process_gps(curr_station, sd, ship_df):
+    def process_gps(curr_station, sd, ship_track):
   
         # Get the current station's initialzation dataframe. ...eval...sorry, it had to be
         init_data[curr_station] = init_data[curr_station].reindex(method='pad',index=sd.index)
@@ -693,9 +710,7 @@ def main(): # the main data crunching program
         sd['ice_alt'] = tmpa
                   
         # Get the bearing on the ship
-        ship_df = ship_df.reindex(sd.index)
-        sd['ship_distance'] = fl.distance_wgs84(sd['lat'],sd['lon'],ship_df['lat'],ship_df['lon'])
-        sd['ship_bearing']  = fl.calculate_initial_angle_wgs84(sd['lat'],sd['lon'],ship_df['lat'],ship_df['lon'])
+        sd['ship_distance'], sd['ship_bearing'] = ship_track.distance_bearing(sd.index, sd['lat'], sd['lon'])
         sd['ship_distance'] = fl.despike(sd['ship_distance'],2,15,'yes')   # tiny spikes in lat/lon resulting in 
         sd['ship_bearing']  = fl.despike(sd['ship_bearing'],0.02,15,'yes') # spikes of ~5 m in distance, so despike
 
@@ -714,7 +729,7 @@ def main(): # the main data crunching program
 
     # actually call the gps functions and recalibrate LW sensors, minor adjustments to plates
     for curr_station in flux_stations:
-        slow_data[curr_station], return_status = process_gps (curr_station, slow_data[curr_station], ship_df)
+        slow_data[curr_station], return_status = process_gps (curr_station, slow_data[curr_station], ship_track)
         station_data = slow_data[curr_station]
    
         c_Sd =coef_S_down[curr_station]
@@ -769,17 +784,13 @@ def main(): # the main data crunching program
     # #########################################################################################################
     # here's where we actually call the data crunching function. for each station we process days sequentially
     # *then* move on to the next station, function for daily processing defined below
-    def process_station_day(curr_station, today, tomorrow, slow_data_today, day_q=None):
+    def process_station_day(curr_station, today, tomorrow, slow_data_today, fast_data_today, day_q=None):
         try:
             data_to_return = [] # this function processes the requested day then returns processed DFs appended to this
                                 # list, e.g. data_to_return(data_name='slow', slow_df, None) or data_to_return(data_name='turb', turb_df, win_len)
 
             printline(endline="\n")
-            print("Retreiving level1 fast data for {} on {}\n".format(curr_station,today))
-
-            # get fast data from netcdf files for daily processing
-            fast_data_today, fd_version = get_flux_data(curr_station, today-timedelta(1), today+timedelta(1),
-                                                        1, data_dir, 'fast', verbose=False)
+            print("Processing level1 data for {} on {}\n".format(curr_station,today))
 
             # shorthand to save some space/make code more legible
             fdt = fast_data_today[today-timedelta(hours=1):tomorrow+timedelta(hours=1)]   
@@ -900,7 +911,8 @@ def main(): # the main data crunching program
             if arm_data.empty or sdt.ship_distance.mean() > 2000:
                 diffuse_flux = -1 # we don't have an spn1 so we model the error. later we can use it if we have it
             else:
-                diffuse_flux = arm_data[today-timedelta(1):tomorrow-timedelta(1)].PSPdif.reindex(index=sdt.index)
+                diffuse_flux, align_info = fl.align_to_index(arm_data[today-timedelta(1):tomorrow-timedelta(1)].PSPdif,
+                                                             sdt.index, direction='exact')
 
             # now run the correcting function      
             fl.tilt_corr(sdt,diffuse_flux) # modified sdt is returned
@@ -1279,13 +1291,16 @@ def main(): # the main data crunching program
             # original calculation because I think it is a nice opportunity for a sanity check. 
             print('... calculating a corrected set of slow wind speed and direction.')
 
-            u_min = fdt_10hz['metek_u'].resample('1T',label='left').apply(fl.take_average)
-            v_min = fdt_10hz['metek_v'].resample('1T',label='left').apply(fl.take_average)
-            w_min = fdt_10hz['metek_w'].resample('1T',label='left').apply(fl.take_average)
+            # the 1 min stats of the fast data in one go, the winds with take_average's rule on missing data
+            fast_stats = fl.bin_stats(fdt_10hz[['metek_u', 'metek_v', 'metek_w', 'metek_T', 'licor_h2o', 'licor_co2', 'licor_pr']], '1T')
+            uvw_avg    = fl.bin_average(fdt_10hz[['metek_u', 'metek_v', 'metek_w']], '1T')
+            u_min      = uvw_avg['metek_u']
+            v_min      = uvw_avg['metek_v']
+            w_min      = uvw_avg['metek_w']
 
-            u_sigmin = fdt_10hz['metek_u'].resample('1T',label='left').std()
-            v_sigmin = fdt_10hz['metek_v'].resample('1T',label='left').std()
-            w_sigmin = fdt_10hz['metek_w'].resample('1T',label='left').std()
+            u_sigmin   = fast_stats['std']['metek_u']
+            v_sigmin   = fast_stats['std']['metek_v']
+            w_sigmin   = fast_stats['std']['metek_w']
             
             ws = np.sqrt(u_min**2+v_min**2)
             wd = np.mod((np.arctan2(-u_min,-v_min)*180/np.pi),360)
@@ -1338,12 +1353,12 @@ def main(): # the main data crunching program
             sdt['wspd_u_std']        = u_sigmin
             sdt['wspd_v_std']        = v_sigmin
             sdt['wspd_w_std']        = w_sigmin            
-            sdt['temp_acoustic_std'] = fdt_10hz['metek_T'].resample('1T',label='left').std()
-            sdt['temp_acoustic']     = fdt_10hz['metek_T'].resample('1T',label='left').mean()
+            sdt['temp_acoustic_std'] = fast_stats['std']['metek_T']
+            sdt['temp_acoustic']     = fast_stats['mean']['metek_T']
 
-            sdt['h2o_licor']         = fdt_10hz['licor_h2o'].resample('1T',label='left').mean()
-            sdt['co2_licor']         = fdt_10hz['licor_co2'].resample('1T',label='left').mean()
-            sdt['pr_licor']          = fdt_10hz['licor_pr'].resample('1T',label='left').mean()*10 # [to hPa]
+            sdt['h2o_licor']         = fast_stats['mean']['licor_h2o']
+            sdt['co2_licor']         = fast_stats['mean']['licor_co2']
+            sdt['pr_licor']          = fast_stats['mean']['licor_pr']*10 # [to hPa]
 
             # ~~~~~~~~~~~~~~~~~~~~ (6) Flux Capacitor  ~~~~~~~~~~~~~~~~~~~~~~~~~
     
@@ -1385,6 +1400,7 @@ def main(): # the main data crunching program
                 metek_10hz = fl.fix_high_frequency(metek_10hz)
 
                 turb_ec_data = {}
+                turb_ec_spec = {}
 
                 # calculate before loop, used to modify height offsets below to be 'more correct'
                 # snow depth calculation shouldn't/doesn't fail but catch the exception just in case
@@ -1404,121 +1420,52 @@ def main(): # the main data crunching program
                     flux_time_today   = pd.date_range(today-timedelta(hours=1), tomorrow+timedelta(hours=1), freq=flux_freq_str) 
 
                     # recalculate wind vectors to be saved with turbulence data  later
-                    u_min  = metek_10hz['u'].resample(flux_freq_str, label='left').apply(fl.take_average)
-                    v_min  = metek_10hz['v'].resample(flux_freq_str, label='left').apply(fl.take_average)
-                    ws     = np.sqrt(u_min**2+v_min**2)
-                    wd     = np.mod((np.arctan2(-u_min,-v_min)*180/np.pi),360)
+                    vec_avg = fl.bin_vector_average(metek_10hz['u'], metek_10hz['v'], flux_freq_str)
+                    ws      = vec_avg['wspd']
+                    wd      = vec_avg['wdir']
 
                     turb_winds = pd.DataFrame()
                     turb_winds['wspd_vec_mean'] = ws
                     turb_winds['wdir_vec_mean'] = wd
 
-                    for time_i in range(0,len(flux_time_today)-1): # flux_time_today = a DatetimeIndex defined earlier and based
-                                                                   # on integ_time_turb_flux, the integration window for the
-                                                                   # calculations that is defined at the top of the code
-
-                        if time_i % 24 == 0:
-                            verboseprint(f'... turbulence integration across {flux_freq_str} for '+
-                                         f'{flux_time_today[time_i].strftime("%m-%d-%Y %H")}h {curr_station}')
-
-                        # Get the index, ind, of the metek frame that pertains to the present calculation A
-                        # little tricky. We need to make sure we give it enough data to encompass the nearest
-                        # power of 2: for 30 min fluxes this is ~27 min so you are good, but for 10 min fluxes
-                        # it is 13.6 min so you need to give it more.
-
-                        # We buffered the 10 Hz so that we can go outside the edge of "today" by up to an hour.
-                        # It's a bit of a formality, but for general cleanliness we are going to
-                        # center all fluxes to the nearest min so that e.g:
-                        # 12:00-12:10 is actually 11:58 through 12:12
-                        # 12:00-12:30 is actually 12:01 through 12:28     
-                        po2_len  = np.ceil(2**round(np.log2(integration_window*60*10))/10/60) # @10Hz, min needed to cover nearet po2 [minutes]
-                        t_win    = pd.Timedelta((po2_len-integration_window)/2,'minutes')
-                        metek_in = metek_10hz.loc[flux_time_today[time_i]-t_win:flux_time_today[time_i+1]+t_win].copy()
-
-                        # we need pressure and temperature and humidity
-                        Pr_time_i = sdt['atmos_pressure'] .loc[flux_time_today[time_i]-t_win:flux_time_today[time_i+1]+t_win].mean()
-                        T_time_i  = sdt['temp']  .loc[flux_time_today[time_i]-t_win:flux_time_today[time_i+1]+t_win].mean()
-                        Q_time_i  = sdt['mixing_ratio']    .loc[flux_time_today[time_i]-t_win:flux_time_today[time_i+1]+t_win].mean()/1000
-
-                        # get the licor data
-                        licor_data = licor_10hz.loc[flux_time_today[time_i]-t_win:flux_time_today[time_i+1]+t_win].copy()
-
-                        # make th1e turbulent flux calculations via Grachev module
-                        v = False
-                        if verbose: v = True;
-                        sonic_z       = 3.3 # what is sonic_z for the flux stations
-
-                        data = fl.grachev_fluxcapacitor(sonic_z, metek_in, licor_data, 'g/m3', 'mg/m3',
-                                                            Pr_time_i, T_time_i, Q_time_i, verbose=v)
-                        
-                        # Sanity check on Cd. Ditch the run if it fails
-                        #data[:].mask( (data['Cd'] < cd_lim[0])  | (data['Cd'] > cd_lim[1]) , inplace=True) 
-
-                        # doubtless there is a better way to initialize this
-                        if time_i == 0: turbulencetom = data
-                        else: turbulencetom = turbulencetom.append(data)
-
-                    # now add the indexer datetime doohicky
-                    turbulencetom.index = flux_time_today[0:-1] 
-
-                    turb_cols = turbulencetom.keys()
-
-                    # ugh. there are 2 dimensions to the spectral variables, but the spectra are smoothed. The smoothing routine
-                    # is a bit strange in that is is dependent on the length of the window (to which it should be orthogonal!)
-                    # and worse, is not obviously predictable...it groes in a for loop nested in a while loop that is seeded by
-                    # a counter and limited by half the length of the window, but the growth is not entirely predictable and
-                    # neither is the result so I can't preallocate the frequency vector. I need to talk to Andrey about this and
-                    # I need a programatic solution to assigning a frequency dimension when pandas actually treats that
-                    # dimension indpendently along the time dimension. I will search the data frame for instances of a frequency
-                    # dim then assign times without it nan of that length. for days without a frequency dim I will assign it to
-                    # be length of 2 arbitrarily so that the netcdf can be written. This is ugly.
-
-                    # (1) figure out the length of the freq dim and how many times are missing. also, save the frequency itself
-                    # or you will write that vector as nan later on...
-                    missing_f_dim_ind = []
-                    f_dim_len = 1 
-                    for ii in range(0, np.array(turbulencetom['fs']).size):
-                        len_var = np.array(turbulencetom['fs'][ii]).size
-                        if len_var == 1:
-                            missing_f_dim_ind.append(ii)
-                        else:
-                            f_dim_len = len_var
-                            fs = turbulencetom['fs'][ii]
-
-
-                    # (2) if missing times were found, fill with nans of the freq length you discovered. this happens on days
-                    # when the instruents are turned on and also perhaps runs when missing data meant the flux_capacitor
-                    # returned for lack of inputs
-                    if f_dim_len > 0 and missing_f_dim_ind:        
-                                                                    
-                        # case we have no data we need to remake a nominal fs as a filler
-                        if 'fs' not in locals(): 
-                            fs = pd.DataFrame(np.zeros((60,1)),columns=['fs'])
-                            fs = fs['fs']*nan
-                        
-
-                        for ii in range(0,len(missing_f_dim_ind)):
-                            # these are the array with multiple dims...  im filling the ones that are missing with nan (of fs in
-                            # the case of fs...) such that they can form a proper and square array for the netcdf
-                            turbulencetom['fs'][missing_f_dim_ind[ii]] = fs
-                            turbulencetom['sUs'][missing_f_dim_ind[ii]] = fs*nan
-                            turbulencetom['sVs'][missing_f_dim_ind[ii]] = fs*nan
-                            turbulencetom['sWs'][missing_f_dim_ind[ii]] = fs*nan
-                            turbulencetom['sTs'][missing_f_dim_ind[ii]] = fs*nan
-                            turbulencetom['sqs'][missing_f_dim_ind[ii]] = fs*nan
-                            turbulencetom['scs'][missing_f_dim_ind[ii]] = fs*nan
-                            turbulencetom['cWUs'][missing_f_dim_ind[ii]] = fs*nan
-                            turbulencetom['cWVs'][missing_f_dim_ind[ii]] = fs*nan
-                            turbulencetom['cWTs'][missing_f_dim_ind[ii]] = fs*nan
-                            turbulencetom['cUTs'][missing_f_dim_ind[ii]] = fs*nan
-                            turbulencetom['cVTs'][missing_f_dim_ind[ii]] = fs*nan
-                            turbulencetom['cWqs'][missing_f_dim_ind[ii]] = fs*nan
-                            turbulencetom['cUqs'][missing_f_dim_ind[ii]] = fs*nan
-                            turbulencetom['cVqs'][missing_f_dim_ind[ii]] = fs*nan
-                            turbulencetom['cWcs'][missing_f_dim_ind[ii]] = fs*nan
-                            turbulencetom['cUcs'][missing_f_dim_ind[ii]] = fs*nan
-                            turbulencetom['cVcs'][missing_f_dim_ind[ii]] = fs*nan
-                            turbulencetom['cUVs'][missing_f_dim_ind[ii]] = fs*nan
+                    verboseprint(f'... turbulence integration across {flux_freq_str} for {today.strftime("%m-%d-%Y")} {curr_station}')
+
+                    # Get the edges of each window of the metek frame that pertains to the calculations. A
+                    # little tricky. We need to make sure we give it enough data to encompass the nearest
+                    # power of 2: for 30 min fluxes this is ~27 min so you are good, but for 10 min fluxes
+                    # it is 13.6 min so you need to give it more.
+
+                    # We buffered the 10 Hz so that we can go outside the edge of "today" by up to an hour.
+                    # It's a bit of a formality, but for general cleanliness we are going to
+                    # center all fluxes to the nearest min so that e.g:
+                    # 12:00-12:10 is actually 11:58 through 12:12
+                    # 12:00-12:30 is actually 12:01 through 12:28     
+                    po2_len    = np.ceil(2**round(np.log2(integration_window*60*10))/10/60) # @10Hz, min needed to cover nearet po2 [minutes]
+                    t_win      = pd.Timedelta((po2_len-integration_window)/2,'minutes')
+                    win_starts = flux_time_today[0:-1]-t_win
+                    win_ends   = flux_time_today[1:]+t_win
+
+                    # we need pressure and temperature and humidity for each window
+                    Pr_win = np.array([sdt['atmos_pressure'].loc[t0:t1].mean()      for t0, t1 in zip(win_starts, win_ends)])
+                    T_win  = np.array([sdt['temp'].loc[t0:t1].mean()                for t0, t1 in zip(win_starts, win_ends)])
+                    Q_win  = np.array([sdt['mixing_ratio'].loc[t0:t1].mean()/1000   for t0, t1 in zip(win_starts, win_ends)])
+
+                    # make the turbulent flux calculations via Grachev module, all windows in one go
+                    v = False
+                    if verbose: v = True;
+                    sonic_z       = 3.3 # what is sonic_z for the flux stations
+
+                    turb_rec = fl.grachev_fluxcapacitor_batched(sonic_z, metek_10hz, licor_10hz, 'g/m3', 'mg/m3',
+                                                                Pr_win, T_win, Q_win, win_starts, win_ends, verbose=v)
+
+                    # Sanity check on Cd. Ditch the run if it fails
+                    #data[:].mask( (data['Cd'] < cd_lim[0])  | (data['Cd'] > cd_lim[1]) , inplace=True) 
+
+                    # now add the indexer datetime doohicky. the spectra are kept apart from the dataframe
+                    # in a dense (time, freq) container, every window has a row (nan if it was missing)
+                    turbulencetom          = fl.turb_record_to_dataframe(turb_rec, flux_time_today[0:-1], with_spectra=False)
+                    turb_ec_spec[win_len]  = fl.turb_spectra.from_record(turb_rec, flux_time_today[0:-1])
+
                     turb_ec_data[win_len] = turbulencetom.copy()
 
                 # calculate the bulk 
@@ -1537,7 +1484,7 @@ def main(): # the main data crunching program
                 bulk_input['zu'] = 3.86-snow_depth   # height of anemometer               (m)
                 bulk_input['zt'] = 2.13-snow_depth   # height of thermometer              (m)
                 bulk_input['zq'] = 1.84-snow_depth   # height of hygrometer               (m)      
-                bulk_input = bulk_input.resample(str(integration_window)+'min',label='left').apply(fl.take_average)
+                bulk_input = fl.bin_average(bulk_input, str(integration_window)+'min')
 
                 # output dataframe
                 empty_data = np.zeros(len(bulk_input))
@@ -1572,28 +1519,22 @@ def main(): # the main data crunching program
                         pickle.dump(bulk_input, pkl_file)
 
 
-                for ii in range(len(bulk)):
-                    tmp = [bulk_input['u'][ii], bulk_input['ts'][ii], bulk_input['t'][ii], \
-                           bulk_input['Q'][ii], bulk_input['zi'][ii], bulk_input['P'][ii], \
-                           bulk_input['zu'][ii],bulk_input['zt'][ii], bulk_input['zq'][ii]] 
-
-                    if not any(np.isnan(tmp)):
-                        bulkout = fl.cor_ice_A10(tmp)
-                        for hh in range(len(bulkout)):
-                            if bulkout[13] < cd_lim[0] or bulkout[13] > cd_lim[1]:  # Sanity check on Cd. Ditch the whole run if it fails
-                                bulk[bulk.columns[hh]][ii]=nan                      # for some reason this needs to be in a loop
-                            else:
-                                bulk[bulk.columns[hh]][ii]=bulkout[hh]
+                # all the records at once, nan where any input is missing
+                bulkout = fl.cor_ice_A10_array([bulk_input[var].values for var in ['u','ts','t','Q','zi','P','zu','zt','zq']])
+                bad_cd  = (bulkout[13] < cd_lim[0]) | (bulkout[13] > cd_lim[1]) # Sanity check on Cd. Ditch the whole run if it fails
+                for hh in range(0, len(bulk.columns)):
+                    bulk[bulk.columns[hh]] = np.where(bad_cd, nan, bulkout[hh])
+                verboseprint('... bulk fluxes for {} records, {} iterations at most'.format(np.sum(bulkout[-1]>0), np.max(bulkout[-1])))
 
                 for win_len in range(0,len(integ_time_turb_flux)):
 
                     # add this to the EC data, concat columns alongside each other without adding indexes
                     turbulencenew = pd.concat( [turb_ec_data[win_len], bulk, turb_winds], axis=1)  
                     data_to_return.append(('turb', turbulencenew.copy()[today:tomorrow], win_len))
+                    data_to_return.append(('spec', turb_ec_spec[win_len].between(today, tomorrow), win_len))
                     if win_len < len(integ_time_turb_flux)-1: print('\n')
 
-            out_dir   = '/Projects/MOSAiC_internal/flux_data_tests/'+curr_station+'/2_level_product_'+curr_station+'/' # where will level 2 data written?
-            #out_dir   = '/Projects/MOSAiC_internal/mgallagher/'+curr_station+'/2_level_product_'+curr_station+'/' # where will level 2 data written?
+            out_dir   = get_level2_out_dir(curr_station) # where will level 2 data written?
     
             try: 
                 trash_var = write_level2_10hz(curr_station, metek_10hz[today:tomorrow], licor_10hz[today:tomorrow], today, out_dir)
@@ -1623,72 +1564,85 @@ def main(): # the main data crunching program
 
 
     # used to store dataframes to be QCed/written after all days are processed,
-    turb_data_dict = {}; slow_data_dict = {}
+    turb_data_dict = {}; slow_data_dict = {}; spec_data_dict = {}
     for st in flux_stations: 
-        turb_data_dict[st] = {}; slow_data_dict[st] = []
+        turb_data_dict[st] = {}; slow_data_dict[st] = []; spec_data_dict[st] = {}
         for win_len in range(0,len(integ_time_turb_flux)):
             turb_data_dict[st][win_len] = []
-
-    # call processing by day then station (allows threading for processing a single days data)
-    failed_days = {}
-    for curr_station in flux_stations:
-        failed_days[curr_station] = []
-        printline(endline=f"\n\n  Processing all requested days of data for {curr_station}\n\n"); printline()
-
-        day_ind = -1*nthreads
-        while day_ind < len(day_series): # loop over the days in the processing range and crunch away
-            day_ind += nthreads
-
-            q_list = []
-            for day_i in range(day_ind, day_ind+nthreads): # with nthreads parallel processing
-                if day_i >= len(day_series): continue
-
-                today    = day_series[day_i]
+            spec_data_dict[st][win_len] = []
+
+    # the fast data for a day is the day and the hour either side, read here in order through a
+    # ring of decoded days so each level1 fast file is read once, not once for each day that needs it
+    def station_days():
+        for curr_station in flux_stations:
+            fast_ring = flux_day_ring(curr_station, 1, data_dir, 'fast')
+            for today in day_series: # loop over the days in the processing range and crunch away
+                if fl.dstr(today) not in stale_days[curr_station]: continue
                 tomorrow = today+day_delta
                 sd_today = slow_data[curr_station][today-timedelta(hours=1):tomorrow+timedelta(hours=1)]
                 if len(sd_today[today:tomorrow]) == 0: continue # weird corner case where data begins tomorrow/ended yesterday
+                print("Retreiving level1 fast data for {} on {}\n".format(curr_station,today))
+                fd_today = fast_ring.window(today-timedelta(hours=1), tomorrow+timedelta(hours=1))
+                yield curr_station, today, tomorrow, sd_today, fd_today
+
+    # every station day goes to the pool as its own task, the workers pick them up as they free
+    # up so a slow day doesn't hold up the ones after it (see fl.task_pool). days are handed over
+    # as workers free up, with one in hand, so only a few days of fast data are in memory here.
+    # the first days are submitted before the pool starts, so the workers have process_station_day
+    # and the days after are sent with only their data, it's local to main() and can't be pickled
+    failed_days = {curr_station: [] for curr_station in flux_stations}
+    day_pool    = fl.task_pool(nthreads, max_tasks=max_tasks_per_worker)
+    day_tasks   = station_days()
+    def submit_next_day():
+        for curr_station, today, tomorrow, sd_today, fd_today in day_tasks:
+            day_pool.submit((curr_station, today), process_station_day, curr_station, today, tomorrow, sd_today, fd_today)
+            return
+
+    printline(endline=f"\n\n  Processing all requested days of data for {flux_stations}\n\n"); printline()
+
+    for i_task in range(0, max(1, nthreads)+1): submit_next_day()
+    for (curr_station, day), status, day_results, runtime in day_pool.results():
+        submit_next_day()
+        verboseprint(f"... {curr_station} {day} took {runtime:.1f} s")
+        if status != 'ok':
+            failed_days[curr_station].append((day, f"{status} after {runtime:.1f} s: {day_results}"))
+            continue
 
-                q_today = Q()
-                P(target=process_station_day, args=(curr_station, today, tomorrow, sd_today, q_today)).start()
-                q_list.append((q_today, today))
-                
-            for qq, day in q_list: 
-                try: df_tuple_list = qq.get(timeout=600)
-                except:
-                    import traceback
-                    import sys
-                    exc = traceback.format_exc()
-                    failed_days[curr_station].append((day,exc))
-                    df_tuple_list= None
-
-                if type(df_tuple_list) != type([]): 
-                    failed_days[curr_station].append((day,f"failed for undetermined reason, look at log {df_tuple_list}"))
-                    continue
-
-                for dft in df_tuple_list: 
-                    return_status = dft[0]
-                    if any(return_status in s for s in ['fail', 'trace']):
-                        failed_days[curr_station].append((day, dft[1]))
-                        break
-                    elif dft[0] == 'slow':
-                        slow_data_dict[curr_station].append(dft[1])
-                    elif dft[0] == 'turb':
-                        win_len = dft[2]
-                        turb_data_dict[curr_station][win_len].append(dft[1])
-                    else:
-                        failed_days[curr_station].append((day,"failed for undetermined reason, look at log {dft}"))
-                        break
+        df_tuple_list = day_results[0] if len(day_results) > 0 else None
+        if type(df_tuple_list) != type([]): 
+            failed_days[curr_station].append((day,f"failed for undetermined reason, look at log {df_tuple_list}"))
+            continue
+
+        for dft in df_tuple_list: 
+            return_status = dft[0]
+            if any(return_status in s for s in ['fail', 'trace']):
+                failed_days[curr_station].append((day, dft[1]))
+                break
+            elif dft[0] == 'slow':
+                slow_data_dict[curr_station].append(dft[1])
+            elif dft[0] == 'turb':
+                win_len = dft[2]
+                turb_data_dict[curr_station][win_len].append(dft[1])
+            elif dft[0] == 'spec':
+                win_len = dft[2]
+                spec_data_dict[curr_station][win_len].append(dft[1])
+            else:
+                failed_days[curr_station].append((day,"failed for undetermined reason, look at log {dft}"))
+                break
 
     printline(endline=f"\n\n  Finished with data processing, now we QC and write out all files!!!"); printline()
     print("\n ... but first we have to concat the data and then QC, a bit slow")
 
-    turb_all = {}; slow_all = {}; 
+    turb_all = {}; slow_all = {}; spec_all = {}
     for curr_station in flux_stations:
         slow_all[curr_station] = pd.concat( slow_data_dict[curr_station] )
         slow_all[curr_station] = slow_all[curr_station].sort_index() 
-        turb_all[curr_station] = {}
+        turb_all[curr_station] = {}; spec_all[curr_station] = {}
         for win_len in range(0, len(integ_time_turb_flux)):
             turb_all[curr_station][win_len] = pd.concat( turb_data_dict[curr_station][win_len] ).sort_index()
+            if spec_data_dict[curr_station][win_len]:
+                spec_all[curr_station][win_len] = fl.turb_spectra.concat(spec_data_dict[curr_station][win_len])
+            else: spec_all[curr_station][win_len] = None
 
         # if we_want_to_debug:
         #     with open(f'./tests/{datetime(2022,10,10).today().strftime("%Y%m%d")}_qc_debug_before_{curr_station}.pkl', 'wb') as pkl_file:
@@ -1712,11 +1666,7 @@ def main(): # the main data crunching program
 
         station_data = slow_all[curr_station][today:tomorrow].copy()
 
-        out_dir   = '/Projects/MOSAiC_internal/flux_data_tests/'+curr_station+'/2_level_product_'+curr_station+'/' # where will level 2 data written?
-        #out_dir   = '/Projects/MOSAiC_internal/mgallagher/'+curr_station+'/2_level_product_'+curr_station+'/' # where will level 2 data written?
- 
-        #out_dir   = '/Projects/MOSAiC_internal/flux_data_tests/'+curr_station+'/2_level_product_'+curr_station+'/' 
-        #out_dir   = data_dir+'/'+curr_station+'/2_level_product_'+curr_station+'/' # where will level 2 data written?
+        out_dir   = get_level2_out_dir(curr_station) # where will level 2 data written?
 
         wr, sr, write_data = qc_asfs_winds(station_data.copy())
 
@@ -1728,10 +1678,13 @@ def main(): # the main data crunching program
 
         trash_var = write_level2_netcdf(write_data.copy(), curr_station, today, "1min", out_dir)
 
+        wrote_all = True # a window that fails is printed and the others are still written, but the day isn't done
         for win_len in range(0, len(integ_time_turb_flux)):
             integration_window = integ_time_turb_flux[win_len]
             fstr = f'{integ_time_turb_flux[win_len]}T' # pandas notation for timestep
             turb_data = turb_all[curr_station][win_len][today:tomorrow]
+            turb_spec = spec_all[curr_station][win_len]
+            if turb_spec is not None: turb_spec = turb_spec.between(today, tomorrow)
 
             # do averaging, a little weird, a little kludgy, a little annoying... whatever...
             # should have built the qc pipeline into the original code as a module and this would be cleaner
@@ -1744,21 +1697,22 @@ def main(): # the main data crunching program
             vector_vars = ['wspd_vec_mean', 'wdir_vec_mean']
             angle_vars  = ['heading', 'ship_bearing']
 
+            # every variable averaged at once, the qc flags with average_mosaic_flags' rule
+            have_cols   = [v for v in l2_cols if v in station_data.columns]
+            qc_vars     = [v for v in have_cols if v.split('_')[-1] == 'qc']
+            angle_cols  = [v for v in have_cols if v not in qc_vars and any(substr in v for substr in angle_vars)]
+            station_avg = fl.bin_average(station_data[have_cols], fstr, angle_cols=angle_cols, qc_cols=qc_vars)
+
             for ivar, var_name in enumerate(l2_cols):
                 try: 
-                    if var_name.split('_')[-1] == 'qc':
-                        data_list.append(fl.average_mosaic_flags(station_data[var_name], fstr))
-                    elif any(substr in var_name for substr in vector_vars):
+                    if var_name.split('_')[-1] != 'qc' and any(substr in var_name for substr in vector_vars):
                         data_list.append(turb_data[var_name]) # yank a few select variables out of turbulence, vestigial nonsense
-                    elif any(substr in var_name for substr in angle_vars):
-                        data_list.append(station_data[var_name].resample(fstr, label='left').apply(fl.take_average, is_angle=True))
                     else:
-                        data_list.append(station_data[var_name].resample(fstr, label='left').apply(fl.take_average))
+                        data_list.append(station_avg[var_name])
                 except Exception as e: 
                     # this is a little silly, data didn't exist for var fill with nans so computation continues
                     print(f"... wait what/why/huh??? {var_name} — {e}")
-                    data_list.append(pd.Series([np.nan]*len(station_data), index=station_data.index, name=var_name)\
-                                     .resample(fstr, label='left').apply(fl.take_average))
+                    data_list.append(pd.Series(np.nan, index=station_avg.index, name=var_name))
 
             avged_data = pd.concat(data_list, axis=1)
             avged_data = avged_data[today:tomorrow]
@@ -1782,7 +1736,7 @@ def main(): # the main data crunching program
                 # pkl_file.close()
 
                 trash_var = write_level2_netcdf(avged_data.copy(), curr_station, today,
-                                                f"{integration_window}min", out_dir, turb_data)
+                                                f"{integration_window}min", out_dir, turb_data, turb_spec)
 
 
             except: 
@@ -1794,23 +1748,30 @@ def main(): # the main data crunching program
                 print(traceback.format_exc())
                 print("==========================================================================================")
                 #print(sys.exc_info()[2])
+                wrote_all = False
 
+        day_q.put(wrote_all)
 
-        day_q.put(True) 
-
-    # call processing by day then station (allows threading for processing a single days data)
+    # a new pool, its workers are forked now so they have the qc'd data to write from
+    printline(endline=f"\n\n  Writing all requested days of data for {flux_stations}\n\n"); printline()
+    write_pool = fl.task_pool(nthreads, max_tasks=max_tasks_per_worker)
     for curr_station in flux_stations:
-        printline(endline=f"\n\n  Writing all requested days of data for {curr_station}\n\n"); printline()
-        q_list = []  # setup queue storage
-        for i_day, today in enumerate(day_series): # loop over the days in the processing range and crunch away
+        for today in day_series: 
+            if fl.dstr(today) not in stale_days[curr_station]: continue
+            write_pool.submit((curr_station, today), write_todays_data, curr_station, today)
 
-            q_today = Q()
-            P(target=write_todays_data, args=(curr_station, today, q_today)).start()
-            q_list.append(q_today)
+    for (curr_station, day), status, write_results, runtime in write_pool.results():
+        if status != 'ok': failed_days[curr_station].append((day, f"writing {status}: {write_results}"))
+        elif not write_results[0]: failed_days[curr_station].append((day, "qc/write of the turbulence data failed, traceback above"))
 
-            if (i_day+1) % nthreads == 0 or today == day_series[-1]:
-                for qq in q_list: qq.get()
-                q_list = []
+    # the days that were written go in the run manifest, the ones that failed are taken out so they're redone
+    for curr_station in flux_stations:
+        failed = set(fl.dstr(fday[0]) for fday in failed_days[curr_station])
+        for day_str in stale_days[curr_station]:
+            if day_str in failed: manifest[curr_station].drop(day_str); continue
+            day_files = glob.glob(f"{get_level2_out_dir(curr_station)}/*{curr_station}*.{day_str.replace('-', '')}.000000.nc")
+            manifest[curr_station].record(day_str, day_jobs[curr_station][day_str], day_files)
+        manifest[curr_station].close()
 
     printline()
     print("All done! Go check out your freshly baked files!!!")
@@ -1825,9 +1786,15 @@ def main(): # the main data crunching program
                 print(f"... {date} for {curr_station} -- with:\n {exception}\n\n")
 
 
+# where the level2 files for a station are written
+def get_level2_out_dir(curr_station):
+    return '/Projects/MOSAiC_internal/flux_data_tests/'+curr_station+'/2_level_product_'+curr_station+'/'
+    #return '/Projects/MOSAiC_internal/mgallagher/'+curr_station+'/2_level_product_'+curr_station+'/'
+    #return data_dir+'/'+curr_station+'/2_level_product_'+curr_station+'/'
+
 # do the stuff to write out the level1 files, set timestep equal to anything from "1min" to "XXmin"
 # and we will average the native 1min data to that timestep. right now we are writing 1 and 10min files
-def write_level2_netcdf(l2_data, curr_station, date, timestep, out_dir, turb_data=None):
+def write_level2_netcdf(l2_data, curr_station, date, timestep, out_dir, turb_data=None, turb_spec=None):
 
     day_delta = pd.to_timedelta(86399999999,unit='us') # we want to go up to but not including 00:00
     tomorrow  = date+day_delta
@@ -1908,6 +1875,7 @@ def write_level2_netcdf(l2_data, curr_station, date, timestep, out_dir, turb_dat
         # missing data (time, freq) for turbulence calcultations, etc etc etc   
         first_exception = True
         for var_name, var_atts in turb_atts.items(): 
+            if turb_spec is not None and var_name in turb_spec: continue # already (time, freq) arrays, see fl.turb_spectra
             try: turb_data[var_name]
             except KeyError as ke: 
                 if var_name.split("_")[-1] == 'qc': continue; do_nothing = True # we don't fill in all qc variables yet
@@ -1941,6 +1909,9 @@ def write_level2_netcdf(l2_data, curr_station, date, timestep, out_dir, turb_dat
             # create variable, # dtype inferred from data file via pandas
             if 'fs' in var_name:
                 netcdf_lev2.createDimension('freq', turb_data[var_name][chosen_index].size)   
+
+        if turb_spec is not None: 
+            netcdf_lev2.createDimension('freq', turb_spec.freqs.size)
  
     write_data = l2_data # vestigial, like many things
 
@@ -1993,7 +1964,7 @@ def write_level2_netcdf(l2_data, curr_station, date, timestep, out_dir, turb_dat
 
     delta_ints = np.floor((dti - tm).total_seconds())      # seconds
 
-    t_ind = pd.Int64Index(delta_ints)
+    t_ind = pd.Index(delta_ints, dtype='int64')
 
     # set the time dimension and variable attributes to what's defined above
     t = netcdf_lev2.createVariable('time', 'd','time') # seconds since
@@ -2001,7 +1972,7 @@ def write_level2_netcdf(l2_data, curr_station, date, timestep, out_dir, turb_dat
     # now we create the array and attributes for 'time_offset'
     bt_delta_ints = np.floor((dti - bot).total_seconds())      # seconds
 
-    bt_ind = pd.Int64Index(bt_delta_ints)
+    bt_ind = pd.Index(bt_delta_ints, dtype='int64')
 
     # set the time dimension and variable attributes to what's defined above
     bt = netcdf_lev2.createVariable('time_offset', 'd','time') # seconds since
@@ -2080,7 +2051,18 @@ def write_level2_netcdf(l2_data, curr_station, date, timestep, out_dir, turb_dat
     ivar=0
     for var_name, var_atts in turb_atts.items():
         ivar+=1
-        if not turb_data.empty: 
+        if turb_spec is not None and var_name in turb_spec:
+            # the spectra are already dense float32 arrays, one row per time. hand them over as they are,
+            # nan is their fill value so the missing rows don't have to be replaced in a copy
+            if var_name == 'fs':
+                var_turb    = netcdf_lev2.createVariable(var_name, turb_spec.freqs.dtype, ('freq'))
+                var_turb[:] = turb_spec.freqs
+            else:
+                td          = turb_spec.reindex(turb_data.index)[var_name]
+                var_turb    = netcdf_lev2.createVariable(var_name, td.dtype, ('time','freq'), fill_value=np.float32(nan))
+                var_turb[:] = td
+
+        elif not turb_data.empty: 
             # create variable, # dtype inferred from data file via pandas
             var_dtype = turb_data[var_name][0].dtype
             if turb_data[var_name][0].size == 1:
@@ -2132,7 +2114,8 @@ def write_level2_netcdf(l2_data, curr_station, date, timestep, out_dir, turb_dat
         # add a percent_missing attribute to give a first look at "data quality"
         perc_miss = fl.perc_missing(var_turb)
         netcdf_lev2[var_name].setncattr('percent_missing', perc_miss)
-        netcdf_lev2[var_name].setncattr('missing_value', def_fill_flt)
+        if '_FillValue' in var_turb.ncattrs(): netcdf_lev2[var_name].setncattr('missing_value', var_turb._FillValue)
+        else:                                  netcdf_lev2[var_name].setncattr('missing_value', def_fill_flt)
 
     netcdf_lev2.close() # close and write files for today
 
@@ -2221,8 +2204,8 @@ def write_level2_10hz(curr_station, sonic_data, licor_data, date, out_dir):
     bt_fast_delta_ints = np.floor((bt_fast_dti - bot).total_seconds()*1000)      # milliseconds
     fast_delta_ints    = np.floor((fast_dti - tm).total_seconds()*1000)      # milliseconds
 
-    bt_fast_ind = pd.Int64Index(bt_fast_delta_ints)
-    t_fast_ind  = pd.Int64Index(fast_delta_ints)
+    bt_fast_ind = pd.Index(bt_fast_delta_ints, dtype='int64')
+    t_fast_ind  = pd.Index(fast_delta_ints, dtype='int64')
 
     t_fast[:]   = t_fast_ind.values
     bt_fast[:]  = bt_fast_ind.values
@@ -2326,7 +2309,7 @@ def write_turb_netcdf(turb_data, curr_station, date, integration_window, win_len
 
     # !! sorry, i have a different set of globals for this file so it isnt in the file list
     for att_name, att_val in global_atts.items(): netcdf_turb.setncattr(att_name, att_val) 
-    n_turb_in_day = np.int(24*60/integration_window)
+    n_turb_in_day = int(24*60/integration_window)
 
     netcdf_turb.createDimension('time', None)
 
@@ -2376,7 +2359,7 @@ def write_turb_netcdf(turb_data, curr_station, date, integration_window, win_len
     dti = pd.DatetimeIndex(turb_data.index.values)
     delta_ints = np.floor((dti - tm).total_seconds())      # seconds
 
-    t_ind = pd.Int64Index(delta_ints)
+    t_ind = pd.Index(delta_ints, dtype='int64')
 
     # set the time dimension and variable attributes to what's defined above
     t = netcdf_turb.createVariable('time', 'd','time') # seconds since
@@ -2386,7 +2369,7 @@ def write_turb_netcdf(turb_data, curr_station, date, integration_window, win_len
 
     bt_delta_ints = np.floor((bt_dti - bot).total_seconds())      # seconds
 
-    bt_ind = pd.Int64Index(bt_delta_ints)
+    bt_ind = pd.Index(bt_delta_ints, dtype='int64')
 
     # set the time dimension and variable attributes to what's defined above
     bt = netcdf_turb.createVariable('time_offset', 'd','time') # seconds since
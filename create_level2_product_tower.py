@@ -42,9 +42,9 @@ from tower_data_definitions import define_global_atts, define_level2_variables
 from tower_data_definitions import define_turb_variables, define_qc_variables
 from tower_data_definitions import define_10hz_variables, define_level1_slow, define_level1_fast
 
-from get_data_functions     import get_flux_data, get_arm_radiation_data, get_ship_df
+from get_data_functions     import get_flux_data, get_flux_file, get_arm_radiation_data, get_ship_track
 from site_metadata          import metcity_metadata
-from qc_level2              import qc_tower, qc_tower_winds, qc_tower_turb_data
+from qc_level2              import qc_tower, qc_tower_winds, qc_tower_turb_data, qc_table_digest
 
 import functions_library as fl # includes a bunch of helper functions that we wrote
 
@@ -59,7 +59,7 @@ from pvlib import spa
     #    solar radiation applications. Solar Energy, vol. 81, no. 6, p. 838,
     #    2007.
 
-import os, inspect, argparse, time, gc
+import os, inspect, argparse, time, gc, glob
 
 import socket 
 
@@ -75,16 +75,13 @@ if '.psd.' in hostname:
         nthreads = 65  # the new compute is hefty.... real hefty
 
 else: nthreads = 8     # laptops don't tend to have 12  cores... yet
-
-from multiprocessing import Process as P
-from multiprocessing import Queue   as Q
+max_tasks_per_worker = 10 # worker processes are replaced after this many days, caps memory growth
+median_decimate      = 1  # the 6 hr/1 day heading and ice altitude medians take every this many seconds, 1 is exact
 
 # need to debug something? this makes useful pickle files in ./tests/ ... uncomment below if you want to kill threading
 we_want_to_debug = False
 if we_want_to_debug:
 
-    # from multiprocessing.dummy import Process as P
-    # from multiprocessing.dummy import Queue   as Q
     # nthreads = 1
     try: from debug_functions import drop_me as dm
     except: you_dont_care=True
@@ -120,6 +117,7 @@ def main(): # the main data crunching program
     epoch_time        = datetime(1970,1,1,0,0,0) # Unix epoch, sets time integers
 
     global integ_time_step, win_len
+    global median_decimate
 
     integ_time_step = [10]# [minutes] integration time for the turb flux calculation and average window for mosseb files
 
@@ -149,7 +147,14 @@ def main(): # the main data crunching program
     
     # pass the base path to make it more mobile
     parser.add_argument('-p', '--path', metavar='str', help='fulll path to data, including /data/ andtrailing slash')
-    parser.add_argument('-pd', '--pickledir', metavar='str',help='want to store a pickle of the data for debugging?')
+    parser.add_argument('-pd', '--pickledir', metavar='str',help='directory to cache the data in (feather/zarr), for speed on reruns')
+
+    # days are only redone if the run manifest says they're out of date, see fl.run_manifest
+    parser.add_argument('-f', '--force', action ='store_true', help='reprocess every day, even the ones that are up to date')
+
+    # the long heading/ice altitude medians, see fl.long_rolling_median
+    parser.add_argument('-md', '--median_decimate', metavar='int', type=int, help=f'take every this many seconds for the long medians, 10 is ~10x faster, 1 is exact (default {median_decimate})')
+    parser.add_argument('-mc', '--median_check', action ='store_true', help='also do the exact long medians and print how far the decimated ones are off')
 
     args         = parser.parse_args()
     if args.verbose: verbose = True
@@ -165,6 +170,8 @@ def main(): # the main data crunching program
 
     if args.pickledir: pickle_dir=args.pickledir
     else: pickle_dir=False
+
+    if args.median_decimate: median_decimate = args.median_decimate
     level1_dir = data_dir+'/tower/1_level_ingest/'                                  # where does level1 data live?
     level2_dir = data_dir+'/tower/2_level_product/version2/'                        # where does level2 data go
     level2_dir = '/Projects/MOSAiC_internal/flux_data_tests/tower/2_level_product/' # where does level2 data go
@@ -412,9 +419,30 @@ def main(): # the main data crunching program
     # Now that everything is defined, we read in the logger data for the date range requested and then
     # do vector operations for data QC, as well as any processing to derive output variables (i.e. no loops)
 
-    # read *all* of the tower logger data...? this could be too much. but why have so much RAM if you don't use it?
+    # a day is made from the level1 files for yesterday, today and tomorrow and the qc table rows for today.
+    # the run manifest knows which days were already written from those as they are now, with this
+    # code_version and these parameters, only the others are (re)done unless --force. the partner data
+    # (ARM, ship track) isn't tracked, use --force when it changes
     curr_station = "tower" # be compatible with asfs notation 
-    slow_data, code_version = get_flux_data(curr_station, start_time, end_time, 1,
+    manifest     = fl.run_manifest(f'{level2_dir}/run_manifest_level2.sqlite')
+    day_params   = {'integ_time_step': integ_time_step, 'median_decimate': median_decimate}
+    day_jobs     = {}
+    for today in pd.date_range(start_time, end_time):
+        day_files = [get_flux_file(curr_station, today+timedelta(d), 1, data_dir, data_type)
+                     for d in [-1, 0, 1] for data_type in ['slow', 'fast']]
+        qc_hash   = qc_table_digest("./qc_tables/qc_table_tower.csv", today, today+timedelta(1))
+        day_jobs[fl.dstr(today)] = manifest.fingerprint(day_files, code_version, qc_hash, day_params)
+
+    print("Checking the run manifest for days that are already up to date:")
+    stale_days = manifest.plan(day_jobs, force=args.force, verbose=verbose)
+    printline()
+    if len(stale_days) == 0:
+        print("\nEvery day you asked for is up to date, nothing to do!! (use -f/--force to redo them anyway)")
+        print(version_msg)
+        return
+
+    # read *all* of the tower logger data...? this could be too much. but why have so much RAM if you don't use it?
+    slow_data, level1_version = get_flux_data(curr_station, start_time, end_time, 1,
                                             data_dir, 'slow', verbose, nthreads, False, pickle_dir)
 
     slow_data = slow_data[start_time:end_time] # in case we pickled the larger dataset
@@ -463,11 +491,15 @@ def main(): # the main data crunching program
     # The filter needs to be carried out in vector space. the filter is 6 hrs = 21600 sec
     unitv1 = np.cos(np.radians(slow_data['tower_heading'])) # degrees -> unit vector
     unitv2 = np.sin(np.radians(slow_data['tower_heading'])) # degrees -> unit vector
-    unitv1 = unitv1.interpolate(method='pad').rolling(21600,min_periods=1,center=True).median() # filter the unit vector
-    unitv2 = unitv2.interpolate(method='pad').rolling(21600,min_periods=1,center=True).median() # filter the unit vector
+    # these change over hours so the medians can be done on every median_decimate'th second instead
+    # (-md, fl.long_rolling_median), -mc prints how far that is from the exact rolling median
+    unitv1, dev1 = fl.long_rolling_median(unitv1.interpolate(method='pad'), 21600, median_decimate, check=args.median_check) # filter the unit vector
+    unitv2, dev2 = fl.long_rolling_median(unitv2.interpolate(method='pad'), 21600, median_decimate, check=args.median_check) # filter the unit vector
     tmph = np.degrees(np.arctan2(-unitv2,-unitv1))+180 # back to degrees
 
-    tmpa = slow_data['tower_ice_alt'].interpolate(method='pad').rolling(21600,min_periods=1,center=True).median()
+    tmpa, deva = fl.long_rolling_median(slow_data['tower_ice_alt'].interpolate(method='pad'), 21600, median_decimate, check=args.median_check)
+    if args.median_check:
+        print(f"... decimated tower medians, max deviation from exact: heading unit vector {max(dev1, dev2):.2e}, ice alt {deva:.4f} m")
 
     tmph.mask(slow_data['tower_heading'].isna(),inplace=True)
     tmpa.mask(slow_data['tower_ice_alt'].isna(),inplace=True)
@@ -495,26 +527,21 @@ def main(): # the main data crunching program
     arm_data = arm_data.drop_duplicates(); 
     drop_len = len(arm_data)
     print(f"... for some reason there were {prev_len-drop_len} duplicates in ARM data, if this number is 0, that's good")
-    arm_inds = arm_data.index
     slow_data = slow_data.sort_index(); 
     slow_inds = slow_data.index
 
 
     # now we have to match the ARM timestamps up to the flux timestamps, the naive
-    # pd.concat([slow_data, arm_data], axis=1) is so absurdly slow that we wrote a
-    # custom function that does this in a more clever way
-    not_present, index_map = compare_indexes(arm_inds, slow_inds)
-    slow_map = np.array(index_map[0]) # these just say which index in ARM data relates to which
-    arm_map  = np.array(index_map[1]) # index in the slow data
+    # pd.concat([slow_data, arm_data], axis=1) is so absurdly slow, fl.align_to_index
+    # does it with one get_indexer call. no ARM files for the days leaves the radiation nan
+    arm_aligned, align_info = fl.align_to_index(arm_data.reindex(columns=rad_vars), slow_inds, direction='exact')
 
-    verboseprint(f"\n... there were {len(not_present)} datapoints present in ARM but not in flux ")
+    verboseprint(f"\n... there were {len(align_info['unmatched_source'])} datapoints present in ARM but not in flux ")
     verboseprint(f"... data for the requested timeframe!!! \n")
 
     # now we have to actually *put* the ARM data into the slow_data dataframe at the mapped indices
     for iv, rv in enumerate(rad_vars):
-        val_arr = np.array([nan]*len(slow_inds))
-        val_arr[slow_map] = arm_data[rv].values[arm_map]
-        slow_data[rv] = val_arr
+        slow_data[rv] = arm_aligned[rv].values.astype(np.float64)
         slow_data[rv] = slow_data[rv].interpolate(limit=59) # fill in the NaNs that should not be but leave
                                                             # the ones that should be... one mins worth
 
@@ -532,8 +559,10 @@ def main(): # the main data crunching program
 
 
 
-        tmph = slow_data['mast_heading'].rolling(86400,min_periods=1,center=True).median()
-        tmpa = slow_data['mast_ice_alt'].interpolate(method='pad').rolling(86400,min_periods=1,center=True).median()
+        tmph, devh = fl.long_rolling_median(slow_data['mast_heading'], 86400, median_decimate, check=args.median_check)
+        tmpa, deva = fl.long_rolling_median(slow_data['mast_ice_alt'].interpolate(method='pad'), 86400, median_decimate, check=args.median_check)
+        if args.median_check:
+            print(f"... decimated mast medians, max deviation from exact: heading {devh:.4f} deg, ice alt {deva:.4f} m")
         tmph.mask(slow_data['mast_heading'].isna(), inplace=True)
         tmpa.mask(slow_data['mast_ice_alt'].isna(), inplace=True)
 
@@ -560,7 +589,9 @@ def main(): # the main data crunching program
     arm_vars = ['down_long_hemisp', 'down_short_hemisp', 'up_long_hemisp', 'up_short_hemisp']
     for av in arm_vars: slow_data.loc[slow_data[av].isnull(), av+'_qc'] = 2
 
-    ship_df = get_ship_df(leica_dir).reindex(slow_data.index).interpolate() # ship location used in daily calcs
+    ship_track = get_ship_track(leica_dir) # ship location used in daily calcs
+    ship_lat, ship_lon = ship_track.position(slow_data.index)
+    ship_df = pd.DataFrame({'lat': ship_lat, 'lon': ship_lon}, index=slow_data.index)
 
     print('... done with the slow stuff, moving into parallelized daily processing') 
     verboseprint("\n We've retreived and QCed all slow data, now processing each day...\n")
@@ -907,9 +938,7 @@ def main(): # the main data crunching program
 
         # Get the bearing on the ship... load the ship track and reindex to slow_data, calculate distance
         # [m] and bearing [deg from tower rel to true north, as wind direction]
-        sdf = ship_df[today:tomorrow]
-        sd['ship_distance'] = fl.distance_wgs84(sd['lat_tower'],sd['lon_tower'], sdf['lat'],sdf['lon'])
-        sd['ship_bearing']  = fl.calculate_initial_angle_wgs84(sd['lat_tower'], sd['lon_tower'], sdf['lat'], sdf['lon']) 
+        sd['ship_distance'], sd['ship_bearing'] = ship_track.distance_bearing(sd.index, sd['lat_tower'], sd['lon_tower'])
         sd['ship_distance'].mask( (sd['ship_distance']>700), inplace=True)
 
         # something breaks in the trig model briefly. its weird. i'll just screen it out
@@ -1344,8 +1373,10 @@ def main(): # the main data crunching program
                     # This is Leg 1 and 2.  We use information available and interpolate between.
                     if today < datetime(2020,3,12,0,0):   
                         # interpolate the mast alignment metadata for today
-                        most_recent_gps = mast_hdg_df['gps_hdg'].reindex(index=fast_data_10hz[inst].index,method='pad')
-                        most_recent_mast = mast_hdg_df['mast_hdg'].reindex(index=fast_data_10hz[inst].index,method='pad')
+                        mast_hdg_now, align_info = fl.align_to_index(mast_hdg_df[['gps_hdg', 'mast_hdg']],
+                                                                     fast_data_10hz[inst].index, direction='backward')
+                        most_recent_gps  = mast_hdg_now['gps_hdg']
+                        most_recent_mast = mast_hdg_now['mast_hdg']
                         mast_align = most_recent_gps - most_recent_mast   
                         if today >  mast_hdg_df.index[-2]: # if we are in leg 1 pad, but lineraly interp thru leg 2
                             meth = 'linear'
@@ -1411,10 +1442,9 @@ def main(): # the main data crunching program
             metek_ws = {}
             metek_wd = {}
             for inst in metek_inst_keys:
-                u_min = fast_data_10hz[inst] [inst+'_u'].resample('1T',label='left').apply(fl.take_average)
-                v_min = fast_data_10hz[inst] [inst+'_v'].resample('1T',label='left').apply(fl.take_average)
-                ws = np.sqrt(u_min**2+v_min**2)
-                wd = np.mod((np.arctan2(-u_min,-v_min)*180/np.pi),360)
+                vec_avg = fl.bin_vector_average(fast_data_10hz[inst][inst+'_u'], fast_data_10hz[inst][inst+'_v'], '1T')
+                ws = vec_avg['wspd']
+                wd = vec_avg['wdir']
                 metek_ws[inst] = ws
                 metek_wd[inst] = wd
 
@@ -1537,86 +1567,70 @@ def main(): # the main data crunching program
 
                     # recalculate wind vectors to be saved with turbulence data  later
                     height = inst_dict[inst]
-                    u_min  = fast_data_10hz[inst] [inst+'_u'].resample(flux_freq,label='left').apply(fl.take_average)
-                    v_min  = fast_data_10hz[inst] [inst+'_v'].resample(flux_freq,label='left').apply(fl.take_average)
-                    ws     = np.sqrt(u_min**2+v_min**2)
-                    wd     = np.mod((np.arctan2(-u_min,-v_min)*180/np.pi),360)
+                    vec_avg = fl.bin_vector_average(fast_data_10hz[inst][inst+'_u'], fast_data_10hz[inst][inst+'_v'], flux_freq)
+                    ws      = vec_avg['wspd']
+                    wd      = vec_avg['wdir']
 
                     turb_winds[inst] = pd.DataFrame()
                     turb_winds[inst]['wspd_vec_mean_'+height] = ws
                     turb_winds[inst]['wdir_vec_mean_'+height] = wd
 
-                    for time_i in range(0,len(flux_time_today)-1): # flux_time_today = 
-                        # Get the index, ind, of the metek frame that pertains to the present calculation 
-                        # indswrite = (fast_data_10hz[inst].index >= flux_time_today[time_i]) \
-                        #        & \
-                        #        (fast_data_10hz[inst].index < flux_time_today[time_i+1]) 
-
-                        # Get the index, ind, of the metek frame that pertains to the present calculation A
-                        # little tricky. We need to make sure we give it enough data to encompass the nearest
-                        # power of 2: for 30 min fluxes this is ~27 min so you are good, but for 10 min
-                        # fluxes it is 13.6 min so you need to give it more.
-                        # 
-                        # We buffered the 10 Hz so that we can go outside the edge of "today" by up to an
-                        # hour. It's a bit of a formality, but for general cleanliness we are going to center
-                        # all fluxes to the nearest min so that e.g,
-                        # 
-                        # 12:00-12:10 is actually 11:58 through 12:12
-                        # 12:00-12:30 is actually 12:01 through 12:28   
-
-                        # @10Hz, min needed to cover the nearet po2 [minutes]
-                        po2_len = np.ceil(2**round(np.log2(integ_time_step[win_len]*60*10))/10/60) 
-                        t_win = pd.Timedelta((po2_len-integ_time_step[win_len])/2,'minutes')
-                        calc_data = fast_data_10hz[inst].loc[flux_time_today[time_i]-t_win:flux_time_today[time_i+1]+t_win].copy()
-
-                        # get the licor data. we will just pass it through for every height as a placeholder,
-                        # but only save the output for the right height. the decision doesnt need to be in
-                        # the loop, but at least it is findable
-                        licor_data = licor_10hz.loc[flux_time_today[time_i]-t_win:flux_time_today[time_i+1]+t_win].copy()  
-                        if licor_z > 8: 
-                            use_this_licor = suffix_list[2]
-                        elif licor_z > 4 and licor_z < 8: 
-                            use_this_licor = suffix_list[1] 
-                        elif licor_z < 4:
-                            use_this_licor = suffix_list[0]
-                        else: # nan
-                            use_this_licor = '_2m'
-
-                        # we need pressure and temperature these are just for calculation of constants so the
-                        # 2m data should be close enough...the original code assumed a nominal pressure and
-                        # used sonic temperature...
-                        Pr_time_i = logger_today['atmos_pressure_2m'].loc[flux_time_today[time_i]\
-                                                                           -t_win:flux_time_today[time_i+1]+t_win].mean()
-                        T_time_i = logger_today['temp_2m'].loc[flux_time_today[time_i]\
-                                                                      -t_win:flux_time_today[time_i+1]+t_win].mean()
-                        Q_time_i = logger_today['mixing_ratio_2m'].loc[flux_time_today[time_i]\
-                                                                    -t_win:flux_time_today[time_i+1]+t_win].mean()/1000
-
-                        # make the turbulent flux calculations via Grachev module
-                        if args.verbose: v = True;
-                        else: v = False
-
-                        # give generic names for calculations and select the desired indexes
-                        calc_data.rename(columns={inst+'_u' : 'u',
-                                            inst+'_v' : 'v',
-                                            inst+'_w' : 'w',
-                                            inst+'_T' : 'T',
-                                            }, errors="raise", inplace=True)
-                        if 'mast' not in inst: sz = sonic_z[i_inst]
-                        else: sz = mast_sonic_height
-                        data = fl.grachev_fluxcapacitor(sz, calc_data, licor_data, 'mmol/m3', 'mmol/m3',
-                                                        Pr_time_i, T_time_i, Q_time_i, verbose=v)
-
-                        # Sanity check on Cd. Ditch the whole run if it fails
-                        #data[:].mask( (data['Cd'] < cd_lim[0])  | (data['Cd'] > cd_lim[1]) , inplace=True)
-                        data = data.add_suffix(suffix_list[i_inst])                                        
-
-                        # doubtless there is a better way to initialize this
-                        if time_i == 0: inst_data = data
-                        else: inst_data = inst_data.append(data)
-
-
-                        # now add the indexer datetime doohicky
+                    # Get the edges of each window of the metek frame that pertains to the calculations A
+                    # little tricky. We need to make sure we give it enough data to encompass the nearest
+                    # power of 2: for 30 min fluxes this is ~27 min so you are good, but for 10 min
+                    # fluxes it is 13.6 min so you need to give it more.
+                    # 
+                    # We buffered the 10 Hz so that we can go outside the edge of "today" by up to an
+                    # hour. It's a bit of a formality, but for general cleanliness we are going to center
+                    # all fluxes to the nearest min so that e.g,
+                    # 
+                    # 12:00-12:10 is actually 11:58 through 12:12
+                    # 12:00-12:30 is actually 12:01 through 12:28   
+
+                    # @10Hz, min needed to cover the nearet po2 [minutes]
+                    po2_len    = np.ceil(2**round(np.log2(integ_time_step[win_len]*60*10))/10/60) 
+                    t_win      = pd.Timedelta((po2_len-integ_time_step[win_len])/2,'minutes')
+                    win_starts = flux_time_today[0:-1]-t_win
+                    win_ends   = flux_time_today[1:]+t_win
+
+                    # give generic names for calculations 
+                    calc_data = fast_data_10hz[inst].rename(columns={inst+'_u' : 'u',
+                                                                     inst+'_v' : 'v',
+                                                                     inst+'_w' : 'w',
+                                                                     inst+'_T' : 'T',
+                                                                     }, errors="raise")
+
+                    # get the licor data. we will just pass it through for every height as a placeholder,
+                    # but only save the output for the right height. 
+                    if licor_z > 8: 
+                        use_this_licor = suffix_list[2]
+                    elif licor_z > 4 and licor_z < 8: 
+                        use_this_licor = suffix_list[1] 
+                    elif licor_z < 4:
+                        use_this_licor = suffix_list[0]
+                    else: # nan
+                        use_this_licor = '_2m'
+
+                    # we need pressure and temperature these are just for calculation of constants so the
+                    # 2m data should be close enough...the original code assumed a nominal pressure and
+                    # used sonic temperature...
+                    Pr_win = np.array([logger_today['atmos_pressure_2m'].loc[t0:t1].mean()    for t0, t1 in zip(win_starts, win_ends)])
+                    T_win  = np.array([logger_today['temp_2m'].loc[t0:t1].mean()              for t0, t1 in zip(win_starts, win_ends)])
+                    Q_win  = np.array([logger_today['mixing_ratio_2m'].loc[t0:t1].mean()/1000 for t0, t1 in zip(win_starts, win_ends)])
+
+                    # make the turbulent flux calculations via Grachev module, all windows in one go
+                    if args.verbose: v = True;
+                    else: v = False
+
+                    if 'mast' not in inst: sz = sonic_z[i_inst]
+                    else: sz = mast_sonic_height
+                    turb_rec = fl.grachev_fluxcapacitor_batched(sz, calc_data, licor_10hz, 'mmol/m3', 'mmol/m3',
+                                                                Pr_win, T_win, Q_win, win_starts, win_ends, verbose=v)
+
+                    # Sanity check on Cd. Ditch the whole run if it fails
+                    #data[:].mask( (data['Cd'] < cd_lim[0])  | (data['Cd'] > cd_lim[1]) , inplace=True)
+                    inst_data = fl.turb_record_to_dataframe(turb_rec, flux_time_today[0:-1])
+                    inst_data = inst_data.add_suffix(suffix_list[i_inst])                                        
 
                     verboseprint("... concatting turbulence calculations to one dataframe")
                     inst_data.index = flux_time_today[0:-1]
@@ -1721,7 +1735,7 @@ def main(): # the main data crunching program
                 # Input dataframe
                 # first get 1 s wind speed. i dont care about direction. 
                 ws = (fast_data_10hz['metek_10m']['metek_10m_u']**2 + fast_data_10hz['metek_10m']['metek_10m_v']**2)**0.5
-                ws = ws.resample('1s',label='left').apply(fl.take_average)
+                ws = fl.bin_average(ws, '1s')
 
                 # make a better surface temperature
                 empty_data = np.zeros(np.size(slow_data['mixing_ratio_10m'][seconds_today]))
@@ -1739,7 +1753,7 @@ def main(): # the main data crunching program
                 
                 bulk_input['ts'] = slow_data['skin_temp_surface'][seconds_today]     # bulk water/ice surface temp (degC) 
 
-                bulk_input = bulk_input.resample(str(integ_time_step[win_len])+'min',label='left').apply(fl.take_average)
+                bulk_input = fl.bin_average(bulk_input, str(integ_time_step[win_len])+'min')
 
                 # output dataframe
                 empty_data = np.zeros(len(bulk_input))
@@ -1768,16 +1782,12 @@ def main(): # the main data crunching program
                 bulk['bulk_Rq']          = empty_data*nan # 
                 bulk=bulk.reindex(index=bulk_input.index)
 
-                for ii in range(len(bulk)):
-                    tmp = [bulk_input['u'][ii],bulk_input['ts'][ii],bulk_input['t'][ii],bulk_input['Q'][ii],
-                           bulk_input['zi'][ii],bulk_input['P'][ii],bulk_input['zu'][ii],bulk_input['zt'][ii],bulk_input['zq'][ii]] 
-                    if not any(np.isnan(tmp)):
-                        bulkout = fl.cor_ice_A10(tmp)
-                        for hh in range(len(bulkout)):
-                            if bulkout[13] < cd_lim[0] or bulkout[13] > cd_lim[1]:  # Sanity check on Cd. Ditch the whole run if it fails
-                                bulk[bulk.columns[hh]][ii]=nan  # for some reason this needs to be in a loop
-                            else:
-                                bulk[bulk.columns[hh]][ii]=bulkout[hh]
+                # all the records at once, nan where any input is missing
+                bulkout = fl.cor_ice_A10_array([bulk_input[var].values for var in ['u','ts','t','Q','zi','P','zu','zt','zq']])
+                bad_cd  = (bulkout[13] < cd_lim[0]) | (bulkout[13] > cd_lim[1]) # Sanity check on Cd. Ditch the whole run if it fails
+                for hh in range(0, len(bulk.columns)):
+                    bulk[bulk.columns[hh]] = np.where(bad_cd, nan, bulkout[hh])
+                verboseprint('... bulk fluxes for {} records, {} iterations at most'.format(np.sum(bulkout[-1]>0), np.max(bulkout[-1])))
 
                 # qc/flagging algorithm for turbulence calculations, this should likely be ripped out and put into
                 # functions_library once the qc-ing is satisfactorily performed....  similar to a despiker but based on
@@ -1834,28 +1844,12 @@ def main(): # the main data crunching program
         l2_atts, l2_cols = define_level2_variables(); qc_atts, qc_cols = define_qc_variables(include_turb=True)
         l2_cols = l2_cols+qc_cols
 
-        logger_list = []
-        for ivar, var_name in enumerate(logger_today.columns):
-            fstr = f'1T' # pandas notation for timestep
-
-            # this was copied from the 10min debugging, not all these
-            # vars are actually in the 1 second logger_today dataframe
-            try: 
-                if var_name.split('_')[-1] == 'qc':
-                    logger_list.append(fl.average_mosaic_flags(logger_today[var_name], fstr))
-                elif any(substr in var_name for substr in angle_vars):
-                    logger_list.append(logger_today[var_name].resample(fstr, label='left').apply(fl.take_average, is_angle=True))
-                else:
-                    logger_list.append(logger_today[var_name].resample(fstr, label='left').apply(fl.take_average))
-
-            except Exception as e: 
-                print("... this should never happen, why did it?\n {e}\n\n")
-                import traceback
-                import sys
-                print(traceback.format_exc())
-                raise
-
-        logger_1min = pd.concat(logger_list, axis=1)
+        # every variable averaged at once, the qc flags with average_mosaic_flags' rule. this was copied
+        # from the 10min debugging, not all these vars are actually in the 1 second logger_today dataframe
+        fstr        = f'1T' # pandas notation for timestep
+        qc_vars     = [v for v in logger_today.columns if v.split('_')[-1] == 'qc']
+        angle_cols  = [v for v in logger_today.columns if v not in qc_vars and any(substr in v for substr in angle_vars)]
+        logger_1min = fl.bin_average(logger_today, fstr, angle_cols=angle_cols, qc_cols=qc_vars)
 
         try: l2_data = pd.concat([logger_1min, stats_data], axis=1)
         except UnboundLocalError: l2_data = logger_1min # there was no fast data, rare
@@ -1878,28 +1872,28 @@ def main(): # the main data crunching program
         write_level2_netcdf(onemin_data.copy(), today, "1min")
 
         # now resample variables at specified turbulence integration timestep, currently only 10 minutes
+        wrote_all = True # a window that fails is printed and the others are still written, but the day isn't done
         for win_len in range(0,len(integ_time_step)):
 
             data_list = []
 
+            # every variable averaged at once, the qc flags with average_mosaic_flags' rule
+            fstr       = f'{integ_time_step[win_len]}T' # pandas notation for timestep
+            have_cols  = [v for v in l2_cols if v in l2_data.columns]
+            qc_vars    = [v for v in have_cols if v.split('_')[-1] == 'qc']
+            angle_cols = [v for v in have_cols if v not in qc_vars and any(substr in v for substr in angle_vars)]
+            l2_avg     = fl.bin_average(l2_data[have_cols], fstr, angle_cols=angle_cols, qc_cols=qc_vars)
 
             for ivar, var_name in enumerate(l2_cols):
-                fstr = f'{integ_time_step[win_len]}T' # pandas notation for timestep
-                
                 try: 
-                    if var_name.split('_')[-1] == 'qc':
-                        data_list.append(fl.average_mosaic_flags(l2_data[var_name], fstr))
-                    elif any(substr in var_name for substr in vector_vars):
+                    if var_name.split('_')[-1] != 'qc' and any(substr in var_name for substr in vector_vars):
                         data_list.append(turb_data[var_name]) 
-                    elif any(substr in var_name for substr in angle_vars):
-                        data_list.append(l2_data[var_name].resample(fstr, label='left').apply(fl.take_average, is_angle=True))
                     else:
-                        data_list.append(l2_data[var_name].resample(fstr, label='left').apply(fl.take_average))
+                        data_list.append(l2_avg[var_name])
                 except Exception as e: 
                     # this is a little silly, data didn't exist for var fill with nans
                     print(f"... wait what/why/huh??? {var_name} {e}")
-                    data_list.append(pd.Series([np.nan]*len(l2_data), index=l2_data.index, name=var_name)\
-                                     .resample(fstr, label='left').apply(fl.take_average))
+                    data_list.append(pd.Series(np.nan, index=l2_avg.index, name=var_name))
 
             avged_data = pd.concat(data_list, axis=1)
             avged_data = avged_data[today:tomorrow]
@@ -1908,7 +1902,7 @@ def main(): # the main data crunching program
             try: 
                 
 
-                avged_data = qc_tower_winds(avged_data, ship_df[today:tomorrow].resample(fstr,label='left').apply(fl.take_average))
+                avged_data = qc_tower_winds(avged_data, fl.bin_average(ship_df[today:tomorrow], fstr))
                 # for debugging the write function.... ugh
                 if we_want_to_debug:
                     import pickle
@@ -1922,6 +1916,7 @@ def main(): # the main data crunching program
                 write_level2_netcdf(avged_data.copy(), today, f"{integ_time_step[win_len]}min", turb_data[today:tomorrow])
 
             except: 
+                wrote_all = False
                 print(f"!!! failed to qc and write turbulence data for {win_len} on {today} !!!")
                 print("==========================================================================================")
                 print("Python traceback: \n\n")
@@ -1932,65 +1927,41 @@ def main(): # the main data crunching program
                 #print(sys.exc_info()[2])
 
         print(f"... finally finished with day {today_str}, returning worker process to parent")
-        day_q.put(True); return
+        day_q.put(wrote_all); return
             
     # #########################################################################################
     # here's where we actually call the data crunching function, processing days sequentially
     day_series = pd.date_range(start_time, end_time)
     day_delta  = pd.to_timedelta(86399999999,unit='us') # we want to go up to but not including 00:00
 
-    q_list = []  # setup queue storage
-    for i_day, today in enumerate(day_series): # loop over the days in the processing range and crunch away
+    # each day is its own task, handed to the next free worker (see fl.task_pool)
+    day_pool = fl.task_pool(nthreads, max_tasks=max_tasks_per_worker)
+    for today in day_series: # loop over the days in the processing range and crunch away
+        if fl.dstr(today) not in stale_days: continue
         tomorrow        = today+day_delta
         slow_data_today = slow_data[today:tomorrow]
-
-        q_today = Q()
-        P(target=process_day, args=(today, tomorrow, slow_data_today, q_today)).start()
-        q_list.append(q_today)
-
-        if (i_day+1) % nthreads == 0 or today == day_series[-1]:
-            for qq in q_list: qq.get()
-            q_list = []
+        day_pool.submit(today, process_day, today, tomorrow, slow_data_today)
+
+    # only the days that wrote all of their files go in the run manifest, the ones without data or where
+    # a write failed are taken out so they're redone
+    for today, status, day_results, runtime in day_pool.results():
+        verboseprint(f"... {today} took {runtime:.1f} s")
+        if status != 'ok': 
+            print(f"!!! {today} {status} after {runtime:.1f} s:\n{day_results}")
+            manifest.drop(fl.dstr(today))
+        elif not day_results[0]:
+            print(f"!!! {today} wasn't written, or not all of it")
+            manifest.drop(fl.dstr(today))
+        else:
+            day_files = glob.glob(f"{level2_dir}/*.{today.strftime('%Y%m%d.%H%M%S')}.nc")
+            manifest.record(fl.dstr(today), day_jobs[fl.dstr(today)], day_files)
+    manifest.close()
 
     printline()
     print('All done! Netcdf output files can be found in: {}'.format(level2_dir))
     print(version_msg)
     printline()
 
-def compare_indexes(inds_sparse, inds_lush, guess_jump = 50):
-    inds_not_present = [] 
-    map_between = ([],[]) # tuple of matching indexes
-
-    sl = len(inds_sparse)
-
-    # we assume monotonicity
-    if not inds_sparse.is_monotonic_increasing or not inds_lush.is_monotonic_increasing:
-        raise Exception("indexes not sorted")
-
-    sparse_i = 0; old_perc = 0 
-
-
-    print("")
-    n_missed_but_not_really = 0 
-    range_inds = iter(range(len(inds_sparse)))
-    #for lush_i in range_inds:
-    for sparse_i in range_inds:
-        
-        if sparse_i % 1000 == 0: print(f"... aligning {round((sparse_i/sl)*100,4)}% of ARM/flux data", end='\r')
-
-        sparse_date = inds_sparse[sparse_i] # get the actual timestamp to compare
-        try: 
-            lush_i = inds_lush.get_loc(sparse_date)
-            map_between[0].append(lush_i)
-            map_between[1].append(sparse_i)
-        except Exception:
-            inds_not_present.append(sparse_date)
-
-    print(f"...  aligned 100.000% of ARM/flux \n", end='\r')
-
-    #print(f"!!!!!! there were these indexes weirdly skipped {n_missed_but_not_really} !!!!!!!!!")
-    return inds_not_present, map_between
-
 def fast_concat_dfs(df_list):
     from pandas.core.indexes.api import union_indexes
     all_cols = union_indexes([df.columns for df in df_list])
@@ -2267,12 +2238,12 @@ def write_level2_netcdf(l2_data, date, timestep, turb_data=None):
 
     delta_ints = np.floor((dti - tm).total_seconds())      # seconds
 
-    t_ind = pd.Int64Index(delta_ints)
+    t_ind = pd.Index(delta_ints, dtype='int64')
 
     # now we create the array and attributes for 'time_offset'
     bt_delta_ints = np.floor((dti - bot).total_seconds())      # seconds
 
-    bt_ind = pd.Int64Index(bt_delta_ints)
+    bt_ind = pd.Index(bt_delta_ints, dtype='int64')
 
     # set the time dimension and variable attributes to what's defined above
     bt = netcdf_lev2.createVariable('time_offset', 'd','time') # seconds since
@@ -2576,8 +2547,8 @@ def write_level2_10hz(sonic_data, licor_data, date):
     bt_fast_delta_ints = np.floor((bt_fast_dti - bot).total_seconds()*1000)      # milliseconds
     fast_delta_ints    = np.floor((fast_dti - tm).total_seconds()*1000)      # milliseconds
 
-    bt_fast_ind = pd.Int64Index(bt_fast_delta_ints)
-    t_fast_ind  = pd.Int64Index(fast_delta_ints)
+    bt_fast_ind = pd.Index(bt_fast_delta_ints, dtype='int64')
+    t_fast_ind  = pd.Index(fast_delta_ints, dtype='int64')
 
     t_fast[:]   = t_fast_ind.values
     bt_fast[:]  = bt_fast_ind.values
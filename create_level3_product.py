@@ -28,11 +28,11 @@ from tower_data_definitions import define_turb_variables as define_turb_variable
 from asfs_data_definitions import define_global_atts as define_global_atts_asfs 
 from asfs_data_definitions import define_turb_variables as define_turb_variables_asfs 
 
-from get_data_functions     import get_flux_data
+from get_data_functions     import get_flux_data, get_flux_file, get_flux_attrs
 
 import functions_library as fl # includes a bunch of helper functions that we wrote
 
-import os, inspect, argparse, time, gc
+import os, inspect, argparse, time, gc, fnmatch
 import socket 
 
 hostname = socket.gethostname()
@@ -45,16 +45,16 @@ if '.psd.' in hostname:
         nthreads = 90  # the new compute is hefty.... real hefty
 
 else: nthreads = 8     # laptops don't tend to have 12  cores... yet
+max_tasks_per_worker = 20 # worker processes are replaced after this many days, caps memory growth
+max_writers          = 8  # daily files written at once, they all want the same disk
 
-from multiprocessing import Pool as pool
-from multiprocessing import Process as P
-from multiprocessing import Queue   as Q
+# zlib level for the level3 variables, (fnmatch pattern, level) and the first pattern that matches
+# the variable name wins, 0 is no compression. -z/--complevel on the command line replaces it
+level3_complevels = [('*', 9)]
 
 # need to debug something? kills multithreading to step through function calls
 we_want_to_debug = False
 if we_want_to_debug:
-    from multiprocessing.dummy import Process as P
-    from multiprocessing.dummy import Queue   as Q
     nthreads = 1
     from debug_functions import drop_me as dm
  
@@ -84,7 +84,10 @@ print('-------------------------------------------------------------------------
 # argparse is defined at bottom in __main__ and this function takes those as arguments
 # which makes debugging at the REPL via "import main" much easier
 def main(station_name, start_time=datetime(2019,10,1), end_time=datetime(2020,10,1),
-         data_dir='/Projects/MOSAiC/', filetype='seb', verbose=True, pickle_dir=None):
+         data_dir='/Projects/MOSAiC/', filetype='seb', verbose=True, pickle_dir=None, force=False,
+         complevels=None):
+
+    if complevels is None: complevels = level3_complevels
 
     global verboseprint  # defines a function that prints only if -v is used when running
     global printline     # prints a line out of dashes, pretty boring
@@ -103,8 +106,31 @@ def main(station_name, start_time=datetime(2019,10,1), end_time=datetime(2020,10
     print('The last day we will process data is:  %s' % str(end_time))
     printline()
 
-    ds, code_version = get_flux_data(station_name, start_time, end_time, 2, data_dir,
-                                     filetype, True, nthreads, True, pickle_dir)
+    # a level3 day is made from its level2 file, the run manifest (see fl.run_manifest) knows which days
+    # were already written from the level2 files as they are now with this code_version, only the others
+    # are read and (re)written unless force
+    manifest = fl.run_manifest(f'{data_dir}/{station_name}/3_level_archive/run_manifest_level3.sqlite')
+    day_jobs = {}
+    for today in pd.date_range(start_time, end_time, freq='D'):
+        day_jobs[f'{filetype} {fl.dstr(today)}'] = manifest.fingerprint([get_flux_file(station_name, today, 2, data_dir, filetype)],
+                                                                        code_version, params={'filetype': filetype})
+    print(f"Checking the run manifest for {station_name} {filetype} days that are already up to date:")
+    stale_days = manifest.plan(day_jobs, force=force, verbose=verbose)
+    printline()
+    if len(stale_days) == 0:
+        print(f"\nEvery {filetype} day you asked for is up to date, nothing to do!! (use -f/--force to redo them anyway)")
+        manifest.close()
+        return None, None, [], []
+
+    days_to_write = pd.DatetimeIndex([today for today in pd.date_range(start_time, end_time, freq='D')
+                                      if f'{filetype} {fl.dstr(today)}' in stale_days])
+
+    # only the range of days that are out of date is read. the attributes of each day's level2 variables
+    # are read from the file headers at the same time, they go into the level3 files as they are
+    ds, level2_version = get_flux_data(station_name, days_to_write[0], days_to_write[-1], 2, data_dir,
+                                       filetype, True, nthreads, True, pickle_dir)
+    level2_files = {today: get_flux_file(station_name, today, 2, data_dir, filetype) for today in days_to_write}
+    level2_attrs = get_flux_attrs(level2_files.values())
  
     # a wrapper that does detailed accounting of filling in nans for bad/enginnering, etc, gets called below
     # and reports back the results
@@ -238,7 +264,8 @@ def main(station_name, start_time=datetime(2019,10,1), end_time=datetime(2020,10
     att_delete_list = ['min_val', 'max_val', 'avg_val']
     for v in ds.variables:
 
-        encoding[v] = {'zlib': True, "complevel": 9, "_FillValue": None}
+        complevel   = get_complevel(v, complevels)
+        encoding[v] = {'zlib': complevel > 0, "complevel": complevel, "_FillValue": None}
 
         if 'time' not in v: ds[v].attrs['data_provenance'] = data_provenance
 
@@ -263,26 +290,38 @@ def main(station_name, start_time=datetime(2019,10,1), end_time=datetime(2020,10
             try: del ds[v].attrs[att]
             except: do_nothing = True 
 
+    nwriters = min(nthreads, max_writers)
     printline('\n', '\n')
-    print(f"Writing out level3 files by splitting up days, threaded with {nthreads} threads...")
+    print(f"Writing out level3 files by splitting up days, {nwriters} at a time...")
 
-    days_to_write = pd.date_range(start_time, end_time, freq='D')   # all the minutes today, for obs
+    # every day is a slice of the one dataset, the writers are forked after the days are submitted
+    # so they find them in their copy of it, nothing is pickled or read again
     day_delta  = pd.to_timedelta(86399999999,unit='us') # we want to go up to but not including 00:00
     write_arg_list = []
 
     for today in days_to_write:
         tomorrow = today+day_delta
-        write_arg_list.append((station_name, filetype, ds.sel(time=slice(today,tomorrow)), data_dir, encoding, today))
+        write_arg_list.append((station_name, filetype, ds.sel(time=slice(today,tomorrow)), data_dir, encoding, today,
+                               level2_attrs.get(level2_files[today])))
 
     print("\n    ... now actually calling write out\n")
     printline()
-    call_function_threaded(write_level3, write_arg_list)
+    written = call_function_threaded(write_level3, write_arg_list, nworkers=nwriters)
+
+    # written is True/False (no data) for the days that worked and None for the ones that failed, those
+    # are taken out of the manifest so they're redone
+    for today, day_written in zip(days_to_write, written):
+        job_name = f'{filetype} {fl.dstr(today)}'
+        if day_written is None: manifest.drop(job_name)
+        else: manifest.record(job_name, day_jobs[job_name], [get_flux_file(station_name, today, 3, data_dir, filetype)])
+    manifest.close()
 
     return ds, dropped_df, vars_to_drop, write_arg_list
 
-# this takes advantage of the xarray netcdf write function, since
-# we're just leaving most attributes the same from the level2 files
-def write_level3(station_name, filetype, ds, data_dir, encoding, data_date, q=None):
+# this takes advantage of the xarray netcdf write function, since we're just leaving most attributes the
+# same from the level2 files. var_attrs are the attributes of the day's level2 variables (get_flux_attrs),
+# None if there's no level2 file for the day
+def write_level3(station_name, filetype, ds, data_dir, encoding, data_date, var_attrs, q=None):
 
     level3_dir = f'{data_dir}/{station_name}/3_level_archive/'
     os.makedirs(level3_dir, exist_ok=True)
@@ -327,10 +366,10 @@ def write_level3(station_name, filetype, ds, data_dir, encoding, data_date, q=No
                  'calendar'  : 'standard',}
 
     to_delta_ints = np.floor((dti - bot).total_seconds())      # seconds
-    to_ind = pd.Int64Index(to_delta_ints)
+    to_ind = pd.Index(to_delta_ints, dtype='int64')
 
     delta_ints = np.floor((dti - tm).total_seconds())      # seconds
-    t_ind = pd.Int64Index(delta_ints)
+    t_ind = pd.Index(delta_ints, dtype='int64')
 
     ds = ds.drop(['base_time', 'time', 'time_offset'])
 
@@ -358,11 +397,7 @@ def write_level3(station_name, filetype, ds, data_dir, encoding, data_date, q=No
     
     # copy attributes from original dataset values 
     att_delete_list = ['min_val', 'max_val', 'avg_val']
-    old_ds, cv = get_flux_data(station_name, data_date, data_date,
-                               2, data_dir, filetype, False, 1, True) # no pickle
- 
-    try: old_ds.time # are we empty?
-    except Exception as e:
+    if var_attrs is None: # are we empty?
         print(f"... no data for {station_name} on {data_date}, not writing")
         try:
             q.put(False); return False
@@ -381,7 +416,7 @@ def write_level3(station_name, filetype, ds, data_dir, encoding, data_date, q=No
 
         if 'time' not in v:
 
-            for att, descr in old_ds[v].attrs.items():
+            for att, descr in var_attrs.get(v, {}).items():
                 if att not in att_delete_list: ds[v].attrs[att] = descr
  
             ds[v].attrs['percent_missing'] = np.round(((len(ds[v])-ds[v].notnull().sum().values)/len(ds[v]))*100, 2)
@@ -395,28 +430,27 @@ def write_level3(station_name, filetype, ds, data_dir, encoding, data_date, q=No
         return True
 
 
-def call_function_threaded(func, arg_list, timeout=None):
-
-    # with pool(processes=nthreads) as p:
-    #     ret_list = p.starmap(func, arg_list)
-    #     return ret_list
-
-    # this was a custom function that allows for interrupts (.gets) and printing and other fun things
-    # but it's pretty unnecessary for most use cases
-    q_list = []
-    p_list = []
-    ret_list = [] 
-    for i_call, arg_tuple in enumerate(arg_list):
-        q = Q(); q_list.append(q)
-        p = P(target=func, args=arg_tuple+(q,))
-        p_list.append(p); p.start()
-        if (i_call+1) % nthreads == 0 or arg_tuple is arg_list[-1]:
-            for iq, fq in enumerate(q_list):
-                rval = fq.get()
-                p_list[iq].join(timeout=1.0)
-                ret_list.append(rval)
-            q_list = []
-            p_list = []
+# the zlib level for var_name, from the first (pattern, level) in complevels that matches it
+def get_complevel(var_name, complevels):
+    for pattern, complevel in complevels:
+        if fnmatch.fnmatchcase(var_name, pattern): return int(complevel)
+    return 9
+
+def call_function_threaded(func, arg_list, timeout=None, nworkers=None):
+
+    # the days go to a pool of nworkers (nthreads) workers as they free up (see fl.task_pool), each
+    # call can take up to timeout seconds. returns what each call put on its queue, in arg_list order
+    if nworkers is None: nworkers = nthreads
+    n_workers = 0 if we_want_to_debug else nworkers
+    pool      = fl.task_pool(n_workers, max_tasks=max_tasks_per_worker, timeout=timeout)
+    for i_call, arg_tuple in enumerate(arg_list): pool.submit(i_call, func, *arg_tuple)
+
+    ret_list = [None]*len(arg_list)
+    for i_call, status, rval, runtime in pool.results():
+        if status == 'ok': 
+            if len(rval) > 0: ret_list[i_call] = rval[0]
+        else:
+            print(f"!!! {func.__name__} {status} for call {i_call} after {runtime:.1f} s:\n{rval}")
 
     return ret_list
 
@@ -436,9 +470,11 @@ if __name__ == '__main__':
     
     # pass the base path to make it more mobile
     parser.add_argument('-p', '--path', metavar='str', help='full path to data, including /data/ andtrailing slash')
-    parser.add_argument('-pd', '--pickledir', metavar='str',help='want to store a pickle of the data for debugging?')
+    parser.add_argument('-pd', '--pickledir', metavar='str',help='directory to cache the data in (feather/zarr), for speed on reruns')
 
     parser.add_argument('-a', '--station', metavar='str',help='asfs#0/tower, if omitted all will be procesed')
+    parser.add_argument('-f', '--force', action ='store_true', help='rewrite every day, even the ones the run manifest says are up to date')
+    parser.add_argument('-z', '--complevel', metavar='str', help='zlib levels, "pattern=level,..." first match wins, e.g. "*_qc=4,*=9" or just "4"')
 
     args         = parser.parse_args()
     if args.verbose: verbose = True
@@ -466,8 +502,16 @@ if __name__ == '__main__':
     else:
         end_time = datetime(2020,10,1)
 
+    complevels = level3_complevels
+    if args.complevel:
+        complevels = []
+        for level_str in args.complevel.split(','):
+            if '=' in level_str: complevels.append(tuple(level_str.rsplit('=', 1)))
+            else:                complevels.append(('*', level_str))
+        complevels = [(pattern.strip(), int(complevel)) for pattern, complevel in complevels]
+
     filetypes = ['seb', 'met']
     for station_name in station_list:
         for filetype in filetypes:
-            main(station_name, start_time, end_time, data_dir, filetype, verbose, pickle_dir)
+            main(station_name, start_time, end_time, data_dir, filetype, verbose, pickle_dir, args.force, complevels)
     
@@ -5,41 +5,81 @@
 # The following functions are defined here (in this order):
 #
 
-# def despike(spikey_panda, thresh, filterlen, medfill):
+# def despike(spikey_panda, thresh, filterlen, medfill, min_periods=1):
+# class running_median(object):
+# class despike_stream(object):
+# def long_rolling_median(series, window, decimate=10, min_periods=1, check=False):
 # def calc_humidity_ptu300(RHw, temp, press, Td):
 # def calculate_initial_angle_wgs84(latA,lonA,latB,lonB):
 # def distance_wgs84(latA,lonA,latB,lonB):
+# def get_geod():
+# def geod_inverse(latA, lonA, latB, lonB):
+# def vincenty_inverse(latA, lonA, latB, lonB, max_iter=200, tol=1e-12):
 # def calculate_initial_angle(latA,lonA, latB, lonB):
 # def distance(lat1, lon1, lat2, lon2):
 # def tilt_rotation(ct_phi, ct_theta, ct_psi, ct_up, ct_vp, ct_wp):
 # def fix_high_frequency(fast_data, inst_prefix=''):
 # def decode_licor_diag(raw_diag):
+# def unpack_licor_diag(raw_diag):
 # def get_ct(licor_db):
 # def get_dt(licor_db):
 # def get_pll(licor_db):
 # def take_average(array_like_thing, **kwargs):
 # def take_vector_average(array_like_thing, **kwargs):
+# def resample_bins(index, freq):
+# def bin_average(df, freq, perc_allowed_missing=50.0, angle_cols=[], qc_cols=[]):
+# def bin_stats(df, freq, ddof=1, perc_allowed_missing=None):
+# def bin_vector_average(u, v, freq, perc_allowed_missing=50.0):
 # def warn(string):
 # def fatal(string):
 # def num_missing(series):
 # def perc_missing(series):
 # def column_is_ints(ser): 
 # def despik(uraw):
+# class spectral_plan(object):
+# def get_spectral_plan(fs, nperseg, noverlap=None, window='hamming'):
+# def log_spaced_bins(nf, c1=0.1, nbins=None):
+# def smooth_spectra(F, spectra, nf, c1=0.1, nbins=None):
 # def grachev_fluxcapacitor(z_level_n, metek, licor, h2ounit, co2unit, pr, temp, mr, verbose=False):
+# def despik_rows(uraw):
+# def grachev_fluxcapacitor_batched(z_level_n, metek, licor, h2ounit, co2unit, pr, temp, mr, win_starts, win_ends, verbose=False):
+# def turb_record_to_dataframe(turb_rec, time_index, with_spectra=True):
+# class turb_spectra(object):
 # def dstr(date):
 # def cor_ice_A10(bulk_input):
 #     def psih_sheba(zet):
 #     def psim_sheba(zet):
+# def cor_ice_A10_array(bulk_input, tol=None):
+#     def psih_sheba(zet):
+#     def psim_sheba(zet):
 # def qcrad(df,sw_range,lw_range,D1,D5,D11,D12,D13,D14,D15,D16,A0):
 # def tilt_corr(df,diff):
 # def interpolate_nans_vectorized(arr):
 # def average_mosaic_flags(qc_series, fstr):
 #     def take_qc_average(data_series):
+# def spread_scan_timestamps(times, scan_len=5, samples_per_scan=None):
+# def align_to_index(source, target_index, direction='exact', tolerance=None):
+# def build_timestamps(year, month, day, hour=0, minute=0, second=0, usec=0):
+# def parse_logger_timestamps(strings):
+# def parse_logger_time(field):
+# def read_last_line(data_file, block_size=4096):
+# def scan_raw_file(data_file, max_header_lines=4):
+# class raw_file_catalogue(object):
+# class frame_cache(object):
+# class run_manifest(object):
+# class task_pool(object):
 #
 # ############################################################################################
 import pandas as pd
 import numpy  as np
 import scipy  as sp
+import os, sqlite3, time, traceback, json, hashlib, shutil, importlib.util, heapq
+
+from collections import deque
+
+from multiprocessing import Process as P
+from multiprocessing import Pipe
+from multiprocessing.connection import wait
 
 from datetime import datetime, timedelta
 from scipy    import signal, stats
@@ -47,9 +87,9 @@ from scipy    import signal, stats
 global nan; nan = np.NaN
 
 # despiker
-def despike(spikey_panda, thresh, filterlen, medfill):
+def despike(spikey_panda, thresh, filterlen, medfill, min_periods=1):
     # outlier detection from a running median !!!! Replaces outliers with that median !!!!
-    tmp                    = spikey_panda.rolling(window=filterlen, center=True, min_periods=1).median()
+    tmp                    = spikey_panda.rolling(window=filterlen, center=True, min_periods=min_periods).median()
     spikes_i               = (np.abs(spikey_panda - tmp)) > thresh
     if medfill == 'yes': # fill with median
         spikey_panda[spikes_i] = tmp
@@ -59,6 +99,199 @@ def despike(spikey_panda, thresh, filterlen, medfill):
         spikey_panda = spikes_i
     return spikey_panda
 
+class running_median(object):
+
+    __doc__ = """
+
+    Centred running median of a series that arrives in pieces, e.g. day by day, that comes out
+    exactly as series.rolling(window, center=True, min_periods=min_periods).median() would on the
+    whole series, with no edge effects where the pieces join. The window is kept in two heaps,
+    the lower half as a max heap and the upper half as a min heap, and samples leaving the window
+    are only taken out once they come to the top of their heap, so every sample costs O(log
+    window) however long the window is, and the state carries from one piece to the next. nans
+    aren't put in the heaps and don't count towards min_periods, like pandas.
+
+    The medians for the last (window-1)//2 samples of a piece need samples from the next one, so
+    they come out of the next update() (or flush() at the end of the series).
+
+    Parameters:
+    ----------
+    window      : window length [samples]
+    min_periods : non-nan samples needed in a window, else the median is nan
+
+    Example:
+    -------
+    rm = running_median(21600)
+    for chunk in chunks:
+        values, medians = rm.update(chunk)  # medians for values, lagging chunk by (window-1)//2
+    values, medians = rm.flush()            # the rest, windows truncated at the end
+
+    ================================================================================================
+
+    """
+
+    def __init__(self, window, min_periods=1):
+
+        self.window      = int(window)
+        self.min_periods = max(int(min_periods), 1)
+        self.ahead       = (self.window-1)//2 # samples after the centre, like pandas
+        self.samples     = deque()            # the last window samples, nans too
+        self.lower       = []                 # max heap (negated) of the lower half of the window
+        self.upper       = []                 # min heap of the upper half
+        self.n_lower     = 0                  # samples in each heap that are still in the window
+        self.n_upper     = 0
+        self.gone        = {}                 # value: count, left the window but still in a heap
+        self.n_in        = 0                  # samples given to update()
+        self.waiting     = np.empty(0)        # the last samples given, their medians aren't out yet
+
+    # takes the next piece, returns the samples whose windows are now complete and their medians
+    def update(self, chunk):
+
+        chunk   = np.asarray(chunk, dtype=np.float64)
+        skip    = min(max(self.ahead-self.n_in, 0), chunk.size) # the first medians come out with later samples
+        medians = np.empty(chunk.size)
+        for i, x in enumerate(chunk.tolist()): medians[i] = self._push(x)
+        self.n_in += chunk.size
+
+        waiting      = np.concatenate([self.waiting, chunk])
+        n_out        = chunk.size-skip
+        self.waiting = waiting[n_out:]
+        return waiting[0:n_out], medians[skip:]
+
+    # the medians for the samples that are left, with the windows running off the end of the series.
+    # starts over afterwards, for the next series
+    def flush(self):
+
+        values  = self.waiting
+        medians = np.array([self._push(nan) for i in range(0, self.ahead)])[self.ahead-values.size:]
+        self.__init__(self.window, self.min_periods)
+        return values, medians
+
+    def _push(self, x):
+
+        self.samples.append(x)
+        if x == x: self._add(x) # not nan
+        if len(self.samples) > self.window:
+            old = self.samples.popleft()
+            if old == old: self._remove(old)
+
+        n = self.n_lower+self.n_upper
+        if n < self.min_periods: return nan
+        if n % 2 == 1: return -self.lower[0]
+        return (-self.lower[0]+self.upper[0])/2
+
+    def _add(self, x):
+        if self.n_lower == 0 or x <= -self.lower[0]:
+            heapq.heappush(self.lower, -x); self.n_lower += 1
+        else:
+            heapq.heappush(self.upper, x); self.n_upper += 1
+        self._balance()
+
+    # the sample is in the lower heap if it's not above the lower heap's top, equal values can be
+    # taken from either heap
+    def _remove(self, x):
+        self.gone[x] = self.gone.get(x, 0)+1
+        if x <= -self.lower[0]: self.n_lower -= 1
+        else:                   self.n_upper -= 1
+        self._balance()
+
+    # the lower heap has as many samples as the upper one, or one more, and both tops are in the window
+    def _balance(self):
+        self._prune(self.lower, -1); self._prune(self.upper, 1)
+        if self.n_lower > self.n_upper+1:
+            heapq.heappush(self.upper, -heapq.heappop(self.lower))
+            self.n_lower -= 1; self.n_upper += 1
+            self._prune(self.lower, -1)
+        elif self.n_lower < self.n_upper:
+            heapq.heappush(self.lower, -heapq.heappop(self.upper))
+            self.n_upper -= 1; self.n_lower += 1
+            self._prune(self.upper, 1)
+
+    def _prune(self, heap, sign):
+        while heap and self.gone.get(sign*heap[0], 0) > 0:
+            x = sign*heapq.heappop(heap)
+            self.gone[x] -= 1
+            if self.gone[x] == 0: del self.gone[x]
+
+class despike_stream(object):
+
+    __doc__ = """
+
+    despike() for a series that arrives in pieces, on a running_median so the result is the same
+    as despike() on the whole series. Like running_median, the output lags the input by
+    (filterlen-1)//2 samples, and flush() gives the rest at the end of the series.
+
+    Parameters:
+    ----------
+    thresh      : distance from the median that's a spike
+    filterlen   : median window length [samples]
+    medfill     : 'yes' spikes are replaced by the median, 'no' by nan, anything else returns
+                  True where there are spikes
+    min_periods : non-nan samples needed in a window, else the median is nan and nothing is a spike
+
+    Example:
+    -------
+    ds = despike_stream(2, 1200, 'yes')
+    despiked = np.concatenate([ds.update(chunk) for chunk in chunks]+[ds.flush()])
+
+    ================================================================================================
+
+    """
+
+    def __init__(self, thresh, filterlen, medfill, min_periods=1):
+        self.thresh  = thresh
+        self.medfill = medfill
+        self.medians = running_median(filterlen, min_periods)
+
+    def update(self, chunk):
+        return self._despike(*self.medians.update(chunk)[0:2])
+
+    def flush(self):
+        return self._despike(*self.medians.flush())
+
+    def _despike(self, values, medians):
+        spikes_i = np.abs(values-medians) > self.thresh
+        if self.medfill == 'yes': return np.where(spikes_i, medians, values)
+        if self.medfill == 'no':  return np.where(spikes_i, nan, values)
+        return spikes_i
+
+# centred running median over window samples of a regularly sampled series, for the hours to a day
+# long filters on the heading and ice altitude, which don't change from one second to the next.
+# decimated: every decimate'th sample is taken and the running median over window/decimate of those is
+# interpolated back to every sample, decimate times less work than the exact
+# series.rolling(window, center=True, min_periods).median(), which is what you get with decimate=1.
+# the samples that are taken have the same spread as all of them (a median of block medians doesn't,
+# it's biased for skewed noise and next to pad-filled gaps), so what's left is sampling noise, up to
+# 0.1 of the spread of the samples in a 6 hr window of 1 s data at decimate=10 (benchmark_long_median.py).
+# min_periods counts samples of the full series, so it's divided by decimate for the ones taken.
+# returns the medians and, with check=True, the largest absolute difference from the exact medians
+# (None otherwise) so the decimated filter can be checked on real data
+def long_rolling_median(series, window, decimate=10, min_periods=1, check=False):
+
+    exact = None
+    if decimate <= 1 or check:
+        exact = series.rolling(window, center=True, min_periods=min_periods).median()
+        if decimate <= 1: return exact, (0.0 if check else None)
+
+    values  = np.asarray(series.values, dtype=np.float64)
+    taken   = np.arange((decimate-1)//2, values.size, decimate)
+    sub_med = pd.Series(values[taken]).rolling(max(int(round(window/decimate)), 1), center=True,
+                                               min_periods=max(int(np.ceil(min_periods/decimate)), 1)).median().values
+
+    has_data = ~np.isnan(sub_med)
+    medians  = np.full(values.size, nan)
+    if has_data.any():
+        medians  = np.interp(np.arange(values.size), taken[has_data], sub_med[has_data])
+        nearest  = np.clip(np.rint((np.arange(values.size)-taken[0])/decimate).astype(np.int64), 0, taken.size-1)
+        medians[~has_data[nearest]] = nan
+    medians = pd.Series(medians, index=series.index, name=series.name)
+
+    max_dev = None
+    if check: 
+        both    = ~np.isnan(medians.values) & ~np.isnan(exact.values)
+        max_dev = float(np.max(np.abs(medians.values[both]-exact.values[both]))) if both.any() else 0.0
+    return medians, max_dev
+
 # calculate humidity variables following Vaisala
 def calc_humidity_ptu300(RHw, temp, press, Td):
 
@@ -122,28 +355,90 @@ def calc_humidity_ptu300(RHw, temp, press, Td):
 def calculate_initial_angle_wgs84(latA,lonA,latB,lonB):
     
     # a little more accurate than calculate_initial_angle, which assumed a great circle. here we match gps datum wgs84
-    from pyproj import Geod  
-
-    g = Geod(ellps='WGS84')
-    az12,az21,dist = g.inv(lonA,latA,lonB,latB)
-    compass_bearing = az12
+    compass_bearing, dist = geod_inverse(latA,lonA,latB,lonB)
     return compass_bearing
   
 def distance_wgs84(latA,lonA,latB,lonB):
     
     # a little more accurate than distance, which assumed a great circle. here we match gps datum wgs84
-    from pyproj import Geod  
-
     try:
-        g = Geod(ellps='WGS84')
-        az12,az21,dist = g.inv(lonA,latA,lonB,latB)
-        d = dist
+        az12, d = geod_inverse(latA,lonA,latB,lonB)
         return d
 
     except:
         print(f"!!! failed at calculation for:\n {latA} {latB}")
         raise
 
+# one pyproj Geod per process, made the first time it's needed. None if there's no pyproj
+_geod_cache = {}
+def get_geod():
+    if 'wgs84' not in _geod_cache:
+        try:
+            from pyproj import Geod
+            _geod_cache['wgs84'] = Geod(ellps='WGS84')
+        except ImportError:
+            print("!!! no pyproj, the wgs84 distances/bearings are from vincenty_inverse")
+            _geod_cache['wgs84'] = None
+    return _geod_cache['wgs84']
+
+# azimuth [deg, -180 to 180, from A towards B] and distance [m] between the points A and B on the wgs84
+# ellipsoid, for whole arrays at once. Geod.inv if there's pyproj, vincenty_inverse if not. nans give nans
+def geod_inverse(latA, lonA, latB, lonB):
+
+    latA, lonA, latB, lonB = [np.asarray(x, dtype=np.float64) for x in (latA, lonA, latB, lonB)]
+    latA, lonA, latB, lonB = np.broadcast_arrays(latA, lonA, latB, lonB)
+
+    geod = get_geod()
+    if geod is None: return vincenty_inverse(latA, lonA, latB, lonB)
+
+    az12, az21, dist = geod.inv(lonA, latA, lonB, latB)
+    return np.asarray(az12), np.asarray(dist)
+
+# Vincenty's (1975) inverse solution on the wgs84 ellipsoid in numpy, iterated on every pair at once
+# until lambda converges. good to well under a mm, except for nearly antipodal points where it doesn't
+# converge, those are nan (which doesn't matter for stations a few km from a ship). returns the azimuth
+# from A to B [deg, -180 to 180] and the distance [m], like Geod.inv
+def vincenty_inverse(latA, lonA, latB, lonB, max_iter=200, tol=1e-12):
+
+    a  = 6378137.0
+    f  = 1/298.257223563
+    b  = (1-f)*a
+
+    latA, lonA, latB, lonB = [np.asarray(x, dtype=np.float64) for x in (latA, lonA, latB, lonB)]
+    L  = np.radians(np.mod(lonB-lonA+180, 360)-180)
+    U1 = np.arctan((1-f)*np.tan(np.radians(latA)))
+    U2 = np.arctan((1-f)*np.tan(np.radians(latB)))
+    sinU1, cosU1, sinU2, cosU2 = np.sin(U1), np.cos(U1), np.sin(U2), np.cos(U2)
+
+    lam       = L.copy()
+    converged = np.zeros(lam.shape, dtype=bool)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for i_iter in range(0, max_iter):
+            sin_lam, cos_lam = np.sin(lam), np.cos(lam)
+            sin_sig   = np.sqrt((cosU2*sin_lam)**2+(cosU1*sinU2-sinU1*cosU2*cos_lam)**2)
+            cos_sig   = sinU1*sinU2+cosU1*cosU2*cos_lam
+            sig       = np.arctan2(sin_sig, cos_sig)
+            sin_alpha = np.where(sin_sig == 0, 0.0, cosU1*cosU2*sin_lam/sin_sig)
+            cos2alpha = 1-sin_alpha**2
+            cos2sig_m = np.where(cos2alpha == 0, 0.0, cos_sig-2*sinU1*sinU2/cos2alpha) # equatorial lines
+            C         = f/16*cos2alpha*(4+f*(4-3*cos2alpha))
+            lam_new   = L+(1-C)*f*sin_alpha*(sig+C*sin_sig*(cos2sig_m+C*cos_sig*(-1+2*cos2sig_m**2)))
+
+            converged = np.abs(lam_new-lam) < tol
+            lam       = lam_new
+            if np.all(converged | np.isnan(lam)): break
+
+        u2    = cos2alpha*(a**2-b**2)/b**2
+        A     = 1+u2/16384*(4096+u2*(-768+u2*(320-175*u2)))
+        B     = u2/1024*(256+u2*(-128+u2*(74-47*u2)))
+        d_sig = B*sin_sig*(cos2sig_m+B/4*(cos_sig*(-1+2*cos2sig_m**2)
+                                          -B/6*cos2sig_m*(-3+4*sin_sig**2)*(-3+4*cos2sig_m**2)))
+        dist  = b*A*(sig-d_sig)
+        az12  = np.degrees(np.arctan2(cosU2*np.sin(lam), cosU1*sinU2-sinU1*cosU2*np.cos(lam)))
+
+    dist = np.where(converged, dist, np.nan)
+    az12 = np.where(converged, az12, np.nan)
+    return az12, dist
 
 def calculate_initial_angle(latA,lonA, latB, lonB):
 
@@ -270,7 +565,7 @@ def fix_high_frequency(fast_data, inst_prefix=''):
                                    0.0455,0.0597,0.0767,0.0958,0.1134,0.1229])])
 
     # Eq. (5) from data paper?
-    Num   = np.int(np.ceil(np.log2(np.size(fast_data[inst+'w']))))
+    Num   = int(np.ceil(np.log2(np.size(fast_data[inst+'w']))))
     freqw = np.fft.fft(fast_data[inst+'w'].fillna(fast_data[inst+'w'].median()),2**Num)
     freqf = (10/2**Num)*np.arange(0,2**(Num-1)) # frequencies of the fft. 10 is 10 Hz sampling freq. can this be softcoded?
 
@@ -287,59 +582,51 @@ def fix_high_frequency(fast_data, inst_prefix=''):
 
 def decode_licor_diag(raw_diag):
 
-    # speed things up so we dont wait forever
-    bin_v     = np.vectorize(bin)
-    get_ct_v  = np.vectorize(get_ct)
-    get_dt_v  = np.vectorize(get_dt)
-    get_pll_v = np.vectorize(get_pll)
-
     # licor diagnostics are encoded in the binary of an integer reported by the sensor. the coding is described
-    # in Licor Technical Document, 7200_TechTip_Diagnostic_Values_TTP29 and unpacked here.
-    licor_diag     = np.int16(raw_diag)
-    pll            = licor_diag*np.nan
-    detector_temp  = licor_diag*np.nan
-    chopper_temp   = licor_diag*np.nan
-    # __"why the %$@$)* can't this be vectorized? This loop is slow"__
-    # well, chris, you asked for vectorization.. now you got it! now to get rid of the list comprehension
-    non_nan_inds  = ~np.isnan(raw_diag) 
-    #if not np.isnan(raw_diag).all():
-    if non_nan_inds.any():
-
-        licor_diag_bin = bin_v(licor_diag[non_nan_inds])
-
-        # asfs radio data doesn't contain good licor_diags, so this fails, treat as if we had nans
-        try: chopper_temp_bin = licor_diag_bin[:][2]
-        except:
-            print("!!! no licor diags for today !!!")
-            pass
-
-        # try to use vectorized functions?
-        # chopper_temp[non_nan_inds]  = get_ct_v(licor_diag_bin)
-        # detector_temp[non_nan_inds] = get_dt_v(licor_diag_bin)
-        # pll[non_nan_inds]           = get_pll_v(licor_diag_bin)
-        
-        # or just use list comprehension? vectorize is doing weird things, and not much faster... maybe this is better
-        chopper_temp[non_nan_inds]  = [np.int(x[2]) if len(x)==10 and x[2]!='b' else np.nan for x in licor_diag_bin]
-        detector_temp[non_nan_inds] = [np.int(x[3]) if len(x)==10 and x[2]!='b' else np.nan for x in licor_diag_bin]
-        pll[non_nan_inds]           = [np.int(x[4]) if len(x)==10 and x[2]!='b' else np.nan for x in licor_diag_bin]
+    # in Licor Technical Document, 7200_TechTip_Diagnostic_Values_TTP29 and unpacked in unpack_licor_diag.
+    # this used to go through bin() strings, which only read the codes with 8 binary digits (128-255, the
+    # chopper bit set), everything else was nan. that's kept so the flags come out the same as before
+    diag  = unpack_licor_diag(raw_diag)
+    eight = ~np.ma.getmaskarray(diag['chopper']) & (diag['chopper'].filled(0) == 1)
+
+    pll           = np.where(eight, diag['pll'].filled(0),      np.nan)
+    detector_temp = np.where(eight, diag['detector'].filled(0), np.nan)
+    chopper_temp  = np.where(eight, diag['chopper'].filled(0),  np.nan)
 
     return pll, detector_temp, chopper_temp
 
+# the licor diagnostic words unpacked with masks and shifts on the whole array at once. the diagnostic is a
+# byte (TTP29): bit 7 chopper temp ok, bit 6 detector temp ok, bit 5 pll ok, bit 4 sync ok and bits 0-3 the
+# agc (*6.25 for %). returns a dict of masked uint8 arrays, one per field, masked where the diagnostic was nan
+# or isn't a byte. fractions are truncated, as the int cast in the old decoder did
+def unpack_licor_diag(raw_diag):
+
+    raw   = np.asarray(raw_diag, dtype=np.float64)
+    valid = np.isfinite(raw) & (raw > -1) & (raw < 256)
+    codes = np.where(valid, raw, 0).astype(np.uint8)
+
+    diag = {}
+    for field, bit in (('chopper', 7), ('detector', 6), ('pll', 5), ('sync', 4)):
+        diag[field] = np.ma.masked_array(np.bitwise_and(np.right_shift(codes, bit), 1), mask=~valid)
+    diag['agc'] = np.ma.masked_array(np.bitwise_and(codes, 0x0f), mask=~valid)
+
+    return diag
+
 # these functions are for vectorization by numpy to 
 def get_ct(licor_db):
     if len(licor_db)>4 and licor_db[2]!='b':
         if licor_db[2] != np.nan:
-            return np.int(licor_db[2])
+            return int(licor_db[2])
     else: return np.nan
 def get_dt(licor_db):
     if len(licor_db)>4 and licor_db[2]!='b': 
         if licor_db[3] != np.nan:
-            return np.int(licor_db[3])
+            return int(licor_db[3])
     else: return np.nan
 def get_pll(licor_db):
     if len(licor_db)>4 and licor_db[2]!='b':
         if licor_db[4] != np.nan:
-            return np.int(licor_db[4])
+            return int(licor_db[4])
     else: return np.nan
 
 # this is the function that averages for the 1m and 10m averages
@@ -400,6 +687,142 @@ def take_vector_average(array_like_thing, **kwargs):
         return mean_val
 
 
+# ############################################################################################
+# take_average and friends without a python call per bin. the rows are sorted into the same left
+# labelled bins resample(freq, label='left') uses and every column is reduced at once with
+# np.add.reduceat, so a day of 10 Hz data in 1 min bins is a few array operations, not 1440*ncols
+# function calls. the sums are in a different order than np.nanmean's, so the results can differ
+# from take_average in the last couple of digits
+
+# the bins of index (a DatetimeIndex) for a fixed freq ('1T', '10min', '1s'...), labelled on the left
+# and starting from midnight of the first day like resample. returns the labels of every bin from
+# the first to the last (empty ones too) and the bin number of each row
+def resample_bins(index, freq):
+
+    step = pd.Timedelta(freq).value
+    if len(index) == 0: return pd.DatetimeIndex([], name=index.name), np.array([], dtype=np.int64)
+
+    times  = np.asarray(index.asi8)
+    origin = index.min().floor('D').value
+    first  = origin+(times.min()-origin)//step*step
+    bins   = (times-first)//step
+    labels = pd.date_range(pd.Timestamp(first), periods=bins.max()+1, freq=pd.Timedelta(step), name=index.name)
+    return labels, bins
+
+# the rows of values (2d) grouped by bin: the sorted values, where each occupied bin starts, which bins
+# those are and how many rows each has
+def _group_bins(values, bins):
+
+    if np.any(bins[1:] < bins[:-1]):
+        order  = np.argsort(bins, kind='stable')
+        bins   = bins[order]
+        values = values[order]
+    starts   = np.flatnonzero(np.r_[True, bins[1:] != bins[:-1]])
+    occupied = bins[starts]
+    nrows    = np.diff(np.r_[starts, bins.size])
+    return values, starts, occupied, nrows
+
+# the numeric columns of df as a 2d float array, the other columns (dates, strings...) are all nan,
+# as take_average gives them
+def _numeric_values(df):
+
+    values = np.full((len(df), df.shape[1]), np.nan)
+    for icol in range(0, df.shape[1]):
+        col = df.iloc[:, icol]
+        if col.dtype.kind in 'biuf': values[:, icol] = col.to_numpy(dtype=np.float64, na_value=np.nan)
+    return values
+
+# take_average for every column of df (or a series) at once: the nanmean of each freq bin, nan if more
+# than perc_allowed_missing percent of it is missing (same rounding as take_average). angle_cols get the
+# circular mean from sin/cos sums (stats.circmean with high=360) and qc_cols the flag from the rule in
+# average_mosaic_flags. returns the same DataFrame (series) as df.resample(freq, label='left').apply(take_average)
+def bin_average(df, freq, perc_allowed_missing=50.0, angle_cols=[], qc_cols=[]):
+
+    is_series = isinstance(df, pd.Series)
+    if is_series: df = df.to_frame()
+
+    labels, bins = resample_bins(df.index, freq)
+    avg = np.full((len(labels), df.shape[1]), np.nan)
+    if len(df) > 0:
+        values, starts, occupied, nrows = _group_bins(_numeric_values(df), bins)
+        is_nan  = np.isnan(values)
+        n_nan   = np.add.reduceat(is_nan.astype(np.int64), starts, axis=0)
+        n_valid = nrows[:, None]-n_nan
+        missing = np.round(n_nan/nrows[:, None]*100.0, decimals=4) > perc_allowed_missing
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            sums = np.add.reduceat(np.where(is_nan, 0.0, values), starts, axis=0)
+            mean = np.where(n_valid > 0, sums/n_valid, np.nan)
+
+            angles = np.array([c in angle_cols for c in df.columns])
+            if angles.any():
+                rad      = np.deg2rad(values[:, angles])
+                sin_sum  = np.add.reduceat(np.where(is_nan[:, angles], 0.0, np.sin(rad)), starts, axis=0)
+                cos_sum  = np.add.reduceat(np.where(is_nan[:, angles], 0.0, np.cos(rad)), starts, axis=0)
+                circ     = np.arctan2(sin_sum, cos_sum)
+                circ     = np.where(circ < 0, circ+2*np.pi, circ)*360/(2*np.pi)
+                mean[:, angles] = np.where(n_valid[:, angles] > 0, circ, np.nan)
+
+            qcs = np.array([c in qc_cols for c in df.columns])
+            if qcs.any():
+                flags  = values[:, qcs]
+                frac   = lambda flag: np.add.reduceat((flags == flag).astype(np.int64), starts, axis=0)/nrows[:, None]
+                good   = frac(0)
+                qc_avg = np.where(n_valid[:, qcs] == 0, np.nan, 2.0)
+                qc_avg = np.where(frac(3) >= 0.5, 3.0, qc_avg)
+                qc_avg = np.where(good+frac(1) >= 0.5, 1.0, qc_avg)
+                qc_avg = np.where(good >= 0.5, 0.0, qc_avg)
+
+        mean = np.where(missing, np.nan, mean)
+        if qcs.any(): mean[:, qcs] = qc_avg # the flags have their own rule for missing data
+        avg[occupied] = mean
+
+    avged = pd.DataFrame(avg, index=labels, columns=df.columns)
+    if is_series: return avged.iloc[:, 0]
+    return avged
+
+# mean, std (ddof), min, max and number of valid values of every column of df in each freq bin, as a
+# dict of DataFrames. like resample().mean()/.std()/... unless perc_allowed_missing is given, then the
+# bins missing more than that (take_average's rule) are nan, all but count. the std is from the
+# deviations from the bin means, a second pass rather than sums of squares
+def bin_stats(df, freq, ddof=1, perc_allowed_missing=None):
+
+    labels, bins = resample_bins(df.index, freq)
+    stats_out = {s: np.full((len(labels), df.shape[1]), np.nan) for s in ['mean', 'std', 'min', 'max']}
+    stats_out['count'] = np.zeros((len(labels), df.shape[1]), dtype=np.int64)
+    if len(df) > 0:
+        values, starts, occupied, nrows = _group_bins(_numeric_values(df), bins)
+        is_nan  = np.isnan(values)
+        n_valid = np.add.reduceat((~is_nan).astype(np.int64), starts, axis=0)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.add.reduceat(np.where(is_nan, 0.0, values), starts, axis=0)/n_valid
+            dev  = np.where(is_nan, 0.0, values-np.repeat(mean, nrows, axis=0))
+            std  = np.sqrt(np.add.reduceat(dev**2, starts, axis=0)/(n_valid-ddof))
+        std = np.where(n_valid > ddof, std, np.nan)
+
+        if perc_allowed_missing is not None:
+            missing = np.round((nrows[:, None]-n_valid)/nrows[:, None]*100.0, decimals=4) > perc_allowed_missing
+        else: missing = np.zeros(n_valid.shape, dtype=bool)
+
+        stats_out['mean'][occupied]  = np.where(missing | (n_valid == 0), np.nan, mean)
+        stats_out['std'][occupied]   = np.where(missing, np.nan, std)
+        stats_out['min'][occupied]   = np.where(missing, np.nan, np.fmin.reduceat(values, starts, axis=0))
+        stats_out['max'][occupied]   = np.where(missing, np.nan, np.fmax.reduceat(values, starts, axis=0))
+        stats_out['count'][occupied] = n_valid
+
+    return {s: pd.DataFrame(v, index=labels, columns=df.columns) for s, v in stats_out.items()}
+
+# the vector averaged wind in each freq bin from the u/v components (earth frame, m/s), the mean
+# components with take_average's rule and the speed and meteorological direction they make. for
+# speed/direction in, pass u = -ws*sin(wd), v = -ws*cos(wd). returns a DataFrame of u, v, wspd, wdir
+def bin_vector_average(u, v, freq, perc_allowed_missing=50.0):
+
+    uv   = bin_average(pd.DataFrame({'u': u, 'v': v}), freq, perc_allowed_missing)
+    wspd = np.sqrt(uv['u']**2+uv['v']**2)
+    wdir = np.mod((np.arctan2(-uv['u'], -uv['v'])*180/np.pi), 360)
+    return pd.DataFrame({'u': uv['u'], 'v': uv['v'], 'wspd': wspd, 'wdir': wdir})
+
 # functions to make grepping lines easier, differentiating between normal output, warnings, and fatal errors
 def warn(string):
     max_line = len(max(string.splitlines(), key=len))
@@ -514,6 +937,170 @@ def despik(uraw):
     
     return uu
 
+class spectral_plan(object):
+
+    __doc__ = """
+
+    Everything scipy.signal.welch/csd rebuild on every call, computed once: the window, the
+    segment indices, the linear detrend and the density scaling, plus the frequency vector.
+    Each series is detrended/windowed/transformed once (segment_fft) and every spectrum or
+    cross spectrum is then a product of those transforms, so a pair doesn't redo the fft.
+
+    Gives the same result as welch/csd with detrend='linear', scaling='density', onesided
+    and average='mean'. Use get_spectral_plan() to get a cached plan rather than making one.
+
+    Parameters:
+    ----------
+    fs       : sampling frequency [Hz]
+    nperseg  : segment length
+    noverlap : overlap between segments, nperseg//2 if None (like scipy)
+    window   : name of a scipy window, or the window itself
+
+    Example:
+    -------
+    plan   = get_spectral_plan(10, 2**13)
+    X      = plan.segment_fft(np.stack([u, w]))
+    su     = plan.spectrum(X[0])
+    swu    = plan.cross_spectrum(X[1], X[0]) # same as signal.csd(w, u, ...)
+
+    ================================================================================================
+
+    """
+
+    def __init__(self, fs, nperseg, noverlap=None, window='hamming'):
+
+        if noverlap is None: noverlap = nperseg//2
+
+        self.fs       = fs
+        self.nperseg  = nperseg
+        self.noverlap = noverlap
+        self.step     = nperseg-noverlap
+
+        # symmetric windows, like the signal.windows.hamming(nf) we've always passed to welch/csd
+        # (signal.get_window would give the periodic version)
+        if isinstance(window, str): self.window = getattr(signal.windows, window)(nperseg)
+        else:                       self.window = np.asarray(window, dtype=np.float64)
+
+        self.freqs = np.fft.rfftfreq(nperseg, 1/fs)
+        self.scale = 1.0/(fs*(self.window*self.window).sum())
+
+        # least squares line for each segment is mean + slope*(t-mean(t))
+        self._tc   = np.arange(nperseg)-(nperseg-1)/2
+        self._tcss = np.sum(self._tc*self._tc)
+
+        # onesided density, double everything but dc (and nyquist if nperseg is even)
+        self._dbl = np.full(self.freqs.size, 2.0)
+        self._dbl[0] = 1.0
+        if nperseg % 2 == 0: self._dbl[-1] = 1.0
+
+    # segments are along the last axis, [..., nseg, nperseg]
+    def _segments(self, x):
+        nseg = (x.shape[-1]-self.noverlap)//self.step
+        if nseg == 1:
+            return x[..., None, 0:self.nperseg]
+        seg_i = np.arange(nseg)[:,None]*self.step + np.arange(self.nperseg)[None,:]
+        return x[..., seg_i]
+
+    # detrended, windowed ffts of each segment of x (series along the last axis) [..., nseg, nfreq]
+    def segment_fft(self, x):
+        seg   = self._segments(np.asarray(x, dtype=np.float64))
+        slope = (seg @ self._tc)/self._tcss
+        seg   = seg - seg.mean(axis=-1)[...,None] - slope[...,None]*self._tc
+        return np.fft.rfft(seg*self.window, n=self.nperseg, axis=-1)
+
+    # same as signal.welch, from the segment_fft of a series
+    def spectrum(self, X):
+        return (np.real(np.conjugate(X)*X)*self.scale*self._dbl).mean(axis=-2)
+
+    # same as signal.csd(x, y), from the segment_ffts of x and y
+    def cross_spectrum(self, X, Y):
+        return (np.conjugate(X)*Y*self.scale*self._dbl).mean(axis=-2)
+
+# the plans only depend on these, so keep one per process for each combination. window has to
+# be a name here so it can be part of the key
+_spectral_plans = {}
+def get_spectral_plan(fs, nperseg, noverlap=None, window='hamming'):
+    if noverlap is None: noverlap = nperseg//2
+    plan_key = (fs, nperseg, noverlap, window)
+    if plan_key not in _spectral_plans:
+        _spectral_plans[plan_key] = spectral_plan(fs, nperseg, noverlap, window)
+    return _spectral_plans[plan_key]
+
+# bin layout for the log-spaced band averaging of an nf point spectrum (nf/2+1 frequencies).
+#
+# with nbins=None this is the layout of the original while/for loop from grachev_fluxcapacitor:
+# each bin is exp(c1) times wider than the last and the nyquist frequency isn't used. with nbins
+# the bins are geometrically spaced instead, at most nbins of them (narrow bins at the low end
+# merge into single frequencies)
+#
+# returns the bin number of every frequency (nbins for the ones that aren't used), the number of
+# points in each bin, and the first/last index used for the bandwidth of each bin
+_log_bin_cache = {}
+def log_spaced_bins(nf, c1=0.1, nbins=None):
+
+    bin_key = (nf, c1, nbins)
+    if bin_key in _log_bin_cache: return _log_bin_cache[bin_key]
+
+    nfd2 = nf//2
+    lo   = []
+    hi   = []
+    if nbins is None:
+        jx = 0
+        dx = 1
+        ix = 0
+        while jx<nfd2 and ix<nfd2:
+            dx   = (dx*np.exp(c1))
+            d1   = np.int32(np.floor(dx))
+            stop = int(min(ix+d1, nfd2))
+            jx   = stop if ix+d1 > nfd2 else stop-1 # the loop index ends at nfd2 when it's cut short
+            lo.append(ix)
+            hi.append(jx)
+            ix = jx+1
+        stops = [min(h+1, nfd2) for h in hi]
+    else:
+        edges = np.unique(np.floor(np.geomspace(1, nfd2+1, nbins+1)).astype(np.int64)-1)
+        lo    = list(edges[:-1])
+        stops = list(edges[1:])
+        hi    = [s-1 for s in stops]
+
+    lo     = np.array(lo,    dtype=np.int64)
+    hi     = np.array(hi,    dtype=np.int64)
+    stops  = np.array(stops, dtype=np.int64)
+    k      = stops-lo
+    bin_id = np.full(nfd2+1, lo.size, dtype=np.int64)
+    for ib in range(0, lo.size): bin_id[lo[ib]:stops[ib]] = ib
+
+    _log_bin_cache[bin_key] = (bin_id, k, lo, hi)
+    return _log_bin_cache[bin_key]
+
+# log-spaced band averaging of spectra/cospectra (frequency along the last axis) with one
+# np.bincount over all of them. bincount adds each bin up in order starting from zero, the same
+# as the accumulators in the original loop, so on the default layout the result is bit-for-bit
+# the same. complex input (cospectra) is returned as the real part, scaled by 1/k like numpy
+# does when dividing a complex accumulator by k.
+#
+# returns the smoothed spectra, the mean frequency and the bandwidth of each bin
+def smooth_spectra(F, spectra, nf, c1=0.1, nbins=None):
+
+    bin_id, k, lo, hi = log_spaced_bins(nf, c1, nbins)
+    nb = k.size
+
+    spec = np.asarray(spectra)
+    rows = spec.reshape(-1, spec.shape[-1])
+    if np.iscomplexobj(rows): rows = rows.real
+
+    nrow = rows.shape[0]
+    ids  = (bin_id[None,:] + (nb+1)*np.arange(nrow)[:,None]).ravel()
+    sums = np.bincount(ids, weights=rows.ravel(), minlength=nrow*(nb+1)).reshape(nrow, nb+1)[:,0:nb]
+
+    if np.iscomplexobj(spec): smoothed = sums*(1.0/k)
+    else:                     smoothed = sums/k
+
+    fs  = np.bincount(bin_id, weights=F, minlength=nb+1)[0:nb]/k
+    dfs = F[hi]-F[lo]+F[1]
+
+    return smoothed.reshape(spec.shape[:-1]+(nb,)), fs, dfs
+
 # maybe this goes in a different file?
 def grachev_fluxcapacitor(z_level_n, metek, licor, h2ounit, co2unit, pr, temp, mr, verbose=False):
 
@@ -653,7 +1240,7 @@ def grachev_fluxcapacitor(z_level_n, metek, licor, h2ounit, co2unit, pr, temp, m
     min_pts = 2**13
     if npt < 8192:
         if npt!=7201: verboseprint(f'!!! no valid data on {metek.index[0]} for sonic at'+
-                                   f'height (np=={npt}<8192) {np.str(z_level_n)}')
+                                   f'height (np=={npt}<8192) {z_level_n}')
         # 7201 is the number of points you get if you cut a day by the previous hour like us, so it's not alarming
 
         # give the cols unique names (for netcdf later), give it a row of nans, and kick it back to the main
@@ -661,7 +1248,7 @@ def grachev_fluxcapacitor(z_level_n, metek, licor, h2ounit, co2unit, pr, temp, m
         turbulence_data.keys    = turbulence_data.keys()#+'_'+z_level_nominal
         #print(turbulence_data)
         turbulence_data.columns = turbulence_data.keys
-        turbulence_data         = turbulence_data.append([{turbulence_data.keys[0]: np.nan}])  
+        turbulence_data         = pd.concat([turbulence_data, pd.DataFrame([{turbulence_data.keys[0]: np.nan}])])  
         return turbulence_data
 
     # Reject the series of more than 50% of u- or v- or w-wind speed component are nan
@@ -671,9 +1258,9 @@ def grachev_fluxcapacitor(z_level_n, metek, licor, h2ounit, co2unit, pr, temp, m
         # !! what is the difference betwee dataframe keys and columns? baffled. just change them both.
         turbulence_data.keys    = turbulence_data.keys()#+'_'+z_level_nominal
         turbulence_data.columns = turbulence_data.keys
-        turbulence_data         = turbulence_data.append([{turbulence_data.keys[0]: nan}])       
+        turbulence_data         = pd.concat([turbulence_data, pd.DataFrame([{turbulence_data.keys[0]: nan}])])       
         return turbulence_data
-        verboseprint('  No valid data for sonic at height (>50% missing)  '+np.str(z_level_n))
+        verboseprint('  No valid data for sonic at height (>50% missing)  '+str(z_level_n))
 
     # Specical case for Licor. If the licor has inssufficient data, we still want to run the code for Hs so we will
     # set licor to -9999 so that nan-sensitive operations can complete then return it to nan at the end of the code
@@ -713,8 +1300,8 @@ def grachev_fluxcapacitor(z_level_n, metek, licor, h2ounit, co2unit, pr, temp, m
     if um == 0 and vm ==0 and wm ==0: #half hour of _zero_ wind? has to be bad data
         turbulence_data.keys    = turbulence_data.keys()#+'_'+z_level_nominal
         turbulence_data.columns = turbulence_data.keys
-        turbulence_data         = turbulence_data.append([{turbulence_data.keys[0]: nan}])
-        verboseprint('  Bad data for sonic at height {}'.format(np.str(z_level_n)))
+        turbulence_data         = pd.concat([turbulence_data, pd.DataFrame([{turbulence_data.keys[0]: nan}])])
+        verboseprint('  Bad data for sonic at height {}'.format(z_level_n))
         return turbulence_data
 
     # Rotate!
@@ -799,179 +1386,47 @@ def grachev_fluxcapacitor(z_level_n, metek, licor, h2ounit, co2unit, pr, temp, m
     # >>> Perform Fast Fourier Transform (FFT) to compute power spectra and cospectra:
     # In the following version linear detrend is used (no overlaping)
 
-    F,su = signal.welch(us-usm,10,signal.windows.hamming(nf),detrend='linear') # (psd = Power Spectral Density)
-    F,sv = signal.welch(vs-vsm,10,signal.windows.hamming(nf),detrend='linear')
-    F,sw = signal.welch(ws-wsm,10,signal.windows.hamming(nf),detrend='linear')
-    F,sT = signal.welch(Ts-Tsm,10,signal.windows.hamming(nf),detrend='linear')
-    F,sq = signal.welch(qs-qsm,10,signal.windows.hamming(nf),detrend='linear')
-    F,sc = signal.welch(cs-csm,10,signal.windows.hamming(nf),detrend='linear')
-    F,swu = signal.csd(ws-wsm,us-usm,10,signal.windows.hamming(nf),detrend='linear')   # (csd = Cross Spectral Density)
-    F,swv = signal.csd(ws-wsm,vs-vsm,10,signal.windows.hamming(nf),detrend='linear')
-    F,swT = signal.csd(ws-wsm,Ts-Tsm,10,signal.windows.hamming(nf),detrend='linear')
-    F,swq = signal.csd(ws-wsm,qs-qsm,10,signal.windows.hamming(nf),detrend='linear')
-    F,swc = signal.csd(ws-wsm,cs-csm,10,signal.windows.hamming(nf),detrend='linear')
+    # The window, detrending and scaling are the same for every call so they live in a cached plan, and
+    # each series is transformed once and reused for every spectrum/cospectrum it is part of. This is
+    # the same as signal.welch(x,10,signal.windows.hamming(nf),detrend='linear') and signal.csd(...)
+    plan = get_spectral_plan(10, nf)
+    F    = plan.freqs
+    Xu, Xv, Xw, XT, Xq, Xc, Xwdir = plan.segment_fft(np.stack([us-usm, vs-vsm, ws-wsm, Ts-Tsm, qs-qsm, cs-csm, wdirs-wdirsm]))
+
+    su = plan.spectrum(Xu) # (psd = Power Spectral Density)
+    sv = plan.spectrum(Xv)
+    sw = plan.spectrum(Xw)
+    sT = plan.spectrum(XT)
+    sq = plan.spectrum(Xq)
+    sc = plan.spectrum(Xc)
+    swu = plan.cross_spectrum(Xw,Xu)   # (csd = Cross Spectral Density)
+    swv = plan.cross_spectrum(Xw,Xv)
+    swT = plan.cross_spectrum(Xw,XT)
+    swq = plan.cross_spectrum(Xw,Xq)
+    swc = plan.cross_spectrum(Xw,Xc)
             
     # In addition to Chris' original code, computation of CuT, CvT, and Cuv are added by AG
     # Cospectra CuT & CvT are associated with the horizontal heat flux
-    F,suT = signal.csd(us-usm,Ts-Tsm,10,signal.windows.hamming(nf),detrend='linear')
-    F,svT = signal.csd(vs-vsm,Ts-Tsm,10,signal.windows.hamming(nf),detrend='linear')
-    F,suv = signal.csd(us-usm,vs-vsm,10,signal.windows.hamming(nf),detrend='linear')
-    F,suq = signal.csd(us-usm,qs-qsm,10,signal.windows.hamming(nf),detrend='linear')
-    F,svq = signal.csd(vs-vsm,qs-qsm,10,signal.windows.hamming(nf),detrend='linear')
-    F,suc = signal.csd(us-usm,cs-csm,10,signal.windows.hamming(nf),detrend='linear')
-    F,svc = signal.csd(vs-vsm,cs-csm,10,signal.windows.hamming(nf),detrend='linear')
+    suT = plan.cross_spectrum(Xu,XT)
+    svT = plan.cross_spectrum(Xv,XT)
+    suv = plan.cross_spectrum(Xu,Xv)
+    suq = plan.cross_spectrum(Xu,Xq)
+    svq = plan.cross_spectrum(Xv,Xq)
+    suc = plan.cross_spectrum(Xu,Xc)
+    svc = plan.cross_spectrum(Xv,Xc)
     
 
     # Also spectrum of wind speed direction is added (AG)
-    F,swdir = signal.welch(wdirs-wdirsm,10,signal.windows.hamming(nf),detrend='linear')
-
-    # Spectra smoothing
-    nfd2 = nf/2
-    c1   = 0.1
-    jx   = 0
-    dx   = 1
-    ix   = 0
-    inx  = 0
-           
-    sus    = np.zeros(int(nfd2), dtype=complex)
-    svs    = np.zeros(int(nfd2), dtype=complex)
-    sws    = np.zeros(int(nfd2), dtype=complex)
-    sTs    = np.zeros(int(nfd2), dtype=complex)
-    sqs    = np.zeros(int(nfd2), dtype=complex)
-    scs    = np.zeros(int(nfd2), dtype=complex)
-    cwus   = np.zeros(int(nfd2), dtype=complex)
-    cwvs   = np.zeros(int(nfd2), dtype=complex)
-    cwTs   = np.zeros(int(nfd2), dtype=complex)
-    cuTs   = np.zeros(int(nfd2), dtype=complex)
-    cvTs   = np.zeros(int(nfd2), dtype=complex)
-    cwqs   = np.zeros(int(nfd2), dtype=complex)
-    cuqs   = np.zeros(int(nfd2), dtype=complex)
-    cvqs   = np.zeros(int(nfd2), dtype=complex)
-    cwcs   = np.zeros(int(nfd2), dtype=complex)
-    cucs   = np.zeros(int(nfd2), dtype=complex)
-    cvcs   = np.zeros(int(nfd2), dtype=complex)
-    cuvs   = np.zeros(int(nfd2), dtype=complex)
-    swdirs = np.zeros(int(nfd2), dtype=complex)
-    fs     = np.zeros(int(nfd2), dtype=complex)
-    dfs    = np.zeros(int(nfd2), dtype=complex)
-
-    while jx<nfd2:
-        dx     = (dx*np.exp(c1))
-        d1     = np.int32(np.floor(dx))
-        acu    = 0
-        acv    = 0
-        acw    = 0
-        acT    = 0
-        acq    = 0
-        acc    = 0
-        acwu   = 0
-        acwv   = 0
-        acwT   = 0
-        acuT   = 0
-        acvT   = 0
-        acwq   = 0
-        acuq   = 0
-        acvq   = 0
-        acwc   = 0
-        acuc   = 0
-        acvc   = 0
-        acuv   = 0
-        acwdir = 0
-        ac2    = 0
-        k=0
-        for jx in range(ix,ix+d1):
-            if (jx==nfd2):
-                break
-            acu    = acu+su[jx]
-            acv    = acv+sv[jx]
-            acw    = acw+sw[jx]
-            acT    = acT+sT[jx]
-            acq    = acq+sq[jx]
-            acc    = acc+sc[jx]
-            acwu   = acwu+swu[jx]
-            acwv   = acwv+swv[jx]
-            acwT   = acwT+swT[jx]
-            acuT   = acuT+suT[jx]
-            acvT   = acvT+svT[jx]
-            acwq   = acwq+swq[jx]
-            acuq   = acuq+suq[jx]
-            acvq   = acvq+svq[jx]
-            acwc   = acwc+swc[jx]
-            acuc   = acuc+suc[jx]
-            acvc   = acvc+svc[jx]
-            acuv   = acuv+suv[jx]
-            acwdir = acwdir+swdir[jx]
-            ac2    = ac2+F[jx]
-            k=k+1    
-
-        sus[inx] = acu/k   
-        svs[inx] = acv/k   
-        sws[inx] = acw/k   
-        sTs[inx] = acT/k   
-        sqs[inx] = acq/k 
-        scs[inx] = acc/k 
-        cwus[inx] = acwu/k 
-        cwvs[inx] = acwv/k
-        cwTs[inx] = acwT/k
-        cuTs[inx] = acuT/k
-        cvTs[inx] = acvT/k
-        cwqs[inx] = acwq/k
-        cuqs[inx] = acuq/k
-        cvqs[inx] = acvq/k
-        cwcs[inx] = acwc/k
-        cucs[inx] = acuc/k
-        cvcs[inx] = acvc/k
-        cuvs[inx] = acuv/k
-        swdirs[inx]=acwdir/k
-        fs[inx]=ac2/k
-        dfs[inx]=F[jx]-F[ix]+F[1]
-        ix=jx+1
-        inx=inx+1
-    
-    sus = sus[0:inx]
-    svs = svs[0:inx]
-    sws = sws[0:inx]
-    sTs = sTs[0:inx]
-    sqs = sqs[0:inx]
-    scs = scs[0:inx]
-    cwus = cwus[0:inx]
-    cwvs = cwvs[0:inx]
-    cwTs = cwTs[0:inx]
-    cuTs = cuTs[0:inx]
-    cvTs = cvTs[0:inx]
-    cwqs = cwqs[0:inx]
-    cuqs = cuqs[0:inx]
-    cvqs = cvqs[0:inx]
-    cwcs = cwcs[0:inx]
-    cucs = cucs[0:inx]
-    cvcs = cvcs[0:inx]
-    cuvs = cuvs[0:inx]
-    swdirs = swdirs[0:inx]
-    fs = fs[0:inx]
-    dfs = dfs[0:inx]
-    
-    # take the real part
-    sus    = np.real(sus)
-    svs    = np.real(svs)
-    sws    = np.real(sws)
-    sTs    = np.real(sTs)
-    sqs    = np.real(sqs)
-    scs    = np.real(scs)
-    cwus   = np.real(cwus)
-    cwvs   = np.real(cwvs)
-    cwTs   = np.real(cwTs)
-    cuTs   = np.real(cuTs)
-    cvTs   = np.real(cvTs)
-    cwqs   = np.real(cwqs)
-    cuqs   = np.real(cuqs)
-    cvqs   = np.real(cvqs)
-    cwcs   = np.real(cwcs)
-    cucs   = np.real(cucs)
-    cvcs   = np.real(cvcs)
-    cuvs   = np.real(cuvs)
-    swdirs = np.real(swdirs)
-    fs     = np.real(fs)
-    dfs    = np.real(dfs)
+    swdir = plan.spectrum(Xwdir)
+
+    # Spectra smoothing, averages in log-spaced frequency bands. this used to be a while loop with a
+    # running sum for every spectrum, smooth_spectra() does them all at once with the same result
+    spec_sm, fs, dfs = smooth_spectra(F, np.stack([su, sv, sw, sT, sq, sc, swdir]), nf)
+    sus, svs, sws, sTs, sqs, scs, swdirs = spec_sm
+
+    # cospectra are complex, the real part is taken
+    cosp_sm, fs, dfs = smooth_spectra(F, np.stack([swu, swv, swT, suT, svT, swq, suq, svq, swc, suc, svc, suv]), nf)
+    cwus, cwvs, cwTs, cuTs, cvTs, cwqs, cuqs, cvqs, cwcs, cucs, cvcs, cuvs = cosp_sm
 
     #+++++++++++++++++++++++++++++ Wind speed and direction ++++++++++++++++++++++++++++++++++++
     wsp = (um**2 + vm**2 + wm**2)**0.5       # hour averaged wind speed (m/s)
@@ -1120,7 +1575,7 @@ def grachev_fluxcapacitor(z_level_n, metek, licor, h2ounit, co2unit, pr, temp, m
     if not -0.01 < Cd < 0.05: 
         turbulence_data.keys    = turbulence_data.keys()#+'_'+z_level_nominal
         turbulence_data.columns = turbulence_data.keys
-        turbulence_data         = turbulence_data.append([{turbulence_data.keys[0]: nan}])
+        turbulence_data         = pd.concat([turbulence_data, pd.DataFrame([{turbulence_data.keys[0]: nan}])])
         verboseprint(f'  Bad Cd outside bounds {Cd}')
         return turbulence_data
 
@@ -1648,7 +2103,7 @@ def grachev_fluxcapacitor(z_level_n, metek, licor, h2ounit, co2unit, pr, temp, m
     #
     # End of calculations. Now output something
     #
-    turbulence_data = turbulence_data.append([{ \
+    turbulence_data = pd.concat([turbulence_data, pd.DataFrame([{ \
         'WU_csp': wu_csp,'WV_csp': wv_csp,'UV_csp': uv_csp,'ustar': ustar,'WT_csp': wT_csp,'UT_csp': uT_csp,'VT_csp': vT_csp,'Wq_csp': wq_csp,'Uq_csp': uq_csp,'Vq_csp': vq_csp,'Wc_csp': wc_csp,'Uc_csp': uc_csp,'Vc_csp': vc_csp, \
         'Hs': Hs,'Hl':Hl,'Hl_Webb':Hl_Webb,'CO2_flux':CO2_flux,'CO2_flux_Webb':CO2_flux_Webb,'Tstar': Tstar,'zeta_level_n': zeta_level_n,'Cd': Cd, \
         'phi_U': phi_u,'phi_V': phi_v,'phi_W': phi_w,'phi_T': phi_T,'phi_UT': phi_uT, \
@@ -1658,7 +2113,7 @@ def grachev_fluxcapacitor(z_level_n, metek, licor, h2ounit, co2unit, pr, temp, m
         'Phi_NT': Phi_Nt, \
         'sigU': urs, 'sigV': vrs, 'sigW': wrs, \
         'DeltaU': Deltau,'DeltaV': Deltav,'DeltaT': DeltaT,'Deltaq': Deltaq,'Deltac': Deltac, \
-        'sUs': pd.Series(sus),'sVs':pd.Series(svs),'sWs':pd.Series(sws),'sTs':pd.Series(sTs),'sqs':pd.Series(sqs),'scs':pd.Series(scs),'cWUs':pd.Series(cwus),'cWVs':pd.Series(cwvs),'cWTs':pd.Series(cwTs),'cUTs':pd.Series(cuTs),'cVTs':pd.Series(cvTs),'cWqs':pd.Series(cwqs),'cUqs':pd.Series(cuqs),'cVqs':pd.Series(cvqs),'cWcs':pd.Series(cwcs),'cUcs':pd.Series(cucs),'cVcs':pd.Series(cvcs),'cUVs':pd.Series(cuvs),'fs':pd.Series(fs)}])      
+        'sUs': pd.Series(sus),'sVs':pd.Series(svs),'sWs':pd.Series(sws),'sTs':pd.Series(sTs),'sqs':pd.Series(sqs),'scs':pd.Series(scs),'cWUs':pd.Series(cwus),'cWVs':pd.Series(cwvs),'cWTs':pd.Series(cwTs),'cUTs':pd.Series(cuTs),'cVTs':pd.Series(cvTs),'cWqs':pd.Series(cwqs),'cUqs':pd.Series(cuqs),'cVqs':pd.Series(cvqs),'cWcs':pd.Series(cwcs),'cUcs':pd.Series(cucs),'cVcs':pd.Series(cvcs),'cUVs':pd.Series(cuvs),'fs':pd.Series(fs)}])])      
 
     # # we need to give the columns unique names for the netcdf build later...
     # !! what is the difference betwee dataframe keys and columns? baffled. just change them both.
@@ -1669,6 +2124,473 @@ def grachev_fluxcapacitor(z_level_n, metek, licor, h2ounit, co2unit, pr, temp, m
 
     return turbulence_data
 
+# the column layout written by grachev_fluxcapacitor, in order. the batched version below returns
+# the same fields so the two can be swapped without touching the netcdf writers
+turb_scalar_names  = ['Hs', 'Hl', 'Hl_Webb', 'CO2_flux', 'CO2_flux_Webb', 'Cd', 'ustar', 'Tstar', 'zeta_level_n',
+                      'WU_csp', 'WV_csp', 'UV_csp', 'WT_csp', 'UT_csp', 'VT_csp',
+                      'Wq_csp', 'Uq_csp', 'Vq_csp', 'Wc_csp', 'Uc_csp', 'Vc_csp',
+                      'phi_U', 'phi_V', 'phi_W', 'phi_T', 'phi_UT',
+                      'epsilon_U', 'epsilon_V', 'epsilon_W', 'epsilon', 'Phi_epsilon',
+                      'nSU', 'nSV', 'nSW', 'nST', 'nSq', 'nSc', 'NT', 'Phi_NT',
+                      'sigU', 'sigV', 'sigW', 'Phix',
+                      'DeltaU', 'DeltaV', 'DeltaT', 'Deltaq', 'Deltac']
+turb_spectra_names = ['sUs', 'sVs', 'sWs', 'sTs', 'sqs', 'scs',
+                      'cWUs', 'cWVs', 'cWTs', 'cUTs', 'cVTs', 'cWqs', 'cUqs', 'cVqs', 'cWcs', 'cUcs', 'cVcs', 'cUVs',
+                      'fs']
+
+# row-wise version of despik() for a (windows x samples) array, same quirks as the original
+# (the lowest value and the value at the upper cutoff are always set to the median)
+def despik_rows(uraw):
+
+    uz  = np.array(uraw, dtype=np.float64)
+    npt = uz.shape[1]
+
+    order = np.argsort(uz, axis=1) # nans sort to the end, just like in despik()
+    uu    = np.take_along_axis(uz, order, axis=1)
+
+    mu   = uu[:, int(np.floor(npt/2))]
+    sig  = (uu[:, int(np.floor(0.84*npt))]-uu[:, int(np.floor(0.16*npt))])/2
+    dsig = np.maximum(4*sig, 0.5)
+
+    # the while loops in despik() walk in from both ends until they are within dsig of the median
+    with np.errstate(invalid='ignore'):
+        in_lo = ~(np.abs(mu[:,None]-uu[:,1:]) > dsig[:,None])
+        in_hi = ~(np.abs(uu-mu[:,None])       > dsig[:,None])
+    im = 1 + np.argmax(in_lo, axis=1)
+    ip = npt-1 - np.argmax(in_hi[:,::-1], axis=1)
+
+    pos = np.arange(npt)[None,:]
+    uu  = np.where((pos < im[:,None]) | (pos >= ip[:,None]), mu[:,None], uu)
+
+    np.put_along_axis(uz, order, uu, axis=1)
+    return uz
+
+# the same calculations as grachev_fluxcapacitor, but for all of the (regularly gridded) windows
+# of a day at once. the 10 Hz data is cut into a (windows x samples) array and everything is done
+# along the sample axis in one pass instead of building a dataframe for every window.
+#
+# win_starts/win_ends are the edges of each window (inclusive, like .loc), pr/temp/mr can be
+# scalars or one value per window. the windows are found in metek's index and licor's rows are
+# taken at the same positions, so licor has to be on exactly the same 10 Hz index as metek. windows that don't have the full number of samples get nans
+# if they're too short (like the original) or are handed to grachev_fluxcapacitor otherwise.
+#
+# returns a numpy record array, one record per window, with the fields turb_scalar_names and
+# the spectra in turb_spectra_names as (freq) subarrays. turb_record_to_dataframe() converts
+# it to what grachev_fluxcapacitor returns, appended together
+def grachev_fluxcapacitor_batched(z_level_n, metek, licor, h2ounit, co2unit, pr, temp, mr,
+                                  win_starts, win_ends, verbose=False):
+
+    # define the verbose print option
+    v_print      = print if verbose else lambda *a, **k: None
+    verboseprint = v_print
+    nan          = np.NaN
+
+    samp_freq = 10
+    min_pts   = 2**13
+
+    nwin = len(win_starts)
+    pr   = np.array(np.broadcast_to(np.asarray(pr,   dtype=np.float64), (nwin,)))
+    temp = np.array(np.broadcast_to(np.asarray(temp, dtype=np.float64), (nwin,)))
+    mr   = np.array(np.broadcast_to(np.asarray(mr,   dtype=np.float64), (nwin,)))
+
+    # where does each window sit in the 10 Hz index? .loc slicing includes both ends
+    i_beg   = metek.index.searchsorted(pd.DatetimeIndex(win_starts), side='left')
+    i_end   = metek.index.searchsorted(pd.DatetimeIndex(win_ends),   side='right')
+    npt_win = i_end-i_beg
+    npt     = int(np.bincount(npt_win).argmax()) if nwin > 0 else 0 # the nominal window length
+
+    if   npt < 16384: nf = 2**13
+    elif npt < 32768: nf = 2**14
+    else:             nf = 2**15
+
+    # the frequency vector and the smoothing don't depend on the data, so do them once
+    F              = get_spectral_plan(samp_freq, nf).freqs
+    _, fs, dfs     = smooth_spectra(F, np.zeros((1, F.size)), nf)
+    nfreq          = fs.size
+
+    rec_dtype = [(n, np.float64) for n in turb_scalar_names] + [(n, np.float64, (nfreq,)) for n in turb_spectra_names]
+    turb_rec  = np.zeros(nwin, dtype=rec_dtype).view(np.recarray)
+    for n in turb_scalar_names+turb_spectra_names[:-1]: turb_rec[n] = nan
+    turb_rec['fs'] = fs
+
+    full_win = (npt_win == npt) & (npt >= min_pts)
+    odd_win  = np.where(~full_win & (npt_win >= min_pts))[0]
+    calc_i   = np.where(full_win)[0]
+
+    # odd sized windows are rare (edge of the data), leave them to the original code
+    for iw in odd_win:
+        odd_data = grachev_fluxcapacitor(z_level_n, metek.iloc[i_beg[iw]:i_end[iw]].copy(),
+                                         licor.iloc[i_beg[iw]:i_end[iw]].copy(), h2ounit, co2unit,
+                                         pr[iw], temp[iw], mr[iw], verbose=verbose)
+        for n in turb_scalar_names: turb_rec[n][iw] = odd_data[n].iloc[0]
+        for n in turb_spectra_names:
+            odd_spec = np.array(odd_data[n].iloc[0], dtype=np.float64)
+            if odd_spec.size == nfreq: turb_rec[n][iw] = odd_spec
+
+    if calc_i.size == 0:
+        verboseprint(f'!!! no valid windows for sonic at height {z_level_n}')
+        return turb_rec
+
+    samp_i = i_beg[calc_i][:,None] + np.arange(npt)[None,:]
+    U = metek['u'].to_numpy(dtype=np.float64)[samp_i]
+    V = metek['v'].to_numpy(dtype=np.float64)[samp_i]
+    W = metek['w'].to_numpy(dtype=np.float64)[samp_i]
+    T = metek['T'].to_numpy(dtype=np.float64)[samp_i]
+    Q = licor['licor_h2o'].to_numpy(dtype=np.float64)[samp_i]
+    C = licor['licor_co2'].to_numpy(dtype=np.float64)[samp_i]
+
+    pr   = pr[calc_i]
+    temp = temp[calc_i]
+    mr   = mr[calc_i]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+
+        # pandas style means, skipping nans. all nan rows give nan
+        def row_mean(x):
+            n_ok = np.sum(~np.isnan(x), axis=1)
+            return np.where(n_ok > 0, np.nansum(x, axis=1)/n_ok, nan)
+
+        mr[np.isnan(mr)] = 0
+        pr[np.isnan(pr)] = 1013
+        temp             = np.where(np.isnan(temp), row_mean(T), temp)
+
+        #++++++++++++++++++++++++ Important constants and equations ++++++++++++++++++++++++++++++++
+        tdk   = 273.15
+        Rd    = 287.1
+        Rv    = 461
+        pp_wv = mr / (mr + 0.622) * pr*100
+        rho_d = ((pr*100)-pp_wv)/(Rd*(temp+tdk))
+        rho_v = pp_wv/(Rv*(temp+tdk))
+        rho   = rho_d + rho_v
+        sigma = rho_v/rho_d
+        cp    = 1005.6+0.017211*temp+0.000392*temp**2
+        Le    = (2.501-.00237*temp)*1e6
+        M_h2o = 18.01528/1000
+        M_co2 = 44.01/1000
+
+        # get the gases into the right units
+        if 'g/m3' in h2ounit:
+            Q = Q/1000
+        elif 'mmol/m3' in h2ounit:
+            Q = Q/1000 * M_h2o
+        if 'mmol/m3' in co2unit:
+            C = (C/1000 * M_co2)*1e6 # mg/m3 is left as is
+        Q = Q / rho[:,None]
+
+        # despike following Fairall et al., T twice like the original
+        U = despik_rows(U)
+        V = despik_rows(V)
+        W = despik_rows(W)
+        T = despik_rows(T)
+        Q = despik_rows(Q)
+        T = despik_rows(T)
+
+        # reject windows where more than 50% of u, v, w or T are nan
+        nan_lim = np.floor((npt/2)-2)
+        bad     = (np.sum(np.isnan(U), axis=1) >= nan_lim) | (np.sum(np.isnan(V), axis=1) >= nan_lim) | \
+                  (np.sum(np.isnan(W), axis=1) >= nan_lim) | (np.sum(np.isnan(T), axis=1) >= nan_lim)
+
+        # licor gets -9999 so that the sonic calculations can complete, set back to nan at the end
+        licor_missing = np.sum(np.isnan(Q), axis=1) > nan_lim
+        Q[licor_missing,:] = -9999.
+        C[licor_missing,:] = -9999.
+
+        # replace inf and nan with the mean of the window
+        for x in (U, V, W, T, Q):
+            x[np.isinf(x)] = nan
+        for x in (U, V, W, T, Q, C):
+            x_mean = row_mean(x)
+            np.copyto(x, np.broadcast_to(x_mean[:,None], x.shape), where=np.isnan(x))
+
+        um = U.mean(axis=1)
+        vm = V.mean(axis=1)
+        wm = W.mean(axis=1)
+
+        bad |= (um == 0) & (vm == 0) & (wm == 0) # zero wind, bad data
+
+        # double rotation into the streamline
+        thet = np.arctan2(vm,um)
+        ss   = (um**2+vm**2)**0.5
+        phi  = np.arctan2(wm,ss)
+        cph  = np.cos(phi)[:,None]
+        sph  = np.sin(phi)[:,None]
+        cth  = np.cos(thet)[:,None]
+        sth  = np.sin(thet)[:,None]
+        U, V, W = cph*cth*U + cph*sth*V + sph*W, -sth*U + cth*V, -sph*cth*U - sph*sth*V + cph*W
+
+        urs = U.std(axis=1)
+        vrs = V.std(axis=1)
+        wrs = W.std(axis=1)
+
+        # the fft segment and its means
+        us = U[:,0:nf]
+        vs = V[:,0:nf]
+        ws = W[:,0:nf]
+        Ts = T[:,0:nf]
+        qs = Q[:,0:nf]
+        cs = C[:,0:nf]
+
+        usm = us.mean(axis=1)
+        vsm = vs.mean(axis=1)
+        wsm = ws.mean(axis=1)
+        Tsm = Ts.mean(axis=1)
+        qsm = qs.mean(axis=1)
+        csm = cs.mean(axis=1)
+
+        usd = us-usm[:,None]
+        vsd = vs-vsm[:,None]
+        wsd = ws-wsm[:,None]
+        Tsd = Ts-Tsm[:,None]
+        qsd = qs-qsm[:,None]
+        csd = cs-csm[:,None]
+
+        # spectra and cospectra for every window at once, each series is transformed once
+        plan = get_spectral_plan(samp_freq, nf)
+        Xu, Xv, Xw, XT, Xq, Xc = plan.segment_fft(np.stack([usd, vsd, wsd, Tsd, qsd, csd]))
+        auto  = np.stack([plan.spectrum(Xu), plan.spectrum(Xv), plan.spectrum(Xw),
+                          plan.spectrum(XT), plan.spectrum(Xq), plan.spectrum(Xc)])
+        cross = np.stack([plan.cross_spectrum(Xw,Xu), plan.cross_spectrum(Xw,Xv), plan.cross_spectrum(Xw,XT),
+                          plan.cross_spectrum(Xu,XT), plan.cross_spectrum(Xv,XT), plan.cross_spectrum(Xw,Xq),
+                          plan.cross_spectrum(Xu,Xq), plan.cross_spectrum(Xv,Xq), plan.cross_spectrum(Xw,Xc),
+                          plan.cross_spectrum(Xu,Xc), plan.cross_spectrum(Xv,Xc), plan.cross_spectrum(Xu,Xv)])
+
+        # log-spaced smoothing, same as the single window version
+        auto,  fs, dfs = smooth_spectra(F, auto,  nf)
+        cross, fs, dfs = smooth_spectra(F, cross, nf)
+        spec = np.concatenate([auto, cross])
+        sus, svs, sws, sTs, sqs, scs, cwus, cwvs, cwTs, cuTs, cvTs, cwqs, cuqs, cvqs, cwcs, cucs, cvcs, cuvs = spec
+
+        wsp = (um**2 + vm**2 + wm**2)**0.5
+
+        # fluxes and standard deviations from the (co)spectra integration
+        wu_csp, wv_csp, wT_csp, uT_csp, vT_csp, wq_csp, uq_csp, vq_csp, wc_csp, uc_csp, vc_csp, uv_csp = \
+            np.sum(spec[6:]*dfs, axis=-1)
+        sigu_spc, sigv_spc, sigw_spc, sigT_spc = np.sum(spec[0:4]*dfs, axis=-1)**0.5
+
+        ustar = -np.sign(wu_csp)*(np.abs(wu_csp))**0.5
+
+        Hs            = wT_csp*rho*cp
+        Hl            = wq_csp*Le*rho
+        Hl_Webb       = Hl+(Le*qsm*(1.61*wq_csp/rho_d+(1+1.61*sigma)*wT_csp/(temp+tdk)))
+        CO2_flux      = wc_csp.copy()
+        CO2_flux_Webb = CO2_flux + (csm*(1.61*wq_csp/rho_d+(1+1.61*sigma)*wT_csp/(temp+tdk)))
+        Tstar         = -wT_csp/np.abs(ustar)
+
+        # inertial subrange, same (0 based) indices as grachev_fluxcapacitor
+        if   npt < 16384: fsi01 = 40-1
+        elif npt < 32768: fsi01 = 47-1
+        else:             fsi01 = 54-1
+        fsi12 = fsi01+11
+        isr   = slice(fsi01, fsi12)
+
+        zeta_level_n = - ((0.4*9.81)/(Tsm+tdk))*(z_level_n*wT_csp/(ustar**3))
+        Cd           = - wu_csp/(wsp**2)
+
+        # add reasonable cut on cd and return nans if outside
+        bad |= ~((-0.01 < Cd) & (Cd < 0.05))
+
+        phi_u  = sigu_spc/ustar
+        phi_v  = sigv_spc/ustar
+        phi_w  = sigw_spc/ustar
+        phi_T  = sigT_spc/np.abs(Tstar)
+        phi_uT = uT_csp/wT_csp
+
+        gfac = 4*(2*np.pi/wsp)**0.667
+        cu2  = gfac*np.median(sus[:,isr]*fs[isr]**1.667, axis=1)
+        cv2  = gfac*np.median(svs[:,isr]*fs[isr]**1.667, axis=1)
+        cw2  = gfac*np.median(sws[:,isr]*fs[isr]**1.667, axis=1)
+        cT2  = gfac*np.median((sTs[:,isr]-np.min(sTs, axis=1)[:,None])*fs[isr]**1.667, axis=1)
+
+        alphaK      = 0.55
+        epsilon_u   = (cu2/(4*alphaK))**(3/2)
+        epsilon_v   = (3/4)*(cv2/(4*alphaK))**(3/2)
+        epsilon_w   = (3/4)*(cw2/(4*alphaK))**(3/2)
+        epsilon     = np.median(np.stack([epsilon_u,epsilon_v,epsilon_w]), axis=0)
+        Phi_epsilon = (0.4*z_level_n*epsilon)/(ustar**3)
+
+        betaK  = 0.8
+        Nt     = (cT2*(epsilon**(1/3)))/(4*betaK)
+        Phi_Nt = (0.4*z_level_n*Nt)/(ustar*Tstar**2)
+
+        # median of the six spectral slopes in the inertial subrange
+        lo = np.arange(fsi01, fsi01+6)
+        hi = lo+6
+        def isr_slope(s_hi, s_lo):
+            return np.median(np.log(s_hi[:,hi]/s_lo[:,lo])/np.log(fs[hi]/fs[lo]), axis=1)
+        nSu = isr_slope(sus, sus)
+        nSv = isr_slope(svs, svs)
+        nSw = isr_slope(sws, sws)
+        nSt = isr_slope(sTs, sTs)
+        nSq = isr_slope(sqs, sqs)
+        nSc = isr_slope(scs, sqs) # sic, matches the original
+
+        # non-stationarity, the change across the linear trend of the segment
+        tt    = np.arange(nf)-(nf-1)/2
+        def trend_delta(x):
+            return (np.sum(tt*(x-x.mean(axis=1)[:,None]), axis=1)/np.sum(tt*tt))*(nf-1)
+        Deltau = trend_delta(us)
+        Deltav = trend_delta(vs)
+        DeltaT = trend_delta(Ts)
+        Deltaq = trend_delta(qs)
+        Deltac = trend_delta(cs)
+
+        # if we are missing licor data, make those nan
+        lm = licor_missing
+        for x in (wq_csp, uq_csp, vq_csp, Hl, Hl_Webb, CO2_flux, CO2_flux_Webb, nSq, nSc, Deltaq, Deltac):
+            x[lm] = nan
+        for x in (sqs, cwqs, cuqs, cvqs, scs, cwcs, cucs, cvcs):
+            x[lm,:] = nan
+
+    calc_vals = {
+        'Hs': Hs, 'Hl': Hl, 'Hl_Webb': Hl_Webb, 'CO2_flux': CO2_flux, 'CO2_flux_Webb': CO2_flux_Webb, 'Cd': Cd,
+        'ustar': ustar, 'Tstar': Tstar, 'zeta_level_n': zeta_level_n,
+        'WU_csp': wu_csp, 'WV_csp': wv_csp, 'UV_csp': uv_csp, 'WT_csp': wT_csp, 'UT_csp': uT_csp, 'VT_csp': vT_csp,
+        'Wq_csp': wq_csp, 'Uq_csp': uq_csp, 'Vq_csp': vq_csp, 'Wc_csp': wc_csp, 'Uc_csp': uc_csp, 'Vc_csp': vc_csp,
+        'phi_U': phi_u, 'phi_V': phi_v, 'phi_W': phi_w, 'phi_T': phi_T, 'phi_UT': phi_uT,
+        'epsilon_U': epsilon_u, 'epsilon_V': epsilon_v, 'epsilon_W': epsilon_w, 'epsilon': epsilon,
+        'Phi_epsilon': Phi_epsilon, 'nSU': nSu, 'nSV': nSv, 'nSW': nSw, 'nST': nSt, 'nSq': nSq, 'nSc': nSc,
+        'NT': Nt, 'Phi_NT': Phi_Nt, 'sigU': urs, 'sigV': vrs, 'sigW': wrs,
+        'DeltaU': Deltau, 'DeltaV': Deltav, 'DeltaT': DeltaT, 'Deltaq': Deltaq, 'Deltac': Deltac,
+        'sUs': sus, 'sVs': svs, 'sWs': sws, 'sTs': sTs, 'sqs': sqs, 'scs': scs,
+        'cWUs': cwus, 'cWVs': cwvs, 'cWTs': cwTs, 'cUTs': cuTs, 'cVTs': cvTs, 'cWqs': cwqs, 'cUqs': cuqs,
+        'cVqs': cvqs, 'cWcs': cwcs, 'cUcs': cucs, 'cVcs': cvcs, 'cUVs': cuvs}
+
+    # 'Phix' is never filled by the original either, so it stays nan
+    good_i = calc_i[~bad]
+    for n, vals in calc_vals.items():
+        turb_rec[n][good_i] = vals[~bad]
+
+    verboseprint(f'... {good_i.size} of {nwin} windows with valid fluxes for sonic at height {z_level_n}')
+    return turb_rec
+
+# takes the record array from grachev_fluxcapacitor_batched and returns a dataframe in the layout of
+# grachev_fluxcapacitor output (spectra as series in each cell), indexed by 'time_index'. with
+# with_spectra=False only the scalar columns are returned, keep the spectra in a turb_spectra
+def turb_record_to_dataframe(turb_rec, time_index, with_spectra=True):
+
+    turb_dict = {}
+    for n in turb_scalar_names:
+        turb_dict[n] = turb_rec[n]
+    if with_spectra:
+        for n in turb_spectra_names:
+            turb_dict[n] = [pd.Series(s) for s in turb_rec[n]]
+
+    return pd.DataFrame(turb_dict, index=time_index)
+
+class turb_spectra(object):
+
+    __doc__ = """
+
+    Dense storage for the smoothed spectra/cospectra from the flux calculations. Every spectrum
+    is one contiguous float32 (time, freq) array sharing a single frequency vector, instead of
+    a pd.Series in every dataframe cell. Rows are windows, missing windows are nan rows, so the
+    arrays can go straight into a (time, freq) netcdf variable.
+
+    Appending only keeps a list of blocks, they're stitched together the first time the data
+    is asked for.
+
+    Parameters:
+    ----------
+    freqs : frequency vector [Hz]
+    names : spectra to store, turb_spectra_names without 'fs' by default
+
+    Example:
+    -------
+    turb_spec = turb_spectra.from_record(turb_rec, flux_time_index)
+    turb_spec.append(other_spec)
+    day_spec  = turb_spec.between(today, tomorrow).reindex(day_index)
+    var[:]    = day_spec['sUs']
+
+    ================================================================================================
+
+    """
+
+    def __init__(self, freqs, names=None):
+
+        if names is None: names = [n for n in turb_spectra_names if n != 'fs']
+
+        self.freqs   = np.asarray(freqs, dtype=np.float32)
+        self.names   = list(names)
+        self._blocks = [] # (times, {name: 2d array}) waiting to be stitched together
+        self._times  = pd.DatetimeIndex([])
+        self._data   = {n: np.empty((0, self.freqs.size), dtype=np.float32) for n in self.names}
+
+    # build from the record array returned by grachev_fluxcapacitor_batched
+    @classmethod
+    def from_record(cls, turb_rec, time_index):
+        spec = cls(turb_rec['fs'][0] if len(turb_rec) > 0 else [])
+        spec.append(time_index, {n: turb_rec[n] for n in spec.names})
+        return spec
+
+    # put a list of these together end to end
+    @classmethod
+    def concat(cls, spec_list):
+        spec = cls(spec_list[0].freqs, spec_list[0].names)
+        for s in spec_list: spec.append(s)
+        return spec
+
+    def append(self, times, spec_dict=None):
+        if isinstance(times, turb_spectra):
+            times, spec_dict = times.times, {n: times[n] for n in self.names}
+        self._blocks.append((pd.DatetimeIndex(times),
+                             {n: np.asarray(spec_dict[n], dtype=np.float32) for n in self.names}))
+
+    def _consolidate(self):
+        if not self._blocks: return
+        self._times = self._times.append([b[0] for b in self._blocks])
+        for n in self.names:
+            self._data[n] = np.ascontiguousarray(np.concatenate([self._data[n]]+[b[1][n] for b in self._blocks]))
+        self._blocks = []
+
+        # keep it in time order, like the dataframes it travels with
+        if not self._times.is_monotonic_increasing:
+            order = np.argsort(self._times.values, kind='stable')
+            self._times = self._times[order]
+            for n in self.names: self._data[n] = self._data[n][order]
+
+    @property
+    def times(self):
+        self._consolidate()
+        return self._times
+
+    def __contains__(self, name):
+        return name == 'fs' or name in self.names
+
+    # the (time, freq) array for a spectrum, not a copy. 'fs' gives the frequency vector
+    def __getitem__(self, name):
+        if name == 'fs': return self.freqs
+        self._consolidate()
+        return self._data[name]
+
+    def __len__(self):
+        return len(self.times)
+
+    # rows with t0 <= time <= t1, like .loc[t0:t1]. views, not copies
+    def between(self, t0, t1):
+        times = self.times
+        i0    = times.searchsorted(t0, side='left')
+        i1    = times.searchsorted(t1, side='right')
+        spec  = turb_spectra(self.freqs, self.names)
+        spec._times = times[i0:i1]
+        spec._data  = {n: self._data[n][i0:i1] for n in self.names}
+        return spec
+
+    # rows for time_index, nan rows where there were no spectra (missing windows)
+    def reindex(self, time_index):
+        time_index = pd.DatetimeIndex(time_index)
+        times      = self.times
+        if times.equals(time_index): return self
+        row_i = times.get_indexer(time_index)
+        found = row_i >= 0
+        spec  = turb_spectra(self.freqs, self.names)
+        spec._times = time_index
+        for n in self.names:
+            arr = np.full((len(time_index), self.freqs.size), np.nan, dtype=np.float32)
+            arr[found] = self._data[n][row_i[found]]
+            spec._data[n] = arr
+        return spec
+
+
 # takes datetime object, returns string YYYY-mm-dd
 def dstr(date):
     return date.strftime("%Y-%m-%d")
@@ -1965,6 +2887,180 @@ def cor_ice_A10(bulk_input):
     
     return bulk_return
 
+# array version of cor_ice_A10 for a day (or a year) of records at once. bulk_input is the same 9
+# inputs (u, ts, t, Q, zi, P, zu, zt, zq), each an array (numpy, pandas or xarray) or a scalar,
+# they're broadcast against each other so fixed heights can just be numbers.
+#
+# all records are iterated together. a record gets as many iterations as it would in the scalar
+# version (7, or 3 if it's very stable) unless tol is given, then it also stops once usr, tsr and
+# qsr all change by less than tol (relative) in an iteration. records with a nan input are nan.
+#
+# returns the same 22 outputs as cor_ice_A10 as arrays, plus the number of iterations each
+# record got (0 for the nan records)
+def cor_ice_A10_array(bulk_input, tol=None):
+
+    import math
+
+    inputs = np.broadcast_arrays(*[np.atleast_1d(np.asarray(x, dtype=np.float64)) for x in bulk_input])
+    u, ts, t, Q, zi, P, zu, zt, zq = [x.ravel() for x in inputs]
+    n     = u.size
+    valid = ~np.any(np.isnan(np.stack([u, ts, t, Q, zi, P, zu, zt, zq])), axis=0)
+
+    with np.errstate(all='ignore'): # the branches not taken by np.where are nonsense, don't care
+
+        # constants, see cor_ice_A10
+        Beta  = 1.25   
+        von   = 0.4    
+        fdg   = 1.00   
+        tdk   = 273.15 
+        grav  = 9.82   
+        CDn10 = 1.5e-3 
+
+        Rgas  = 287.1
+        Le    = (2.501-.00237*ts)*1e6
+        cpa   = 1004.67 
+        rhoa  = P*100/(Rgas*(t+tdk)*(1+1.61*Q)) 
+        visa  = 1.325e-5*(1+6.542e-3*t+8.301e-6*t*t-4.8e-9*t*t*t) 
+
+        # same stability functions, both branches computed and picked with np.where
+        def psih_sheba(zet):
+            x    = (1-15*zet)**.5
+            psik = 2*np.log((1+x)/2)
+            x    = (1-34.15*zet)**.3333
+            psic = 1.5*np.log((1+x+x*x)/3)-math.sqrt(3)*np.arctan((1+2*x)/math.sqrt(3))+4*math.atan(1)/math.sqrt(3)
+            f    = zet*zet/(1+zet*zet)
+            psi_unstable = (1-f)*psik+f*psic                                              
+
+            ah = 5 
+            bh = 5 
+            ch = 3
+            BH = math.sqrt(ch**2 - 4)
+            psi_stable = - (bh/2)*np.log(1+ch*zet+zet**2) + (((bh*ch)/(2*BH)) - (ah/BH))*(np.log((2*zet+ch-BH)/(2*zet+ch+BH)) - math.log((ch-BH)/(ch+BH)))
+            return np.where(zet<0, psi_unstable, psi_stable)
+
+        def psim_sheba(zet):
+            x    = (1-15*zet)**.25
+            psik = 2*np.log((1+x)/2)+np.log((1+x*x)/2)-2*np.arctan(x)+2*math.atan(1)
+            x    = (1-10.15*zet)**.333
+            psic = 1.5*np.log((1+x+x*x)/3)-math.sqrt(3)*np.arctan((1+2*x)/math.sqrt(3))+4*math.atan(1)/math.sqrt(3)
+            f    = zet*zet/(1+zet*zet)
+            psi_unstable = (1-f)*psik+f*psic                                             
+
+            am = 5 
+            bm = am/6.5
+            BM = ((1-bm)/bm)**(1/3)
+            y  = (1+zet)**(1/3)
+            psi_stable = - (3*am/bm)*(y-1)+((am*BM)/(2*bm))*(2*np.log((BM+y)/(BM+1))-np.log((BM**2-BM*y+y**2)/(BM**2-BM+1))+2*math.sqrt(3)*np.arctan((2*y-BM)/(BM*math.sqrt(3)))-2*math.sqrt(3)*math.atan((2-BM)/(BM*math.sqrt(3))))
+            return np.where(zet<0, psi_unstable, psi_stable)
+
+        # first guesses
+        es   = np.where(ts<=0,
+                        (1.0003+4.18e-6*P)*6.1115*np.exp(22.452*ts/(ts+272.55)),
+                        6.112*np.exp(17.502*ts/(ts+241.0))*(1.0007+3.46e-6*P))
+        Qs   = es*622/(1010.0-.378*es)/1000
+        wetc = 0.622*Le*Qs/(Rgas*(ts+tdk)**2)
+
+        du   = u
+        dt   = ts-t-0.0098*zt
+        dq   = Qs-Q
+        ta   = t+tdk
+        ug   = np.full(n, 0.5)
+        dter = np.zeros(n)
+        ut   = np.sqrt(du*du+ug*ug)
+        zogs = 10/(math.exp(von*(CDn10)**-0.5)) 
+
+        # (the u10 neutral guess at usr in the scalar version is overwritten before it's used)
+        zo10  = zogs
+        Cd10  = (von/math.log(10/zo10))**2
+        Ch10  = 0.0015
+        Ct10  = Ch10/math.sqrt(Cd10)
+        zot10 = 10/math.exp(von/Ct10)
+        Cd    = (von/np.log(zu/zo10))**2
+        Ct    = von/np.log(zt/zot10) 
+        CC    = von*Ct/Cd 
+        Ribcu = -zu/zi/.004/Beta**3 
+        Ribu  = -grav*zu/ta*((dt-dter)+.61*ta*dq)/ut**2
+
+        zetu  = np.where(Ribu<0, CC*Ribu/(1+Ribu/Ribcu), CC*Ribu*(1+27/9*Ribu/CC))
+        L10   = zu/zetu 
+        nits  = np.where(zetu>150, 3, 7) # cutoff iteration if too stable
+
+        usr = ut*von/(np.log(zu/zo10)-psim_sheba(zu/L10))
+        tsr = -(dt-dter)*von*fdg/(np.log(zt/zot10)-psih_sheba(zt/L10))
+        qsr = -(dq-wetc*dter)*von*fdg/(np.log(zq/zot10)-psih_sheba(zq/L10))
+
+        zot = np.full(n, 1e-4)
+        zoq = np.full(n, 1e-4) # approximate values found by Andreas et al. (2004)  		    
+        zo  = np.full(n, zogs)
+
+        rr  = np.full(n, nan); rt  = np.full(n, nan); rq  = np.full(n, nan)
+        L   = np.full(n, nan); hsb = np.full(n, nan); hlb = np.full(n, nan)
+
+        n_iter    = np.zeros(n, dtype=np.int64)
+        converged = np.zeros(n, dtype=bool)
+
+        # bulk loop, records drop out when they've had their iterations (or converged)
+        for i in range(0, int(nits.max()) if n > 0 else 0):
+            active = valid & (i < nits) & ~converged
+            if not np.any(active): break
+
+            zet  = von*grav*zu/ta*(tsr+0.61*ta*qsr)/(usr**2) 
+            rr_i = zo*usr/visa 
+            lrr  = np.log(rr_i)
+
+            # Andreas (1987) for snow/ice, smooth/transition/rough. past 1000 they keep the last value
+            rt_i = np.select([rr_i<=0.135, rr_i<=2.5, rr_i<=1000],
+                             [rr_i*math.exp(1.250), rr_i*np.exp(0.149-.55*lrr), rr_i*np.exp(0.317-0.565*lrr-0.183*lrr*lrr)], rt)
+            rq_i = np.select([rr_i<=0.135, rr_i<=2.5, rr_i<=1000],
+                             [rr_i*math.exp(1.610), rr_i*np.exp(0.351-0.628*lrr), rr_i*np.exp(0.396-0.512*lrr-0.180*lrr*lrr)], rq)
+
+            L_i   = zu/zet
+            usr_i = ut*von/(np.log(zu/zo)-psim_sheba(zu/L_i))
+            tsr_i = -(dt-dter)*von*fdg/(np.log(zt/zot)-psih_sheba(zt/L_i))
+            qsr_i = -(dq-wetc*dter)*von*fdg/(np.log(zq/zoq)-psih_sheba(zq/L_i))
+            Bf    = -grav/ta*usr_i*(tsr_i+0.61*ta*qsr_i)
+            ug_i  = np.where(Bf>0, Beta*(Bf*zi)**0.333, 0.2)
+            ut_i  = np.sqrt(du*du+ug_i*ug_i)
+
+            if tol is not None:
+                change = np.fmax(np.fmax(np.abs((usr_i-usr)/usr), np.abs((tsr_i-tsr)/tsr)), np.abs((qsr_i-qsr)/qsr))
+                converged = converged | (active & (change < tol))
+
+            rr  = np.where(active, rr_i,  rr)
+            rt  = np.where(active, rt_i,  rt)
+            rq  = np.where(active, rq_i,  rq)
+            L   = np.where(active, L_i,   L)
+            hsb = np.where(active, -rhoa*cpa*usr_i*tsr_i, hsb)
+            hlb = np.where(active, -rhoa*Le*usr_i*qsr_i,  hlb)
+            usr = np.where(active, usr_i, usr)
+            tsr = np.where(active, tsr_i, tsr)
+            qsr = np.where(active, qsr_i, qsr)
+            ut  = np.where(active, ut_i,  ut)
+
+            n_iter = n_iter + active
+
+        dqer = wetc*dter
+
+        tau = rhoa*usr*usr*du/ut # stress
+
+        # Webb et al. correction following Fairall et al 1996 Eqs. 21 and 22
+        wbar    = 1.61*(hlb/rhoa/Le)+(1+1.61*Q)*(hsb/rhoa/cpa)/ta
+        hl_webb = hlb+(rhoa*Le*wbar*Q)
+
+        # compute transfer coeffs relative to du @meas. ht
+        Cd = tau/rhoa/du**2
+        Ch = -usr*tsr/du/(dt-dter)
+        Ce = -usr*qsr/(dq-dqer)/du
+        # 10-m neutral coeff realtive to ut
+        Cdn_10 = von**2/np.log(10/zo)/np.log(10/zo)
+        Chn_10 = von**2*fdg/np.log(10/zo)/np.log(10/zot)
+        Cen_10 = von**2*fdg/np.log(10/zo)/np.log(10/zoq)
+
+    bulk_return = [hsb,hlb,tau,zo,zot,zoq,L,usr,tsr,qsr,dter,dqer,hl_webb,Cd,Ch,Ce,Cdn_10,Chn_10,Cen_10,rr,rt,rq]
+    bulk_return = [np.where(valid, var, nan) for var in bulk_return]
+
+    return bulk_return+[n_iter]
+
 
 
 # QCRAD
@@ -2152,20 +3248,897 @@ def average_mosaic_flags(qc_series, fstr):
     # >= 5 good then average good + flag good; If >= 5 caution or good then average those + flag caution; If
     # >= 5 engineering then average those + flag engineering; Otherwise, average all + flag bad
     # 0 = good, 1 = caution, 2 = bad, 3 = engineering
-    def take_qc_average(data_series):
-        tot_good             = (data_series == 0).sum()
-        tot_caution_and_good = tot_good + (data_series == 1).sum()
-        tot_engineering      = (data_series == 3).sum()
-
-        #print(f"{tot_good} -- {tot_caution_and_good} -- {tot_engineering}")
-        if tot_good/len(data_series) >= 0.5:             return 0 # if more than half are good, we're good
-        if tot_caution_and_good/len(data_series) >= 0.5: return 1 # if more than half are caution&&good, we're caution
-        if tot_engineering/len(data_series) >= 0.5:      return 3 # if more than half are engineering, we're engineers
-
-        # this should only affect data from turbulence calculations, are there an other places that
-        # would have an issue with this ugly fix??
-        if data_series.isna().sum() == len(data_series): return nan
-
-        return 2                                                  # any other combination is bad bad not good
+    #
+    # if more than half are good, we're good. if more than half are caution&&good, we're caution. if more
+    # than half are engineering, we're engineers. all nan (turbulence calculations) is nan and any other
+    # combination is bad bad not good. bin_average does this for every bin at once
+    return bin_average(qc_series.rename('qc'), fstr, qc_cols=['qc']).rename(qc_series.name)
+
+# The asfs fast data comes in 5 second scans where every sample carries the time at the *end* of
+# the scan. This spreads the samples of each scan evenly across it and shifts everything back by the
+# scan length so the times mark the beginning, on int64 nanoseconds instead of row by row.
+#
+# The result is the same as the original loop (correct_timestamps in level1 asfs):
+#   - a scan starts at the first occurrence of a timestamp. a timestamp that shows up again, right
+#     away (the logger repeated a scan time) or later (clock jumped backwards), doesn't start a new
+#     scan, its samples are spread with the scan before
+#   - every scan is spread over scan_len at microsecond resolution, however many samples it has
+#   - the very last sample is left where it is
+#
+# samples_per_scan (the median scan length if not given) is only used to count short and long scans.
+# returns the new times (datetime64[ns]) and a dict counting the scans, short scans, long scans (a
+# scan time repeated right away), timestamps repeated later and clock jumps that were found
+def spread_scan_timestamps(times, scan_len=5, samples_per_scan=None):
+
+    t    = np.asarray(times, dtype='datetime64[ns]')
+    nat  = np.isnat(t)
+    t    = t.view(np.int64)
+    n    = t.size
+
+    scan_info = {'n_scans': 0, 'short_scans': 0, 'long_scans': 0, 'repeated_times': 0, 'clock_jumps': 0}
+    if n == 0: return t.view('datetime64[ns]'), scan_info
+
+    # the scans start at the first occurrence of a value
+    first_seen   = ~pd.Series(t).duplicated().to_numpy()
+    value_change = np.ones(n, dtype=bool)
+    value_change[1:] = np.diff(t) != 0
+
+    starts = np.flatnonzero(first_seen)
+    scan_i = np.cumsum(first_seen)-1           # which scan each sample is in
+    pos    = np.arange(n)-starts[scan_i]       # cumcount within the scan
+    nexts  = np.append(starts[1:], n-1)
+    dist   = nexts-starts                      # samples to spread over each scan
+
+    if samples_per_scan is None: samples_per_scan = int(np.median(dist[dist > 0])) if np.any(dist > 0) else 1
+
+    # the original used timedelta(0, 5/dist), which rounds to the microsecond (half to even, like np.round)
+    step_ns = np.zeros(dist.size, dtype=np.int64)
+    step_ns[dist > 0] = np.round(scan_len/dist[dist > 0]*1e6).astype(np.int64)*1000
+
+    offset = pos*step_ns[scan_i]
+    offset[n-1] = 0
+
+    new_t = t + offset - np.int64(round(scan_len*1e9))
+    new_t[nat] = np.iinfo(np.int64).min # NaT stays NaT
+
+    scan_len_ns = np.int64(round(scan_len*1e9))
+    scan_info['n_scans']        = starts.size
+    scan_info['short_scans']    = int(np.sum(dist[:-1] < samples_per_scan))
+    scan_info['long_scans']     = int(np.sum(dist[:-1] > samples_per_scan))
+    scan_info['repeated_times'] = int(np.sum(value_change & ~first_seen))
+    scan_info['clock_jumps']    = int(np.sum(np.diff(t[value_change]) != scan_len_ns))
+
+    return new_t.view('datetime64[ns]'), scan_info
+
+# puts source (a series or dataframe with a time index, from another instrument/platform) on the station's
+# target_index with one Index.get_indexer call instead of looking up every timestamp. direction is how
+# a target time is matched to the source:
+#   'exact'    only the same timestamp
+#   'nearest'  the closest source time
+#   'backward' the last source time at or before it, like reindex(method='pad')
+#   'forward'  the first source time at or after it
+# tolerance (a timedelta or string like '500ms') is the largest offset that's still a match, targets
+# without a match are nan. duplicated source times keep the last one. returns the aligned data and a dict
+# with the source times that weren't used ('unmatched_source') and how many targets went without ('unmatched_target')
+def align_to_index(source, target_index, direction='exact', tolerance=None):
+
+    methods = {'exact': None, 'nearest': 'nearest', 'backward': 'pad', 'forward': 'backfill'}
+    if direction not in methods: raise ValueError(f"direction has to be one of {list(methods)}, not {direction}")
+    if direction == 'exact': tolerance = None
+
+    source = source[~source.index.duplicated(keep='last')].sort_index()
+    src_i  = source.index.get_indexer(target_index, method=methods[direction],
+                                      tolerance=pd.Timedelta(tolerance) if tolerance is not None else None)
+
+    aligned = source.reset_index(drop=True).reindex(src_i) # -1 isn't a row so it's nan
+    aligned.index = target_index
+
+    used = np.zeros(len(source), dtype=bool)
+    used[src_i[src_i >= 0]] = True
+    align_info = {'unmatched_source': source.index[~used], 'unmatched_target': int(np.sum(src_i < 0))}
+    return aligned, align_info
+
+# datetime64[ns] from integer year, month, day, hour, minute, second and microsecond components (arrays
+# or scalars, they're broadcast), days-from-civil arithmetic instead of building strings for pd.to_datetime.
+# components can be floats with nans, as they come out of read_csv. a sample with a component that's
+# out of range (month 13, feb 30, hour 24, second 60, fractions, nans ...) doesn't raise, it's NaT and
+# True in the bad mask that's returned with the times
+ns_years = (1678, 2261) # what fits in datetime64[ns]
+def build_timestamps(year, month, day, hour=0, minute=0, second=0, usec=0):
+
+    comps = np.broadcast_arrays(*[np.asarray(c, dtype=np.float64) for c in (year, month, day, hour, minute, second, usec)])
+    bad   = np.zeros(comps[0].shape, dtype=bool)
+    for c in comps: bad |= ~np.isfinite(c) | (c != np.floor(c))
+
+    year, month, day, hour, minute, second, usec = [np.where(bad, 1, c).astype(np.int64) for c in comps]
+
+    leap      = (year%4 == 0) & ((year%100 != 0) | (year%400 == 0))
+    month_len = np.array([31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31])[np.clip(month, 1, 12)-1] + (leap & (month == 2))
+    bad |= (year < ns_years[0]) | (year > ns_years[1]) | (month < 1) | (month > 12) | (day < 1) | (day > month_len)
+    bad |= (hour < 0) | (hour > 23) | (minute < 0) | (minute > 59) | (second < 0) | (second > 59)
+    bad |= (usec < 0) | (usec > 999999)
+
+    y    = year - (month <= 2)          # years start in march, so the leap day is the last one
+    era  = y // 400
+    yoe  = y - era*400
+    doy  = (153*((month+9)%12) + 2)//5 + day - 1
+    days = era*146097 + yoe*365 + yoe//4 - yoe//100 + doy - 719468
+
+    ns = (((days*24 + hour)*60 + minute)*60 + second)*1000000000 + usec*1000
+    ns[bad] = np.iinfo(np.int64).min # NaT
+    return ns.view('datetime64[ns]'), bad
+
+# timestamp strings from a campbell logger ('2020-01-31 23:59:59', with or without a fraction) to
+# datetime64[ns] with pandas' C ISO 8601 parser, the one read_csv(parse_dates=...) uses. the difference
+# is that one bad string doesn't leave the whole column as strings, it's NaT and True in the bad mask
+# that's returned with the times
+def parse_logger_timestamps(strings):
+
+    strings = pd.Series(np.asarray(strings, dtype=object).ravel())
+    if int(pd.__version__.split('.')[0]) >= 2: times = pd.to_datetime(strings, format='ISO8601', errors='coerce')
+    else:                                      times = pd.to_datetime(strings, errors='coerce') # iso is tried first there
+
+    times = times.values.astype('datetime64[ns]').reshape(np.shape(strings))
+    return times, np.isnat(times)
+
+# the timestamp at the start of a line from a campbell logger file, None if it isn't one
+def parse_logger_time(field):
+    field = field.strip().strip('"')
+    for time_fmt in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M:%S.%f'):
+        try: return datetime.strptime(field, time_fmt)
+        except ValueError: pass
+    return None
+
+# last non-empty line of a text file, read backwards from the end in blocks, so we don't read
+# the whole file (or spawn a 'tail' for every file). returns '' for an empty file
+def read_last_line(data_file, block_size=4096):
+    with open(data_file, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        pos  = f.tell()
+        tail = b''
+        while pos > 0:
+            read_size = min(block_size, pos)
+            pos      -= read_size
+            f.seek(pos)
+            tail      = f.read(read_size)+tail
+            stripped  = tail.rstrip(b'\r\n\x00 ')
+            newline_i = stripped.rfind(b'\n')
+            if newline_i >= 0 or pos == 0:
+                return stripped[newline_i+1:].decode('utf-8', errors='replace').strip()
+    return ''
+
+# first/last timestamp, number of columns and number of header lines (TOA5 headers are 4 lines)
+# of a raw logger file. the times are None if they couldn't be read
+def scan_raw_file(data_file, max_header_lines=4):
+    first_ts, last_ts, ncols, header_lines = None, None, None, 0
+    with open(data_file, errors='replace') as f:
+        for header_lines in range(0, max_header_lines+1):
+            line = f.readline()
+            if not line: break
+            fields   = line.rsplit(',')
+            first_ts = parse_logger_time(fields[0])
+            if first_ts is not None:
+                ncols = len(fields)
+                break
+    if first_ts is not None:
+        last_ts = parse_logger_time(read_last_line(data_file).rsplit(',')[0])
+    return first_ts, last_ts, ncols, header_lines
+
+class raw_file_catalogue(object):
+
+    __doc__ = """
+
+    A small sqlite database of the raw logger files for a station, so finding the files for a day
+    doesn't mean walking the site visit directories and opening every file again on every run.
+    For each file it keeps the size, mtime, first and last timestamps, the number of columns and
+    the number of header lines (which together say which layout/version the file is). For each
+    directory it keeps the mtime and what was in it, so unchanged directories aren't listed again.
+
+    update() only opens files that are new or whose size/mtime changed and drops the ones that
+    have gone away. overlapping() is a range query on an index over (kind, first_ts, last_ts).
+    Files whose timestamps couldn't be read are kept with NULL times, so they aren't re-read
+    every run, and are never returned by overlapping(). Times are stored as integer microseconds
+    since 1970.
+
+    Parameters:
+    ----------
+    db_file : sqlite file to keep the catalogue in, created if it doesn't exist
+
+    Example:
+    -------
+    cat   = raw_file_catalogue('/Projects/MOSAiC/asfs30/raw_files_asfs30.sqlite')
+    cat.update('fast', cat.card_files('/Projects/MOSAiC/asfs30/0_level_raw/site_visits/', 'fast'))
+    files = cat.overlapping('fast', datetime(2019,11,1), datetime(2019,11,2), ncols=[7,11,12])
+
+    ================================================================================================
+
+    """
+
+    schema_version = 1
+
+    def __init__(self, db_file):
+
+        self.db_file = db_file
+        self.conn    = sqlite3.connect(db_file, timeout=120)
+
+        # it's only a cache of what's on disk, if the layout changed just start again
+        if self.conn.execute('PRAGMA user_version').fetchone()[0] != self.schema_version:
+            self.conn.executescript('DROP TABLE IF EXISTS raw_files; DROP TABLE IF EXISTS raw_dirs;')
+
+        self.conn.executescript(f"""
+            CREATE TABLE IF NOT EXISTS raw_files (path TEXT PRIMARY KEY, kind TEXT NOT NULL,
+                                                  size INTEGER, mtime_ns INTEGER,
+                                                  first_ts INTEGER, last_ts INTEGER,
+                                                  ncols INTEGER, header_lines INTEGER);
+            CREATE INDEX IF NOT EXISTS raw_files_range ON raw_files (kind, first_ts, last_ts);
+            CREATE TABLE IF NOT EXISTS raw_dirs (path TEXT PRIMARY KEY, mtime_ns INTEGER,
+                                                 subdirs TEXT, files TEXT);
+            PRAGMA user_version = {self.schema_version};
+        """)
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    @staticmethod
+    def _to_us(t):
+        if t is None: return None
+        return int(pd.Timestamp(t).value//1000)
+
+    # the filestr .dat files in every sdcard directory under searchdir, same as the os.walk in
+    # get_card_file_list, but a directory is only listed again if its mtime changed
+    def card_files(self, searchdir, filestr):
+
+        root   = searchdir.rstrip('/')
+        stored = {p: (m, s, f) for p, m, s, f in self.conn.execute('SELECT path, mtime_ns, subdirs, files FROM raw_dirs')}
+        seen   = set()
+
+        card_files = []
+        to_visit   = [root]
+        while to_visit:
+            curr_dir = to_visit.pop()
+            try: mtime_ns = os.stat(curr_dir).st_mtime_ns
+            except OSError: continue
+            seen.add(curr_dir)
+
+            if curr_dir in stored and stored[curr_dir][0] == mtime_ns:
+                subdirs = stored[curr_dir][1].split('\n') if stored[curr_dir][1] else []
+                files   = stored[curr_dir][2].split('\n') if stored[curr_dir][2] else []
+            else:
+                subdirs, files = [], []
+                with os.scandir(curr_dir) as entries:
+                    for entry in entries:
+                        if entry.is_dir(): subdirs.append(entry.name)
+                        else:              files.append(entry.name)
+                self.conn.execute('INSERT OR REPLACE INTO raw_dirs VALUES (?,?,?,?)',
+                                  (curr_dir, mtime_ns, '\n'.join(subdirs), '\n'.join(files)))
+
+            if "sdcard" in os.path.basename(curr_dir).lower():
+                card_files.extend([curr_dir+'/'+f for f in files
+                                   if filestr in f.lower() and f.endswith('.dat') and not f.startswith('._')])
+
+            to_visit.extend([curr_dir+'/'+d for d in subdirs])
+
+        gone = [(p,) for p in stored if (p == root or p.startswith(root+'/')) and p not in seen]
+        self.conn.executemany('DELETE FROM raw_dirs WHERE path=?', gone)
+        self.conn.commit()
+        return sorted(card_files)
+
+    # bring the catalogue up to date with file_list, only opening files that are new or changed.
+    # files of this kind that aren't in file_list any more are dropped. returns the number of
+    # files that were scanned and the number that were dropped
+    def update(self, kind, file_list, verbose=False):
+
+        stored = {p: (s, m) for p, s, m in
+                  self.conn.execute('SELECT path, size, mtime_ns FROM raw_files WHERE kind=?', (kind,))}
+
+        n_scanned = 0
+        for data_file in file_list:
+            try: file_stat = os.stat(data_file)
+            except OSError as e:
+                print("!!! problem with data file {}!!!".format(data_file))
+                print("!!! {} !!!".format(e))
+                continue
+            if stored.get(data_file) == (file_stat.st_size, file_stat.st_mtime_ns): continue
+
+            try: first_ts, last_ts, ncols, header_lines = scan_raw_file(data_file)
+            except Exception as e:
+                print("!!! problem with data file {}!!!".format(data_file))
+                print("!!! {} !!!".format(e))
+                first_ts, last_ts, ncols, header_lines = None, None, None, None
+
+            if first_ts is None or last_ts is None:
+                print("!!! something was wrong with the timestamp format in {} !!!".format(data_file))
+
+            self.conn.execute('INSERT OR REPLACE INTO raw_files VALUES (?,?,?,?,?,?,?,?)',
+                              (data_file, kind, file_stat.st_size, file_stat.st_mtime_ns,
+                               self._to_us(first_ts), self._to_us(last_ts), ncols, header_lines))
+            n_scanned += 1
+            if n_scanned % 1000 == 0:
+                self.conn.commit()
+                if verbose: print("... scanned {} new/changed {} files".format(n_scanned, kind))
+
+        gone = [(p,) for p in set(stored)-set(file_list)]
+        self.conn.executemany('DELETE FROM raw_files WHERE path=?', gone)
+        self.conn.commit()
+        return n_scanned, len(gone)
+
+    # files of this kind with any data in [t0, t1], ordered by their first timestamp. ncols and
+    # header_lines optionally restrict it to files with those layouts
+    def overlapping(self, kind, t0, t1, ncols=None, header_lines=None):
+
+        query  = 'SELECT path FROM raw_files WHERE kind=? AND first_ts<=? AND last_ts>=?'
+        params = [kind, self._to_us(t1), self._to_us(t0)]
+        if ncols is not None:
+            query  += ' AND ncols IN ({})'.format(','.join('?'*len(ncols)))
+            params += list(ncols)
+        if header_lines is not None:
+            query  += ' AND header_lines=?'
+            params += [header_lines]
+
+        return [row[0] for row in self.conn.execute(query+' ORDER BY first_ts, path', params)]
+
+class frame_cache(object):
+
+    __doc__ = """
+
+    An on disk cache of the DataFrames/Datasets the codes read over and over (the level1 data
+    for level2, the raw slow data...), replacing the pickles that were found by walking the
+    pickle directory for a file with the right name in it. Entries are found by key and the
+    key says exactly what's in them: a name (station, level, data type, date range...), the
+    code_version and the path, size and mtime of every source file. If a source file changes
+    or the code does the key changes, the old entry is never returned again and is dropped when
+    the new one is written.
+
+    DataFrames are stored as uncompressed feather files (pyarrow) and Datasets as zarr stores,
+    both columnar, so get() can read only some of the columns, and the feather files are memory
+    mapped rather than read. Without pyarrow/zarr they're pickled like the old cache was, and
+    get() reads the whole pickle before picking the columns. An sqlite index
+    in cache_dir keeps the size and last use of every entry, and the least recently used are
+    removed once the cache is bigger than max_gb.
+
+    Parameters:
+    ----------
+    cache_dir : directory to keep the cache in, created if it doesn't exist
+    max_gb    : size the cache is kept under [GB]
+
+    Example:
+    -------
+    cache = frame_cache('/ramdisk/cache/')
+    key   = cache.make_key('asfs30_1_slow_df_20191101_20191105', file_list, code_version)
+    df, version = cache.get(key, columns=['vaisala_T_Avg', 'vaisala_RH_Avg'])
+    if df is None:
+        df, version = read_the_files(file_list)
+        cache.put(key, 'asfs30_1_slow_df_20191101_20191105', df, version)
+
+    ================================================================================================
+
+    """
+
+    schema_version = 1
+    index_col      = '__index__' # the DataFrame index is stored as a column with this name
+
+    def __init__(self, cache_dir, max_gb=20):
+
+        os.makedirs(cache_dir, exist_ok=True)
+        self.cache_dir = cache_dir.rstrip('/')
+        self.max_bytes = int(max_gb*1e9)
+        self.conn      = sqlite3.connect(f'{self.cache_dir}/frame_cache.sqlite', timeout=120)
+
+        if self.conn.execute('PRAGMA user_version').fetchone()[0] != self.schema_version:
+            self.conn.executescript('DROP TABLE IF EXISTS entries;')
+
+        self.conn.executescript(f"""
+            CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, name TEXT NOT NULL,
+                                                path TEXT, kind TEXT, columns TEXT,
+                                                nbytes INTEGER, code_version TEXT,
+                                                created REAL, accessed REAL);
+            CREATE INDEX IF NOT EXISTS entries_name ON entries (name);
+            PRAGMA user_version = {self.schema_version};
+        """)
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    # the same name, code_version and source files (as they are on disk right now) always give
+    # the same key. files that don't exist are part of the key too, so one showing up is a change
+    @staticmethod
+    def make_key(name, source_files, code_version=''):
+
+        sources = []
+        for source_file in sorted(source_files):
+            try:
+                file_stat = os.stat(source_file)
+                sources.append((source_file, file_stat.st_size, file_stat.st_mtime_ns))
+            except OSError: sources.append((source_file, None, None))
+
+        key_str = json.dumps([name, str(code_version), sources])
+        return hashlib.sha1(key_str.encode()).hexdigest()
+
+    # returns (data, code_version) for key or (None, None) if it isn't cached. columns (all if
+    # None) are the columns/variables to read, the ones the entry doesn't have are skipped
+    def get(self, key, columns=None):
+
+        row = self.conn.execute('SELECT path, kind, columns, code_version FROM entries WHERE key=?',
+                                (key,)).fetchone()
+        if row is None: return None, None
+        path, kind, layout, code_version = row
+
+        if not os.path.exists(path) or not self._can_read(kind):
+            self._remove([key])
+            return None, None
+
+        layout = json.loads(layout) # {'index': name of the DataFrame index, 'columns': [...]}
+        if columns is not None: columns = [c for c in layout['columns'] if c in set(columns)]
+
+        try:
+            if kind == 'feather':
+                from pyarrow import feather
+                if columns is not None: columns = [self.index_col]+columns
+                data = feather.read_table(path, columns=columns, memory_map=True).to_pandas()
+                data = data.set_index(self.index_col)
+                data.index.name = layout['index']
+            elif kind == 'pickle':
+                data = pd.read_pickle(path)
+                if columns is not None: data = data[columns]
+            else:
+                import xarray as xr
+                data = xr.open_zarr(path)
+                if columns is not None: data = data[columns]
+        except Exception as e:
+            print(f"!!! couldn't read cached {path}, dropping it: {e}")
+            self._remove([key])
+            return None, None
+
+        self.conn.execute('UPDATE entries SET accessed=? WHERE key=?', (time.time(), key))
+        self.conn.commit()
+        return data, code_version
+
+    # stores data (a DataFrame or an xarray Dataset) under key. the entries with the same name
+    # and a different key are from older source files/code, they're removed. returns True if
+    # it was cached
+    def put(self, key, name, data, code_version=''):
+
+        kind = 'zarr' if hasattr(data, 'to_zarr') else 'feather'
+        if not self._can_read(kind): kind = 'pickle'
+
+        path     = f'{self.cache_dir}/{name}_{key[0:16]}.{kind}'
+        tmp_path = f'{path}.{os.getpid()}.tmp' # other processes might be writing the same entry
+        try:
+            if kind == 'feather':
+                if isinstance(data.index, pd.MultiIndex): raise ValueError('MultiIndex not supported')
+                layout = {'index': data.index.name, 'columns': [str(c) for c in data.columns]}
+                frame  = data.reset_index(drop=True)
+                frame.columns = layout['columns']
+                frame.insert(0, self.index_col, data.index)
+                frame.to_feather(tmp_path, compression='uncompressed') # so it can be memory mapped
+                os.replace(tmp_path, path)
+            elif kind == 'pickle':
+                columns = data.data_vars if hasattr(data, 'data_vars') else data.columns
+                layout  = {'index': None, 'columns': [str(c) for c in columns]}
+                pd.to_pickle(data, tmp_path)
+                os.replace(tmp_path, path)
+            else:
+                layout = {'index': None, 'columns': [str(v) for v in data.data_vars]}
+                store  = data.copy() # the netcdf encodings (chunking, compression...) don't carry over
+                for var in store.variables.values(): var.encoding = {}
+                store.to_zarr(tmp_path, mode='w')
+                if os.path.exists(path): shutil.rmtree(path)
+                os.replace(tmp_path, path)
+        except Exception as e:
+            print(f"!!! couldn't cache {name}: {e}")
+            if os.path.isdir(tmp_path): shutil.rmtree(tmp_path, ignore_errors=True)
+            elif os.path.exists(tmp_path): os.remove(tmp_path)
+            return False
 
-    return qc_series.resample(fstr, label='left').apply(take_qc_average)
+        now = time.time()
+        self._remove([k for k, in self.conn.execute('SELECT key FROM entries WHERE name=? AND key!=?',
+                                                    (name, key))])
+        self.conn.execute('INSERT OR REPLACE INTO entries VALUES (?,?,?,?,?,?,?,?,?)',
+                          (key, name, path, kind, json.dumps(layout), self._size_of(path),
+                           str(code_version), now, now))
+        self.conn.commit()
+        self.evict(keep=key)
+        return True
+
+    # removes the least recently used entries until the cache is under max_bytes, never the keep entry
+    def evict(self, keep=None):
+
+        total   = self.conn.execute('SELECT COALESCE(SUM(nbytes), 0) FROM entries').fetchone()[0]
+        too_old = []
+        for key, nbytes in self.conn.execute('SELECT key, nbytes FROM entries ORDER BY accessed'):
+            if total <= self.max_bytes: break
+            if key == keep: continue
+            too_old.append(key)
+            total -= nbytes
+        self._remove(too_old)
+        return len(too_old)
+
+    def _remove(self, keys):
+        for key in keys:
+            row = self.conn.execute('SELECT path FROM entries WHERE key=?', (key,)).fetchone()
+            if row is not None:
+                if os.path.isdir(row[0]): shutil.rmtree(row[0], ignore_errors=True)
+                elif os.path.exists(row[0]): os.remove(row[0])
+            self.conn.execute('DELETE FROM entries WHERE key=?', (key,))
+        self.conn.commit()
+
+    # feather needs pyarrow and zarr needs zarr, pickles need nothing
+    @staticmethod
+    def _can_read(kind):
+        if kind == 'pickle': return True
+        return importlib.util.find_spec('pyarrow' if kind == 'feather' else 'zarr') is not None
+
+    @staticmethod
+    def _size_of(path):
+        if not os.path.isdir(path): return os.path.getsize(path)
+        return sum(os.path.getsize(os.path.join(root, f)) for root, dirs, files in os.walk(path) for f in files)
+
+class run_manifest(object):
+
+    __doc__ = """
+
+    A ledger of what the level1/level2/level3 codes wrote and what from, so a rerun only redoes
+    the days that are out of date instead of every day that was asked for. For each job (a
+    station day, usually) it keeps the input files (path, size and mtime), the code_version, a
+    digest of the qc table rows that apply to it, the processing parameters and the files that
+    were written. plan() compares the jobs a run is about to do with the ledger and prints what
+    will be recomputed and why, record() is called once a job's files have been written.
+
+    A job is out of date if it was never recorded, if one of the files it wrote is gone or was
+    changed since, or if its inputs, code_version, qc digest or parameters aren't the same. Inputs
+    are compared by size and mtime like the frame_cache keys, not by content, so touching a file is
+    enough to rebuild what was made from it. Inputs that don't exist are part of the fingerprint
+    too, so a file showing up (tomorrow's level1 file, say) makes the job out of date.
+
+    Parameters:
+    ----------
+    db_file : sqlite file to keep the manifest in, created if it doesn't exist
+
+    Example:
+    -------
+    manifest = run_manifest('/Projects/MOSAiC/tower/1_level_ingest/run_manifest_level1.sqlite')
+    jobs     = {today: manifest.fingerprint(input_files(today), code_version) for today in day_series}
+    stale    = manifest.plan({fl.dstr(today): fp for today, fp in jobs.items()}, force=args.force)
+    ... process the stale days, then for each one that worked ...
+    manifest.record(fl.dstr(today), jobs[today], glob.glob(f'{level1_dir}/*{today:%Y%m%d}*.nc'))
+
+    ================================================================================================
+
+    """
+
+    schema_version = 1
+
+    def __init__(self, db_file):
+
+        os.makedirs(os.path.dirname(os.path.abspath(db_file)), exist_ok=True)
+        self.db_file = db_file
+        self.conn    = sqlite3.connect(db_file, timeout=120)
+
+        if self.conn.execute('PRAGMA user_version').fetchone()[0] != self.schema_version:
+            self.conn.executescript('DROP TABLE IF EXISTS jobs;')
+
+        self.conn.executescript(f"""
+            CREATE TABLE IF NOT EXISTS jobs (name TEXT PRIMARY KEY, inputs TEXT, code_version TEXT,
+                                             qc_hash TEXT, params TEXT, outputs TEXT, finished REAL);
+            PRAGMA user_version = {self.schema_version};
+        """)
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    # [path, size, mtime_ns] for each file, sorted by path, size and mtime are None if it doesn't exist
+    @staticmethod
+    def file_states(file_list):
+
+        states = []
+        for file_name in sorted(set(file_list)):
+            try:
+                file_stat = os.stat(file_name)
+                states.append([file_name, file_stat.st_size, file_stat.st_mtime_ns])
+            except OSError: states.append([file_name, None, None])
+        return states
+
+    # what a job is made from, as things are on disk right now. params has to be json-able,
+    # anything that isn't (datetimes...) is compared as a string
+    @staticmethod
+    def fingerprint(input_files, code_version, qc_hash='', params=None):
+
+        if params is None: params = {}
+        return {'inputs'       : run_manifest.file_states(input_files),
+                'code_version' : str(code_version),
+                'qc_hash'      : qc_hash,
+                'params'       : json.loads(json.dumps(params, sort_keys=True, default=str))}
+
+    # why the job called name has to be redone, or None if what it wrote is up to date with fingerprint
+    def why_stale(self, name, fingerprint):
+
+        row = self.conn.execute('SELECT inputs, code_version, qc_hash, params, outputs FROM jobs WHERE name=?',
+                                (name,)).fetchone()
+        if row is None: return 'never made'
+        inputs, code_version, qc_hash, params, outputs = row
+
+        outputs = json.loads(outputs)
+        if self.file_states([o[0] for o in outputs]) != outputs:
+            return 'output deleted or changed'
+
+        if code_version != fingerprint['code_version']:
+            return f"code_version changed ({code_version} -> {fingerprint['code_version']})"
+
+        if qc_hash != fingerprint['qc_hash']: return 'qc table changed'
+
+        params = json.loads(params)
+        if params != fingerprint['params']:
+            changed = sorted(k for k in set(params) | set(fingerprint['params']) if params.get(k) != fingerprint['params'].get(k))
+            return f"parameters changed ({', '.join(changed)})"
+
+        old_inputs = {path: (size, mtime) for path, size, mtime in json.loads(inputs)}
+        new_inputs = {path: (size, mtime) for path, size, mtime in fingerprint['inputs']}
+        if old_inputs != new_inputs:
+            n_new     = len(set(new_inputs)-set(old_inputs))
+            n_gone    = len(set(old_inputs)-set(new_inputs))
+            n_changed = sum(old_inputs[p] != new_inputs[p] for p in set(old_inputs) & set(new_inputs))
+            return f'inputs changed ({n_changed} changed, {n_new} new, {n_gone} gone)'
+
+        return None
+
+    # jobs is {name: fingerprint} for everything the run was asked to do, returns {name: reason} for
+    # the ones that have to be (re)done, in the same order. force redoes everything. the plan is
+    # printed, grouped by reason, with every job listed if verbose or there aren't many
+    def plan(self, jobs, force=False, verbose=False):
+
+        stale = {}
+        for name, fingerprint in jobs.items():
+            reason = 'forced' if force else self.why_stale(name, fingerprint)
+            if reason is not None: stale[name] = reason
+
+        print(f"... {len(stale)} of {len(jobs)} jobs to (re)do, {len(jobs)-len(stale)} are up to date in {self.db_file}")
+        reasons = {}
+        for reason in stale.values():
+            reason_type = reason.split(' (')[0]
+            reasons[reason_type] = reasons.get(reason_type, 0)+1
+        for reason_type, n_jobs in reasons.items(): print(f"...     {n_jobs:5d} {reason_type}")
+        if verbose or len(stale) <= 30:
+            for name, reason in stale.items(): print(f"...     {name}: {reason}")
+
+        return stale
+
+    # the job called name, made from fingerprint, wrote output_files (which can be none at all, if
+    # there was no data). it's up to date until one of them changes or the fingerprint does
+    def record(self, name, fingerprint, output_files):
+
+        outputs = [o for o in self.file_states(output_files) if o[1] is not None]
+        self.conn.execute('INSERT OR REPLACE INTO jobs VALUES (?,?,?,?,?,?,?)',
+                          (name, json.dumps(fingerprint['inputs']), fingerprint['code_version'],
+                           fingerprint['qc_hash'], json.dumps(fingerprint['params']), json.dumps(outputs),
+                           time.time()))
+        self.conn.commit()
+
+    # forget the job, it'll be redone on the next run
+    def drop(self, name):
+        self.conn.execute('DELETE FROM jobs WHERE name=?', (name,))
+        self.conn.commit()
+
+class task_pool(object):
+
+    __doc__ = """
+
+    A pool of long lived worker processes that are handed tasks (days, stations...) one at a time
+    as they become free, rather than running them in fixed batches of nthreads processes that
+    each wait for the slowest. Workers are forked, so the tasks submitted before the pool
+    starts (the usual case) are never pickled, they're found in the workers' copy of the task
+    list. Tasks submitted once it's running have their arguments pickled, and their function
+    too unless an earlier task used the same one (so a function local to main() is fine, as
+    long as the pool had a task for it before it started).
+
+    Tasks follow the convention the processing codes already use: func(*args, q) where q is a
+    queue the task puts its results on. The pool hands each task something that looks like
+    that queue and returns everything that was put on it.
+
+    results() yields (key, status, value, runtime) as tasks finish, in whatever order that is.
+    status is 'ok' (value is the list of things put on q), 'fail' (value is the traceback),
+    'timeout' (the task ran longer than its timeout and its worker was killed) or 'died' (the
+    worker went away mid-task, e.g. the OOM killer). Each task has its own timeout, there's no
+    time limit on waiting for results.
+
+    Parameters:
+    ----------
+    nworkers  : number of worker processes, 0 runs the tasks here one by one (for debugging)
+    max_tasks : a worker is replaced after this many tasks, caps memory growth (None, never)
+    timeout   : default per task time limit [s] (None, no limit)
+    verbose   : print each task's runtime
+
+    Example:
+    -------
+    pool = task_pool(nthreads, max_tasks=10)
+    for today in day_series: pool.submit(today, process_day, today, slow_data[today:tomorrow])
+    for today, status, value, runtime in pool.results():
+        if status == 'ok': data_list.append(value[0])
+
+    ================================================================================================
+
+    """
+
+    def __init__(self, nworkers, max_tasks=None, timeout=None, verbose=False):
+
+        self.nworkers  = max(0, int(nworkers))
+        self.max_tasks = max_tasks
+        self.timeout   = timeout
+        self.verbose   = verbose
+        self.runtimes  = {} # key: runtime of every task that finished
+
+        self._tasks    = [] # (func, args), the workers find tasks here by number
+        self._funcs    = [] # every task's function, kept when the task is done for the tasks after it
+        self._keys     = []
+        self._timeouts = []
+        self._pending  = set()
+        self._waiting  = [] # task numbers not handed to a worker yet, in order
+        self._workers  = {} # pid: [process, number of tasks it knows about, pipe, tasks handed to it]
+        self._running  = {} # pid: (task number, time it was handed over)
+
+    def submit(self, key, func, *args, timeout=None):
+
+        task_i = len(self._tasks)
+        self._tasks.append((func, args))
+        self._funcs.append(func)
+        self._keys.append(key)
+        self._timeouts.append(timeout if timeout is not None else self.timeout)
+        self._pending.add(task_i)
+        self._waiting.append(task_i)
+        return task_i
+
+    def _start_worker(self):
+        conn, worker_conn = Pipe()
+        proc = P(target=_task_pool_worker, args=(self._tasks, self._funcs, worker_conn, self.max_tasks))
+        proc.start()
+        worker_conn.close()
+        self._workers[proc.pid] = [proc, len(self._tasks), conn, 0]
+
+    # each free worker gets the next task, over its own pipe. the task is recorded as running on
+    # that worker before it's sent, so whatever happens to the worker from here on, the pool knows
+    # which task went with it. a worker forked before the task existed is sent the task itself,
+    # which is pickled here, so a task that can't be fails right away. its function isn't sent if
+    # the worker has it from an earlier task, only which task that was
+    def _hand_out(self):
+        for pid, worker in self._workers.items():
+            if len(self._waiting) == 0: break
+            proc, n_known, conn, n_handed = worker
+            if pid in self._running or (self.max_tasks is not None and n_handed >= self.max_tasks): continue
+
+            task_i = self._waiting.pop(0)
+            task   = None
+            if task_i >= n_known:
+                func, args = self._tasks[task_i]
+                func_i = next((i for i in range(0, n_known) if self._funcs[i] is func), None)
+                task   = (func if func_i is None else func_i, args)
+
+            self._running[pid] = (task_i, time.time())
+            try:
+                conn.send((task_i, task))
+                worker[3] += 1
+            except (BrokenPipeError, EOFError, OSError): # the worker's gone, it's found below
+                self._running.pop(pid)
+                self._waiting.insert(0, task_i)
+            except Exception:
+                self._running.pop(pid)
+                print(f"!!! task {self._keys[task_i]} couldn't be sent to a worker")
+                yield self._done(task_i, 'fail', traceback.format_exc(), 0.0)
+
+    # everything the worker has sent back so far
+    def _receive(self, pid):
+        conn = self._workers[pid][2]
+        while conn.poll():
+            try: task_i, status, value, runtime = conn.recv()
+            except (EOFError, OSError): break # it exited
+            self._running.pop(pid, None)
+            if task_i in self._pending: yield self._done(task_i, status, value, runtime)
+
+    # the worker is gone, with the task it was handed if it hadn't finished it
+    def _lose_worker(self, pid, status, reason):
+        proc, n_known, conn, n_handed = self._workers.pop(pid)
+        proc.join(timeout=5)
+        conn.close()
+        if pid not in self._running: return None
+        task_i, t_start = self._running.pop(pid)
+        if task_i not in self._pending: return None
+        self._pending.discard(task_i)
+        self._tasks[task_i] = None
+        return (self._keys[task_i], status, reason, time.time()-t_start)
+
+    def _done(self, task_i, status, value, runtime):
+        key = self._keys[task_i]
+        self._pending.discard(task_i)
+        self._tasks[task_i] = None # let the parent's copy of the arguments go
+        self.runtimes[key] = runtime
+        if self.verbose: print(f"... task {key} {status} in {runtime:.1f} s")
+        return (key, status, value, runtime)
+
+    def results(self):
+
+        while self.nworkers == 0 and len(self._pending) > 0: # no workers, step through them here
+            task_i = min(self._pending)
+            func, args = self._tasks[task_i]
+            q_task  = _task_results()
+            t_start = time.time()
+            try:
+                func(*args, q_task)
+                status, value = 'ok', q_task.items
+            except Exception:
+                status, value = 'fail', traceback.format_exc()
+            yield self._done(task_i, status, value, time.time()-t_start)
+
+        while len(self._pending) > 0:
+
+            # keep the pool full, but no more workers than there is work for
+            while len(self._workers) < min(self.nworkers, len(self._pending)): self._start_worker()
+            for failed in self._hand_out(): yield failed
+
+            # a result or a worker exiting, whichever comes first
+            pipes = {worker[2]: pid for pid, worker in self._workers.items()}
+            procs = {worker[0].sentinel: pid for pid, worker in self._workers.items()}
+            ready = wait(list(pipes.keys())+list(procs.keys()), timeout=1.0)
+
+            for pid in set(pipes.get(r, procs.get(r)) for r in ready):
+                for result in self._receive(pid): yield result
+                if self._workers[pid][0].is_alive(): continue
+
+                # whatever it sent before it exited has been read, anything it was handed is lost
+                exitcode = self._workers[pid][0].exitcode
+                lost     = self._lose_worker(pid, 'died', f'worker exited with {exitcode}')
+                if lost is not None:
+                    print(f"!!! worker for task {lost[0]} exited with {exitcode} mid-task")
+                    yield lost
+
+            for pid in list(self._running.keys()):
+                task_i, t_start = self._running[pid]
+                if self._timeouts[task_i] is not None and time.time()-t_start > self._timeouts[task_i]:
+                    self._workers[pid][0].terminate()
+                    print(f"!!! task {self._keys[task_i]} ran longer than {self._timeouts[task_i]} s, killed it")
+                    lost = self._lose_worker(pid, 'timeout', f'ran longer than {self._timeouts[task_i]} s')
+                    if lost is not None: yield lost
+
+        self.close()
+
+    def close(self):
+        for proc, n_known, conn, n_handed in self._workers.values():
+            try: conn.send(None)
+            except (BrokenPipeError, OSError): pass
+        for proc, n_known, conn, n_handed in self._workers.values(): proc.join(); conn.close()
+        self._workers = {}
+        self._running = {}
+
+# what task_pool workers put on the task's q, they send the list back when it's done
+class _task_results(object):
+    def __init__(self):
+        self.items = []
+    def put(self, item, *args, **kwargs):
+        self.items.append(item)
+
+def _task_pool_worker(tasks, funcs, conn, max_tasks):
+    n_done = 0
+    while max_tasks is None or n_done < max_tasks:
+        try: work = conn.recv()
+        except EOFError: break # the pool went away
+        if work is None: break
+
+        task_i, task = work
+        if task is None: task = tasks[task_i]
+        func, args = task
+        if isinstance(func, int): func = funcs[func] # the same function as an earlier task
+
+        q_task  = _task_results()
+        t_start = time.time()
+        try:
+            func(*args, q_task)
+            status, value = 'ok', q_task.items
+        except BaseException:
+            status, value = 'fail', traceback.format_exc()
+        try:
+            conn.send((task_i, status, value, time.time()-t_start))
+        except Exception: # results that can't be pickled
+            conn.send((task_i, 'fail', traceback.format_exc(), time.time()-t_start))
+        n_done += 1
+
+    conn.close()
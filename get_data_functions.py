@@ -1,4 +1,4 @@
-import os, time, pickle
+import os, time, importlib.util
 
 from datetime  import datetime, timedelta
 
@@ -6,12 +6,14 @@ import pandas as pd
 import xarray as xr
 import numpy  as np
 
-from multiprocessing import Process as P
-from multiprocessing import Queue   as Q
+import functions_library as fl
+
+cache_version = 1 # part of the frame_cache keys, bump it when what's returned here changes
 
 def get_flux_data(station, start_day, end_day, level,
                   data_dir='/Projects/MOSAiC/', data_type='slow',
-                  verbose=False, nthreads=1, as_xrds=False, pickle_dir=None):
+                  verbose=False, nthreads=1, as_xrds=False, pickle_dir=None,
+                  variables=None, time_range=None):
 
 
     """ Get a dataset from the MOSAiC flux project. 
@@ -33,10 +35,19 @@ def get_flux_data(station, start_day, end_day, level,
     nthreads    : how many cpu threads would you like to use 
     verbose     : would you like to see more print statements?
 
-    pickle_dir : if provided, we search for a pandas 'pickle' binary
-                 file containing the pre-packed pandas objects. if we
-                 don't find it, it is written after ingest. saves *a lot*
-                 of time when stored on ramdisk for bigger files.
+    pickle_dir : if provided, the data is cached here (fl.frame_cache, feather
+                 or zarr, pickle without them) after it's read and taken from the cache the next
+                 time, as long as the files didn't change. saves *a lot* of
+                 time when stored on ramdisk for bigger files.
+
+    variables  : list of variable names, only these are read 
+    time_range : (start, end) datetimes, only data in between (inclusive) is read
+
+                 with either of these only these variables are read from the
+                 cache, if the whole range is in it. if not the files are
+                 opened lazily as one multi-file dataset (see open_flux_files)
+                 instead of read whole, one process per file, nthreads is
+                 ignored then and nothing is cached
 
     Returns
     -------
@@ -56,133 +67,264 @@ def get_flux_data(station, start_day, end_day, level,
     if as_xrds: data_format = 'ds'
     else: data_format = 'df'
 
-    pickled_filename = f'{station}_{level}_{data_type}_{data_format}' # code_version is tacked on to this when run
+    day_series = pd.date_range(start_day, end_day) 
+    file_list  = [get_flux_file(station, today, level, data_dir, data_type) for today in day_series]
+
+    cache = None
+    if pickle_dir:
+        cache_name = f'{station}_{level}_{data_type}_{data_format}_{day_series[0]:%Y%m%d}_{day_series[-1]:%Y%m%d}'
+        cache      = fl.frame_cache(pickle_dir)
+        cache_key  = cache.make_key(cache_name, file_list, cache_version)
+
+        columns = None
+        if variables is not None: columns = list(variables) if as_xrds else list(variables)+['time']
+        data_obj, code_version = cache.get(cache_key, columns)
+        if data_obj is not None:
+            print(f" ... found {cache_name} in the cache\n\n")
+            cache.close()
+            if time_range is not None:
+                if not as_xrds:             data_obj = data_obj[time_range[0]:time_range[1]]
+                elif 'time' in data_obj.dims: data_obj = data_obj.sel(time=slice(time_range[0], time_range[1]))
+            return data_obj, code_version
+        print(f"... {cache_name} isn't cached\n\n")
+
+    if variables is not None or time_range is not None: # only read what was asked for
+        if cache is not None: cache.close()
+        ds = open_flux_files(file_list, variables, time_range, verbose)
+        code_version = ds.attrs.get('version', 'unknown')
+        if as_xrds: return ds, code_version
+        if len(ds.dims) == 0: return pd.DataFrame(), code_version
+        return tidy_flux_df(ds.to_dataframe()), code_version
+
     df = pd.DataFrame() # dataframe and version we return from this function
     code_version = "?"
-    was_pickled = False
-    if pickle_dir:
-        if verbose: print(f"\n!!! searching for pickle file containing {pickled_filename} and loading it, takes time...\n")
-        for root, dirs, files in os.walk(pickle_dir): # pretty stupid way to find the file
-            for filename in files:
-                if pickled_filename in filename:
-                    filename = pickle_dir+filename
-
-                    with open(filename, "rb") as f:
-                        data_obj = pickle.load(f)
-                    name_words = filename.rpartition('_')[-1].rpartition('.')
-                    code_version = f"{name_words[0]}.{name_words[1]}"
-                    was_pickled = True
-                    print(f" ... found and loaded pickle {filename} \n\n")
-                    break
-
-        if not was_pickled: print("... didn't find a pickle, we'll write one !!!\n\n")
-
-    if not was_pickled: 
-        data_list = [] # data frames get appended here in loop and then concatted by function after
-        day_series = pd.date_range(start_day, end_day) 
-
-        q_list = []; p_list = []; day_list = []
-        for i_day, today in enumerate(day_series): # loop over days in processing range and get list of files
-
-            if i_day %nthreads == 0:
-                if nthreads > 1:
-                    print("  ... getting data for day {} (and {} days after in parallel)".format(today,nthreads))
-                else:
-                    print("  ... getting data for day {}".format(today))
-
-            date_str = today.strftime('%Y%m%d.%H%M%S')
-            if level == 1: level_str = 'ingest'
-            if level == 2: level_str = 'product'
-            if level == 3: level_str = 'archive'
-
-            subdir   = f'/{level}_level_{level_str}_{station}/'
-            if level==3: subdir   = f'/{level}_level_{level_str}/'
-            if station == 'tower':
-                subdir   = f'/{level}_level_{level_str}/'
-                file_str = f'/mosflx{station}{data_type}.level{level}.{date_str}.nc'
-                if level in [2, 3]:
-                    #subdir = subdir+'version3/'
-                    #subdir = subdir+'finalqc/'
-                    cadence = '1'
-                    if data_type=='seb': cadence = '10'
-                    #file_str = f'/mos{data_type}.metcity.level{level}v3.{cadence}min.{date_str}.nc'
-                    file_str = f'/mos{data_type}.metcity.level{level}.4.{cadence}min.{date_str}.nc'
+    data_list = [] # data frames get appended here in loop and then concatted by function after
+
+    file_pool = fl.task_pool(nthreads) # each day's file is read by the next free worker
+    for i_day, today in enumerate(day_series): # loop over days in processing range and get list of files
 
+        if i_day %nthreads == 0:
+            if nthreads > 1:
+                print("  ... getting data for day {} (and {} days after in parallel)".format(today,nthreads))
             else:
-                file_str = f'/mos{station}{data_type}.level{level}.{date_str}.nc'
-                if level in [2, 3]:
-                    cadence = '1'
-                    if data_type=='seb': cadence = '10'
-                    file_str = f'/mos{data_type}.{station}.level{level}.4.{cadence}min.{date_str}.nc'
-                    #subdir = subdir+'/version3'
-
-
-            files_dir = data_dir+station+subdir
-            curr_file = files_dir+file_str
-
-            q_today = Q()
-            P(target=get_datafile, args=(curr_file, as_xrds , q_today),).start()
-            q_list.append(q_today)
-            day_list.append(today)
-            if (i_day+1) % nthreads == 0 or today == day_series[-1]:
-                for qq in q_list:
-                    data_today = qq.get()
-                    cv = qq.get()
-                    if cv!=None: code_version = cv # assume all files have same code version, save only one
-                    if type(data_today) in [type(pd.DataFrame()), type(xr.Dataset())]:
-                        data_list.append(data_today.copy())
-                q_list = []
-                day_list = []
-
-        if verbose: print("... concatting, takes some time...")
-        if as_xrds: 
-
-            try    :
-                if verbose: print(data_list[0])
-                ds = xr.concat(data_list, 'time')
-            except Exception as e :
-                if verbose: print("-----------------------")
-                if verbose: print(e)
-                ds = xr.Dataset()   
-
-
-            data_obj = ds
+                print("  ... getting data for day {}".format(today))
+
+        file_pool.submit(i_day, get_datafile, file_list[i_day], as_xrds)
+
+    # the files come back in whatever order they're read, put them back in day order
+    data_by_day = {}
+    for i_day, status, file_data, runtime in file_pool.results():
+        if status != 'ok' or len(file_data) < 2:
+            print(f"!!! couldn't read the file for {day_series[i_day]}, {status}:\n{file_data}")
+            continue
+        data_today, cv = file_data[0:2]
+        if cv!=None: code_version = cv # assume all files have same code version, save only one
+        if type(data_today) in [type(pd.DataFrame()), type(xr.Dataset())]:
+            data_by_day[i_day] = data_today
+    data_list = [data_by_day[i_day] for i_day in sorted(data_by_day)]
+
+    if verbose: print("... concatting, takes some time...")
+    if as_xrds: 
 
-        else:
-            try    : df = pd.concat(data_list)
-            except : pd.DataFrame()
+        try    :
+            if verbose: print(data_list[0])
+            ds = xr.concat(data_list, 'time')
+        except Exception as e :
+            if verbose: print("-----------------------")
+            if verbose: print(e)
+            ds = xr.Dataset()   
+
+
+        data_obj = ds
+
+    else:
+        try    : df = pd.concat(data_list)
+        except : pd.DataFrame()
+
+        data_obj = tidy_flux_df(df)
+
+
+    if verbose:
+        print('\n ... data sample :')
+        print('================')
+        print(data_obj)
+        print('\n')
+        print('================\n\n') 
+
+    if cache is not None:
+        print("... caching it, this takes a minute, patience")
+        cache.put(cache_key, cache_name, data_obj, code_version)
+        cache.close()
 
-            try: 
-                df.index = df.index.droplevel("freq")
-                df       = df[~df.index.duplicated(keep='first')]
-            except: pass # this only applices to 'seb', no need to worry. more specific exception though? 
-
-            time_dates = df.index
-            df['time'] = time_dates # duplicates index... but it can be convenient
-
-            data_obj = df
-
-
-        if verbose:
-            print('\n ... data sample :')
-            print('================')
-            print(data_obj)
-            print('\n')
-            print('================\n\n') 
-
-        if pickle_dir:
-            print("\n\n!!! You requested to pickle the dataframe for speed !!!")
-            print(f"... right now we're writing it to this directory {pickled_filename}")
-            print("... copy this manually to a ramdisk somewhere for bonus speed points")
-            print("... must be symlinked here to be seen by this routine")
-            print("...\n... this takes a minute, patience\n\n")
-            pickle_name = f"{pickle_dir}/{pickled_filename}_{code_version[0:3]}.pkl"
-
-            with open(pickle_name, 'wb') as pf:
-                retcode = pickle.dump(data_obj, pf)#, protocol=pickle.HIGHEST_PROTOCOL)
- 
     return data_obj, code_version 
 
+# the daily file for station/level/data_type, in the standard folder structure of the NOAA archive
+def get_flux_file(station, today, level, data_dir, data_type):
+
+    date_str = today.strftime('%Y%m%d.%H%M%S')
+    if level == 1: level_str = 'ingest'
+    if level == 2: level_str = 'product'
+    if level == 3: level_str = 'archive'
+
+    subdir   = f'/{level}_level_{level_str}_{station}/'
+    if level==3: subdir   = f'/{level}_level_{level_str}/'
+    if station == 'tower':
+        subdir   = f'/{level}_level_{level_str}/'
+        file_str = f'/mosflx{station}{data_type}.level{level}.{date_str}.nc'
+        if level in [2, 3]:
+            #subdir = subdir+'version3/'
+            #subdir = subdir+'finalqc/'
+            cadence = '1'
+            if data_type=='seb': cadence = '10'
+            #file_str = f'/mos{data_type}.metcity.level{level}v3.{cadence}min.{date_str}.nc'
+            file_str = f'/mos{data_type}.metcity.level{level}.4.{cadence}min.{date_str}.nc'
+
+    else:
+        file_str = f'/mos{station}{data_type}.level{level}.{date_str}.nc'
+        if level in [2, 3]:
+            cadence = '1'
+            if data_type=='seb': cadence = '10'
+            file_str = f'/mos{data_type}.{station}.level{level}.4.{cadence}min.{date_str}.nc'
+            #subdir = subdir+'/version3'
+
+
+    files_dir = data_dir+station+subdir
+    return files_dir+file_str
+
+# the variable attributes of each of the daily files, from a header only read (no data is read), as
+# {file: {var_name: {att: value}}}. the attributes xarray decodes into .encoding (_FillValue,
+# missing_value...) are left out, so it's what .attrs would be on the opened dataset. files that
+# don't exist aren't in it
+encoding_atts = ['_FillValue', 'missing_value', 'scale_factor', 'add_offset']
+def get_flux_attrs(file_list):
+
+    from netCDF4 import Dataset
+
+    file_attrs = {}
+    for curr_file in file_list:
+        if not os.path.isfile(curr_file): continue
+        try:
+            with Dataset(curr_file, 'r') as nc_file:
+                file_attrs[curr_file] = {var_name: {att: var.getncattr(att) for att in var.ncattrs() if att not in encoding_atts}
+                                         for var_name, var in nc_file.variables.items()}
+        except Exception as e:
+            print(f"!!! couldn't read the header of {curr_file}: {e}")
+    return file_attrs
+
+# the 'seb' files have a freq dimension, the dataframe just wants time. the index is duplicated
+# in a time column too... it can be convenient
+def tidy_flux_df(df):
+    try: 
+        df.index = df.index.droplevel("freq")
+        df       = df[~df.index.duplicated(keep='first')]
+    except: pass # this only applices to 'seb', no need to worry. more specific exception though? 
+
+    time_dates = df.index
+    df['time'] = time_dates # duplicates index... but it can be convenient
+    return df
+
+# opens the daily files that exist as one lazy dataset, nothing is read until it's asked for and
+# then only variables (all if None) in time_range (all if None). with dask it's a chunked
+# open_mfdataset, without it the files are opened lazily one by one and concatenated
+def open_flux_files(file_list, variables=None, time_range=None, verbose=False):
+
+    file_list = [f for f in file_list if os.path.isfile(f)]
+    if verbose: print(f"... opening {len(file_list)} files lazily, variables {variables}, time range {time_range}")
+    if len(file_list) == 0: 
+        print("!!! none of the requested files exist")
+        return xr.Dataset()
+
+    def select(ds):
+        if variables is not None: ds = ds[[v for v in variables if v in ds.variables]]
+        if time_range is not None and 'time' in ds.dims: ds = ds.sel(time=slice(time_range[0], time_range[1]))
+        return ds
+
+    have_dask = importlib.util.find_spec('dask') is not None
+
+    combine_args = dict(data_vars='minimal', coords='minimal', compat='override')
+    if have_dask:
+        return xr.open_mfdataset(file_list, engine='netcdf4', combine='nested', concat_dim='time',
+                                 preprocess=select, chunks={}, **combine_args)
+    else:
+        ds_list = [select(xr.open_dataset(f, engine='netcdf4')) for f in file_list]
+        return xr.concat(ds_list, 'time', **combine_args)
+
+
+class flux_day_ring(object):
+
+    """ The daily files of one station/level/data_type, read in sequence.
+
+    Processing a day wants a bit of the days either side too, so reading
+    yesterday/today/tomorrow for every day reads every file three times.
+    This keeps the last ndays decoded days in memory and hands out the
+    slice that's asked for, a day's file is only read again if it was
+    dropped from the ring in between, which doesn't happen when the
+    days are asked for in order.
+
+    Required params
+    ---------------
+    station     : str station name, 'asfs30', etc 'tower'
+    level       : 1, 2, 3 ... which dataset 
+
+    Optional params
+    ---------------
+    data_dir    : the head where the files can be found
+    data_type   : 'fast' 'slow', 'turb','met'data, etc
+    ndays       : how many decoded days are kept
+    verbose     : would you like to see more print statements?
+
+    Example
+    -------
+    ring = flux_day_ring('asfs30', 1, data_dir, 'fast')
+    for today in day_series: 
+        fdt = ring.window(today-timedelta(hours=1), today+timedelta(days=1, hours=1))
+
+    """
+
+    def __init__(self, station, level, data_dir='/Projects/MOSAiC/', data_type='fast', ndays=3, verbose=False):
+
+        self.station      = station
+        self.level        = level
+        self.data_dir     = data_dir
+        self.data_type    = data_type
+        self.ndays        = ndays
+        self.verbose      = verbose
+        self.code_version = 'unknown'
+        self.opened       = [] # every file that was read, in order
+        self._days        = {} # day: tidied dataframe, oldest first
+
+    def day(self, today):
+
+        today = pd.Timestamp(today).floor('D')
+        if today in self._days: return self._days[today]
+
+        day_file = get_flux_file(self.station, today, self.level, self.data_dir, self.data_type)
+        df = pd.DataFrame()
+        if os.path.isfile(day_file):
+            if self.verbose: print(f'... got {day_file}')
+            self.opened.append(day_file)
+            try: 
+                with xr.load_dataset(day_file, engine='netcdf4') as xarr_ds:
+                    self.code_version = xarr_ds.attrs.get('version', self.code_version)
+                    df = tidy_flux_df(xarr_ds.to_dataframe())
+            except Exception as e: 
+                print(f"!!! couldn't read {day_file}: {e}")
+        else:
+            print(f"!!! requested file doesn't exist : {day_file}")
+
+        self._days[today] = df
+        while len(self._days) > self.ndays: self._days.pop(next(iter(self._days)))
+        return df
+
+    # the data between t0 and t1 (inclusive) from the days it falls in
+    def window(self, t0, t1):
+
+        frames = [self.day(today) for today in pd.date_range(pd.Timestamp(t0).floor('D'), t1)]
+        frames = [f[t0:t1] for f in frames if not f.empty]
+        if len(frames) == 0: return pd.DataFrame()
+        return pd.concat(frames)
+
+
 def get_datafile(curr_file, as_xrds=False, q=None):
 
     if os.path.isfile(curr_file):
@@ -252,6 +394,69 @@ def get_ship_df(ship_data_dir='/Projects/MOSAiC_internal/partner_data/AWI/polars
 
     return ship_df
 
+class ship_track(object):
+
+    """ Polarstern's position at any time, from the Leica track. 
+
+    The track is interpolated in time, linearly, longitude unwrapped so
+    crossing 180 doesn't go the long way round. Times outside the track
+    or in a gap longer than max_gap are nan. Get one per process with
+    get_ship_track, reading the Leica file is the slow part.
+
+    Required params
+    ---------------
+    ship_df     : dataframe with lat/lon columns and a time index, from get_ship_df
+
+    Optional params
+    ---------------
+    max_gap     : pandas Timedelta, longest gap in the track that's interpolated (None, any)
+
+    Example
+    -------
+    track = get_ship_track(leica_dir)
+    sd['ship_distance'], sd['ship_bearing'] = track.distance_bearing(sd.index, sd['lat'], sd['lon'])
+
+    """
+
+    def __init__(self, ship_df, max_gap=None):
+
+        track = ship_df[['lat', 'lon']].dropna()
+        track = track[~track.index.duplicated(keep='first')].sort_index()
+
+        self.max_gap = max_gap
+        self.times   = track.index.asi8
+        self.lat     = track['lat'].values
+        self.lon     = np.degrees(np.unwrap(np.radians(track['lon'].values)))
+
+    # (lat, lon) of the ship at times, arrays
+    def position(self, times):
+
+        t   = pd.DatetimeIndex(times).asi8
+        lat = np.interp(t, self.times, self.lat, left=np.nan, right=np.nan)
+        lon = np.interp(t, self.times, self.lon, left=np.nan, right=np.nan)
+        lon = np.mod(lon+180, 360)-180
+
+        if self.max_gap is not None and self.times.size > 1:
+            after  = np.clip(np.searchsorted(self.times, t), 1, self.times.size-1)
+            in_gap = (self.times[after]-self.times[after-1]) > pd.Timedelta(self.max_gap).value
+            lat[in_gap & (t != self.times[after])] = np.nan
+            lon[in_gap & (t != self.times[after])] = np.nan
+
+        return lat, lon
+
+    # distance [m] and bearing [deg from the station, -180 to 180, like wind direction] from the
+    # station at lat/lon to the ship, at times. all arrays of the same length, one call
+    def distance_bearing(self, times, lat, lon):
+
+        ship_lat, ship_lon = self.position(times)
+        bearing, dist      = fl.geod_inverse(lat, lon, ship_lat, ship_lon)
+        return dist, bearing
+
+_ship_tracks = {} # ship_data_dir: ship_track, read once per process
+def get_ship_track(ship_data_dir='/Projects/MOSAiC_internal/partner_data/AWI/polarstern/WXstation/'):
+    if ship_data_dir not in _ship_tracks: _ship_tracks[ship_data_dir] = ship_track(get_ship_df(ship_data_dir))
+    return _ship_tracks[ship_data_dir]
+
 
 def get_arm_radiation_data(start_day, end_day, data_dir='/Projects/MOSAiC/',
                            verbose=False, nthreads=1, pickle_dir=None):
@@ -272,10 +477,10 @@ def get_arm_radiation_data(start_day, end_day, data_dir='/Projects/MOSAiC/',
     nthreads    : how many cpu threads would you like to use 
     verbose     : would you like to see more print statements?
 
-    pickle_dir : if provided, we search for a pandas 'pickle' binary
-                 file containing the pre-packed pandas objects. if we
-                 don't find it, it is written after ingest. saves *a lot*
-                 of time when stored on ramdisk for bigger files.
+    pickle_dir : if provided, the data is cached here (fl.frame_cache, feather,
+                 pickle without pyarrow) after it's read and taken from the cache the next time, as
+                 long as the files didn't change. saves *a lot* of time when
+                 stored on ramdisk for bigger files.
 
     Returns
     -------
@@ -286,85 +491,70 @@ def get_arm_radiation_data(start_day, end_day, data_dir='/Projects/MOSAiC/',
 
     """
 
-    subdir = 'ARM/mosiceradriihimakiS3.b1/'
+    subdir     = 'ARM/mosiceradriihimakiS3.b1/'
+    day_series = pd.date_range(start_day, end_day) 
+    file_list  = [data_dir+subdir+f"/mosiceradriihimakiS3.b1.{today.strftime('%Y%m%d.%H%M%S')}.nc" for today in day_series]
+
+    cache = None
+    if pickle_dir:
+        cache_name = f'ARM_df_{day_series[0]:%Y%m%d}_{day_series[-1]:%Y%m%d}'
+        cache      = fl.frame_cache(pickle_dir)
+        cache_key  = cache.make_key(cache_name, file_list, cache_version)
+
+        df, code_version = cache.get(cache_key)
+        if df is not None:
+            print(f" ... found {cache_name} in the cache\n\n")
+            cache.close()
+            return df, code_version
+        print(f"... {cache_name} isn't cached, we will cache it\n\n")
 
-    pickled_filename = f'ARM_df_{start_day}_{end_day}' 
     df = pd.DataFrame() # dataframe and version we return from this function
     code_version = "?"
-    was_pickled = False
-    if pickle_dir:
-        print(f"\n!!! searching for pickle file containing {pickled_filename} and loading it, takes time...\n")
-        for root, dirs, files in os.walk(pickle_dir): # pretty stupid way to find the file
-            for filename in files:
-                if pickled_filename in filename:
-                    filename = pickle_dir+ filename
-                    with open(filename, "rb") as f:
-                        df = pickle.load(f)
-                    name_words = filename.rpartition('_')[-1].rpartition('.')
-                    code_version = f"{name_words[0]}.{name_words[1]}"
-                    was_pickled = True
-                    print(f" ... found and loaded pickle {filename} \n\n")
-                    break
-
-        if not was_pickled: print("... didn't find a pickle, we'll write one !!!\n\n")
-
-    if not was_pickled: 
-        df_list = [] # data frames get appended here in loop and then concatted by function after
-        day_series = pd.date_range(start_day, end_day) 
-
-        q_list = []; p_list = []; day_list = []
-        for i_day, today in enumerate(day_series): # loop over days in processing range and get list of files
-
-            if i_day %nthreads == 0:
-                if nthreads > 1:
-                    print("  ... getting data for day {} (and {} days after in parallel)".format(today,nthreads))
-                else:
-                    print("  ... getting data for day {}".format(today))
-
-            date_str = today.strftime('%Y%m%d.%H%M%S')
-
-            file_str = f'/mosiceradriihimakiS3.b1.{date_str}.nc'
-            files_dir = data_dir+subdir
-            curr_file = files_dir+file_str
-
-            if verbose: 
-                print(f"  ... {curr_file}")
-            q_today = Q()
-            P(target=get_datafile, args=(curr_file, False, q_today),).start()
-            q_list.append(q_today)
-            day_list.append(today)
-            if (i_day+1) % nthreads == 0 or today == day_series[-1]:
-                for iq,qq in enumerate(q_list):
-                    df_today = qq.get()
-                    cv = qq.get()
-                    if cv!=None: code_version = cv # assume all files have same code version, save only one
-                    if type(df_today) == type(pd.DataFrame()): 
-                        df_list.append(df_today.copy())
-                q_list = []
-                day_list = []
-
-        if verbose: print("... concatting, takes some time...")
-        try    : df = pd.concat(df_list)
-        except : pd.DataFrame()
+    df_list = [] # data frames get appended here in loop and then concatted by function after
 
-        time_dates = df.index
-        df['time'] = time_dates # duplicates index... but it can be convenient
-
-        if verbose:
-            print('\n ... data sample :')
-            print('================')
-            print(df)
-            print('\n')
-            print(df.info())
-            print('================\n\n') 
-
-        if pickle_dir:
-            print("\n\n!!! You requested to pickle the dataframe for speed !!!")
-            print(f"... right now we're writing it to this directory {pickled_filename}")
-            print("... copy this manually to a ramdisk somewhere for bonus speed points")
-            print("... must be symlinked here to be seen by this routine")
-            print("...\n... this takes a minute, patience\n\n")
-            df.to_pickle(f"{pickle_dir}/{pickled_filename}_{code_version[0:3]}.pkl")
+    file_pool = fl.task_pool(nthreads) # each day's file is read by the next free worker
+    for i_day, today in enumerate(day_series): # loop over days in processing range and get list of files
+
+        if i_day %nthreads == 0:
+            if nthreads > 1:
+                print("  ... getting data for day {} (and {} days after in parallel)".format(today,nthreads))
+            else:
+                print("  ... getting data for day {}".format(today))
+
+        if verbose: 
+            print(f"  ... {file_list[i_day]}")
+        file_pool.submit(i_day, get_datafile, file_list[i_day], False)
+
+    df_by_day = {}
+    for i_day, status, file_data, runtime in file_pool.results():
+        if status != 'ok' or len(file_data) < 2:
+            print(f"!!! couldn't read the file for {day_series[i_day]}, {status}:\n{file_data}")
+            continue
+        df_today, cv = file_data[0:2]
+        if cv!=None: code_version = cv # assume all files have same code version, save only one
+        if type(df_today) == type(pd.DataFrame()): 
+            df_by_day[i_day] = df_today
+    df_list = [df_by_day[i_day] for i_day in sorted(df_by_day)]
+
+    if verbose: print("... concatting, takes some time...")
+    try    : df = pd.concat(df_list)
+    except : pd.DataFrame()
+
+    time_dates = df.index
+    df['time'] = time_dates # duplicates index... but it can be convenient
+
+    if verbose:
+        print('\n ... data sample :')
+        print('================')
+        print(df)
+        print('\n')
+        print(df.info())
+        print('================\n\n') 
+
+    if cache is not None:
+        print("... caching it, this takes a minute, patience")
+        cache.put(cache_key, cache_name, df, code_version)
+        cache.close()
 
     return df, code_version 
 
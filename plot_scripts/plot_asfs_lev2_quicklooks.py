@@ -178,7 +178,7 @@ def main(): # the main data crunching program
     parser.add_argument('-s', '--start_time', metavar='str',   help='beginning of processing period, Ymd syntax')
     parser.add_argument('-e', '--end_time',   metavar='str',   help='end  of processing period, Ymd syntax')
     parser.add_argument('-p', '--path', metavar='str',         help='base path to data up to, including /data/, include trailing slash')
-    parser.add_argument('-pd', '--pickledir', metavar='str',   help='want to store a pickle of the data for debugging?')
+    parser.add_argument('-pd', '--pickledir', metavar='str',   help='directory to cache the data in (feather/zarr), for speed on reruns')
 
     args         = parser.parse_args()
     v_print      = print if args.verbose else lambda *a, **k: None
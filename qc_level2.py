@@ -7,7 +7,7 @@ import pandas as pd
 pd.options.mode.use_inf_as_na = True # no inf values anywhere 
 
 from datetime  import datetime as dt
-import time
+import time, hashlib
 
 from collections import OrderedDict
 
@@ -167,11 +167,8 @@ def qc_tower_winds(tower_data, ship_data):
 
                 try:
 
-                    ship_distance = fl.distance_wgs84(tower_data['lat_mast'], tower_data['lon_mast'],
-                                                      ship_data['lat'], ship_data['lon'])
-
-                    ship_bearing = fl.calculate_initial_angle_wgs84(tower_data['lat_mast'], tower_data['lon_mast'],
-                                                                    ship_data['lat'],ship_data['lon']) 
+                    ship_bearing, ship_distance = fl.geod_inverse(tower_data['lat_mast'], tower_data['lon_mast'],
+                                                                  ship_data['lat'], ship_data['lon'])
                 except:
 
                     ship_distance = tower_data['ship_distance']-63.3
@@ -271,7 +268,7 @@ def qc_asfs_winds(station_data):
 def qc_flagging(data_frame, table_file, qc_var_names, station_name):
 
     print(f"…………… getting qc file, {table_file}")
-    flag_df = get_qc_table(table_file)
+    qc_table = get_compiled_qc_table(table_file, qc_var_names, station_name)
 
     print("…………… setting qc vals to 0")
 
@@ -283,7 +280,6 @@ def qc_flagging(data_frame, table_file, qc_var_names, station_name):
     if station_name == 'tower':
         height_strs = ['2m', '6m', '10m', 'mast'] 
 
-        add_str = '_tower'
         turb_qc_vars = []
         for h in height_strs:
             var = f'turbulence_{h}_qc'
@@ -301,13 +297,30 @@ def qc_flagging(data_frame, table_file, qc_var_names, station_name):
         data_frame.loc[~data_frame['temp'].isnull(), 'turbulence_qc'] = 0
         data_frame.loc[~data_frame['temp'].isnull(), 'bulk_qc']       = 0
 
-        add_str = '' # some vars are different for tower... :::|
+    print("…………… done, moving on to table and inheritance")
+
+    data_frame, problem_vars = qc_table.apply(data_frame)
+
+    if len(problem_vars)>1:
+        print(f"\n\n There were some problems with the QC file {table_file}, specifically,"+
+              f"{len(problem_vars)} of them, these variables aren't in the data: {problem_vars}\n\n")
+        time.sleep(10)
 
-    print("…………… done, moving on to table")
+    else:
+        print("…………… CONGRATULATIONS THERE WERE ZERO TYPOS FOR ONCE OMG")
+
+    print("…………… done, returning")
+
+    return data_frame 
+
+# lookup table for "group" names, these need to include the "_qc", as the code below
+# puts the value into that field, i.e. temp_qc, not just temp, aka 'inheritance'/hierarchy
+# the order matters, btw, since ALL_FIELDS should be evaluated in the loop below last
+def get_qc_lookup_table(qc_var_names, station_name):
+
+    if station_name == 'tower': add_str = '_tower'
+    else: add_str = '' # some vars are different for tower... :::|
 
-    # lookup table for "group" names, these need to include the "_qc", as the code below
-    # puts the value into that field, i.e. temp_qc, not just temp, aka 'inheritance'/hierarchy
-    # the order matters, btw, since ALL_FIELDS should be evaluated in the loop below last
     lookup_table = {
         'up_long_hemisp'   : ['up_long_hemisp', 'skin_temp_surface'],
         'down_long_hemisp' : ['down_long_hemisp', 'skin_temp_surface'],
@@ -339,134 +352,207 @@ def qc_flagging(data_frame, table_file, qc_var_names, station_name):
                           +['turbulence', 'bulk'], 
         })
 
-    lookup_table = OrderedDict(lookup_table) # ensure order doesn't change
+    return OrderedDict(lookup_table) # ensure order doesn't change
 
+class compiled_qc_table(object):
 
-    problem_rows = {} # dictionary to keep rows that don't match any of the conditionals, i.e. bad/nonsense rows
-    # we go through every entry in the qc table and fill in the qc vars in the dataframe
-    for irow, row in flag_df.iterrows():
+    __doc__ = """
 
-        # hackery to account for heights that might exist avoiding duplicating stuff up there ^
-        height_strs = ['2m', '6m', '10m', 'mast'] 
-        if any(h in row['var_name'] for h in height_strs):
-            hstr = '_'+row['var_name'].split('_')[-1]
-            special_key = row['var_name'].rstrip('_'+hstr)
+    A manual QC table parsed once and turned into what qc_flagging used to work out row by row with
+    iterrows every time it was called. Gives the same flags, it's the same three steps:
 
-        else:
-            hstr = ''
-            special_key = row['var_name']
+      1) every row sets its qc value over [start, end] (inclusive) on its variable, or on all of
+         the variables in its lookup_table group. later rows win. compiled into intervals per
+         qc variable, in table order
+      2) in lookup_table order, 'real' parents pass caution/bad/engineering flags (1/2/3) down to
+         their children, without overwriting anything worse
+      3) the ALL_* rows of that parent are applied to its children over (start, end) (exclusive),
+         also without overwriting 2/3 (or 2, if the row is a 2)
 
-        # is the current variable in the lookup list
-        if any(special_key in c for c in lookup_table.keys()):
-            
-            for v in lookup_table[special_key]: 
+    The intervals are turned into index ranges with searchsorted on the (sorted) time index and
+    everything is done on numpy arrays, then put back into the dataframe once at the end. Use
+    get_compiled_qc_table() to get one, they're cached by the content of the csv.
 
-                try: 
-                    special_var = v+hstr+'_qc'
-                    data_frame.loc[row['start_date']:row['end_date'], special_var] = row['qc_val']
-                except Exception as ex:
-                    print(ex)
-                    print(f"... failed for {special_key=} and val {v+hstr}")
+    Parameters:
+    ----------
+    flag_df      : the table, from get_qc_table()
+    qc_var_names : the qc variable names, like tower_qc_variables()[1]
+    station_name : 'tower' or the asfs name
 
-        # it wasn't in the lookup list, only fill out the qc var for this individual variable
-        else:
-            try:
-                var_to_qc = row['var_name']+'_qc' # get var_name column from file
-                data_frame.loc[row['start_date']:row['end_date'], var_to_qc] = row['qc_val']
-
-            except KeyError as ke: 
-                    print(f"!!! problem with entry in manual QC table for {table_file} for var {var_to_qc} at row {irow}!!!")
-                    print(f"{row}")
-                    print("==========================================================================================")
-                    print("Python traceback: \n\n")
-                    import traceback, sys
-                    print(traceback.format_exc())
-                    print("==========================================================================================")
-
-                    problem_rows[irow] = row
-
-    print("…………… done, moving on to inheritance")
-
-
-    # now make sure that everything is inherited from before as well, this could include the automatic qc..
-    # we loop through the list of inherited variables
-    for parent_var, child_var_list in lookup_table.items():
-        # if the parent variable is a "real" measured param, copy all engineering/bad data
-        # from the parent variable and apply it to all inherited variables...
-        if 'ALL_' not in parent_var:
-
-            try:
-                data_frame[parent_var+'_qc'] # does this var exist?
-                height_strs = ['',]
-            except KeyError as ke:
-                data_frame[parent_var+'_2m_qc'] # if no, then it has to be a height var
-                height_strs = ['_2m', '_6m', '_10m', '_mast'] 
-            for h in height_strs:
-                caut_inds = (data_frame[parent_var+h+'_qc']==1)  
-                bad_inds  = (data_frame[parent_var+h+'_qc']==2)  
-                eng_inds  = (data_frame[parent_var+h+'_qc']==3)
-                for child_var in child_var_list:
+    Example:
+    -------
+    qc_table = get_compiled_qc_table("./qc_tables/qc_table_tower.csv", tower_qc_variables()[1], 'tower')
+    data_frame, problem_vars = qc_table.apply(data_frame)
 
-                    no_overwrite = (data_frame[child_var+h+'_qc']!=2)&(data_frame[child_var+h+'_qc']!=3)
-                    data_frame.loc[(caut_inds)&(no_overwrite), child_var+h+'_qc'] = 1
+    ================================================================================================
 
-                    no_overwrite = (data_frame[child_var+h+'_qc']!=2)
+    """
 
-                    data_frame.loc[(eng_inds)&(no_overwrite), child_var+h+'_qc']  = 3
-                    data_frame.loc[bad_inds, child_var+h+'_qc']  = 2
+    def __init__(self, flag_df, qc_var_names, station_name):
 
+        self.station_name = station_name
+        self.lookup_table = get_qc_lookup_table(qc_var_names, station_name)
 
-        # but for "ALL_" variables we're going to manually apply the qc values for each time
-        # range specified in the qc table to all of the applicable variables...
-        # ... this is done here and not above because it needs to supersede any of the other
-        # possible qc values specified
-        else:
+        var_names = flag_df['var_name'].tolist()
+        starts    = flag_df['start_date'].values.astype('datetime64[ns]')
+        ends      = flag_df['end_date'].values.astype('datetime64[ns]')
+        qc_vals   = flag_df['qc_val'].values
 
-            for irow, row in flag_df.iterrows():
-                if parent_var == row['var_name']: 
+        # 1) which qc variables each row is applied to, same hackery as always for the heights
+        height_strs = ['2m', '6m', '10m', 'mast'] 
+        row_targets = {} 
+        for irow, var_name in enumerate(var_names):
+            if any(h in var_name for h in height_strs):
+                hstr = '_'+var_name.split('_')[-1]
+                special_key = var_name.rstrip('_'+hstr)
+            else:
+                hstr = ''
+                special_key = var_name
+
+            if any(special_key in c for c in self.lookup_table.keys()):
+                targets = [v+hstr+'_qc' for v in self.lookup_table[special_key]]
+            else:
+                targets = [var_name+'_qc']
+
+            for qc_var in targets: row_targets.setdefault(qc_var, []).append(irow)
+
+        self.var_intervals = OrderedDict()
+        for qc_var, rows in row_targets.items():
+            self.var_intervals[qc_var] = (starts[rows], ends[rows], qc_vals[rows])
+
+        # 3) the rows of each ALL_* parent, in table order
+        self.all_intervals = OrderedDict()
+        for parent_var in self.lookup_table.keys():
+            if 'ALL_' not in parent_var: continue
+            rows = [irow for irow, var_name in enumerate(var_names) if var_name == parent_var]
+            self.all_intervals[parent_var] = (starts[rows], ends[rows], qc_vals[rows])
+
+    # returns data_frame with the flags applied and the qc variables from the table that weren't
+    # in it (they're added, flagged over their ranges and nan elsewhere, like .loc would do)
+    def apply(self, data_frame):
+
+        if not data_frame.index.is_monotonic_increasing:
+            raise Exception("qc flagging needs a time sorted dataframe")
+
+        times   = data_frame.index.values.astype('datetime64[ns]')
+        columns = {} # qc var name -> float array being worked on
+        problem_vars = []
+
+        def get_col(qc_var):
+            if qc_var not in columns:
+                columns[qc_var] = data_frame[qc_var].to_numpy(dtype=np.float64, copy=True) # KeyError if it isn't there
+            return columns[qc_var]
+
+        # 1) later rows overwrite earlier ones
+        for qc_var, (starts, ends, qc_vals) in self.var_intervals.items():
+            if qc_var in data_frame.columns: col = get_col(qc_var)
+            else:
+                col = columns[qc_var] = np.full(times.size, nan)
+                problem_vars.append(qc_var)
+
+            i0 = np.searchsorted(times, starts, side='left')
+            i1 = np.searchsorted(times, ends,   side='right')
+            for i_start, i_end, qc_val in zip(i0, i1, qc_vals):
+                col[i_start:i_end] = qc_val
+
+        for parent_var, child_var_list in self.lookup_table.items():
+
+            # 2) copy all caution/engineering/bad data from the parent to its children
+            if 'ALL_' not in parent_var:
+
+                if parent_var+'_qc' in columns or parent_var+'_qc' in data_frame.columns: height_strs = ['',]
+                else:
+                    get_col(parent_var+'_2m_qc') # if no, then it has to be a height var
+                    height_strs = ['_2m', '_6m', '_10m', '_mast'] 
+
+                for h in height_strs:
+                    parent_col = get_col(parent_var+h+'_qc')
+                    caut_inds  = (parent_col==1)  
+                    bad_inds   = (parent_col==2)  
+                    eng_inds   = (parent_col==3)
                     for child_var in child_var_list:
-                        try: 
-                            child_qc_var = child_var+'_qc'
-
-                            no_overwrite = (data_frame[child_qc_var]!=2)&(data_frame[child_qc_var]!=3)
-                            if row['qc_val'] == 2:
-                                no_overwrite = (data_frame[child_qc_var]!=2)
-
-                            time_range = (data_frame.index>row['start_date'])&(data_frame.index<row['end_date'])
-
-                            data_frame.loc[(time_range) & (no_overwrite), child_qc_var] = row['qc_val']
-                        except:
-
-                            height_strs = ['_2m', '_6m', '_10m', '_mast'] 
-                            for h in height_strs:
-                                child_qc_var = child_var+h+'_qc'
-                                try:
-                                    no_overwrite = (data_frame[child_qc_var]!=2)&(data_frame[child_qc_var]!=3)
-                                    if row['qc_val'] == 2:
-                                        no_overwrite = (data_frame[child_qc_var]!=2)
-
-                                    time_range = (data_frame.index>row['start_date'])&(data_frame.index<row['end_date'])
+                        child_col = get_col(child_var+h+'_qc')
 
-                                    data_frame.loc[(time_range) & (no_overwrite), child_qc_var] = row['qc_val']
-                                except: 
-                                    import traceback, sys
-                                    print(traceback.format_exc())
-                                    print(f"... an 'ALL_*' ({parent_var})variable had an invalid child ({child_var})"+
-                                          f"! this should never happen...!!!!")
-                                    raise
+                        no_overwrite = (child_col!=2)&(child_col!=3)
+                        child_col[caut_inds & no_overwrite] = 1
 
+                        no_overwrite = (child_col!=2)
+                        child_col[eng_inds & no_overwrite] = 3
+                        child_col[bad_inds] = 2
 
-    if len(problem_rows)>1:
-        print(f"\n\n There were some problems with the QC file {table_file}, specifically,"+
-              f"{len(problem_rows)} of them...\n\n")
-        time.sleep(10)
-
-    else:
-        print("…………… CONGRATULATIONS THERE WERE ZERO TYPOS FOR ONCE OMG")
+            # 3) the ALL_ rows go on top of everything, over the open interval (start, end)
+            else:
 
-    print("…………… done, returning")
+                starts, ends, qc_vals = self.all_intervals[parent_var]
+                if len(starts) == 0: continue
+                i0 = np.searchsorted(times, starts, side='right')
+                i1 = np.searchsorted(times, ends,   side='left')
 
-    return data_frame 
+                child_qc_vars = []
+                for child_var in child_var_list:
+                    if child_var+'_qc' in columns or child_var+'_qc' in data_frame.columns:
+                        child_qc_vars.append(child_var+'_qc')
+                    else:
+                        for h in ['_2m', '_6m', '_10m', '_mast']:
+                            if child_var+h+'_qc' not in columns and child_var+h+'_qc' not in data_frame.columns:
+                                raise KeyError(f"... an 'ALL_*' ({parent_var})variable had an invalid child ({child_var})"+
+                                               f"! this should never happen...!!!!")
+                            child_qc_vars.append(child_var+h+'_qc')
+
+                for i_start, i_end, qc_val in zip(i0, i1, qc_vals):
+                    if i_end <= i_start: continue
+                    for child_qc_var in child_qc_vars:
+                        seg = get_col(child_qc_var)[i_start:i_end] # a view, so this sets the column
+                        if qc_val == 2: no_overwrite = (seg!=2)
+                        else:           no_overwrite = (seg!=2)&(seg!=3)
+                        seg[no_overwrite] = qc_val
+
+        # put them back, keeping ints as ints if there aren't any nans
+        new_cols = {}
+        for qc_var, col in columns.items():
+            if qc_var in data_frame.columns and np.issubdtype(data_frame[qc_var].dtype, np.integer) and not np.any(np.isnan(col)):
+                data_frame[qc_var] = col.astype(data_frame[qc_var].dtype)
+            elif qc_var in data_frame.columns:
+                data_frame[qc_var] = col
+            else:
+                new_cols[qc_var] = col
+        if len(new_cols) > 0:
+            data_frame = pd.concat([data_frame, pd.DataFrame(new_cols, index=data_frame.index)], axis=1)
+
+        return data_frame, problem_vars
+
+# compiling a table only depends on the csv contents and the variables/station it's for, so keep one
+# per process for each combination
+_compiled_qc_tables = {}
+def get_compiled_qc_table(table_file, qc_var_names, station_name):
+    with open(table_file, 'rb') as tf:
+        table_hash = hashlib.sha1(tf.read()).hexdigest()
+
+    table_key = (table_hash, station_name, tuple(qc_var_names))
+    if table_key not in _compiled_qc_tables:
+        _compiled_qc_tables[table_key] = compiled_qc_table(get_qc_table(table_file), qc_var_names, station_name)
+    return _compiled_qc_tables[table_key]
+
+# a digest of the rows of a qc table that touch [t0, t1], for the run manifest (fl.run_manifest):
+# editing, adding or removing a row only makes the days it covers out of date. only what sets the flags
+# goes in, rewording an explanation changes nothing. rows are hashed in table order, later rows win
+_qc_table_rows = {}
+def qc_table_digest(table_file, t0, t1):
+    with open(table_file, 'rb') as tf:
+        table_hash = hashlib.sha1(tf.read()).hexdigest()
+
+    if table_hash not in _qc_table_rows:
+        flag_df = get_qc_table(table_file)
+        _qc_table_rows[table_hash] = (flag_df['var_name'].values.astype(str),
+                                      flag_df['start_date'].values.astype('datetime64[ns]'),
+                                      flag_df['end_date'].values.astype('datetime64[ns]'),
+                                      flag_df['qc_val'].values)
+
+    var_names, starts, ends, qc_vals = _qc_table_rows[table_hash]
+    touching = (starts <= np.datetime64(t1, 'ns')) & (ends >= np.datetime64(t0, 'ns'))
+    rows     = [(v, str(s), str(e), str(q)) for v, s, e, q in
+                zip(var_names[touching], starts[touching], ends[touching], qc_vals[touching])]
+    return hashlib.sha1(repr(rows).encode()).hexdigest()
 
 def get_qc_table(table_file):
 